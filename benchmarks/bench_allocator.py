@@ -0,0 +1,153 @@
+"""Fertilizer assignment: per-call set rebuild against the indexed allocator.
+
+Replays ``assignments`` recommendations for random (device, soil, crop)
+readings spread over ``devices`` devices through the conflict avoidance
+that server2 used to run (rebuild the soil's set of assigned fertilizers and
+the set of all classes on every call, take any leftover class) and through
+FertilizerAssignments (esp32_sensor_interface/fertilizer_allocator.py).
+Class probabilities are computed once, in one predict_proba call, for a
+pool of synthetic readings; only the assignment step is timed.
+
+Also reports how often each changes a recommendation, how often the old
+logic changed one only because of the crop's own earlier assignment, the
+average rank of the class picked instead, and whole-field reassignments.
+Run from the project root:
+
+    python benchmarks/bench_allocator.py [assignments] [devices]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_DIR = os.path.join(PROJECT_ROOT, 'esp32_sensor_interface')
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, PROJECT_ROOT)
+
+from synthetic import synthetic_readings  # noqa: E402
+
+FEATURE_FIELDS = ['temperature', 'humidity', 'moisture', 'soil_type', 'crop_type',
+                  'nitrogen', 'potassium', 'phosphorus']
+POOL = 5000
+FIELDS = 10000
+
+
+def legacy_assign(fertilizer, soil_type, crop_type, fertilizer_cache, fertilizer_encoder):
+    """server2.assign_fertilizer before the allocator, without the prints."""
+    if soil_type in fertilizer_cache:
+        existing_fertilizers = set(fertilizer_cache[soil_type].values())
+        if fertilizer in existing_fertilizers:
+            all_fertilizers = set(fertilizer_encoder.classes_)
+            alternative_fertilizers = list(all_fertilizers - existing_fertilizers)
+            if alternative_fertilizers:
+                fertilizer = alternative_fertilizers[0]
+    if soil_type not in fertilizer_cache:
+        fertilizer_cache[soil_type] = {}
+    fertilizer_cache[soil_type][crop_type] = fertilizer
+    return fertilizer
+
+
+def run(assignments=100000, devices=1000, seed=0):
+    from fertilizer_allocator import FertilizerAssignments, rank_classes
+    from model_bundle import load_models
+
+    models = load_models(os.path.join(PROJECT_ROOT, 'models'))
+    readings = synthetic_readings(POOL, seed=seed)
+    features = np.array([[reading[field] for field in FEATURE_FIELDS] for reading in readings])
+    scaler = models['scaler']
+    proba = models['model'].predict_proba((features - scaler.mean_) / scaler.scale_)
+    classes = models['fertilizer_encoder'].inverse_transform(models['model'].classes_)
+    rankings = rank_classes(proba).tolist()
+    rank_of = np.argsort(rank_classes(proba), axis=1)
+    column = {str(name): i for i, name in enumerate(classes)}
+
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, POOL, assignments).tolist()
+    device_of = rng.integers(0, devices, assignments).tolist()
+    keys = [(readings[r]['soil_type'], readings[r]['crop_type']) for r in picks]
+    top = [str(classes[ranking[0]]) for ranking in rankings]
+
+    legacy = [{} for _ in range(devices)]
+    legacy_out = [None] * assignments
+    start = time.perf_counter()
+    for i, r in enumerate(picks):
+        soil_type, crop_type = keys[i]
+        legacy_out[i] = legacy_assign(top[r], soil_type, crop_type, legacy[device_of[i]], models['fertilizer_encoder'])
+    legacy_seconds = time.perf_counter() - start
+
+    indexed = [FertilizerAssignments() for _ in range(devices)]
+    indexed_out = [None] * assignments
+    start = time.perf_counter()
+    for i, r in enumerate(picks):
+        soil_type, crop_type = keys[i]
+        indexed_out[i] = indexed[device_of[i]].assign(soil_type, crop_type, rankings[r], classes)
+    indexed_seconds = time.perf_counter() - start
+
+    # Replay the old logic to count changes caused only by the crop's own assignment
+    self_conflicts = 0
+    replay = [{} for _ in range(devices)]
+    for i, r in enumerate(picks):
+        soil_type, crop_type = keys[i]
+        crops = replay[device_of[i]].get(soil_type, {})
+        others = [fertilizer for crop, fertilizer in crops.items() if crop != crop_type]
+        if legacy_out[i] != top[r] and top[r] not in others:
+            self_conflicts += 1
+        legacy_assign(top[r], soil_type, crop_type, replay[device_of[i]], models['fertilizer_encoder'])
+
+    def changed(outputs):
+        ranks = [int(rank_of[r, column[outputs[i]]]) for i, r in enumerate(picks) if outputs[i] != top[r]]
+        return len(ranks), float(np.mean(ranks)) if ranks else 0.0
+
+    # Whole fields: every crop type of a soil reassigned in one call
+    crop_types = sorted({reading['crop_type'] for reading in readings})
+    field_proba = proba[rng.integers(0, POOL, (FIELDS, len(crop_types)))]
+    field_soils = rng.integers(0, 5, FIELDS).tolist()
+    field_devices = rng.integers(0, devices, FIELDS).tolist()
+    start = time.perf_counter()
+    for i in range(FIELDS):
+        indexed[field_devices[i]].assign_field(field_soils[i], crop_types, field_proba[i], classes)
+    field_seconds = time.perf_counter() - start
+
+    legacy_changed, legacy_rank = changed(legacy_out)
+    indexed_changed, indexed_rank = changed(indexed_out)
+    return {
+        'assignments': assignments,
+        'devices': devices,
+        'classes': len(classes),
+        'legacy': {
+            'us_per_assignment': legacy_seconds / assignments * 1e6,
+            'changed': legacy_changed,
+            'self_conflicts': self_conflicts,
+            'mean_rank_when_changed': legacy_rank,
+        },
+        'allocator': {
+            'us_per_assignment': indexed_seconds / assignments * 1e6,
+            'changed': indexed_changed,
+            'self_conflicts': 0,
+            'mean_rank_when_changed': indexed_rank,
+        },
+        'fields': FIELDS,
+        'crops_per_field': len(crop_types),
+        'us_per_field': field_seconds / FIELDS * 1e6,
+    }
+
+
+def main():
+    assignments = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    devices = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    r = run(assignments, devices)
+    print(f"\n=== {assignments} fertilizer assignments over {devices} devices, {r['classes']} classes ===")
+    print(f"{'':10s} {'us/assign':>9s} {'changed':>8s} {'own-conflict':>12s} {'mean rank of pick':>17s}")
+    for name in ('legacy', 'allocator'):
+        p = r[name]
+        print(f"{name:10s} {p['us_per_assignment']:9.2f} {p['changed']:8d} {p['self_conflicts']:12d} "
+              f"{p['mean_rank_when_changed']:17.2f}")
+    print(f"allocator is {r['legacy']['us_per_assignment'] / r['allocator']['us_per_assignment']:.1f}x faster per "
+          f"assignment")
+    print(f"{r['fields']} whole-field reassignments of {r['crops_per_field']} crops: {r['us_per_field']:.1f} us each")
+
+
+if __name__ == "__main__":
+    main()
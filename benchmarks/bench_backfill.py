@@ -0,0 +1,118 @@
+"""ThingSpeak backfill throughput, and its deduplication and resume.
+
+Serves a synthetic channel of ``entries`` past readings, 15 s apart, from
+esp32_sensor_interface/fake_thingspeak.py with ``latency`` seconds added to
+every request (ThingSpeak is a remote service), and backfills it into an
+empty log store with backfill.py, first one window at a time and then with
+``concurrency`` windows in flight. A few requests fail on purpose to exercise
+the retries. Each run checks that every entry was logged exactly once, in
+order. A rerun after a few new entries are published must fetch and log
+only those. The exit status is 1 if a check fails. Run from the project
+root:
+
+    python benchmarks/bench_backfill.py [entries] [concurrency] [latency]
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_DIR = os.path.join(PROJECT_ROOT, 'esp32_sensor_interface')
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, PROJECT_ROOT)
+
+WINDOW = 86400
+FAILURES = 3
+NEW_ENTRIES = 25
+
+
+def backfill_once(fake, log_dir, models, concurrency):
+    import backfill
+    from sensor_log import SensorLogStore
+
+    store = SensorLogStore(os.path.join(log_dir, 'backfill-1'))
+    runner = backfill.Backfill(fake.last_url(), store, models, concurrency=concurrency, window=WINDOW,
+                               backoff=0.05)
+    try:
+        return runner.run()
+    finally:
+        runner.close()
+        store.close()
+
+
+def logged_entry_ids(log_dir):
+    from sensor_log import query_stores, store_directories
+
+    return [record['entry_id'] for record in query_stores(store_directories(log_dir))]
+
+
+def run(entries=100000, concurrency=8, latency=1.0):
+    from fake_thingspeak import FakeThingSpeak
+    from model_bundle import load_models
+
+    models = load_models(os.path.join(PROJECT_ROOT, 'models'))
+    results = {'entries': entries, 'latency': latency, 'runs': []}
+    for workers in (1, concurrency):
+        log_dir = tempfile.mkdtemp()
+        try:
+            with FakeThingSpeak(history=entries, delay=latency) as fake:
+                fake.fail_next(FAILURES)
+                first = backfill_once(fake, log_dir, models, workers)
+                ids = logged_entry_ids(log_dir)
+                for _ in range(NEW_ENTRIES):
+                    fake.publish()
+                rerun = backfill_once(fake, log_dir, models, workers)
+                ids_after = logged_entry_ids(log_dir)
+        finally:
+            shutil.rmtree(log_dir, ignore_errors=True)
+        results['runs'].append({
+            'concurrency': workers,
+            'requests': first['requests'],
+            'failures': first['failures'],
+            'seconds': first['seconds'],
+            'entries_per_s': first['written'] / first['seconds'],
+            'duplicates': first['duplicates'],
+            'logged_once_in_order': ids == list(range(1, entries + 1)),
+            'rerun_requests': rerun['requests'],
+            'rerun_written': rerun['written'],
+            'rerun_complete': ids_after == list(range(1, entries + NEW_ENTRIES + 1)),
+        })
+    results['failed_checks'] = failed_checks(results)
+    return results
+
+
+def failed_checks(results):
+    """Descriptions of the deduplication and resume checks that failed."""
+    failed = []
+    for row in results['runs']:
+        name = f"{row['concurrency']} thread(s)"
+        if row['duplicates'] or not row['logged_once_in_order']:
+            failed.append(f"{name}: entries not logged exactly once in order ({row['duplicates']} duplicates)")
+        if not row['rerun_complete']:
+            failed.append(f"{name}: rerun did not log exactly the {NEW_ENTRIES} new entries after the others")
+        if row['rerun_written'] != NEW_ENTRIES:
+            failed.append(f"{name}: rerun wrote {row['rerun_written']} entries, expected {NEW_ENTRIES}")
+    return failed
+
+
+def main():
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+    r = run(entries, concurrency, latency)
+    print(f"\n=== Backfill of {entries} entries, {WINDOW // 3600} h windows, {latency * 1000:.0f} ms per request ===")
+    print(f"{'threads':>7s} {'requests':>8s} {'retries':>7s} {'seconds':>8s} {'entries/s':>9s} {'dups':>5s} "
+          f"{'exact':>5s} {'rerun req':>9s} {'rerun new':>9s} {'resumed':>7s}")
+    for row in r['runs']:
+        print(f"{row['concurrency']:7d} {row['requests']:8d} {row['failures']:7d} {row['seconds']:8.2f} "
+              f"{row['entries_per_s']:9.0f} {row['duplicates']:5d} {str(row['logged_once_in_order']):>5s} "
+              f"{row['rerun_requests']:9d} {row['rerun_written']:9d} {str(row['rerun_complete']):>7s}")
+    for failure in r['failed_checks']:
+        print(f"FAILED: {failure}")
+    if r['failed_checks']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
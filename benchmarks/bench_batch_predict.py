@@ -0,0 +1,99 @@
+"""Throughput of single-row vs batch fertilizer prediction.
+
+Run from the project root:
+
+    python benchmarks/bench_batch_predict.py [n_readings]
+"""
+import os
+import sys
+import time
+
+import pandas as pd
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+sys.path.insert(0, os.path.join(PROJECT_ROOT, 'esp32_sensor_interface'))
+
+import predict  # noqa: E402
+
+
+def sample_readings(n, seed=0):
+    """Draw n readings from the dataset in get_user_input format."""
+    df = pd.read_csv(os.path.join(PROJECT_ROOT, 'dataset', 'data_core.csv'))
+    df = df.sample(n=n, replace=True, random_state=seed).reset_index(drop=True)
+    return df.rename(columns={'Temparature': 'Temperature'}).drop(columns='Fertilizer Name')
+
+
+def to_server_readings(df):
+    """Convert dataset-style readings to the dicts server2 receives."""
+    return [{
+        'temperature': row['Temperature'],
+        'humidity': row['Humidity'],
+        'moisture': row['Moisture'],
+        'soil_type': i % 5,
+        'crop_type': i % 11,
+        'nitrogen': row['Nitrogen'],
+        'phosphorus': row['Phosphorous'],
+        'potassium': row['Potassium'],
+    } for i, row in enumerate(df.to_dict('records'))]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def run(n=2000, single_n=200):
+    """Compare the per-row and batch paths of predict.py and server2.py."""
+    os.chdir(PROJECT_ROOT)
+    import server2
+
+    models = predict.load_models()
+    df = sample_readings(n)
+    records = df.to_dict('records')
+    server_readings = to_server_readings(df)
+
+    def predict_single():
+        out = []
+        for record in records[:single_n]:
+            features = predict.prepare_input(record, models)
+            prediction = models['model'].predict(features)
+            out.append(models['fertilizer_encoder'].inverse_transform(prediction)[0])
+        return out
+
+    def server_single():
+        server_models = server2.get_models()
+        return [server2.predict_fertilizer_names(server2.build_features([r]), server_models)[0]
+                for r in server_readings[:single_n]]
+
+    single, single_time = timed(predict_single)
+    batch, batch_time = timed(lambda: predict.predict_batch(df, models))
+    assert single == batch[:single_n], "predict_batch disagrees with prepare_input"
+
+    server_one, server_single_time = timed(server_single)
+    server_batch, server_batch_time = timed(lambda: server2.predict_fertilizer_batch(server_readings))
+    assert server_one == server_batch[:single_n], "predict_fertilizer_batch disagrees with single path"
+
+    return {
+        'readings': n,
+        'predict_single_rows_per_s': single_n / single_time,
+        'predict_batch_rows_per_s': n / batch_time,
+        'server_single_rows_per_s': single_n / server_single_time,
+        'server_batch_rows_per_s': n / server_batch_time,
+    }
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    results = run(n)
+    print(f"\n=== Batch prediction ({results['readings']} readings) ===")
+    for key, value in results.items():
+        if key != 'readings':
+            print(f"{key:30s} {value:12.1f}")
+    print(f"predict.py speedup:  {results['predict_batch_rows_per_s'] / results['predict_single_rows_per_s']:.1f}x")
+    print(f"server2.py speedup:  {results['server_batch_rows_per_s'] / results['server_single_rows_per_s']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Dataset load time and peak memory: CSV parsing against the columnar cache.
+
+Writes synthetic CSVs of increasing size and, each in a fresh subprocess
+so that every measurement gets its own peak RSS, loads them four ways:
+
+* csv      pd.read_csv and LabelEncoder on the three text columns, as
+           training did before the cache
+* compile  dataset_cache.compile_dataset, the one-time cost on a new file
+* open     dataset_cache.load_dataset on the compiled file: header, source
+           check and memory map
+* scan     open, then read every column once (the sum of each)
+
+The cache's RSS includes the mapped pages it reads. They are page cache
+shared with other processes, not private memory. A measurement that fails,
+e.g. when pd.read_csv runs out of memory, is reported as failed. Run from the
+project root:
+
+    python benchmarks/bench_dataset_cache.py [rows ...]     # default: 1000000 100000000
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dataset_cache import cache_path  # noqa: E402
+from synthetic import write_synthetic_csv  # noqa: E402
+
+MODES = ('csv', 'compile', 'open', 'scan')
+
+# Executed in a child process so each measurement gets its own ru_maxrss
+CHILD = """
+import json, resource, sys, time
+sys.path.insert(0, {root!r})
+import dataset_cache
+path, cache_dir, mode = sys.argv[1], sys.argv[2], sys.argv[3]
+start = time.perf_counter()
+if mode == 'csv':
+    import pandas as pd
+    from sklearn.preprocessing import LabelEncoder
+    df = pd.read_csv(path)
+    for column in ('Soil Type', 'Crop Type', 'Fertilizer Name'):
+        df[column] = LabelEncoder().fit_transform(df[column])
+    rows = len(df)
+elif mode == 'compile':
+    rows = dataset_cache.compile_dataset(path, dataset_cache.cache_path(path, cache_dir))['rows']
+else:
+    dataset = dataset_cache.load_dataset(path, cache_dir)
+    if mode == 'scan':
+        for name in dataset.column_names:
+            dataset[name].sum(dtype='float64')
+    rows = len(dataset)
+print(json.dumps({{'rows': rows, 'seconds': time.perf_counter() - start,
+                   'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}}))
+"""
+
+
+def measure(path, cache_dir, mode):
+    result = subprocess.run([sys.executable, '-c', CHILD.format(root=PROJECT_ROOT), path, cache_dir, mode],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def run(sizes=(1_000_000, 100_000_000), modes=MODES):
+    """Load seconds and peak RSS per (rows, mode)."""
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_dir = os.path.join(tmp, 'cache')
+        for rows in sizes:
+            path = os.path.join(tmp, f"synthetic_{rows}.csv")
+            start = time.perf_counter()
+            write_synthetic_csv(path, rows)
+            generate_seconds = time.perf_counter() - start
+
+            cached = cache_path(path, cache_dir)
+            for mode in modes:
+                result = measure(path, cache_dir, mode) or {'rows': rows, 'seconds': None, 'peak_rss_mb': None}
+                result.update({'mode': mode, 'file_mb': os.path.getsize(path) / 1e6,
+                               'cache_mb': os.path.getsize(cached) / 1e6 if os.path.exists(cached) else None,
+                               'generate_seconds': generate_seconds})
+                results.append(result)
+            if os.path.exists(cached):
+                os.remove(cached)
+            os.remove(path)
+    return results
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1_000_000, 100_000_000]
+    results = run(sizes)
+    print("\n=== Dataset load: CSV vs columnar cache ===")
+    print(f"{'rows':>12s} {'CSV MB':>8s} {'cache MB':>9s} {'mode':>8s} {'seconds':>9s} {'peak RSS MB':>12s}")
+    for r in results:
+        seconds = f"{r['seconds']:9.3f}" if r['seconds'] is not None else f"{'failed':>9s}"
+        rss = f"{r['peak_rss_mb']:12.0f}" if r['peak_rss_mb'] is not None else f"{'-':>12s}"
+        cache = f"{r['cache_mb']:9.1f}" if r['cache_mb'] is not None else f"{'-':>9s}"
+        print(f"{r['rows']:12d} {r['file_mb']:8.1f} {cache} {r['mode']:>8s} {seconds} {rss}")
+
+
+if __name__ == "__main__":
+    main()
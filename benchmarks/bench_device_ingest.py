@@ -0,0 +1,109 @@
+"""Ingest throughput as the number of field devices grows.
+
+Posts readings through the Flask test client, spreading them over a pool of
+device IDs, and separately measures raw DeviceRegistry lookups from several
+threads. Run from the project root:
+
+    python benchmarks/bench_device_ingest.py [posts_per_run]
+"""
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_DIR = os.path.join(PROJECT_ROOT, 'esp32_sensor_interface')
+sys.path.insert(0, SERVER_DIR)
+
+DEVICE_COUNTS = [1, 100, 10000, 100000]
+
+
+def random_reading(rng, device_id):
+    return {
+        'device_id': device_id,
+        'temperature': round(rng.uniform(20, 38), 1),
+        'humidity': round(rng.uniform(30, 80), 1),
+        'moisture': round(rng.uniform(25, 65), 1),
+        'nitrogen': rng.randint(4, 42),
+        'phosphorus': rng.randint(0, 42),
+        'potassium': rng.randint(0, 19),
+    }
+
+
+def bench_posts(server2, n_devices, posts, seed=0):
+    rng = random.Random(seed)
+    client = server2.app.test_client()
+    payloads = [random_reading(rng, f"node-{rng.randrange(n_devices)}") for _ in range(posts)]
+
+    # Silence the per-request conflict-avoidance messages
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for payload in payloads:
+            response = client.post('/sensor-data', json=payload)
+            assert response.status_code == 200, response.get_json()
+        elapsed = time.perf_counter() - start
+    return posts / elapsed
+
+
+def bench_registry(n_devices, lookups=200000, threads=4, max_devices=50000):
+    from device_state import DeviceRegistry
+
+    registry = DeviceRegistry(dict, max_devices=max_devices)
+    ids = [f"node-{i}" for i in range(n_devices)]
+    per_thread = lookups // threads
+
+    def worker(seed):
+        rng = random.Random(seed)
+        for _ in range(per_thread):
+            state = registry.get(ids[rng.randrange(n_devices)])
+            with state.lock:
+                state.readings['temperature'] = 25.0
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads / elapsed, len(registry), registry.evictions
+
+
+def run(posts=2000):
+    """Measure POST /sensor-data and registry throughput per device count."""
+    os.environ['SENSOR_LOG_DIR'] = tempfile.mkdtemp(prefix='bench-sensor-log-')
+    os.environ['DRIFT_ENABLED'] = '0'
+    os.environ['DRIFT_REFRESH'] = '0'
+    os.chdir(SERVER_DIR)
+    import server2
+
+    results = []
+    for n_devices in DEVICE_COUNTS:
+        posts_per_s = bench_posts(server2, n_devices, posts)
+        lookups_per_s, tracked, evictions = bench_registry(n_devices)
+        results.append({
+            'devices': n_devices,
+            'posts_per_s': posts_per_s,
+            'registry_lookups_per_s': lookups_per_s,
+            'registry_tracked': tracked,
+            'registry_evictions': evictions,
+        })
+    return results
+
+
+def main():
+    posts = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    results = run(posts)
+    print(f"\n=== Device ingest ({posts} posts per run) ===")
+    print(f"{'devices':>10s} {'posts/s':>10s} {'lookups/s':>12s} {'tracked':>9s} {'evicted':>9s}")
+    for r in results:
+        print(f"{r['devices']:10d} {r['posts_per_s']:10.1f} {r['registry_lookups_per_s']:12.0f} "
+              f"{r['registry_tracked']:9d} {r['registry_evictions']:9d}")
+
+
+if __name__ == "__main__":
+    main()
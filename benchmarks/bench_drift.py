@@ -0,0 +1,91 @@
+"""Drift detector throughput and detection on in- and out-of-distribution readings.
+
+Feeds readings one at a time (as the server does) and in batches through a
+DriftDetector built on models/training_stats.json, and reports readings
+per second and the cost of a window comparison. Then checks detection:
+rows resampled from the training data should not drift, and
+dataset/data_core.csv, which the model scores poorly on, should. Run from
+the project root:
+
+    python benchmarks/bench_drift.py [readings]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+import drift  # noqa: E402
+from forest_engine import load_dataset_features  # noqa: E402
+
+
+def detection(reference, X, window):
+    detector = drift.DriftDetector(reference, window=window)
+    detector.observe_many(X[:window])
+    report = detector.last_report
+    return {
+        'drifted_features': report['drifted_features'],
+        'max_psi': max(f['psi'] for f in report['features'].values()),
+    }
+
+
+def run(readings=500_000, window=5000):
+    os.chdir(PROJECT_ROOT)
+    reference = drift.load_training_stats('models')
+    if reference is None:
+        X_train, _ = drift.training_rows()
+        reference = drift.training_stats(X_train)
+    training = load_dataset_features(drift.DATASET_PATH)
+    rng = np.random.default_rng(0)
+    X = training[rng.integers(0, len(training), readings)]
+    rows = X.tolist()
+
+    detector = drift.DriftDetector(reference, window=window)
+    start = time.perf_counter()
+    for row in rows:
+        detector.observe(row)
+    single = time.perf_counter() - start
+
+    detector = drift.DriftDetector(reference, window=window)
+    start = time.perf_counter()
+    for i in range(0, readings, 256):
+        detector.observe_many(X[i:i + 256])
+    batch = time.perf_counter() - start
+
+    live = reference.empty_like()
+    live.update(X[:window])
+    start = time.perf_counter()
+    for _ in range(1000):
+        drift.compare(reference, live)
+    compare_us = (time.perf_counter() - start) / 1000 * 1e6
+
+    return {
+        'readings': readings,
+        'single_per_s': readings / single,
+        'batch_per_s': readings / batch,
+        'compare_us': compare_us,
+        'checks': detector.checks,
+        'false_alarms': detector.drift_events,
+        'training_resampled': detection(reference, X, window),
+        'data_core': detection(reference, load_dataset_features('dataset/data_core.csv'), window),
+    }
+
+
+def main():
+    readings = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    r = run(readings)
+    print("\n=== Drift detector ===")
+    print(f"observe(), one reading at a time: {r['single_per_s']:>12,.0f} readings/s")
+    print(f"observe_many(), batches of 256:   {r['batch_per_s']:>12,.0f} readings/s")
+    print(f"window comparison (PSI, 8 features): {r['compare_us']:.0f} us")
+    print(f"windows checked: {r['checks']}, drift flagged in {r['false_alarms']} (readings resampled from training)")
+    for label in ('training_resampled', 'data_core'):
+        result = r[label]
+        print(f"{label:>20s}: max PSI {result['max_psi']:.3f}, drifted: {', '.join(result['drifted_features']) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
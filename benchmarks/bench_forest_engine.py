@@ -0,0 +1,79 @@
+"""Single-row latency of the compiled forest engine vs the joblib model.
+
+Run from the project root:
+
+    python benchmarks/bench_forest_engine.py [n_iterations]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+import forest_engine  # noqa: E402
+
+
+def percentiles(samples):
+    samples = np.asarray(samples) * 1e6
+    return {'p50_us': float(np.percentile(samples, 50)), 'p99_us': float(np.percentile(samples, 99))}
+
+
+def run(iterations=2000):
+    """Time model.predict on scaled rows against CompiledForest.predict_one."""
+    import joblib
+
+    os.chdir(PROJECT_ROOT)
+    model = joblib.load('models/soil_testing_model.joblib')
+    scaler = joblib.load('models/scaler.joblib')
+    engine = forest_engine.load_engine('models')
+    X = forest_engine.load_dataset_features('dataset/data_core.csv')
+    rows = X[np.random.default_rng(0).integers(0, len(X), iterations)]
+
+    mismatches = forest_engine.verify(engine, model, scaler, X)
+    assert mismatches == 0, f"engine disagrees with model.predict on {mismatches} predictions"
+
+    mean, scale = scaler.mean_, scaler.scale_
+    sklearn_times = []
+    for row in rows:
+        start = time.perf_counter()
+        model.predict(((row - mean) / scale).reshape(1, -1))
+        sklearn_times.append(time.perf_counter() - start)
+
+    engine_times = []
+    for row in rows:
+        start = time.perf_counter()
+        engine.predict_one(row)
+        engine_times.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    model.predict((X - mean) / scale)
+    sklearn_batch = time.perf_counter() - start
+    start = time.perf_counter()
+    engine.predict(X)
+    engine_batch = time.perf_counter() - start
+
+    return {
+        'rows_verified': len(X),
+        'sklearn': percentiles(sklearn_times),
+        'engine': percentiles(engine_times),
+        'sklearn_batch_rows_per_s': len(X) / sklearn_batch,
+        'engine_batch_rows_per_s': len(X) / engine_batch,
+    }
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    results = run(iterations)
+    print(f"\n=== Forest engine ({results['rows_verified']} rows verified) ===")
+    print(f"{'':10s} {'p50 (us)':>10s} {'p99 (us)':>10s}")
+    for name in ('sklearn', 'engine'):
+        print(f"{name:10s} {results[name]['p50_us']:10.1f} {results[name]['p99_us']:10.1f}")
+    print(f"Batch rows/s: sklearn {results['sklearn_batch_rows_per_s']:.0f}, "
+          f"engine {results['engine_batch_rows_per_s']:.0f}")
+
+
+if __name__ == "__main__":
+    main()
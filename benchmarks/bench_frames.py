@@ -0,0 +1,142 @@
+"""Binary frame ingest against JSON POSTs: CPU and bytes per reading.
+
+Sends the same synthetic readings for a few devices through the Flask test
+client twice: as one JSON object per POST /sensor-data, as a field node does
+today, and as binary frames of up to ``frame_size`` readings to POST
+/ingest/frames (see esp32_sensor_interface/frame_protocol.py). Both paths
+predict, log and record history for every reading. Reports process CPU per
+reading, request body bytes per reading, and decoding alone (json.loads of
+each body against decode_frames). Run from the project root:
+
+    python benchmarks/bench_frames.py [readings] [frame_size]
+"""
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_DIR = os.path.join(PROJECT_ROOT, 'esp32_sensor_interface')
+sys.path.insert(0, SERVER_DIR)
+
+DEVICES = 8
+
+
+def synthetic_readings(count, seed=0):
+    rng = np.random.default_rng(seed)
+    timestamps = time.time() - 10 * count + 10 * np.arange(count)
+    values = np.column_stack([
+        np.round(rng.uniform(20, 38, count), 1),
+        np.round(rng.uniform(40, 70, count), 1),
+        np.round(rng.uniform(20, 70, count), 1),
+        rng.integers(4, 46, count),
+        rng.integers(0, 43, count),
+        rng.integers(0, 26, count),
+    ]).astype(np.float64)
+    return timestamps, values
+
+
+def json_bodies(values, frame_protocol):
+    return [json.dumps({
+        'device_id': f'node-{i % DEVICES}',
+        **{field: (row[j] if j < 3 else int(row[j])) for j, field in enumerate(frame_protocol.SENSOR_FIELDS)},
+    }).encode() for i, row in enumerate(values.tolist())]
+
+
+def frame_bodies(timestamps, values, frame_size, frame_protocol):
+    """One request per frame_size readings of each device."""
+    bodies = []
+    for device in range(DEVICES):
+        rows = np.arange(device, len(values), DEVICES)
+        for sequence, start in enumerate(range(0, len(rows), frame_size)):
+            chunk = rows[start:start + frame_size]
+            bodies.append(frame_protocol.encode_frame(f'node-{device}', timestamps[chunk], values[chunk],
+                                                      sequence=sequence))
+    return bodies
+
+
+def timed(fn):
+    wall, cpu = time.perf_counter(), time.process_time()
+    fn()
+    return time.perf_counter() - wall, time.process_time() - cpu
+
+
+def run(readings=5000, frame_size=256):
+    os.environ['SENSOR_LOG_DIR'] = tempfile.mkdtemp()
+    os.environ['MODEL_WATCH_INTERVAL'] = '0'
+    os.environ['INGEST_MODE'] = 'sync'
+    os.environ['POLL_THINGSPEAK'] = '0'
+    os.environ['DRIFT_ENABLED'] = '0'
+    os.environ['DRIFT_REFRESH'] = '0'
+    os.environ.setdefault('THINGSPEAK_API_ENDPOINT', 'http://127.0.0.1:9/')
+    import frame_protocol
+    import server2
+
+    client = server2.app.test_client()
+    timestamps, values = synthetic_readings(readings)
+    as_json = json_bodies(values, frame_protocol)
+    as_frames = frame_bodies(timestamps, values, frame_size, frame_protocol)
+    server2.get_models()
+
+    def post_json():
+        for body in as_json:
+            response = client.post('/sensor-data', data=body, content_type='application/json')
+            if response.status_code != 200:
+                raise RuntimeError(f"POST /sensor-data returned {response.status_code}")
+
+    def post_frames():
+        for body in as_frames:
+            response = client.post('/ingest/frames', data=body, content_type='application/octet-stream')
+            if response.status_code != 200:
+                raise RuntimeError(f"POST /ingest/frames returned {response.status_code}: {response.get_json()}")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        server2.prediction_cache.clear()
+        json_wall, json_cpu = timed(post_json)
+        frame_wall, frame_cpu = timed(post_frames)
+    decode_json = timed(lambda: [json.loads(body) for body in as_json])[1]
+    decode_frames = timed(lambda: [frame_protocol.decode_frames(body) for body in as_frames])[1]
+    server2.log_store.close()
+
+    return {
+        'readings': readings,
+        'frame_size': frame_size,
+        'json': {
+            'requests': len(as_json),
+            'bytes_per_reading': sum(map(len, as_json)) / readings,
+            'cpu_us_per_reading': json_cpu / readings * 1e6,
+            'readings_per_s': readings / json_wall,
+            'decode_us_per_reading': decode_json / readings * 1e6,
+        },
+        'frames': {
+            'requests': len(as_frames),
+            'bytes_per_reading': sum(map(len, as_frames)) / readings,
+            'cpu_us_per_reading': frame_cpu / readings * 1e6,
+            'readings_per_s': readings / frame_wall,
+            'decode_us_per_reading': decode_frames / readings * 1e6,
+        },
+    }
+
+
+def main():
+    readings = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    frame_size = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    r = run(readings, frame_size)
+    print(f"\n=== Ingest of {readings} readings: JSON POSTs vs binary frames of {frame_size} ===")
+    print(f"{'path':>6s} {'requests':>8s} {'bytes/reading':>13s} {'CPU us/reading':>14s} "
+          f"{'readings/s':>11s} {'decode us/reading':>17s}")
+    for path in ('json', 'frames'):
+        p = r[path]
+        print(f"{path:>6s} {p['requests']:8d} {p['bytes_per_reading']:13.1f} {p['cpu_us_per_reading']:14.1f} "
+              f"{p['readings_per_s']:11.0f} {p['decode_us_per_reading']:17.2f}")
+    print(f"frames use {r['json']['bytes_per_reading'] / r['frames']['bytes_per_reading']:.1f}x fewer bytes and "
+          f"{r['json']['cpu_us_per_reading'] / r['frames']['cpu_us_per_reading']:.1f}x less CPU per reading")
+
+
+if __name__ == "__main__":
+    main()
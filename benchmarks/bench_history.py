@@ -0,0 +1,118 @@
+"""History rollups over a year of synthetic 10-second readings.
+
+Loads 365 days of readings for one device (3.15 million rows) into a
+HistoryStore a day at a time, times per-reading recording on a sample, and
+measures query latency at each resolution: the rollup lookup alone and the
+full columnar result the /history endpoint serializes.
+Run from the project root:
+
+    python benchmarks/bench_history.py [days]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, 'esp32_sensor_interface'))
+
+from history import FIELDS, HistoryStore  # noqa: E402
+
+INTERVAL = 10
+DAY = 86400
+
+
+def synthetic_day(day, start, rng):
+    """One day of readings with a daily temperature and humidity cycle."""
+    times = start + day * DAY + np.arange(0, DAY, INTERVAL, dtype=np.float64)
+    phase = 2 * np.pi * (times % DAY) / DAY
+    n = len(times)
+    values = np.column_stack([
+        25 + 6 * np.sin(phase) + rng.normal(0, 0.3, n),
+        55 - 10 * np.sin(phase) + rng.normal(0, 1, n),
+        40 + rng.normal(0, 2, n),
+        20 + rng.integers(-2, 3, n),
+        10 + rng.integers(-1, 2, n),
+        8 + rng.integers(-1, 2, n),
+    ]).astype(np.float32)
+    return times, values
+
+
+def percentiles(samples):
+    ms = np.array(samples) * 1000
+    return {'p50_ms': float(np.percentile(ms, 50)), 'p99_ms': float(np.percentile(ms, 99))}
+
+
+def run(days=365, queries=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    store = HistoryStore()
+    start = float((int(time.time()) // DAY - days) * DAY)
+
+    load_start = time.perf_counter()
+    for day in range(days):
+        times, values = synthetic_day(day, start, rng)
+        store.record_many('field-1', times, values)
+    load_seconds = time.perf_counter() - load_start
+    rows = days * DAY // INTERVAL
+    end = start + days * DAY
+
+    # Per-reading path used by the server, on a second device
+    times, values = synthetic_day(0, start, rng)
+    sample = 20000
+    record_start = time.perf_counter()
+    for t, row in zip(times[:sample], values[:sample]):
+        store.record('field-2', t, dict(zip(FIELDS, row)))
+    record_rate = sample / (time.perf_counter() - record_start)
+
+    # Range queries ending at random points within each resolution's retention
+    history = store._history('field-1', create=False)
+    spans = {'minute': DAY, 'hour': 7 * DAY, 'day': days * DAY, 'raw': 3600}
+    results = {}
+    for resolution, span in spans.items():
+        lookup, full = [], []
+        for _ in range(queries):
+            q_end = end - rng.uniform(0, min(span, DAY) / 2)
+            q_start = q_end - span
+            t0 = time.perf_counter()
+            if resolution == 'raw':
+                history.raw.query(q_start, q_end)
+            else:
+                history.rollups[resolution].query(q_start, q_end)
+            t1 = time.perf_counter()
+            result = store.query('field-1', q_start, q_end, resolution=resolution)
+            t2 = time.perf_counter()
+            lookup.append(t1 - t0)
+            full.append(t2 - t1)
+        results[resolution] = {
+            'span_days': span / DAY,
+            'points': len(result['time']),
+            'lookup': percentiles(lookup),
+            'full': percentiles(full),
+        }
+
+    return {
+        'rows': rows,
+        'load_rows_per_s': rows / load_seconds,
+        'record_rows_per_s': record_rate,
+        'bytes_per_device': store.stats()['bytes_per_device'],
+        'queries': results,
+    }
+
+
+def main():
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 365
+    results = run(days)
+    print(f"\n=== History: {results['rows']:,} readings ({days} days at {INTERVAL}s) ===")
+    print(f"bulk load:         {results['load_rows_per_s']:>12,.0f} readings/s")
+    print(f"record():          {results['record_rows_per_s']:>12,.0f} readings/s")
+    print(f"memory per device: {results['bytes_per_device'] / 1024:>12,.0f} KB")
+    print(f"\n{'resolution':>10s} {'span d':>7s} {'points':>7s} {'lookup p50':>11s} {'p99':>7s} "
+          f"{'full p50':>9s} {'p99':>7s}  (ms)")
+    for resolution, r in results['queries'].items():
+        print(f"{resolution:>10s} {r['span_days']:7.1f} {r['points']:7d} {r['lookup']['p50_ms']:11.3f} "
+              f"{r['lookup']['p99_ms']:7.3f} {r['full']['p50_ms']:9.3f} {r['full']['p99_ms']:7.3f}")
+
+
+if __name__ == "__main__":
+    main()
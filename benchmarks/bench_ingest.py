@@ -0,0 +1,133 @@
+"""Load generator for POST /sensor-data in sync and async ingest modes.
+
+Starts server2 in a subprocess on a threaded werkzeug server, then runs
+closed-loop clients (each sends the next POST as soon as the previous one is
+answered) for a fixed duration. Reports request throughput, latency
+percentiles and 429 rejections, and for async mode how long the queue took
+to drain, which gives the sustained processing rate.
+Run from the project root:
+
+    python benchmarks/bench_ingest.py [seconds] [clients]
+"""
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import requests
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_DIR = os.path.join(PROJECT_ROOT, 'esp32_sensor_interface')
+
+SERVE = """
+import os, sys
+sys.path.insert(0, {server_dir!r})
+os.chdir({server_dir!r})
+import server2
+from werkzeug.serving import make_server
+server = make_server('127.0.0.1', 0, server2.app, threaded=True)
+with open({port_file!r}, 'w') as f:
+    f.write(str(server.server_port))
+server.serve_forever()
+"""
+
+
+def start_server(mode, log_dir, **env):
+    port_file = os.path.join(log_dir, 'port')
+    environment = dict(os.environ, INGEST_MODE=mode, SENSOR_LOG_DIR=os.path.join(log_dir, 'log'),
+                       MODEL_WATCH_INTERVAL='0', THINGSPEAK_API_ENDPOINT='http://127.0.0.1:9/',
+                       DRIFT_ENABLED='0', DRIFT_REFRESH='0',
+                       **{key: str(value) for key, value in env.items()})
+    proc = subprocess.Popen([sys.executable, '-c', SERVE.format(server_dir=SERVER_DIR, port_file=port_file)],
+                            env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(300):
+        if os.path.exists(port_file) and os.path.getsize(port_file):
+            with open(port_file) as f:
+                url = f"http://127.0.0.1:{f.read()}"
+            os.remove(port_file)
+            # Warm up: load the model and start the background threads
+            requests.get(f"{url}/sensor-data", timeout=30)
+            return proc, url
+        time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("Server did not start")
+
+
+def client(url, deadline, devices, latencies, statuses, seed):
+    rng = random.Random(seed)
+    session = requests.Session()
+    while time.perf_counter() < deadline:
+        body = {
+            'temperature': round(rng.uniform(20, 38), 1),
+            'humidity': round(rng.uniform(40, 70), 1),
+            'moisture': round(rng.uniform(20, 70), 1),
+            'nitrogen': rng.randint(4, 46),
+            'phosphorus': rng.randint(0, 42),
+            'potassium': rng.randint(0, 25),
+        }
+        start = time.perf_counter()
+        response = session.post(f"{url}/sensor-data?device=node-{rng.randrange(devices)}", json=body)
+        latencies.append(time.perf_counter() - start)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+
+def run_mode(mode, seconds=10.0, clients=16, devices=100, **env):
+    with tempfile.TemporaryDirectory() as log_dir:
+        proc, url = start_server(mode, log_dir, **env)
+        try:
+            latencies, statuses = [], {}
+            start = time.perf_counter()
+            deadline = start + seconds
+            threads = [threading.Thread(target=client, args=(url, deadline, devices, latencies, statuses, i))
+                       for i in range(clients)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+
+            result = {'mode': mode, 'clients': clients, 'requests': len(latencies),
+                      'requests_per_s': len(latencies) / elapsed, 'statuses': statuses}
+            ms = np.array(latencies) * 1000
+            result.update({f'p{p}_ms': float(np.percentile(ms, p)) for p in (50, 90, 99, 99.9)})
+
+            if mode == 'async':
+                # Wait for the worker to finish what was accepted
+                while True:
+                    stats = requests.get(f"{url}/stats/ingest").json()
+                    if stats['queued'] == 0 and stats['processed'] >= stats['accepted']:
+                        break
+                    time.sleep(0.05)
+                drained = time.perf_counter() - start
+                result.update(processed_per_s=stats['processed'] / drained,
+                              drain_seconds=drained - elapsed,
+                              mean_batch_size=stats['mean_batch_size'])
+            return result
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+def run(seconds=10.0, clients=16):
+    return [run_mode('sync', seconds, clients), run_mode('async', seconds, clients)]
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    results = run(seconds, clients)
+    print(f"\n=== POST /sensor-data, {clients} clients, {seconds:.0f}s ===")
+    print(f"{'mode':>6s} {'req/s':>8s} {'p50 ms':>8s} {'p90 ms':>8s} {'p99 ms':>8s} {'p99.9 ms':>9s} "
+          f"{'processed/s':>12s} {'batch':>6s}  statuses")
+    for r in results:
+        print(f"{r['mode']:>6s} {r['requests_per_s']:8.0f} {r['p50_ms']:8.1f} {r['p90_ms']:8.1f} "
+              f"{r['p99_ms']:8.1f} {r['p99.9_ms']:9.1f} {r.get('processed_per_s', r['requests_per_s']):12.0f} "
+              f"{r.get('mean_batch_size', 1):6.1f}  {r['statuses']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Lookup table vs forest: footprint, compile time, agreement and latency per grid.
+
+For every grid in lookup_table.GRIDS, compiles the table for the bundled
+model in memory (grids over the size limit are only sized), then reports
+the share of rows the table answers and how often its answer matches the
+forest, on the two dataset files and on random readings at sensor
+resolution, plus single-row and batch latency of the lookup and the forest.
+Nothing is written to models/. Run from the project root:
+
+    python benchmarks/bench_lookup_table.py [grid ...]
+"""
+import os
+import sys
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+import lookup_table as lt  # noqa: E402
+from forest_engine import load_dataset_features  # noqa: E402
+from model_bundle import load_bundle  # noqa: E402
+
+DATASETS = ['dataset/enhanced_data_core.csv', 'dataset/data_core.csv']
+
+
+def run(grids=None, samples=20000, latency_rows=2000, batch_rows=100_000, max_bytes=lt.MAX_TABLE_BYTES):
+    os.chdir(PROJECT_ROOT)
+    bundle = load_bundle('models')
+    engine = bundle.engine
+    n_soil, n_crop = len(bundle.soil_encoder.classes_), len(bundle.crop_encoder.classes_)
+    datasets = {os.path.basename(path): load_dataset_features(path) for path in DATASETS}
+
+    results = []
+    for name in grids or list(lt.GRIDS):
+        axes = lt.grid_axes(lt.GRIDS[name], n_soil, n_crop)
+        result = {'grid': name, 'shape': [axis['size'] for axis in axes], 'bytes': lt.table_bytes(axes)}
+        results.append(result)
+        if result['bytes'] > max_bytes:
+            result['skipped'] = 'over the size limit'
+            continue
+
+        start = time.perf_counter()
+        table = lt.LookupTable(lt.compile_table(engine, axes), {'axes': axes})
+        result['compile_seconds'] = time.perf_counter() - start
+
+        random_rows = lt.random_inputs(axes, samples, seed=1)
+        result['agreement'] = {label: lt.agreement(table, engine, X) for label, X in datasets.items()}
+        result['agreement']['random'] = lt.agreement(table, engine, random_rows)
+        result['latency'] = lt.measure_latency(table, engine, random_rows[:latency_rows])
+
+        batch = lt.random_inputs(axes, batch_rows, seed=2)
+        start = time.perf_counter()
+        table.lookup(batch)
+        result['lookup_rows_per_s'] = batch_rows / (time.perf_counter() - start)
+        start = time.perf_counter()
+        engine.predict(batch[:batch_rows // 10])
+        result['forest_rows_per_s'] = (batch_rows // 10) / (time.perf_counter() - start)
+    return results
+
+
+def main():
+    results = run(sys.argv[1:] or None)
+    print("\n=== Lookup table vs forest ===")
+    print(f"{'grid':>7s} {'shape':>30s} {'size MB':>8s} {'compile s':>9s} "
+          f"{'on grid':>8s} {'agree':>7s} {'lookup us':>10s} {'forest us':>10s} {'batch speedup':>13s}")
+    for r in results:
+        shape = 'x'.join(str(size) for size in r['shape'])
+        if 'skipped' in r:
+            print(f"{r['grid']:>7s} {shape:>30s} {r['bytes'] / 2**20:8.1f}  ({r['skipped']})")
+            continue
+        random = r['agreement']['random']
+        print(f"{r['grid']:>7s} {shape:>30s} {r['bytes'] / 2**20:8.1f} {r['compile_seconds']:9.1f} "
+              f"{random['on_grid']:8.1%} {random['agreement']:7.1%} {r['latency']['lookup_p50_us']:10.1f} "
+              f"{r['latency']['forest_p50_us']:10.1f} {r['lookup_rows_per_s'] / r['forest_rows_per_s']:12.0f}x")
+    print("\nAgreement on the dataset files (share on grid / agreement there):")
+    for r in results:
+        if 'agreement' in r:
+            print(f"{r['grid']:>7s} " + '  '.join(f"{label}: {check['on_grid']:.1%} / {check['agreement']:.1%}"
+                                                 for label, check in r['agreement'].items() if label != 'random'))
+
+
+if __name__ == "__main__":
+    main()
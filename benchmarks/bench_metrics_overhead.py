@@ -0,0 +1,112 @@
+"""Throughput cost of the request instrumentation.
+
+Drives POST /sensor-data (sync ingest) through Flask's test client with
+metrics switched on and off in alternating rounds, so drift in machine
+load affects both equally, and compares the median round throughput. Also
+times a bare histogram timer to show the per-stage cost. Readings are
+random so most requests miss the prediction cache and reach the model.
+Run from the project root:
+
+    python benchmarks/bench_metrics_overhead.py [rounds] [requests_per_round]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_DIR = os.path.join(PROJECT_ROOT, 'esp32_sensor_interface')
+
+
+def make_bodies(n, seed=0):
+    rng = random.Random(seed)
+    return [{
+        'temperature': round(rng.uniform(20, 38), 1),
+        'humidity': round(rng.uniform(40, 70), 1),
+        'moisture': round(rng.uniform(20, 70), 1),
+        'nitrogen': rng.randint(4, 46),
+        'phosphorus': rng.randint(0, 42),
+        'potassium': rng.randint(0, 25),
+    } for _ in range(n)]
+
+
+def timer_cost(iterations=200000):
+    from metrics import Metrics
+    metrics = Metrics()
+    histogram = metrics.histogram('bench')
+    start = time.perf_counter()
+    for _ in range(iterations):
+        with histogram.time():
+            pass
+    enabled = (time.perf_counter() - start) / iterations
+    metrics.enabled = False
+    start = time.perf_counter()
+    for _ in range(iterations):
+        with histogram.time():
+            pass
+    disabled = (time.perf_counter() - start) / iterations
+    return enabled * 1e6, disabled * 1e6
+
+
+def run(rounds=10, per_round=1000, devices=100):
+    os.environ.setdefault('SENSOR_LOG_DIR', tempfile.mkdtemp())
+    os.environ.setdefault('MODEL_WATCH_INTERVAL', '0')
+    os.environ.setdefault('THINGSPEAK_API_ENDPOINT', 'http://127.0.0.1:9/')
+    os.environ['INGEST_MODE'] = 'sync'
+    # Random readings drift from the training data; a refresh must not rewrite models/
+    os.environ['DRIFT_ENABLED'] = '0'
+    os.environ['DRIFT_REFRESH'] = '0'
+    sys.path.insert(0, SERVER_DIR)
+    os.chdir(SERVER_DIR)
+    import server2
+
+    client = server2.app.test_client()
+    bodies = make_bodies(per_round)
+    urls = [f"/sensor-data?device=node-{i % devices}" for i in range(per_round)]
+    # Warm up: load the model and create the devices
+    for url, body in zip(urls, bodies):
+        client.post(url, json=body)
+
+    rates = {True: [], False: []}
+    for round_index in range(rounds * 2):
+        enabled = round_index % 2 == 0
+        server2.metrics.enabled = enabled
+        server2.prediction_cache.clear()
+        start = time.perf_counter()
+        for url, body in zip(urls, bodies):
+            client.post(url, json=body)
+        rates[enabled].append(per_round / (time.perf_counter() - start))
+    server2.metrics.enabled = True
+
+    on, off = float(np.median(rates[True])), float(np.median(rates[False]))
+    timer_on_us, timer_off_us = timer_cost()
+    return {
+        'requests': rounds * 2 * per_round,
+        'enabled_per_s': on,
+        'disabled_per_s': off,
+        'overhead_pct': (off - on) / off * 100,
+        'timer_us': timer_on_us,
+        'disabled_timer_us': timer_off_us,
+        'stages': server2.metrics.summaries('stage_seconds'),
+    }
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    per_round = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    results = run(rounds, per_round)
+    print(f"\n=== Instrumentation overhead, POST /sensor-data, {results['requests']:,} requests ===")
+    print(f"metrics on:   {results['enabled_per_s']:8.0f} req/s")
+    print(f"metrics off:  {results['disabled_per_s']:8.0f} req/s")
+    print(f"overhead:     {results['overhead_pct']:8.2f} %")
+    print(f"timer cost:   {results['timer_us']:8.2f} us on, {results['disabled_timer_us']:.2f} us off")
+    print(f"\n{'stage':>8s} {'count':>8s} {'p50 ms':>8s} {'p99 ms':>8s} {'max ms':>8s}")
+    for stage, s in results['stages'].items():
+        print(f"{stage:>8s} {s['count']:8d} {s['p50_ms']:8.3f} {s['p99_ms']:8.3f} {s['max_ms']:8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Cold-start time and per-worker memory: joblib pickles vs the model bundle.
+
+Starts several worker processes per loading strategy. Each imports what it
+needs, loads the models and makes one prediction, then stays alive while the
+parent reads its memory from /proc/<pid>/smaps_rollup (Linux). PSS divides
+shared pages between the processes mapping them, so it is the fair
+per-worker cost when workers share the bundle's pages.
+Run from the project root:
+
+    python benchmarks/bench_model_startup.py [workers]
+"""
+import json
+import os
+import subprocess
+import sys
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Executed in each worker; prints timings, then waits for stdin to close
+WORKER = """
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+import numpy as np
+mode = sys.argv[1]
+if mode == 'joblib':
+    import joblib
+    models = {{key: joblib.load({models!r} + '/' + name) for key, name in [
+        ('model', 'soil_testing_model.joblib'), ('scaler', 'scaler.joblib'),
+        ('soil_encoder', 'soil_type_encoder.joblib'), ('crop_encoder', 'crop_type_encoder.joblib'),
+        ('fertilizer_encoder', 'fertilizer_encoder.joblib')]}}
+else:
+    import model_bundle
+    models = model_bundle.ModelBundle.open({models!r} + '/model_bundle.bin').as_models()
+loaded = time.perf_counter()
+row = np.array([[30.0, 50.0, 40.0, 1, 2, 20.0, 5.0, 10.0]])
+scaled = (row - models['scaler'].mean_) / models['scaler'].scale_
+models['fertilizer_encoder'].inverse_transform(models['model'].predict(scaled))
+predicted = time.perf_counter()
+print(json.dumps({{'load_seconds': loaded - start, 'first_prediction_seconds': predicted - start}}), flush=True)
+sys.stdin.read()
+"""
+
+SERVER_IMPORT = """
+import os, sys, tempfile, time
+os.environ['SENSOR_LOG_DIR'] = tempfile.mkdtemp()
+os.environ['DRIFT_ENABLED'] = '0'
+sys.path.insert(0, {server_dir!r})
+os.chdir({server_dir!r})
+start = time.perf_counter()
+import server2
+imported = time.perf_counter()
+server2.predict_fertilizer_batch([server2.default_readings()])
+predicted = time.perf_counter()
+print(imported - start, predicted - start)
+"""
+
+
+def memory_kb(pid):
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1])
+    return values
+
+
+def run_workers(mode, workers):
+    models_dir = os.path.join(PROJECT_ROOT, 'models')
+    code = WORKER.format(root=PROJECT_ROOT, models=models_dir)
+    procs = [subprocess.Popen([sys.executable, '-c', code, mode], stdin=subprocess.PIPE,
+                              stdout=subprocess.PIPE, text=True) for _ in range(workers)]
+    try:
+        timings = [json.loads(proc.stdout.readline()) for proc in procs]
+        memory = [memory_kb(proc.pid) for proc in procs]
+    finally:
+        for proc in procs:
+            proc.stdin.close()
+            proc.wait()
+
+    return {
+        'mode': mode,
+        'workers': workers,
+        'load_seconds': sum(t['load_seconds'] for t in timings) / workers,
+        'first_prediction_seconds': sum(t['first_prediction_seconds'] for t in timings) / workers,
+        'rss_mb': sum(m['Rss'] for m in memory) / workers / 1024,
+        'pss_mb': sum(m['Pss'] for m in memory) / workers / 1024,
+        'private_mb': sum(m['Private_Clean'] + m['Private_Dirty'] for m in memory) / workers / 1024,
+    }
+
+
+def server_startup():
+    """Seconds to import server2 (models not loaded yet) and to its first prediction."""
+    server_dir = os.path.join(PROJECT_ROOT, 'esp32_sensor_interface')
+    output = subprocess.run([sys.executable, '-c', SERVER_IMPORT.format(server_dir=server_dir)],
+                            check=True, capture_output=True, text=True).stdout
+    imported, predicted = (float(value) for value in output.split()[-2:])
+    return {'import_seconds': imported, 'first_prediction_seconds': predicted}
+
+
+def run(workers=4):
+    sys.path.insert(0, PROJECT_ROOT)
+    import model_bundle
+
+    model_bundle.load_bundle(os.path.join(PROJECT_ROOT, 'models'))
+    return {
+        'workers': [run_workers('joblib', workers), run_workers('bundle', workers)],
+        'server': server_startup(),
+    }
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    results = run(workers)
+    print(f"\n=== Model loading, {workers} workers ===")
+    print(f"{'mode':>8s} {'load s':>8s} {'1st pred s':>11s} {'RSS MB':>8s} {'PSS MB':>8s} {'private MB':>11s}")
+    for r in results['workers']:
+        print(f"{r['mode']:>8s} {r['load_seconds']:8.3f} {r['first_prediction_seconds']:11.3f} "
+              f"{r['rss_mb']:8.1f} {r['pss_mb']:8.1f} {r['private_mb']:11.1f}")
+    server = results['server']
+    print(f"\nserver2 import: {server['import_seconds']:.3f}s, "
+          f"first prediction after: {server['first_prediction_seconds']:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""Load test of serve.py: throughput and latency against the number of workers.
+
+For each worker count, starts serve.py on a free port with a fresh log
+directory and device database, waits until it answers, then runs client
+processes that POST random readings to /sensor-data (spread over many
+devices, so the per-device locks rarely contend) and GET device readings,
+over new connections, for a fixed time. Reports requests per second, p50
+and p99 latency, errors, and the workers' resident and proportional set
+sizes, which show how much of the loaded model the workers share.
+Throughput can only scale up to the number of CPU cores, which the client
+processes share with the server. Run from the project root:
+
+    python benchmarks/bench_serve.py [max_workers] [seconds]
+"""
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_DIR = os.path.join(PROJECT_ROOT, 'esp32_sensor_interface')
+
+# Share of requests that are reads
+GET_SHARE = 0.2
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def request(port, method, path, body=None):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    finally:
+        connection.close()
+
+
+def client(port, seconds, seed, devices, results):
+    rng = random.Random(seed)
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + seconds
+    while True:
+        device = f'bench-{rng.randrange(devices)}'
+        if rng.random() < GET_SHARE:
+            method, body = 'GET', None
+        else:
+            method, body = 'POST', json.dumps({
+                'temperature': round(rng.uniform(20, 38), 1),
+                'humidity': round(rng.uniform(40, 70), 1),
+                'moisture': round(rng.uniform(20, 70), 1),
+                'nitrogen': rng.randint(4, 46),
+                'phosphorus': rng.randint(0, 42),
+                'potassium': rng.randint(0, 25),
+            })
+        start = time.perf_counter()
+        if start >= deadline:
+            break
+        try:
+            status = request(port, method, f'/sensor-data?device={device}', body)
+        except OSError:
+            status = None
+        latencies.append(time.perf_counter() - start)
+        if status != 200:
+            errors += 1
+    results.put((latencies, errors))
+
+
+def memory(pid):
+    """Resident and proportional set size of a process, in MB."""
+    sizes = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                name, _, rest = line.partition(':')
+                if name in ('Rss', 'Pss'):
+                    sizes[name.lower()] = int(rest.split()[0]) / 1024
+    except OSError:
+        pass
+    return sizes
+
+
+def worker_pids(master_pid):
+    try:
+        with open(f'/proc/{master_pid}/task/{master_pid}/children') as f:
+            return [int(pid) for pid in f.read().split()]
+    except OSError:
+        return []
+
+
+def start_server(workers, port, workdir):
+    env = dict(os.environ,
+               SENSOR_LOG_DIR=os.path.join(workdir, 'log'),
+               DEVICE_STATE_DB=os.path.join(workdir, 'devices.sqlite'),
+               MODEL_WATCH_INTERVAL='0',
+               THINGSPEAK_API_ENDPOINT='http://127.0.0.1:9/',
+               SERVE_MAX_REQUESTS='0',
+               DRIFT_ENABLED='0',
+               DRIFT_REFRESH='0')
+    server = subprocess.Popen([sys.executable, 'serve.py', '--workers', str(workers),
+                               '--host', '127.0.0.1', '--port', str(port)],
+                              cwd=SERVER_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if request(port, 'GET', '/devices') == 200 and len(worker_pids(server.pid)) == workers:
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("serve.py did not start")
+
+
+def run_load(workers, seconds=10, clients_per_worker=4, devices=5000):
+    workdir = tempfile.mkdtemp()
+    port = free_port()
+    server = start_server(workers, port, workdir)
+    try:
+        results = multiprocessing.Queue()
+        clients = [multiprocessing.Process(target=client, args=(port, seconds, i, devices, results))
+                   for i in range(workers * clients_per_worker)]
+        for process in clients:
+            process.start()
+        gathered = [results.get() for _ in clients]
+        for process in clients:
+            process.join()
+        pids = worker_pids(server.pid)
+        sizes = [memory(pid) for pid in pids]
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(60)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies = np.concatenate([np.array(l) for l, _ in gathered]) * 1000
+    return {
+        'workers': workers,
+        'clients': len(clients),
+        'requests': len(latencies),
+        'errors': sum(e for _, e in gathered),
+        'requests_per_s': len(latencies) / seconds,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'worker_rss_mb': float(np.mean([s.get('rss', 0) for s in sizes])) if sizes else None,
+        'worker_pss_mb': float(np.mean([s.get('pss', 0) for s in sizes])) if sizes else None,
+    }
+
+
+def run(max_workers=None, seconds=10):
+    max_workers = max_workers or max(2, os.cpu_count() or 1)
+    counts = sorted({1, *[2 ** i for i in range(1, 8) if 2 ** i < max_workers], max_workers})
+    return [run_load(workers, seconds) for workers in counts]
+
+
+def main():
+    max_workers = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    results = run(max_workers, seconds)
+    print(f"\n=== serve.py load test ({os.cpu_count()} CPU cores) ===")
+    print(f"{'workers':>7s} {'clients':>7s} {'req/s':>8s} {'scaling':>7s} {'p50 ms':>7s} {'p99 ms':>7s} "
+          f"{'errors':>6s} {'RSS MB':>7s} {'PSS MB':>7s}")
+    base = results[0]['requests_per_s']
+    for r in results:
+        print(f"{r['workers']:7d} {r['clients']:7d} {r['requests_per_s']:8.0f} {r['requests_per_s'] / base:6.2f}x "
+              f"{r['p50_ms']:7.1f} {r['p99_ms']:7.1f} {r['errors']:6d} "
+              f"{r['worker_rss_mb'] or 0:7.1f} {r['worker_pss_mb'] or 0:7.1f}")
+
+
+if __name__ == "__main__":
+    main()
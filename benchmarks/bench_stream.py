@@ -0,0 +1,218 @@
+"""Server CPU per live stream client as the number of clients grows.
+
+Starts serve.py with one worker, opens N connections to GET /stream for one
+device (read by a single selector thread here, so the clients cost little),
+then POSTs readings for that device and measures the worker's CPU time
+while every client receives them, and again while the streams sit idle and
+only get heartbeats. The CPU of handling the POSTs themselves, measured
+with no clients, is subtracted, so what remains is the cost of fanning each
+reading out: per event received it should stay flat as N grows. Run from the
+project root:
+
+    python benchmarks/bench_stream.py [max_clients] [readings]
+"""
+import http.client
+import json
+import os
+import selectors
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_DIR = os.path.join(PROJECT_ROOT, 'esp32_sensor_interface')
+sys.path.insert(0, os.path.join(PROJECT_ROOT, 'benchmarks'))
+
+from bench_serve import free_port, request, worker_pids  # noqa: E402
+
+DEVICE = 'bench-stream'
+HEARTBEAT = 0.5
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+
+
+def cpu_seconds(pid):
+    """User plus system CPU time of a process."""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLK_TCK
+
+
+def start_server(port, workdir):
+    env = dict(os.environ,
+               SENSOR_LOG_DIR=os.path.join(workdir, 'log'),
+               DEVICE_STATE_DB=os.path.join(workdir, 'devices.sqlite'),
+               MODEL_WATCH_INTERVAL='0',
+               THINGSPEAK_API_ENDPOINT='http://127.0.0.1:9/',
+               SERVE_MAX_REQUESTS='0',
+               DRIFT_ENABLED='0',
+               DRIFT_REFRESH='0',
+               STREAM_HEARTBEAT=str(HEARTBEAT),
+               STREAM_MAX_SUBSCRIBERS='100000')
+    server = subprocess.Popen([sys.executable, 'serve.py', '--workers', '1',
+                               '--host', '127.0.0.1', '--port', str(port)],
+                              cwd=SERVER_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if request(port, 'GET', '/devices') == 200 and worker_pids(server.pid):
+                return server, worker_pids(server.pid)[0]
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("serve.py did not start")
+
+
+class Clients:
+    """N stream connections, read by one thread, counting events and heartbeats."""
+
+    def __init__(self, port, count):
+        self.selector = selectors.DefaultSelector()
+        self.sockets = []
+        self.events = 0
+        self.heartbeats = 0
+        self.lock = threading.Lock()
+        self.stopping = False
+        for _ in range(count):
+            sock = socket.create_connection(('127.0.0.1', port))
+            sock.sendall(f'GET /stream?device={DEVICE} HTTP/1.1\r\nHost: bench\r\n\r\n'.encode())
+            sock.setblocking(False)
+            self.selector.register(sock, selectors.EVENT_READ)
+            self.sockets.append(sock)
+        self.thread = threading.Thread(target=self.read, daemon=True)
+        self.thread.start()
+
+    def read(self):
+        while not self.stopping:
+            for key, _ in self.selector.select(0.1):
+                try:
+                    data = key.fileobj.recv(65536)
+                except BlockingIOError:
+                    continue
+                with self.lock:
+                    self.events += data.count(b'event: reading')
+                    self.heartbeats += data.count(b': ping')
+
+    def counts(self):
+        with self.lock:
+            return self.events, self.heartbeats
+
+    def wait_for(self, events, timeout=60):
+        deadline = time.time() + timeout
+        while self.counts()[0] < events and time.time() < deadline:
+            time.sleep(0.05)
+        return self.counts()[0]
+
+    def close(self):
+        self.stopping = True
+        self.thread.join()
+        for sock in self.sockets:
+            sock.close()
+
+
+def post_reading(port, i):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        connection.request('POST', f'/sensor-data?device={DEVICE}', body=json.dumps({
+            'temperature': 20 + i % 15, 'humidity': 50, 'moisture': 40,
+            'nitrogen': 10 + i % 30, 'phosphorus': 10, 'potassium': 10,
+        }), headers={'Content-Type': 'application/json'})
+        connection.getresponse().read()
+    finally:
+        connection.close()
+
+
+def run_clients(count, readings=50, idle_seconds=3.0):
+    workdir = tempfile.mkdtemp()
+    port = free_port()
+    server, worker = start_server(port, workdir)
+    clients = None
+    try:
+        clients = Clients(port, count)
+        # Every client gets the current readings first
+        connected = clients.wait_for(count)
+        time.sleep(0.5)
+
+        events_before = clients.counts()[0]
+        cpu_before = cpu_seconds(worker)
+        start = time.perf_counter()
+        for i in range(readings):
+            post_reading(port, i)
+            # Each reading is fanned out on its own: the clients share this
+            # machine's cores, so posting faster than they read would only
+            # measure readings superseded before they are sent
+            clients.wait_for(events_before + count * (i + 1), timeout=10)
+        received = clients.counts()[0] - events_before
+        publish_seconds = time.perf_counter() - start
+        publish_cpu = cpu_seconds(worker) - cpu_before
+
+        heartbeats_before = clients.counts()[1]
+        cpu_before = cpu_seconds(worker)
+        time.sleep(idle_seconds)
+        idle_cpu = cpu_seconds(worker) - cpu_before
+        heartbeats = clients.counts()[1] - heartbeats_before
+        stats = json.loads(http_get(port, '/stats/stream'))
+    finally:
+        if clients is not None:
+            clients.close()
+        server.send_signal(signal.SIGTERM)
+        server.wait(60)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'clients': count,
+        'connected': connected,
+        'readings': readings,
+        'events_received': received,
+        'publish_seconds': publish_seconds,
+        'publish_cpu': publish_cpu,
+        'idle_cpu': idle_cpu,
+        'idle_seconds': idle_seconds,
+        'heartbeats': heartbeats,
+        'coalesced': stats['coalesced'],
+        'dropped': stats['dropped'],
+    }
+
+
+def http_get(port, path):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        connection.request('GET', path)
+        return connection.getresponse().read()
+    finally:
+        connection.close()
+
+
+def run(max_clients=4000, readings=50):
+    counts = [0] + [n for n in (100, 500, 1000, 2000, 4000, 8000) if n < max_clients] + [max_clients]
+    results = [run_clients(count, readings) for count in sorted(set(counts))]
+    base = results[0]
+    for r in results:
+        # Fan-out cost only: the CPU of handling the POSTs is in the 0-client run
+        r['fanout_cpu'] = max(0.0, r['publish_cpu'] - base['publish_cpu'])
+        r['us_per_client_reading'] = r['fanout_cpu'] / r['events_received'] * 1e6 if r['clients'] else None
+        r['us_per_client_second_idle'] = r['idle_cpu'] / (r['clients'] * r['idle_seconds']) * 1e6 \
+            if r['clients'] else None
+    return results
+
+
+def main():
+    max_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 4000
+    readings = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    results = run(max_clients, readings)
+    print(f"\n=== Live stream fan-out ({readings} readings, heartbeat every {HEARTBEAT}s) ===")
+    print(f"{'clients':>7s} {'events':>8s} {'coalesced':>9s} {'CPU s':>6s} {'us/client/reading':>17s} "
+          f"{'idle us/client/s':>16s}")
+    for r in results:
+        per_reading = f"{r['us_per_client_reading']:17.1f}" if r['clients'] else f"{'-':>17s}"
+        per_idle = f"{r['us_per_client_second_idle']:16.1f}" if r['clients'] else f"{'-':>16s}"
+        print(f"{r['clients']:7d} {r['events_received']:8d} {r['coalesced']:9d} {r['publish_cpu']:6.2f} "
+              f"{per_reading} {per_idle}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Peak memory of streaming training as the input CSV grows.
+
+Writes synthetic CSVs of increasing size, then trains on each in a fresh
+subprocess and reports that process's peak RSS. With streaming the peak
+should stay flat; the in-memory pd.read_csv load is shown for comparison.
+Run from the project root:
+
+    python benchmarks/bench_streaming.py [rows ...]      # default: 100000 1000000
+    python benchmarks/bench_streaming.py 1000000 10000000
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import write_synthetic_csv  # noqa: E402
+
+# Executed in a child process so each measurement gets its own ru_maxrss
+CHILD = """
+import json, resource, sys, time
+sys.path.insert(0, {root!r})
+import streaming_data
+path, mode = sys.argv[1], sys.argv[2]
+start = time.perf_counter()
+if mode == 'read_csv':
+    import pandas as pd
+    pd.read_csv(path)
+else:
+    streaming_data.train_streaming(path, mode=mode, chunksize=100000, epochs=1,
+                                   sample_size=50000, n_estimators=20)
+print(json.dumps({{'seconds': time.perf_counter() - start,
+                   'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}}))
+"""
+
+
+def measure(path, mode):
+    output = subprocess.run([sys.executable, '-c', CHILD.format(root=PROJECT_ROOT), path, mode],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(sizes=(100_000, 1_000_000), modes=('forest', 'sgd'), compare_read_csv=True):
+    """Peak RSS and time per (rows, mode)."""
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in sizes:
+            path = os.path.join(tmp, f"synthetic_{rows}.csv")
+            start = time.perf_counter()
+            write_synthetic_csv(path, rows)
+            generate_seconds = time.perf_counter() - start
+
+            measured_modes = list(modes) + (['read_csv'] if compare_read_csv else [])
+            for mode in measured_modes:
+                result = measure(path, mode)
+                result.update({'rows': rows, 'mode': mode, 'file_mb': os.path.getsize(path) / 1e6,
+                               'generate_seconds': generate_seconds})
+                results.append(result)
+            os.remove(path)
+    return results
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100_000, 1_000_000]
+    results = run(sizes)
+    print("\n=== Streaming training peak memory ===")
+    print(f"{'rows':>12s} {'file MB':>9s} {'mode':>9s} {'seconds':>9s} {'peak RSS MB':>12s}")
+    for r in results:
+        print(f"{r['rows']:12d} {r['file_mb']:9.1f} {r['mode']:>9s} {r['seconds']:9.1f} {r['peak_rss_mb']:12.0f}")
+
+
+if __name__ == "__main__":
+    main()
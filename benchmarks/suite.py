@@ -0,0 +1,410 @@
+"""Benchmark suite with JSON results and regression checks against a baseline.
+
+Scenarios run the real code paths:
+
+* ``predict_single`` - predict.prepare_input and the model, one row at a time
+* ``server_single``  - server2.predict_fertilizer, one reading at a time
+* ``batch``          - predict.predict_batch and server2.predict_fertilizer_batch
+* ``train``          - soil_testing_model preprocessing and train_model on
+  dataset/data_core.csv (or a synthetic CSV of ``--train-rows`` rows), in a
+  subprocess working in a temporary directory so models/ is not touched
+* ``ingest``         - sustained POST /sensor-data through Flask's test client
+
+Inputs come from benchmarks/synthetic.py with a fixed seed, so every run
+sees the same data. Each scenario is repeated ``--repeat`` times and the
+median of each metric is kept. Results are written as JSON together with
+the configuration and environment. Metric names give their direction:
+``*_per_s`` and ``accuracy`` should not go down, ``*_us``, ``*_ms``,
+``*_seconds`` and ``*_mb`` should not go up. A metric regresses when it is
+worse than the baseline by more than its threshold, a fraction matched by
+pattern (``--threshold 'ingest.*=0.2'``, then THRESHOLDS, then
+``--default-threshold``). The exit status is 1 if anything regressed.
+Run from the project root:
+
+    python benchmarks/suite.py --save-baseline      # record a baseline
+    python benchmarks/suite.py                      # compare against it
+    python benchmarks/suite.py --quick --only batch ingest
+    python benchmarks/suite.py --batch-rows 2000000 --train-rows 1000000
+"""
+import argparse
+import contextlib
+import fnmatch
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_DIR = os.path.join(PROJECT_ROOT, 'esp32_sensor_interface')
+RESULTS_DIR = os.path.join(PROJECT_ROOT, 'benchmarks', 'results')
+BASELINE_PATH = os.path.join(RESULTS_DIR, 'baseline.json')
+sys.path.insert(0, PROJECT_ROOT)
+sys.path.insert(0, os.path.join(PROJECT_ROOT, 'benchmarks'))
+
+from synthetic import SOURCE_CSV, synthetic_frame, synthetic_readings, write_synthetic_csv  # noqa: E402
+
+DEFAULT_CONFIG = {
+    'seed': 0,
+    'single_rows': 2000,
+    'batch_rows': 100_000,
+    'train_rows': None,      # None trains on dataset/data_core.csv
+    'ingest_posts': 2000,
+    'devices': 100,
+    'repeat': 3,
+}
+QUICK_CONFIG = dict(DEFAULT_CONFIG, single_rows=300, batch_rows=10_000, ingest_posts=300, repeat=1)
+
+# Readings are converted to server dicts this many at a time, so batch runs
+# over millions of rows do not hold millions of dicts
+BATCH_CHUNK = 50_000
+
+DEFAULT_THRESHOLD = 0.10
+# Tail latencies are noisier than medians and throughput
+THRESHOLDS = {
+    '*.p99_*': 0.30,
+    'train.accuracy': 0.02,
+}
+
+TRAIN_SCRIPT = """
+import json, os, resource, sys, time
+sys.path.insert(0, {project_root!r})
+os.makedirs('models', exist_ok=True)
+import joblib
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import train_test_split
+import soil_testing_model as stm
+
+start = time.perf_counter()
+df = stm.preprocess_data(stm.load_data({path!r}))
+preprocessed = time.perf_counter()
+X = df.drop('Fertilizer Name', axis=1)
+y = df['Fertilizer Name']
+model = stm.train_model(X, y)
+trained = time.perf_counter()
+
+# train_model splits with the same test size and seed
+_, X_test, _, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+accuracy = accuracy_score(y_test, model.predict(joblib.load('models/scaler.joblib').transform(X_test)))
+print(json.dumps({{
+    'rows': len(df),
+    'preprocess_seconds': preprocessed - start,
+    'fit_seconds': trained - preprocessed,
+    'total_seconds': trained - start,
+    'accuracy': accuracy,
+    'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}}))
+"""
+
+
+def import_server(log_dir):
+    """Import server2 with its background work pointed away from real state."""
+    os.environ['SENSOR_LOG_DIR'] = log_dir
+    os.environ['MODEL_WATCH_INTERVAL'] = '0'
+    os.environ['INGEST_MODE'] = 'sync'
+    # Synthetic readings drift from the training data; a refresh must not rewrite models/
+    os.environ['DRIFT_ENABLED'] = '0'
+    os.environ['DRIFT_REFRESH'] = '0'
+    os.environ.setdefault('THINGSPEAK_API_ENDPOINT', 'http://127.0.0.1:9/')
+    if SERVER_DIR not in sys.path:
+        sys.path.insert(0, SERVER_DIR)
+    import server2
+    return server2
+
+
+def latency_metrics(latencies, unit='us'):
+    scale = 1e6 if unit == 'us' else 1e3
+    samples = np.array(latencies) * scale
+    return {
+        'rows_per_s': len(latencies) / float(np.sum(latencies)),
+        f'p50_{unit}': float(np.percentile(samples, 50)),
+        f'p99_{unit}': float(np.percentile(samples, 99)),
+    }
+
+
+def user_inputs(rows, seed):
+    """Synthetic readings in get_user_input format."""
+    df = synthetic_frame(rows, seed=seed).drop(columns='Fertilizer Name')
+    return df.rename(columns={'Temparature': 'Temperature'})
+
+
+def bench_predict_single(config, context):
+    import predict
+    models = context['models']
+    records = user_inputs(config['single_rows'], config['seed']).to_dict('records')
+    latencies = []
+    for record in records:
+        start = time.perf_counter()
+        features = predict.prepare_input(record, models)
+        models['fertilizer_encoder'].inverse_transform(models['model'].predict(features))
+        latencies.append(time.perf_counter() - start)
+    return latency_metrics(latencies)
+
+
+def bench_server_single(config, context):
+    from fertilizer_allocator import FertilizerAssignments
+    server2 = context['server2']
+    models = server2.get_models()
+    readings = synthetic_readings(config['single_rows'], seed=config['seed'])
+    server2.prediction_cache.clear()
+    latencies = []
+    # Conflict avoidance prints when it changes a recommendation
+    with contextlib.redirect_stdout(io.StringIO()):
+        for reading in readings:
+            start = time.perf_counter()
+            fertilizer = server2.predict_fertilizer(reading, FertilizerAssignments(), models)
+            latencies.append(time.perf_counter() - start)
+    if fertilizer == "Prediction error":
+        raise RuntimeError("server2.predict_fertilizer failed")
+    return latency_metrics(latencies)
+
+
+def bench_batch(config, context):
+    import predict
+    server2 = context['server2']
+    rows = config['batch_rows']
+    df = user_inputs(rows, config['seed'])
+    start = time.perf_counter()
+    predict.predict_batch(df, context['models'])
+    predict_seconds = time.perf_counter() - start
+    del df
+
+    models = server2.get_models()
+    server_seconds = 0.0
+    for offset in range(0, rows, BATCH_CHUNK):
+        readings = synthetic_readings(min(BATCH_CHUNK, rows - offset), seed=config['seed'] + offset)
+        start = time.perf_counter()
+        server2.predict_fertilizer_batch(readings, models)
+        server_seconds += time.perf_counter() - start
+    return {
+        'predict_rows_per_s': rows / predict_seconds,
+        'server_rows_per_s': rows / server_seconds,
+    }
+
+
+def bench_train(config, context):
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = SOURCE_CSV
+        if config['train_rows']:
+            path = write_synthetic_csv(os.path.join(work_dir, 'train.csv'), config['train_rows'], seed=config['seed'])
+        script = TRAIN_SCRIPT.format(project_root=PROJECT_ROOT, path=path)
+        output = subprocess.check_output([sys.executable, '-c', script], cwd=work_dir, text=True,
+                                         env=dict(os.environ, MPLBACKEND='Agg'))
+    result = json.loads(output.strip().splitlines()[-1])
+    result.pop('rows')
+    return result
+
+
+def bench_ingest(config, context):
+    server2 = context['server2']
+    client = server2.app.test_client()
+    rng = np.random.default_rng(config['seed'])
+    posts, devices = config['ingest_posts'], config['devices']
+    bodies = [{
+        'temperature': float(round(rng.uniform(20, 38), 1)),
+        'humidity': float(round(rng.uniform(40, 70), 1)),
+        'moisture': float(round(rng.uniform(20, 70), 1)),
+        'nitrogen': int(rng.integers(4, 46)),
+        'phosphorus': int(rng.integers(0, 43)),
+        'potassium': int(rng.integers(0, 26)),
+    } for _ in range(posts)]
+    server2.prediction_cache.clear()
+    latencies = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i, body in enumerate(bodies):
+            start = time.perf_counter()
+            response = client.post(f"/sensor-data?device=node-{i % devices}", json=body)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise RuntimeError(f"POST /sensor-data returned {response.status_code}: {response.get_json()}")
+    result = latency_metrics(latencies, unit='ms')
+    result['requests_per_s'] = result.pop('rows_per_s')
+    return result
+
+
+SCENARIOS = {
+    'predict_single': bench_predict_single,
+    'server_single': bench_server_single,
+    'batch': bench_batch,
+    'train': bench_train,
+    'ingest': bench_ingest,
+}
+
+
+def environment():
+    import sklearn
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_ROOT,
+                                         text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'numpy': np.__version__,
+        'sklearn': sklearn.__version__,
+        'commit': commit,
+    }
+
+
+def run(config=None, only=None):
+    """Run the selected scenarios and return the results document."""
+    config = dict(DEFAULT_CONFIG, **(config or {}))
+    names = only or list(SCENARIOS)
+    os.chdir(PROJECT_ROOT)
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        context = {}
+        if set(names) - {'train'}:
+            import predict
+            context['models'] = predict.load_models()
+            context['server2'] = import_server(log_dir)
+            context['server2'].get_models()
+
+        scenarios = {}
+        for name in names:
+            runs = []
+            for _ in range(config['repeat']):
+                runs.append(SCENARIOS[name](config, context))
+            scenarios[name] = {metric: float(np.median([r[metric] for r in runs])) for metric in runs[0]}
+            print(f"{name}: " + ', '.join(f"{metric}={value:.4g}" for metric, value in scenarios[name].items()))
+
+    return {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': config,
+        'environment': environment(),
+        'scenarios': scenarios,
+    }
+
+
+def metric_direction(metric):
+    """+1 if higher is better, -1 if lower is better, 0 if not compared."""
+    if metric.endswith('_per_s') or metric == 'accuracy':
+        return 1
+    if metric.endswith(('_us', '_ms', '_seconds', '_mb')):
+        return -1
+    return 0
+
+
+def threshold_for(key, overrides=None, default=DEFAULT_THRESHOLD):
+    for patterns in (overrides or {}, THRESHOLDS):
+        for pattern, threshold in patterns.items():
+            if fnmatch.fnmatchcase(key, pattern):
+                return threshold
+    return default
+
+
+def compare(results, baseline, overrides=None, default=DEFAULT_THRESHOLD):
+    """Compare each metric with the baseline; returns one row per metric."""
+    rows = []
+    for scenario, metrics in results['scenarios'].items():
+        for metric, value in metrics.items():
+            base = baseline['scenarios'].get(scenario, {}).get(metric)
+            direction = metric_direction(metric)
+            key = f"{scenario}.{metric}"
+            if base is None or direction == 0 or base == 0:
+                rows.append({'metric': key, 'value': value, 'baseline': base, 'change': None, 'regressed': False})
+                continue
+            change = (value - base) / abs(base)
+            threshold = threshold_for(key, overrides, default)
+            rows.append({
+                'metric': key,
+                'value': value,
+                'baseline': base,
+                'change': change,
+                'threshold': threshold,
+                'regressed': -change * direction > threshold,
+            })
+    return rows
+
+
+def config_differences(results, baseline):
+    ignored = {'repeat'}
+    keys = set(results['config']) | set(baseline.get('config', {}))
+    return sorted(key for key in keys - ignored
+                  if results['config'].get(key) != baseline.get('config', {}).get(key))
+
+
+def parse_threshold(value):
+    pattern, _, fraction = value.rpartition('=')
+    if not pattern:
+        raise argparse.ArgumentTypeError("expected PATTERN=FRACTION, e.g. 'ingest.*=0.2'")
+    return pattern, float(fraction)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the benchmark suite and compare against a baseline.")
+    parser.add_argument('--only', nargs='+', choices=list(SCENARIOS), help="scenarios to run (default: all)")
+    parser.add_argument('--quick', action='store_true', help="small inputs and one repeat")
+    parser.add_argument('--repeat', type=int, help="runs per scenario; the median is kept")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--single-rows', type=int, help="rows for the single-row scenarios")
+    parser.add_argument('--batch-rows', type=int, help="rows for the batch scenario")
+    parser.add_argument('--train-rows', type=int, help="train on a synthetic CSV of this many rows")
+    parser.add_argument('--ingest-posts', type=int, help="POSTs for the ingest scenario")
+    parser.add_argument('--output', default=os.path.join(RESULTS_DIR, 'latest.json'), help="results file")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="baseline results to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help="also write the results as the baseline")
+    parser.add_argument('--default-threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed fractional change for metrics without a matching pattern")
+    parser.add_argument('--threshold', type=parse_threshold, action='append', default=[],
+                        metavar='PATTERN=FRACTION', help="allowed change for metrics matching PATTERN")
+    return parser.parse_args(argv)
+
+
+def write_json(path, document):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=2)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = dict(QUICK_CONFIG if args.quick else DEFAULT_CONFIG)
+    for key in ('repeat', 'seed', 'single_rows', 'batch_rows', 'train_rows', 'ingest_posts'):
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+
+    results = run(config, args.only)
+    write_json(args.output, results)
+    print(f"Results written to {args.output}")
+    if args.save_baseline:
+        write_json(args.baseline, results)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to record one")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    differences = config_differences(results, baseline)
+    if differences:
+        print(f"Configuration differs from the baseline ({', '.join(differences)}); not comparing")
+        return 0
+
+    rows = compare(results, baseline, dict(args.threshold), args.default_threshold)
+    print(f"\n=== Compared with baseline from {baseline['created_at']} "
+          f"(commit {baseline['environment'].get('commit')}) ===")
+    print(f"{'metric':36s} {'baseline':>12s} {'current':>12s} {'change':>8s} {'limit':>7s}")
+    for row in rows:
+        if row['change'] is None:
+            continue
+        print(f"{row['metric']:36s} {row['baseline']:12.4g} {row['value']:12.4g} {row['change']:+8.1%} "
+              f"{row['threshold']:7.0%}{'  REGRESSION' if row['regressed'] else ''}")
+    regressions = [row['metric'] for row in rows if row['regressed']]
+    if regressions:
+        print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    print("\nNo regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+"""Synthetic soil datasets of arbitrary size for the benchmarks.
+
+Rows are drawn around the rows of dataset/data_core.csv: a random real row is
+picked and its numeric columns are jittered, so labels stay plausible and the
+trained model has something to learn. Generation is chunked, so files with
+tens of millions of rows can be written with constant memory.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_CSV = os.path.join(PROJECT_ROOT, 'dataset', 'data_core.csv')
+NUMERIC_COLUMNS = ['Temparature', 'Humidity', 'Moisture', 'Nitrogen', 'Potassium', 'Phosphorous']
+
+
+def synthetic_frame(rows, seed=0, source=None):
+    """A DataFrame of ``rows`` synthetic rows with the dataset's columns."""
+    source = source if source is not None else pd.read_csv(SOURCE_CSV)
+    rng = np.random.default_rng(seed)
+    df = source.iloc[rng.integers(0, len(source), rows)].reset_index(drop=True)
+    for column in NUMERIC_COLUMNS:
+        noise = rng.normal(0.0, 1.0, rows).round(1 if column in ('Temparature', 'Humidity', 'Moisture') else 0)
+        df[column] = (df[column] + noise).clip(lower=0)
+    return df
+
+
+def write_synthetic_csv(path, rows, chunk_rows=500_000, seed=0):
+    """Write a synthetic CSV of ``rows`` rows, ``chunk_rows`` at a time."""
+    source = pd.read_csv(SOURCE_CSV)
+    written = 0
+    chunk = 0
+    with open(path, 'w', newline='') as f:
+        while written < rows:
+            n = min(chunk_rows, rows - written)
+            synthetic_frame(n, seed=seed + chunk, source=source).to_csv(f, index=False, header=written == 0)
+            written += n
+            chunk += 1
+    return path
+
+
+def synthetic_readings(rows, seed=0):
+    """Server-style reading dicts (integer soil and crop codes)."""
+    rng = np.random.default_rng(seed)
+    return [{
+        'temperature': float(round(rng.uniform(20, 38), 1)),
+        'humidity': float(round(rng.uniform(40, 70), 1)),
+        'moisture': float(round(rng.uniform(20, 70), 1)),
+        'soil_type': int(rng.integers(0, 5)),
+        'crop_type': int(rng.integers(0, 11)),
+        'nitrogen': float(rng.integers(4, 46)),
+        'phosphorus': float(rng.integers(0, 43)),
+        'potassium': float(rng.integers(0, 26)),
+    } for _ in range(rows)]
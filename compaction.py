@@ -0,0 +1,395 @@
+"""Post-training compaction of the forest for low-power gateways.
+
+train_model fits a full 100-tree forest grown until its leaves are pure,
+though the training set is small and most trees vote the same way. A compacted
+forest is acceptable if its accuracy on the held-out rows saved by training
+is within ``tolerance`` of the full forest's, and it agrees with the full
+forest on at least ``min_agreement`` of the selection rows (the training
+rows plus readings spread uniformly over their range, so that trees are
+chosen for how they generalize, not for the 28 held-out rows).
+
+For every depth cap from 1 to the full forest's depth:
+
+1. Depth cap: every tree is cut at the cap. A node at the cap becomes a
+   leaf predicting the class mix of the training samples that reached it.
+2. Leaf merging: sibling leaves that predict the same class are replaced by
+   their parent, repeatedly, so the tree only splits where the vote changes.
+3. Tree selection: trees are added greedily, each time the one that makes
+   the subset agree most with the full forest (the smaller tree on a tie),
+   until the subset is acceptable.
+
+Of the acceptable candidates, the one with the least work per prediction
+(trees x depth) is kept, or the one with the fewest nodes.
+
+The result is written as a bundle, models/model_bundle_compact.bin, next to
+the full model's, and compared with it in models/compaction_report.json:
+size, load time, single-row and batch latency, accuracy and agreement.
+"""
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from drift import DATASET_PATH, FEATURES, training_rows
+from forest_engine import CompiledForest, load_dataset_features
+from model_bundle import (BUNDLE_FILE, ModelBundle, forest_bundle_arrays, load_bundle, load_joblib_models,
+                          read_manifest, write_bundle)
+
+COMPACT_BUNDLE_FILE = 'model_bundle_compact.bin'
+REPORT_FILE = 'compaction_report.json'
+HOLDOUT_FILE = 'holdout.npz'
+# Accuracy the compacted forest may lose on the held-out rows, and the share
+# of selection rows on which it must predict what the full forest predicts
+DEFAULT_TOLERANCE = 0.01
+DEFAULT_MIN_AGREEMENT = 0.95
+SELECTION_SAMPLES = 5000
+# Readings reported in tenths; the rest in whole units
+DECIMAL_FEATURES = {'Temparature', 'Humidity', 'Moisture'}
+
+
+def tree_nodes(estimator) -> Dict[str, np.ndarray]:
+    """Node arrays of a fitted decision tree, with the class mix at every node."""
+    tree = estimator.tree_
+    value = tree.value[:, 0, :]
+    normalizer = value.sum(axis=1)[:, np.newaxis]
+    normalizer[normalizer == 0.0] = 1.0
+    return {
+        'left': tree.children_left,
+        'right': tree.children_right,
+        'feature': tree.feature,
+        'threshold': tree.threshold,
+        'proba': value / normalizer,
+    }
+
+
+def prune_tree(tree: Dict[str, np.ndarray], max_depth: Optional[int] = None,
+               merge_leaves: bool = False) -> Dict[str, np.ndarray]:
+    """A copy of ``tree`` cut at ``max_depth``, with same-class sibling leaves merged if asked.
+
+    Nodes are renumbered in preorder; leaves have left == right == -1.
+    """
+    feature: List[int] = []
+    threshold: List[float] = []
+    left: List[int] = []
+    right: List[int] = []
+    proba: List[np.ndarray] = []
+    deepest = [0]
+
+    def emit(node: int, depth: int) -> Optional[int]:
+        """Emit the subtree at ``node``; returns its class if it is a single leaf."""
+        index = len(feature)
+        feature.append(0)
+        threshold.append(np.inf)
+        left.append(-1)
+        right.append(-1)
+        proba.append(tree['proba'][node])
+        if tree['left'][node] == -1 or (max_depth is not None and depth >= max_depth):
+            deepest[0] = max(deepest[0], depth)
+            return int(np.argmax(tree['proba'][node]))
+
+        left_class = emit(tree['left'][node], depth + 1)
+        right_index = len(feature)
+        right_class = emit(tree['right'][node], depth + 1)
+        if merge_leaves and left_class is not None and left_class == right_class:
+            # Both children are the leaves just emitted: this node replaces
+            # them, and the parent's class mix has the same majority
+            for values in (feature, threshold, left, right, proba):
+                del values[index + 1:]
+            return left_class
+        feature[index] = int(tree['feature'][node])
+        threshold[index] = float(tree['threshold'][node])
+        left[index] = index + 1
+        right[index] = right_index
+        deepest[0] = max(deepest[0], depth + 1)
+        return None
+
+    emit(0, 0)
+    return {
+        'left': np.array(left, dtype=np.int64),
+        'right': np.array(right, dtype=np.int64),
+        'feature': np.array(feature, dtype=np.int64),
+        'threshold': np.array(threshold, dtype=np.float64),
+        'proba': np.array(proba, dtype=np.float64),
+        'max_depth': deepest[0],
+    }
+
+
+def flatten_trees(trees: Sequence[Dict[str, np.ndarray]], classes) -> Dict[str, np.ndarray]:
+    """Concatenate pruned trees into the arrays of forest_engine.flatten_forest()."""
+    total_nodes = sum(len(tree['feature']) for tree in trees)
+    feature = np.zeros(total_nodes, dtype=np.int64)
+    threshold = np.full(total_nodes, np.inf, dtype=np.float64)
+    children = np.empty((total_nodes, 2), dtype=np.int64)
+    leaf_proba = np.zeros((total_nodes, len(classes)), dtype=np.float64)
+    roots = np.empty(len(trees), dtype=np.int64)
+
+    offset = 0
+    for i, tree in enumerate(trees):
+        n = len(tree['feature'])
+        nodes = np.arange(offset, offset + n)
+        is_leaf = tree['left'] == -1
+        roots[i] = offset
+        feature[offset:offset + n] = tree['feature']
+        threshold[offset:offset + n] = tree['threshold']
+        children[offset:offset + n, 0] = np.where(is_leaf, nodes, tree['left'] + offset)
+        children[offset:offset + n, 1] = np.where(is_leaf, nodes, tree['right'] + offset)
+        leaf_proba[offset:offset + n] = np.where(is_leaf[:, np.newaxis], tree['proba'], 0.0)
+        offset += n
+
+    return {
+        'feature': feature,
+        'threshold': threshold,
+        'children': children,
+        'leaf_proba': leaf_proba,
+        'roots': roots,
+        'max_depth': np.array(max((tree['max_depth'] for tree in trees), default=0), dtype=np.int64),
+        'classes': np.asarray(classes),
+    }
+
+
+def selection_rows(X_train: np.ndarray, samples: int = SELECTION_SAMPLES, seed: int = 0) -> np.ndarray:
+    """The training rows plus readings drawn uniformly over their range, at sensor resolution."""
+    rng = np.random.default_rng(seed)
+    low, high = X_train.min(axis=0), X_train.max(axis=0)
+    columns = []
+    for i, name in enumerate(FEATURES):
+        if name in DECIMAL_FEATURES:
+            columns.append(np.round(rng.uniform(low[i], high[i], samples), 1))
+        else:
+            columns.append(rng.integers(int(low[i]), int(high[i]) + 1, samples).astype(np.float64))
+    return np.vstack([X_train, np.column_stack(columns)])
+
+
+class Evaluator:
+    """Checks candidate forests against the full one on the holdout and selection rows."""
+
+    def __init__(self, full: CompiledForest, X_holdout: np.ndarray, y_holdout: np.ndarray,
+                 X_selection: np.ndarray, tolerance: float, min_agreement: float):
+        self.full = full
+        self.X_holdout = X_holdout
+        self.y_holdout = y_holdout
+        self.X_selection = X_selection
+        self.tolerance = tolerance
+        self.min_agreement = min_agreement
+        self.target = full.predict(X_selection)
+        self.full_accuracy = float((full.predict(X_holdout) == y_holdout).mean())
+
+    def scores(self, holdout_pred: np.ndarray, selection_pred: np.ndarray) -> Dict[str, float]:
+        return {
+            'holdout_accuracy': float((holdout_pred == self.y_holdout).mean()),
+            'agreement': float((selection_pred == self.target).mean()),
+        }
+
+    def acceptable(self, scores: Dict[str, float]) -> bool:
+        return (scores['holdout_accuracy'] >= self.full_accuracy - self.tolerance - 1e-12
+                and scores['agreement'] >= self.min_agreement)
+
+    def evaluate(self, engine: CompiledForest) -> Dict[str, float]:
+        return self.scores(engine.predict(self.X_holdout), engine.predict(self.X_selection))
+
+
+def select_trees(forest: CompiledForest, evaluator: Evaluator, node_counts: np.ndarray) -> Optional[List[int]]:
+    """Greedy forward selection of the smallest acceptable subset of trees, in forest order.
+
+    Returns None if even every tree together is not acceptable.
+    """
+    def tree_proba(X):
+        # Class probabilities of every tree for every row: N x trees x classes
+        return forest.leaf_proba[forest.apply_scaled((X - forest.mean) / forest.scale)].astype(np.float32)
+
+    selection, holdout = tree_proba(evaluator.X_selection), tree_proba(evaluator.X_holdout)
+    chosen: List[int] = []
+    remaining = list(range(forest.n_trees))
+    selection_total = np.zeros((selection.shape[0], forest.n_classes), dtype=np.float32)
+    holdout_total = np.zeros((holdout.shape[0], forest.n_classes), dtype=np.float32)
+    while remaining:
+        candidates = selection_total[:, np.newaxis, :] + selection[:, remaining, :]
+        agreement = (np.argmax(candidates, axis=2) == evaluator.target[:, np.newaxis]).mean(axis=0)
+        # Most agreement first, then fewest nodes
+        best = remaining[min(range(len(remaining)), key=lambda i: (-agreement[i], node_counts[remaining[i]]))]
+        chosen.append(best)
+        remaining.remove(best)
+        selection_total += selection[:, best, :]
+        holdout_total += holdout[:, best, :]
+        scores = evaluator.scores(forest.classes.take(np.argmax(holdout_total, axis=1)),
+                                  forest.classes.take(np.argmax(selection_total, axis=1)))
+        if evaluator.acceptable(scores):
+            # Forest order, since probabilities are summed in estimator order
+            return sorted(chosen)
+    return None
+
+
+def engine_for(forest: Dict[str, np.ndarray], full: CompiledForest) -> CompiledForest:
+    return CompiledForest({**forest, 'scaler_mean': full.mean, 'scaler_scale': full.scale})
+
+
+def measure(path: str, X: np.ndarray, repeats: int = 50, single_rows: int = 2000) -> Dict[str, float]:
+    """Size, load time and prediction latency of a bundle file."""
+    load = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        bundle = ModelBundle.open(path)
+        bundle.engine.predict_one(X[0])
+        load.append(time.perf_counter() - start)
+
+    engine = bundle.engine
+    single = []
+    for row in X[:single_rows]:
+        start = time.perf_counter()
+        engine.predict_one(row)
+        single.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    engine.predict(X)
+    batch = time.perf_counter() - start
+    manifest, _ = read_manifest(path)
+    return {
+        'model_version': manifest['model_version'],
+        'trees': manifest['n_trees'],
+        'nodes': manifest['n_nodes'],
+        'max_depth': manifest['max_depth'],
+        'bundle_bytes': os.path.getsize(path),
+        'load_ms': float(np.median(load) * 1000),
+        'single_row_p50_us': float(np.percentile(single, 50) * 1e6),
+        'single_row_p99_us': float(np.percentile(single, 99) * 1e6),
+        'batch_rows': int(len(X)),
+        'batch_ms': batch * 1000,
+        'batch_rows_per_s': len(X) / batch,
+    }
+
+
+def compact_model(models_dir: str = 'models', dataset: str = DATASET_PATH, tolerance: float = DEFAULT_TOLERANCE,
+                  min_agreement: float = DEFAULT_MIN_AGREEMENT, objective: str = 'latency',
+                  samples: int = SELECTION_SAMPLES, benchmark_dataset: str = 'dataset/data_core.csv') -> Dict[str, Any]:
+    """Compact the saved forest, write the compact bundle and the report, and return the report.
+
+    Every depth cap is tried, with leaves merged and trees selected under
+    it; the acceptable candidate with the least work per prediction (trees
+    x depth) is kept, or with the fewest nodes if ``objective`` is 'size'.
+    """
+    start = time.perf_counter()
+    models = load_joblib_models(models_dir)
+    model = models['model']
+    if not all(hasattr(est, 'tree_') for est in getattr(model, 'estimators_', [None])):
+        raise TypeError(f"Cannot compact a {type(model).__name__}; only tree forests are supported")
+    full = load_bundle(models_dir).engine
+    full_path = os.path.join(models_dir, BUNDLE_FILE)
+
+    with np.load(os.path.join(models_dir, HOLDOUT_FILE), allow_pickle=False) as holdout:
+        X_holdout = holdout['features']
+        y_holdout = models['fertilizer_encoder'].transform(holdout['fertilizer'])
+    X_train, _ = training_rows(dataset, models_dir)
+    evaluator = Evaluator(full, X_holdout, y_holdout, selection_rows(X_train, samples), tolerance, min_agreement)
+
+    trees = [tree_nodes(est) for est in model.estimators_]
+    candidates = []
+    # The full forest itself in case nothing smaller is acceptable
+    forest = flatten_trees([prune_tree(tree) for tree in trees], model.classes_)
+    for cap in range(1, full.max_depth + 1):
+        pruned = [prune_tree(tree, cap, merge_leaves=True) for tree in trees]
+        chosen = select_trees(engine_for(flatten_trees(pruned, model.classes_), full), evaluator,
+                              np.array([len(tree['feature']) for tree in pruned]))
+        if chosen is None:
+            continue
+        forest = flatten_trees([pruned[i] for i in chosen], model.classes_)
+        scores = evaluator.evaluate(engine_for(forest, full))
+        if not evaluator.acceptable(scores):
+            # Selection sums float32 probabilities; a tie may fall the other way in the engine
+            continue
+        candidates.append({
+            'max_depth_cap': cap,
+            'trees': len(chosen),
+            'nodes': int(len(forest['feature'])),
+            'max_depth': int(forest['max_depth']),
+            **scores,
+            'forest': forest,
+        })
+    if objective == 'size':
+        cost = lambda candidate: (candidate['nodes'], candidate['trees'] * candidate['max_depth'])  # noqa: E731
+    else:
+        cost = lambda candidate: (candidate['trees'] * candidate['max_depth'], candidate['nodes'])  # noqa: E731
+    if candidates:
+        forest = min(candidates, key=cost)['forest']
+
+    arrays = forest_bundle_arrays(forest, models['scaler'], models['soil_encoder'], models['crop_encoder'],
+                                  models['fertilizer_encoder'])
+    compact_path = os.path.join(models_dir, COMPACT_BUNDLE_FILE)
+    write_bundle(compact_path, arrays)
+    compact_seconds = time.perf_counter() - start
+
+    # Both bundles measured on the same rows
+    X_bench = load_dataset_features(benchmark_dataset, models_dir) if os.path.exists(benchmark_dataset) \
+        else evaluator.X_selection
+    compact = ModelBundle.open(compact_path).engine
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'tolerance': tolerance,
+        'min_agreement': min_agreement,
+        'objective': objective,
+        'selection_rows': int(len(evaluator.X_selection)),
+        'holdout_rows': int(len(X_holdout)),
+        'compact_seconds': compact_seconds,
+        'candidates': [{key: value for key, value in candidate.items() if key != 'forest'}
+                       for candidate in candidates],
+        'full': {
+            **measure(full_path, X_bench),
+            **evaluator.evaluate(full),
+            'joblib_bytes': os.path.getsize(os.path.join(models_dir, 'soil_testing_model.joblib')),
+        },
+        'compact': {
+            **measure(compact_path, X_bench),
+            **evaluator.evaluate(compact),
+            'benchmark_agreement': float((compact.predict(X_bench) == full.predict(X_bench)).mean()),
+        },
+    }
+    tmp_path = os.path.join(models_dir, f"{REPORT_FILE}.tmp{os.getpid()}")
+    with open(tmp_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, os.path.join(models_dir, REPORT_FILE))
+    return report
+
+
+def print_report(report: Dict[str, Any]):
+    full, compact = report['full'], report['compact']
+    print(f"Compacted {full['trees']} trees / {full['nodes']} nodes / depth {full['max_depth']} to "
+          f"{compact['trees']} / {compact['nodes']} / {compact['max_depth']} in {report['compact_seconds']:.1f}s")
+    print(f"{'':22s} {'full':>10s} {'compact':>10s}")
+    rows = [
+        ('bundle KB', 'bundle_bytes', 1 / 1024, '.0f'),
+        ('load ms', 'load_ms', 1, '.3f'),
+        ('single row p50 us', 'single_row_p50_us', 1, '.1f'),
+        ('single row p99 us', 'single_row_p99_us', 1, '.1f'),
+        (f"batch of {full['batch_rows']} ms", 'batch_ms', 1, '.1f'),
+        ('holdout accuracy', 'holdout_accuracy', 1, '.3f'),
+        ('agreement with full', 'agreement', 1, '.3f'),
+    ]
+    for label, key, factor, spec in rows:
+        print(f"{label:22s} {full[key] * factor:>10{spec}} {compact[key] * factor:>10{spec}}")
+    print(f"Agreement with the full forest on the benchmark rows: {compact['benchmark_agreement']:.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact the trained forest for low-power gateways.")
+    parser.add_argument('--models-dir', default='models')
+    parser.add_argument('--dataset', default=DATASET_PATH)
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="holdout accuracy the compacted forest may lose (default 0.01)")
+    parser.add_argument('--min-agreement', type=float, default=DEFAULT_MIN_AGREEMENT,
+                        help="share of selection rows on which it must agree with the full forest (default 0.95)")
+    parser.add_argument('--objective', choices=['latency', 'size'], default='latency',
+                        help="minimize trees x depth (work per prediction) or nodes (bundle size)")
+    parser.add_argument('--samples', type=int, default=SELECTION_SAMPLES,
+                        help="readings drawn over the training range for the selection rows")
+    args = parser.parse_args()
+
+    report = compact_model(args.models_dir, args.dataset, args.tolerance, args.min_agreement, args.objective,
+                           args.samples)
+    print(f"Saved compacted model {report['compact']['model_version']} to "
+          f"{os.path.join(args.models_dir, COMPACT_BUNDLE_FILE)}")
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,501 @@
+"""Columnar, memory-mapped cache of the datasets and sensor logs.
+
+compile_dataset() converts a source into one file laid out like a model
+bundle. A source is a CSV such as dataset/data_core.csv, a JSON lines
+sensor log, or a sensor log store directory. The layout:
+
+    magic (8 bytes) | format version, manifest length (2 x uint32)
+    | JSON manifest | padding | one array per column, each aligned to 64 bytes
+
+How columns are stored:
+
+* Integer columns use the smallest integer type that holds them. Other
+  numbers are float64.
+* Text columns are dictionary-encoded. The manifest lists the sorted
+  categories, and the column holds int8/16/32 codes, with -1 where a value
+  is missing. These are the codes LabelEncoder assigns.
+* Log timestamps become datetime64[s].
+
+The manifest also holds per-column statistics (count, missing, min/max/mean/
+std, or rows per category). It also records the size, mtime and SHA-256 of
+the source files.
+
+open_dataset() maps the file read-only, and every column is a zero-copy view.
+load_dataset() returns the cached file for a source. It compiles the file
+first if it is missing or the source's checksum has changed. Compiling reads
+the source in chunks, so its memory use does not grow with the source.
+"""
+import argparse
+import datetime
+import glob
+import hashlib
+import json
+import os
+import shutil
+import struct
+import tempfile
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = 'models/cache'
+CACHE_SUFFIX = '.cols'
+MAGIC = b'SOILDAT\x00'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+HEADER = struct.Struct('<II')
+CHUNK_ROWS = 1_000_000
+# Text columns parsed as dates rather than dictionary-encoded
+TIMESTAMP_COLUMNS = ('timestamp', 'created_at')
+# Segment files of a sensor log store (see esp32_sensor_interface/sensor_log.py)
+SEGMENT_GLOB = 'segment-*.jsonl'
+MISSING_TIME = np.iinfo(np.int64).min
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _smallest_int(low: int, high: int, dtypes=(np.int8, np.int16, np.int32, np.int64)) -> np.dtype:
+    for dtype in dtypes:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return np.dtype(dtype)
+    raise OverflowError(f"Values {low}..{high} do not fit in int64")
+
+
+# Sources
+
+def source_files(source: str) -> List[str]:
+    """The files a source is read from, in order."""
+    if os.path.isdir(source):
+        return sorted(glob.glob(os.path.join(source, '**', SEGMENT_GLOB), recursive=True))
+    return [source]
+
+
+def _source_root(source: str) -> str:
+    return source if os.path.isdir(source) else os.path.dirname(source)
+
+
+def source_signature(source: str) -> List[List[Any]]:
+    """Name, size and mtime of every source file, to skip rehashing unchanged sources."""
+    root = _source_root(source)
+    signature = []
+    for path in source_files(source):
+        stat = os.stat(path)
+        signature.append([os.path.relpath(path, root), stat.st_size, stat.st_mtime_ns])
+    return signature
+
+
+def source_checksum(source: str) -> str:
+    """SHA-256 of a source file, or over the names and contents of a store's files."""
+    sha = hashlib.sha256()
+    root = _source_root(source)
+    for name, _, _ in source_signature(source):
+        if os.path.isdir(source):
+            sha.update(name.encode())
+        with open(os.path.join(root, name), 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+    return sha.hexdigest()
+
+
+def iter_chunks(source: str, chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """Yield the source's rows as DataFrames of at most ``chunk_rows`` rows."""
+    for path in source_files(source):
+        if path.endswith('.csv'):
+            yield from pd.read_csv(path, chunksize=chunk_rows)
+            continue
+        with open(path, 'rb') as f:
+            is_array = f.read(64).lstrip().startswith(b'[')
+        if is_array:
+            # The older data/sensor_log.json is one JSON array
+            with open(path, 'r') as f:
+                records = json.load(f)
+            for start in range(0, len(records), chunk_rows):
+                yield pd.DataFrame.from_records(records[start:start + chunk_rows])
+        else:
+            yield from pd.read_json(path, lines=True, chunksize=chunk_rows, dtype=False, convert_dates=False)
+
+
+# Compiling
+
+class _ColumnWriter:
+    """Spools one column to a scratch file and gathers its statistics."""
+
+    def __init__(self, name: str, kind: str, path: str, rows_before: int):
+        self.name = name
+        self.kind = kind
+        self.path = path
+        self.file = open(path, 'wb')
+        self.integer = True
+        self.count = 0
+        self.missing = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.mean = 0.0
+        self.m2 = 0.0
+        # Categories in first-seen order, and rows per category
+        self.categories: Dict[str, int] = {}
+        self.category_counts = np.zeros(0, dtype=np.int64)
+        self.pad(rows_before)
+
+    @property
+    def scratch_dtype(self) -> np.dtype:
+        return np.dtype({'numeric': np.float64, 'categorical': np.int32, 'datetime': np.int64}[self.kind])
+
+    def pad(self, rows: int):
+        """Missing values for rows of chunks that did not have this column."""
+        if rows:
+            fill = {'numeric': np.nan, 'categorical': -1, 'datetime': MISSING_TIME}[self.kind]
+            self.file.write(np.full(rows, fill, dtype=self.scratch_dtype).tobytes())
+            self.missing += rows
+
+    def append(self, series: pd.Series):
+        if self.kind == 'numeric':
+            self._append_numeric(series)
+        elif self.kind == 'categorical':
+            self._append_categorical(series)
+        else:
+            self._append_datetime(series)
+
+    def _append_numeric(self, series: pd.Series):
+        if not pd.api.types.is_numeric_dtype(series):
+            try:
+                series = pd.to_numeric(series)
+            except (TypeError, ValueError):
+                raise ValueError(f"Column {self.name!r} mixes numbers and text") from None
+        self.integer = self.integer and (pd.api.types.is_integer_dtype(series) or pd.api.types.is_bool_dtype(series))
+        values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+        valid = values[~np.isnan(values)]
+        self.missing += len(values) - len(valid)
+        if len(valid):
+            # Chunked mean and variance (Chan et al.)
+            mean = float(valid.mean())
+            m2 = float(((valid - mean) ** 2).sum())
+            total = self.count + len(valid)
+            delta = mean - self.mean
+            self.m2 += m2 + delta * delta * self.count * len(valid) / total
+            self.mean += delta * len(valid) / total
+            self.count = total
+            self.min = min(self.min, float(valid.min()))
+            self.max = max(self.max, float(valid.max()))
+        self.file.write(values.tobytes())
+
+    def _append_categorical(self, series: pd.Series):
+        codes, uniques = pd.factorize(series)
+        lookup = np.array([self.categories.setdefault(str(value), len(self.categories)) for value in uniques] + [-1],
+                          dtype=np.int32)
+        # Code -1 (missing) picks the trailing -1
+        codes = lookup[codes]
+        present = codes[codes >= 0]
+        self.missing += len(codes) - len(present)
+        self.count += len(present)
+        counts = np.bincount(present, minlength=len(self.categories))
+        counts[:len(self.category_counts)] += self.category_counts
+        self.category_counts = counts
+        self.file.write(codes.tobytes())
+
+    def _append_datetime(self, series: pd.Series):
+        if pd.api.types.is_numeric_dtype(series):
+            times = pd.to_datetime(series, unit='s', errors='coerce')
+        else:
+            times = pd.to_datetime(series, errors='coerce', format='mixed')
+        if getattr(times.dt, 'tz', None) is not None:
+            times = times.dt.tz_convert(None)
+        values = times.to_numpy(dtype='datetime64[s]').view(np.int64)
+        valid = values[values != MISSING_TIME]
+        self.missing += len(values) - len(valid)
+        self.count += len(valid)
+        if len(valid):
+            self.min = min(self.min, int(valid.min()))
+            self.max = max(self.max, int(valid.max()))
+        self.file.write(values.tobytes())
+
+    def finish(self) -> Dict[str, Any]:
+        """Close the scratch file; return the column's schema, stats and stored dtype."""
+        self.file.close()
+        stats: Dict[str, Any] = {'count': self.count, 'missing': self.missing}
+        spec: Dict[str, Any] = {'name': self.name, 'kind': self.kind}
+        if self.kind == 'numeric':
+            if self.count:
+                stats.update(min=self.min, max=self.max, mean=self.mean, std=float(np.sqrt(self.m2 / self.count)))
+            if self.integer and self.count and not self.missing:
+                dtype = _smallest_int(int(self.min), int(self.max))
+            else:
+                dtype = np.dtype(np.float64)
+        elif self.kind == 'categorical':
+            names = list(self.categories)
+            order = sorted(range(len(names)), key=names.__getitem__)
+            # Scratch code -> code in the sorted dictionary
+            self.remap = np.empty(len(names) + 1, dtype=np.int64)
+            self.remap[order] = np.arange(len(names))
+            self.remap[-1] = -1
+            spec['categories'] = [names[i] for i in order]
+            stats['counts'] = self.category_counts[order].tolist()
+            dtype = _smallest_int(-1, max(len(names) - 1, 0), (np.int8, np.int16, np.int32))
+        else:
+            if self.count:
+                stats.update(min=str(np.datetime64(self.min, 's')), max=str(np.datetime64(self.max, 's')))
+            dtype = np.dtype('datetime64[s]')
+        spec['dtype'] = dtype.str
+        spec['stats'] = stats
+        return spec
+
+    def copy_to(self, f, dtype: np.dtype, chunk_rows: int):
+        """Write the stored column, converting the scratch file a chunk at a time."""
+        scratch = np.memmap(self.path, dtype=self.scratch_dtype, mode='r') if os.path.getsize(self.path) else \
+            np.zeros(0, dtype=self.scratch_dtype)
+        for start in range(0, len(scratch), chunk_rows):
+            values = np.asarray(scratch[start:start + chunk_rows])
+            if self.kind == 'categorical':
+                values = self.remap[values]
+            elif self.kind == 'datetime':
+                values = values.view('datetime64[s]')
+            f.write(values.astype(dtype).tobytes())
+        del scratch
+
+
+def _column_kind(name: str, series: pd.Series) -> Optional[str]:
+    """Storage kind of a column from its first chunk; None while it holds only missing values."""
+    if name in TIMESTAMP_COLUMNS:
+        return 'datetime'
+    if series.isna().all():
+        return None
+    if pd.api.types.is_numeric_dtype(series):
+        return 'numeric'
+    return 'categorical'
+
+
+def compile_dataset(source: str, path: str, chunk_rows: int = CHUNK_ROWS) -> Dict[str, Any]:
+    """Compile ``source`` into a columnar file at ``path`` and return its manifest.
+
+    The file is written next to ``path`` and renamed into place, so readers
+    never see a partial file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    signature = source_signature(source)
+    checksum = source_checksum(source)
+
+    scratch_dir = tempfile.mkdtemp(prefix='.dataset-', dir=directory)
+    try:
+        # A column that has only had missing values (e.g. model_version while
+        # no model was loaded) gets its writer once a chunk decides its kind
+        writers: Dict[str, Optional[_ColumnWriter]] = {}
+        rows = 0
+
+        def new_writer(name, kind):
+            path = os.path.join(scratch_dir, f"{list(writers).index(name)}.col")
+            writers[name] = _ColumnWriter(name, kind, path, rows)
+            return writers[name]
+
+        for chunk in iter_chunks(source, chunk_rows):
+            for name in chunk.columns:
+                name = str(name)
+                writer = writers.setdefault(name, None)
+                if writer is None:
+                    kind = _column_kind(name, chunk[name])
+                    if kind is None:
+                        continue
+                    writer = new_writer(name, kind)
+                writer.append(chunk[name])
+            for name, writer in writers.items():
+                if writer is not None and name not in chunk.columns:
+                    writer.pad(len(chunk))
+            rows += len(chunk)
+        for name, writer in writers.items():
+            if writer is None:
+                new_writer(name, 'numeric')
+
+        columns = []
+        offset = 0
+        for writer in writers.values():
+            spec = writer.finish()
+            spec['offset'] = offset
+            columns.append(spec)
+            offset = _aligned(offset + rows * np.dtype(spec['dtype']).itemsize)
+
+        manifest = {
+            'format_version': FORMAT_VERSION,
+            'created_at': datetime.datetime.now().isoformat(),
+            'rows': rows,
+            'source': {'path': os.path.abspath(source), 'files': signature, 'sha256': checksum},
+            'columns': columns,
+        }
+        manifest_bytes = json.dumps(manifest).encode('utf-8')
+        data_start = _aligned(len(MAGIC) + HEADER.size + len(manifest_bytes))
+
+        fd, tmp_path = tempfile.mkstemp(prefix='.dataset-', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(MAGIC)
+                f.write(HEADER.pack(FORMAT_VERSION, len(manifest_bytes)))
+                f.write(manifest_bytes)
+                for writer, spec in zip(writers.values(), columns):
+                    f.seek(data_start + spec['offset'])
+                    writer.copy_to(f, np.dtype(spec['dtype']), chunk_rows)
+                f.truncate(data_start + offset)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+    return manifest
+
+
+# Reading
+
+def read_header(path: str):
+    """Validate a compiled dataset's header and return ``(manifest, data_start)``."""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a compiled dataset")
+        version, manifest_length = HEADER.unpack(f.read(HEADER.size))
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported dataset format version {version} (expected {FORMAT_VERSION})")
+        manifest = json.loads(f.read(manifest_length))
+    return manifest, _aligned(len(MAGIC) + HEADER.size + manifest_length)
+
+
+class ColumnarDataset:
+    """A compiled dataset mapped read-only; columns are views into the mapping.
+
+    Text columns are their integer codes; categories() gives the names.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.manifest, data_start = read_header(path)
+        self.rows = self.manifest['rows']
+        self.schema = {spec['name']: spec for spec in self.manifest['columns']}
+        self.column_names = [spec['name'] for spec in self.manifest['columns']]
+
+        data = np.memmap(path, dtype=np.uint8, mode='r')
+        self.columns: Dict[str, np.ndarray] = {}
+        for spec in self.manifest['columns']:
+            dtype = np.dtype(spec['dtype'])
+            start = data_start + spec['offset']
+            self.columns[spec['name']] = data[start:start + self.rows * dtype.itemsize].view(dtype)
+        self._categories: Dict[str, np.ndarray] = {}
+
+    @property
+    def checksum(self) -> str:
+        """SHA-256 of the source the dataset was compiled from."""
+        return self.manifest['source']['sha256']
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def stats(self, name: str) -> Dict[str, Any]:
+        return self.schema[name]['stats']
+
+    def categories(self, name: str) -> np.ndarray:
+        if name not in self._categories:
+            self._categories[name] = np.asarray(self.schema[name]['categories'], dtype=object)
+        return self._categories[name]
+
+    def decode(self, name: str) -> np.ndarray:
+        """Category names of a text column, None where missing."""
+        return np.append(self.categories(name), None)[self.columns[name]]
+
+    def encode_as(self, name: str, classes) -> np.ndarray:
+        """Codes of a text column under another dictionary, e.g. a fitted LabelEncoder's classes."""
+        codes = {value: code for code, value in enumerate(classes)}
+        unseen = [value for value in self.categories(name) if value not in codes]
+        if unseen or self.stats(name)['missing']:
+            raise ValueError(f"y contains previously unseen labels: {(unseen or [None])[0]!r}")
+        lookup = np.array([codes[value] for value in self.categories(name)], dtype=np.int64)
+        return lookup[self.columns[name]]
+
+    def to_frame(self) -> pd.DataFrame:
+        """A DataFrame of every column; text columns become pandas categoricals over the codes."""
+        data = {}
+        for name in self.column_names:
+            if self.schema[name]['kind'] == 'categorical':
+                data[name] = pd.Categorical.from_codes(self.columns[name], self.categories(name))
+            else:
+                data[name] = self.columns[name]
+        return pd.DataFrame(data)
+
+
+def open_dataset(path: str) -> ColumnarDataset:
+    return ColumnarDataset(path)
+
+
+def cache_path(source: str, cache_dir: str = CACHE_DIR) -> str:
+    """Where the compiled form of ``source`` is cached."""
+    key = hashlib.sha256(os.path.abspath(source).encode()).hexdigest()[:8]
+    return os.path.join(cache_dir, f"{os.path.basename(os.path.normpath(source))}.{key}{CACHE_SUFFIX}")
+
+
+def is_current(dataset: ColumnarDataset, source: str) -> bool:
+    """Whether ``dataset`` was compiled from the source as it is now."""
+    recorded = dataset.manifest['source']
+    if recorded['files'] == source_signature(source):
+        return True
+    # Touched or copied but possibly unchanged
+    return recorded['sha256'] == source_checksum(source)
+
+
+def load_dataset(source: str, cache_dir: str = CACHE_DIR, chunk_rows: int = CHUNK_ROWS) -> ColumnarDataset:
+    """The compiled form of ``source``, compiling it first if it is missing or stale."""
+    path = cache_path(source, cache_dir)
+    if os.path.exists(path):
+        try:
+            dataset = ColumnarDataset(path)
+            if is_current(dataset, source):
+                return dataset
+        except ValueError:
+            pass
+    compile_dataset(source, path, chunk_rows)
+    return ColumnarDataset(path)
+
+
+def print_info(dataset: ColumnarDataset):
+    source = dataset.manifest['source']
+    print(f"{dataset.path}: {dataset.rows} rows from {source['path']} (sha256 {source['sha256'][:16]})")
+    for name in dataset.column_names:
+        spec = dataset.schema[name]
+        stats = spec['stats']
+        if spec['kind'] == 'categorical':
+            summary = f"{len(spec['categories'])} categories"
+        elif 'min' in stats:
+            summary = f"{stats['min']} .. {stats['max']}"
+            if 'mean' in stats:
+                summary += f", mean {stats['mean']:.4g}, std {stats['std']:.4g}"
+        else:
+            summary = "empty"
+        print(f"  {name:20s} {spec['kind']:11s} {np.dtype(spec['dtype']).name:14s} "
+              f"{stats['missing']:>9d} missing  {summary}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile datasets and sensor logs into the columnar cache.")
+    parser.add_argument('sources', nargs='*',
+                        help="CSV files, JSON lines logs or sensor log store directories "
+                             "(default: dataset/*.csv and the server's sensor log)")
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
+
+    sources = args.sources or sorted(glob.glob('dataset/*.csv'))
+    if not args.sources and source_files('esp32_sensor_interface/data/sensor_log'):
+        sources.append('esp32_sensor_interface/data/sensor_log')
+    for source in sources:
+        start = time.perf_counter()
+        dataset = load_dataset(source, args.cache_dir, args.chunk_rows)
+        print(f"Loaded {source} in {time.perf_counter() - start:.2f}s "
+              f"({os.path.getsize(dataset.path) / 1e6:.1f} MB cached)")
+        print_info(dataset)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,493 @@
+"""Drift detection on live readings and incremental refresh of the forest.
+
+Training saves per-feature statistics of its training rows to
+models/training_stats.json, next to scaler.joblib: count, mean, variance,
+min/max and a histogram over fixed bins (training deciles for the sensor
+values, one bin per class for soil and crop type). The server feeds every
+reading it logs to a DriftDetector, which keeps the same statistics for the
+current window of readings in constant memory per feature and, once the
+window is full, compares each feature's histogram with training by the
+population stability index (PSI). A feature whose PSI reaches the threshold
+has drifted.
+
+With refresh switched on, the server runs ``python drift.py refresh`` on
+drift, which grows the forest with warm-started trees fitted on the training
+rows plus the logged readings. The refreshed model is written to
+models/candidate/, not over the model files; it replaces them only once it
+passes the holdout check (``promote_candidate``).
+
+    python drift.py stats                      # save training statistics
+    python drift.py refresh --data rows.npz    # write a candidate with trees fitted on new rows
+    python drift.py promote                    # check the candidate on the holdout rows and promote it
+"""
+import argparse
+import fcntl
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+STATS_FILE = 'training_stats.json'
+REFRESH_LOCK_FILE = 'refresh.lock'
+CANDIDATE_DIR = 'candidate'
+# Exit status of `drift.py refresh` when another process holds the refresh lock
+REFRESH_SKIPPED = 3
+# Files a refresh writes to the candidate directory, moved into the models
+# directory in this order on promotion
+CANDIDATE_FILES = ['soil_testing_model.joblib', 'model_bundle.bin', STATS_FILE]
+DATASET_PATH = 'dataset/enhanced_data_core.csv'
+
+# Feature order of the model input, as in predict.FEATURE_COLUMNS
+FEATURES = ['Temparature', 'Humidity', 'Moisture', 'Soil Type', 'Crop Type',
+            'Nitrogen', 'Potassium', 'Phosphorous']
+CATEGORICAL = {'Soil Type', 'Crop Type'}
+
+# Rule of thumb for PSI: below 0.1 no change, 0.1-0.25 moderate, above 0.25
+# a significant shift
+PSI_THRESHOLD = 0.25
+HISTOGRAM_BINS = 10
+
+
+def histogram_edges(X: np.ndarray, names: Sequence[str] = FEATURES, bins: int = HISTOGRAM_BINS) -> List[np.ndarray]:
+    """Inner bin edges per feature: quantiles of continuous features, class boundaries of categorical ones."""
+    edges = []
+    for j, name in enumerate(names):
+        if name in CATEGORICAL:
+            edges.append(np.arange(int(X[:, j].max())) + 0.5)
+        else:
+            edges.append(np.unique(np.quantile(X[:, j], np.linspace(0, 1, bins + 1)[1:-1])))
+    return edges
+
+
+class RunningStats:
+    """Count, mean, variance, min, max and a fixed-bin histogram per feature.
+
+    Updated a batch at a time (Chan et al.'s merge of Welford's running
+    moments), so memory does not grow with the number of rows seen.
+    """
+
+    def __init__(self, edges: Sequence[np.ndarray], names: Sequence[str] = FEATURES):
+        self.names = list(names)
+        self.edges = [np.asarray(e, dtype=np.float64) for e in edges]
+        d = len(self.names)
+        self.count = 0
+        self.mean = np.zeros(d)
+        self.m2 = np.zeros(d)
+        self.min = np.full(d, np.inf)
+        self.max = np.full(d, -np.inf)
+        self.counts = [np.zeros(len(e) + 1, dtype=np.int64) for e in self.edges]
+
+    def empty_like(self) -> 'RunningStats':
+        return RunningStats(self.edges, self.names)
+
+    def update(self, X: np.ndarray):
+        """Add the rows of ``X`` (n x features)."""
+        n = len(X)
+        if n == 0:
+            return
+        batch_mean = X.mean(axis=0)
+        batch_m2 = ((X - batch_mean) ** 2).sum(axis=0)
+        total = self.count + n
+        delta = batch_mean - self.mean
+        self.mean += delta * (n / total)
+        self.m2 += batch_m2 + delta ** 2 * (self.count * n / total)
+        self.count = total
+        np.minimum(self.min, X.min(axis=0), out=self.min)
+        np.maximum(self.max, X.max(axis=0), out=self.max)
+        for j, edges in enumerate(self.edges):
+            self.counts[j] += np.bincount(np.searchsorted(edges, X[:, j], side='right'),
+                                          minlength=len(edges) + 1)
+
+    def merge(self, other: 'RunningStats'):
+        """Add the rows summarized by ``other``, which must use the same bins."""
+        if other.count == 0:
+            return
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * (other.count / total)
+        self.m2 += other.m2 + delta ** 2 * (self.count * other.count / total)
+        self.count = total
+        np.minimum(self.min, other.min, out=self.min)
+        np.maximum(self.max, other.max, out=self.max)
+        for mine, theirs in zip(self.counts, other.counts):
+            mine += theirs
+
+    @property
+    def std(self) -> np.ndarray:
+        return np.sqrt(self.m2 / max(self.count - 1, 1))
+
+    def proportions(self, j: int) -> np.ndarray:
+        return self.counts[j] / max(self.count, 1)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'features': [{
+                'name': name,
+                'mean': float(self.mean[j]),
+                'm2': float(self.m2[j]),
+                'min': float(self.min[j]),
+                'max': float(self.max[j]),
+                'edges': self.edges[j].tolist(),
+                'counts': self.counts[j].tolist(),
+            } for j, name in enumerate(self.names)],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'RunningStats':
+        features = data['features']
+        stats = cls([f['edges'] for f in features], [f['name'] for f in features])
+        stats.count = data['count']
+        stats.mean = np.array([f['mean'] for f in features])
+        stats.m2 = np.array([f['m2'] for f in features])
+        stats.min = np.array([f['min'] for f in features])
+        stats.max = np.array([f['max'] for f in features])
+        stats.counts = [np.asarray(f['counts'], dtype=np.int64) for f in features]
+        return stats
+
+
+def psi(expected: np.ndarray, actual: np.ndarray, eps: float = 1e-4) -> float:
+    """Population stability index between two histograms given as proportions."""
+    expected = np.maximum(expected, eps)
+    actual = np.maximum(actual, eps)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+def compare(reference: RunningStats, live: RunningStats, psi_threshold: float = PSI_THRESHOLD) -> Dict[str, Any]:
+    """Per-feature PSI and mean shift (in training standard deviations) of ``live`` against ``reference``."""
+    features = {}
+    ref_std, live_std = reference.std, live.std
+    for j, name in enumerate(reference.names):
+        scale = ref_std[j] if ref_std[j] > 0 else 1.0
+        features[name] = {
+            'psi': round(psi(reference.proportions(j), live.proportions(j)), 4),
+            'mean': float(live.mean[j]),
+            'reference_mean': float(reference.mean[j]),
+            'mean_shift': round(float((live.mean[j] - reference.mean[j]) / scale), 4),
+            'std_ratio': round(float(live_std[j] / scale), 4),
+        }
+    drifted = [name for name, f in features.items() if f['psi'] >= psi_threshold]
+    return {
+        'count': live.count,
+        'drifted': bool(drifted),
+        'drifted_features': drifted,
+        'psi_threshold': psi_threshold,
+        'features': features,
+        'checked_at': time.time(),
+    }
+
+
+class DriftDetector:
+    """Compare windows of live readings with the training statistics.
+
+    ``observe`` copies a reading into a fixed buffer; the buffer is folded
+    into the window statistics in one vectorized update when it fills, so a
+    reading costs about a microsecond. Every ``window`` readings the window
+    is compared with the reference and reset; ``on_drift`` is called with
+    the report, outside the lock, when a feature has drifted.
+    """
+
+    def __init__(self, reference: RunningStats, window: int = 5000, psi_threshold: float = PSI_THRESHOLD,
+                 batch_size: int = 512, on_drift: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.reference = reference
+        self.window = window
+        self.psi_threshold = psi_threshold
+        self.on_drift = on_drift
+        self.current = reference.empty_like()
+        self.seen = reference.empty_like()
+        self.last_report: Optional[Dict[str, Any]] = None
+        self.checks = 0
+        self.drift_events = 0
+        self._buffer = np.empty((batch_size, len(reference.names)))
+        self._fill = 0
+        self._lock = threading.Lock()
+
+    def _flush(self):
+        if self._fill:
+            batch = self._buffer[:self._fill]
+            self.current.update(batch)
+            self.seen.update(batch)
+            self._fill = 0
+
+    def _check(self) -> Dict[str, Any]:
+        report = compare(self.reference, self.current, self.psi_threshold)
+        self.current = self.reference.empty_like()
+        self.last_report = report
+        self.checks += 1
+        if report['drifted']:
+            self.drift_events += 1
+        return report
+
+    def observe(self, row: Sequence[float]):
+        """Add one reading, given in FEATURES order."""
+        report = None
+        with self._lock:
+            self._buffer[self._fill] = row
+            self._fill += 1
+            if self._fill == len(self._buffer):
+                self._flush()
+                if self.current.count >= self.window:
+                    report = self._check()
+        if report is not None and report['drifted'] and self.on_drift is not None:
+            self.on_drift(report)
+
+    def observe_many(self, X: np.ndarray):
+        """Add several readings (n x features) at once."""
+        report = None
+        with self._lock:
+            self._flush()
+            self.current.update(X)
+            self.seen.update(X)
+            if self.current.count >= self.window:
+                report = self._check()
+        if report is not None and report['drifted'] and self.on_drift is not None:
+            self.on_drift(report)
+
+    def check(self) -> Dict[str, Any]:
+        """Compare the readings of the current window so far, without resetting it."""
+        with self._lock:
+            self._flush()
+            return compare(self.reference, self.current, self.psi_threshold)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'observed': self.seen.count + self._fill,
+                'window': self.window,
+                'window_count': self.current.count + self._fill,
+                'checks': self.checks,
+                'drift_events': self.drift_events,
+                'last_report': self.last_report,
+            }
+
+
+# Training statistics
+
+def training_rows(dataset: str = DATASET_PATH, models_dir: str = 'models'):
+    """Encoded features and labels of the dataset's training split.
+
+    Uses the split of soil_testing_model.load_preprocessed, so the holdout
+    rows the server validates a refreshed model on stay unseen.
+    """
+    import joblib
+    from sklearn.model_selection import train_test_split
+    from dataset_cache import load_dataset
+    from forest_engine import load_dataset_features
+
+    X = load_dataset_features(dataset, models_dir)
+    fertilizer_encoder = joblib.load(os.path.join(models_dir, 'fertilizer_encoder.joblib'))
+    y = load_dataset(dataset, os.path.join(models_dir, 'cache')).encode_as('Fertilizer Name',
+                                                                           fertilizer_encoder.classes_)
+    train_idx, _ = train_test_split(np.arange(len(X)), test_size=0.2, random_state=42)
+    return X[train_idx], y[train_idx]
+
+
+def training_stats(X: np.ndarray) -> RunningStats:
+    stats = RunningStats(histogram_edges(X))
+    stats.update(X)
+    return stats
+
+
+def save_training_stats(X: np.ndarray, models_dir: str = 'models', stats: Optional[RunningStats] = None) -> str:
+    """Write the statistics of the training rows ``X`` (FEATURES order) next to the scaler."""
+    stats = stats or training_stats(np.asarray(X, dtype=np.float64))
+    path = os.path.join(models_dir, STATS_FILE)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump(stats.to_dict(), f, indent=1)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_training_stats(models_dir: str = 'models') -> Optional[RunningStats]:
+    """The saved training statistics, or None if training has not saved any."""
+    try:
+        with open(os.path.join(models_dir, STATS_FILE)) as f:
+            return RunningStats.from_dict(json.load(f))
+    except FileNotFoundError:
+        return None
+
+
+# Incremental refresh
+
+def candidate_dir(models_dir: str = 'models') -> str:
+    return os.path.join(models_dir, CANDIDATE_DIR)
+
+
+def refresh_model(X_new: np.ndarray, labels: Sequence[str], models_dir: str = 'models',
+                  dataset: str = DATASET_PATH, new_trees: int = 20, max_trees: int = 300) -> Dict[str, Any]:
+    """Add ``new_trees`` trees fitted on the training rows plus new rows, and save them as a candidate.
+
+    ``X_new`` holds unscaled features in FEATURES order. ``labels`` are the
+    fertilizer names confirmed to be right for them; rows with unknown
+    labels are skipped. The fertilizer the server logs is no label: it has
+    been changed to avoid conflicts with other crops on the same soil, and
+    labelling rows with the forest's own prediction would only fit it to
+    answers it already gives.
+
+    The existing trees are kept; once the forest would exceed ``max_trees``,
+    the oldest trees added by earlier refreshes are dropped first. The scaler
+    is unchanged, since the existing trees split on its output. The new rows
+    are merged into the training statistics, so drift is afterwards measured
+    against everything the forest has been fitted on.
+
+    The model, its bundle and the statistics are written to the candidate
+    directory; the files in ``models_dir`` are left untouched until
+    promote_candidate().
+    """
+    import joblib
+    import pandas as pd
+    from model_bundle import BUNDLE_FILE, bundle_arrays, write_bundle
+
+    model = joblib.load(os.path.join(models_dir, 'soil_testing_model.joblib'))
+    scaler = joblib.load(os.path.join(models_dir, 'scaler.joblib'))
+    soil_encoder = joblib.load(os.path.join(models_dir, 'soil_type_encoder.joblib'))
+    crop_encoder = joblib.load(os.path.join(models_dir, 'crop_type_encoder.joblib'))
+    fertilizer_encoder = joblib.load(os.path.join(models_dir, 'fertilizer_encoder.joblib'))
+    if 'warm_start' not in model.get_params():
+        raise TypeError(f"{type(model).__name__} cannot be refreshed incrementally")
+
+    def scale(X):
+        if hasattr(scaler, 'feature_names_in_'):
+            return scaler.transform(pd.DataFrame(X, columns=scaler.feature_names_in_))
+        return scaler.transform(X)
+
+    X_new = np.asarray(X_new, dtype=np.float64).reshape(-1, len(FEATURES))
+    if labels is None:
+        raise ValueError("A refresh needs confirmed labels for the new rows")
+    labels = np.asarray(labels, dtype=object)
+    if len(labels) != len(X_new):
+        raise ValueError(f"{len(labels)} labels for {len(X_new)} rows")
+    known = np.isin(labels, fertilizer_encoder.classes_)
+    X_new = X_new[known]
+    y_new = fertilizer_encoder.transform(labels[known])
+
+    # The training rows keep every class present, so classes_ (and with it
+    # the meaning of the existing trees' outputs) stay the same
+    X_train, y_train = training_rows(dataset, models_dir)
+    X = np.vstack([X_train, X_new])
+    y = np.concatenate([y_train, y_new])
+
+    start = time.perf_counter()
+    base_trees = getattr(model, 'base_estimators_count_', len(model.estimators_))
+    model.set_params(warm_start=True, n_estimators=len(model.estimators_) + new_trees)
+    model.fit(scale(X), y)
+    model.set_params(warm_start=False)
+    if len(model.estimators_) > max_trees:
+        keep = max(max_trees - base_trees, new_trees)
+        model.estimators_ = model.estimators_[:base_trees] + model.estimators_[-keep:]
+        model.n_estimators = len(model.estimators_)
+    model.base_estimators_count_ = base_trees
+    fit_seconds = time.perf_counter() - start
+
+    output_dir = candidate_dir(models_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    model_path = os.path.join(output_dir, 'soil_testing_model.joblib')
+    tmp_path = f"{model_path}.tmp{os.getpid()}"
+    joblib.dump(model, tmp_path)
+    os.replace(tmp_path, model_path)
+    # Written after the model, so the bundle is not stale once promoted
+    manifest = write_bundle(os.path.join(output_dir, BUNDLE_FILE),
+                            bundle_arrays(model, scaler, soil_encoder, crop_encoder, fertilizer_encoder))
+
+    stats = load_training_stats(models_dir) or training_stats(X_train)
+    new_stats = stats.empty_like()
+    new_stats.update(X_new)
+    stats.merge(new_stats)
+    save_training_stats(X_train, output_dir, stats)
+
+    return {
+        'new_rows': int(len(X_new)),
+        'skipped_rows': int((~known).sum()),
+        'trees': len(model.estimators_),
+        'fit_seconds': round(fit_seconds, 3),
+        'model_version': manifest['model_version'],
+        'candidate_dir': output_dir,
+    }
+
+
+def refresh_from_file(data_path: str, models_dir: str = 'models', **kwargs) -> Optional[Dict[str, Any]]:
+    """refresh_model on the rows of an .npz file (``X`` and ``labels``), one refresh at a time.
+
+    Returns None without refreshing if another process is refreshing.
+    """
+    with open(os.path.join(models_dir, REFRESH_LOCK_FILE), 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        with np.load(data_path, allow_pickle=False) as data:
+            if 'labels' not in data.files:
+                raise ValueError(f"{data_path} has no labels array")
+            X = data['X']
+            labels = data['labels']
+        return refresh_model(X, labels, models_dir, **kwargs)
+
+
+def load_candidate(models_dir: str = 'models') -> Dict[str, Any]:
+    """Models dict of the refreshed candidate, read from its bundle."""
+    from model_bundle import BUNDLE_FILE, ModelBundle
+
+    return ModelBundle.open(os.path.join(candidate_dir(models_dir), BUNDLE_FILE)).as_models()
+
+
+def promote_candidate(models_dir: str = 'models'):
+    """Move the candidate's files over the current model files."""
+    source = candidate_dir(models_dir)
+    for filename in CANDIDATE_FILES:
+        os.replace(os.path.join(source, filename), os.path.join(models_dir, filename))
+    shutil.rmtree(source, ignore_errors=True)
+
+
+def discard_candidate(models_dir: str = 'models'):
+    shutil.rmtree(candidate_dir(models_dir), ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Training statistics for drift detection, and model refresh.")
+    parser.add_argument('command', choices=['stats', 'refresh', 'promote'])
+    parser.add_argument('--models-dir', default='models')
+    parser.add_argument('--dataset', default=DATASET_PATH)
+    parser.add_argument('--data', help="refresh: .npz file with X (features in model order) and confirmed labels")
+    parser.add_argument('--new-trees', type=int, default=20)
+    parser.add_argument('--max-trees', type=int, default=300)
+    args = parser.parse_args()
+
+    if args.command == 'stats':
+        X_train, _ = training_rows(args.dataset, args.models_dir)
+        path = save_training_stats(X_train, args.models_dir)
+        print(f"Saved statistics of {len(X_train)} training rows to {path}")
+        return
+
+    if args.command == 'promote':
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'esp32_sensor_interface'))
+        from model_bundle import load_models
+        from model_registry import HoldoutValidator
+
+        validate = HoldoutValidator(os.path.join(args.models_dir, 'holdout.npz'))
+        report = validate(load_candidate(args.models_dir), load_models(args.models_dir))
+        if not report['passed']:
+            discard_candidate(args.models_dir)
+            raise SystemExit(f"Candidate rejected and removed: {report['reason']}")
+        promote_candidate(args.models_dir)
+        print(f"Promoted the candidate (holdout accuracy {report.get('accuracy', 'not checked')})")
+        return
+
+    if not args.data:
+        parser.error("refresh needs --data")
+    result = refresh_from_file(args.data, args.models_dir, dataset=args.dataset,
+                               new_trees=args.new_trees, max_trees=args.max_trees)
+    if result is None:
+        print("Another refresh is running; skipped")
+        sys.exit(REFRESH_SKIPPED)
+    print(f"Candidate {result['model_version']} in {result['candidate_dir']}: {result['trees']} trees after "
+          f"fitting on {result['new_rows']} new rows ({result['skipped_rows']} skipped) in {result['fit_seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+"""Backfill the sensor log from a ThingSpeak channel's feed history.
+
+The server only polls ``feeds/last.json``, so readings published while it
+was down are never logged. This tool pages through ``feeds.json`` by time
+window instead: windows of ``--window`` seconds are fetched by up to
+``--concurrency`` threads over one pooled session, with retries, and a window
+holding more than one page (ThingSpeak returns at most 8000 entries per
+request) is paged backwards from its oldest entry. Windows are written in
+time order: entries are deduplicated by ``entry_id``, their fertilizers
+predicted in one model call per window, and the records appended to a log
+store of their own, LOG_STORE_DIR/backfill-<channel>, which the server reads
+along with its own.
+
+Progress is saved in ``backfill.json`` in that store after every window, so
+a rerun (or a run after a failure) only fetches what is new. Usage (from
+esp32_sensor_interface):
+
+    THINGSPEAK_API_ENDPOINT=https://api.thingspeak.com/channels/<id>/feeds/last.json?api_key=<key> \\
+        python backfill.py [--start 2024-01-01] [--end ...] [--concurrency 4]
+"""
+import argparse
+import datetime
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from sensor_log import SensorLogStore, format_timestamps, parse_timestamp
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(BASE_DIR)
+MODELS_DIR = os.path.join(PROJECT_DIR, 'models')
+sys.path.append(PROJECT_DIR)
+from model_bundle import load_models  # noqa: E402
+from model_registry import model_version  # noqa: E402
+
+# Same defaults as server2.py
+LOG_STORE_DIR = os.environ.get('SENSOR_LOG_DIR', os.path.join(BASE_DIR, 'data', 'sensor_log'))
+THINGSPEAK_API_ENDPOINT = os.environ.get('THINGSPEAK_API_ENDPOINT')
+THINGSPEAK_TIMEOUT = float(os.environ.get('THINGSPEAK_TIMEOUT', 5))
+
+CHECKPOINT_FILE = 'backfill.json'
+SOURCE = 'ThingSpeak backfill'
+# ThingSpeak's limit on entries per feeds.json request
+PAGE_SIZE = 8000
+QUERY_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Field1: Humidity, Field2: Temperature, Field3: Moisture,
+# Field4: Nitrogen, Field5: Phosphorus, Field6: Potassium
+THINGSPEAK_FIELDS = ['humidity', 'temperature', 'moisture', 'nitrogen', 'phosphorus', 'potassium']
+# Feature order of the model, as in server2.FEATURE_FIELDS
+FEATURE_FIELDS = ['temperature', 'humidity', 'moisture', 'soil_type', 'crop_type',
+                  'nitrogen', 'potassium', 'phosphorus']
+# Stand-ins for fields missing before the first reading that has them, as
+# for a device that has not reported yet in server2.default_readings
+DEFAULT_READINGS = {'temperature': 25.0, 'humidity': 60.0, 'moisture': 35.0,
+                    'nitrogen': 20.0, 'phosphorus': 15.0, 'potassium': 25.0}
+
+
+def feeds_url(endpoint: str) -> str:
+    """The channel's feeds.json URL, from the feeds/last.json endpoint the server polls."""
+    parts = urlsplit(endpoint)
+    path = re.sub(r'/feeds(/last)?\.json$', '/feeds.json', parts.path)
+    return urlunsplit(parts._replace(path=path))
+
+
+def channel_id(url: str) -> str:
+    match = re.search(r'/channels/([^/]+)/', urlsplit(url).path)
+    if match is None:
+        raise ValueError(f"No channel ID in {url}")
+    return match.group(1)
+
+
+def query_time(epoch_seconds: float) -> str:
+    return datetime.datetime.fromtimestamp(epoch_seconds, datetime.timezone.utc).strftime(QUERY_TIME_FORMAT)
+
+
+def parse_created_at(values: List[str]) -> np.ndarray:
+    """Epoch seconds of ThingSpeak created_at values, parsed by NumPy when they are all UTC."""
+    if all(isinstance(value, str) and value.endswith('Z') for value in values):
+        return np.array([value[:-1] for value in values], dtype='datetime64[s]').astype(np.float64)
+    return np.array([parse_timestamp(value) for value in values], dtype=np.float64)
+
+
+def windows(start: float, end: float, size: float) -> Iterator[Tuple[float, float]]:
+    """Consecutive [start, end] windows of whole seconds, ``size`` seconds long."""
+    start = int(start)
+    while start <= end:
+        yield start, min(start + size - 1, end)
+        start += size
+
+
+class Backfill:
+    """Fetch, predict and log a ThingSpeak channel's history, resuming from a checkpoint.
+
+    ``soil_type`` and ``crop_type`` are the encoded types the readings are
+    predicted for, since the channel does not report them.
+    """
+
+    def __init__(self, url: str, store: SensorLogStore, models: Optional[Dict[str, Any]],
+                 device_id: Optional[str] = None, soil_type: int = 1, crop_type: int = 0,
+                 concurrency: int = 4, window: float = 86400, page_size: int = PAGE_SIZE,
+                 timeout: float = THINGSPEAK_TIMEOUT, retries: int = 5, backoff: float = 0.5):
+        self.url = feeds_url(url)
+        self.store = store
+        self.models = models
+        self.device_id = device_id or channel_id(self.url)
+        self.soil_type = soil_type
+        self.crop_type = crop_type
+        self.concurrency = max(1, concurrency)
+        self.window = int(max(1, window))
+        self.page_size = page_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.checkpoint_path = os.path.join(store.directory, CHECKPOINT_FILE)
+        self.checkpoint = self.load_checkpoint()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.duplicates = 0
+
+    # Checkpoint
+
+    def load_checkpoint(self) -> Dict[str, Any]:
+        try:
+            with open(self.checkpoint_path, 'r') as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            checkpoint = {}
+        checkpoint.setdefault('last_entry_id', 0)
+        checkpoint.setdefault('last_created_at', None)
+        checkpoint.setdefault('records', 0)
+        checkpoint.setdefault('last_readings', dict(DEFAULT_READINGS))
+        # Records written just before a crash, after the last checkpoint
+        for record in self.store.tail(1):
+            if record.get('entry_id', 0) > checkpoint['last_entry_id']:
+                checkpoint['last_entry_id'] = record['entry_id']
+                checkpoint['last_created_at'] = parse_timestamp(record['timestamp'])
+                checkpoint['last_readings'] = {field: record[field] for field in THINGSPEAK_FIELDS}
+        return checkpoint
+
+    def save_checkpoint(self):
+        temporary = self.checkpoint_path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump({**self.checkpoint, 'updated_at': time.time()}, f, indent=4)
+        os.replace(temporary, self.checkpoint_path)
+
+    # Fetching
+
+    def get(self, **params) -> Dict[str, Any]:
+        """GET feeds.json with the given parameters, retrying with exponential backoff."""
+        parts = urlsplit(self.url)
+        url = urlunsplit(parts._replace(query=urlencode(parse_qsl(parts.query) + list(params.items()))))
+        for attempt in range(self.retries + 1):
+            with self._lock:
+                self.requests += 1
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+                if response.status_code != 200:
+                    raise ValueError(f"HTTP {response.status_code}")
+                return response.json()
+            except (requests.RequestException, ValueError) as e:
+                with self._lock:
+                    self.failures += 1
+                if attempt == self.retries:
+                    raise RuntimeError(f"Fetching {params} from ThingSpeak failed: {e}") from e
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def channel_start(self) -> float:
+        """When the channel was created, or its first entry if it does not say."""
+        data = self.get(results=0)
+        created_at = data.get('channel', {}).get('created_at')
+        if created_at:
+            return parse_timestamp(created_at)
+        first = self.get(results=1, start='1970-01-01 00:00:00').get('feeds') or []
+        return parse_timestamp(first[0]['created_at']) if first else time.time()
+
+    def fetch_window(self, start: int, end: int) -> List[Dict[str, Any]]:
+        """Every entry created from ``start`` to ``end``, in pages of at most page_size.
+
+        ThingSpeak returns the newest entries of a range, so a full page is
+        followed by one ending at its oldest entry, until a page is not full.
+        """
+        entries: List[Dict[str, Any]] = []
+        page_end = end
+        while True:
+            feeds = self.get(start=query_time(start), end=query_time(page_end), results=self.page_size).get('feeds')
+            entries.extend(feeds or [])
+            if not feeds or len(feeds) < self.page_size:
+                return entries
+            oldest = int(parse_timestamp(feeds[0]['created_at']))
+            if oldest <= start or oldest >= page_end:
+                # More than a page in one second: nothing more can be paged
+                print(f"Warning: more than {self.page_size} entries at {query_time(oldest)}; some are skipped")
+                return entries
+            # Inclusive, so entries in the oldest second are not missed; the
+            # ones fetched twice are dropped as duplicates
+            page_end = oldest
+
+    # Writing
+
+    def readings(self, entries: List[Dict[str, Any]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Entry IDs, epoch seconds and the N x 6 THINGSPEAK_FIELDS values of new entries.
+
+        Entries at or below the checkpoint's entry ID and repeats are
+        dropped. A missing or zero field keeps the previous reading's value,
+        as in server2.parse_thingspeak_data.
+        """
+        ids = np.array([entry.get('entry_id', 0) for entry in entries], dtype=np.int64)
+        order = np.argsort(ids, kind='stable')
+        _, first = np.unique(ids[order], return_index=True)
+        keep = order[first]
+        keep = keep[ids[keep] > self.checkpoint['last_entry_id']]
+        self.duplicates += len(entries) - len(keep)
+        kept = [entries[i] for i in keep]
+
+        timestamps = parse_created_at([entry.get('created_at') for entry in kept])
+        values = np.array([[float(entry.get(f'field{i}') or 0) for i in range(1, len(THINGSPEAK_FIELDS) + 1)]
+                           for entry in kept], dtype=np.float64).reshape(len(kept), len(THINGSPEAK_FIELDS))
+        previous = np.array([self.checkpoint['last_readings'][field] for field in THINGSPEAK_FIELDS])
+        values = np.vstack([previous, values])
+        values[values == 0] = np.nan
+        # Forward fill each column from the last row that had a value
+        rows = np.where(np.isnan(values), 0, np.arange(len(values))[:, None])
+        values = values[np.maximum.accumulate(rows, axis=0), np.arange(values.shape[1])][1:]
+        return ids[keep], timestamps, values
+
+    def predict(self, values: np.ndarray) -> List[str]:
+        """One fertilizer per row of THINGSPEAK_FIELDS values, in one model call."""
+        if self.models is None:
+            return ["Model not loaded. Please train the model first."] * len(values)
+        features = np.empty((len(values), len(FEATURE_FIELDS)))
+        for i, field in enumerate(FEATURE_FIELDS):
+            if field == 'soil_type':
+                features[:, i] = self.soil_type
+            elif field == 'crop_type':
+                features[:, i] = self.crop_type
+            else:
+                features[:, i] = values[:, THINGSPEAK_FIELDS.index(field)]
+        scaler = self.models['scaler']
+        predictions = self.models['model'].predict((features - scaler.mean_) / scaler.scale_)
+        return list(self.models['fertilizer_encoder'].inverse_transform(predictions))
+
+    def write(self, entries: List[Dict[str, Any]]) -> int:
+        """Log the new entries of a window and advance the checkpoint."""
+        ids, timestamps, values = self.readings(entries)
+        if len(ids):
+            fertilizers = self.predict(values)
+            version = model_version(self.models)
+            base = {'device_id': self.device_id, 'soil_type': self.soil_type, 'crop_type': self.crop_type}
+            records = [{
+                'timestamp': timestamp, **base, **dict(zip(THINGSPEAK_FIELDS, row)),
+                'fertilizer': fertilizer, 'model_version': version, 'source': SOURCE, 'entry_id': entry_id,
+            } for timestamp, row, fertilizer, entry_id in zip(
+                format_timestamps(timestamps), values.tolist(), fertilizers, ids.tolist())]
+            self.store.append_many(records, timestamps.tolist())
+            self.store.flush()
+            self.checkpoint['last_entry_id'] = int(ids[-1])
+            self.checkpoint['last_created_at'] = float(timestamps[-1])
+            self.checkpoint['last_readings'] = dict(zip(THINGSPEAK_FIELDS, values[-1].tolist()))
+            self.checkpoint['records'] += len(ids)
+        return len(ids)
+
+    def run(self, start: Optional[float] = None, end: Optional[float] = None) -> Dict[str, Any]:
+        """Backfill from ``start`` (default: the checkpoint, or the channel's start) to ``end`` (now)."""
+        began = time.perf_counter()
+        if start is None:
+            start = self.checkpoint['last_created_at']
+        if start is None:
+            start = self.channel_start()
+        if end is None:
+            end = time.time()
+        written = fetched = 0
+
+        # Windows are fetched concurrently but written in order, so the
+        # checkpoint only ever covers a complete prefix of the range
+        planned = windows(start, end, self.window)
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='backfill') as pool:
+            pending = deque(pool.submit(self.fetch_window, *window)
+                            for _, window in zip(range(2 * self.concurrency), planned))
+            try:
+                while pending:
+                    entries = pending.popleft().result()
+                    window = next(planned, None)
+                    if window is not None:
+                        pending.append(pool.submit(self.fetch_window, *window))
+                    fetched += len(entries)
+                    written += self.write(entries)
+                    self.save_checkpoint()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+        return {
+            'device_id': self.device_id,
+            'start': start,
+            'end': end,
+            'requests': self.requests,
+            'failures': self.failures,
+            'entries': fetched,
+            'duplicates': self.duplicates,
+            'written': written,
+            'last_entry_id': self.checkpoint['last_entry_id'],
+            'seconds': time.perf_counter() - began,
+        }
+
+    def close(self):
+        self.session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill the sensor log from a ThingSpeak channel's history.")
+    parser.add_argument('--url', default=THINGSPEAK_API_ENDPOINT,
+                        help="The channel's feeds/last.json or feeds.json URL (default THINGSPEAK_API_ENDPOINT)")
+    parser.add_argument('--start', help="Timestamp to start from (default: the checkpoint, else the channel's start)")
+    parser.add_argument('--end', help="Timestamp to stop at (default: now)")
+    parser.add_argument('--log-dir', default=LOG_STORE_DIR)
+    parser.add_argument('--device', help="Device ID to log the readings under (default: the channel ID)")
+    parser.add_argument('--soil-type', type=int, default=1)
+    parser.add_argument('--crop-type', type=int, default=0)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--window', type=float, default=86400, help="Seconds of feed per request")
+    args = parser.parse_args()
+    if not args.url:
+        parser.error("Set THINGSPEAK_API_ENDPOINT or pass --url")
+
+    try:
+        models = load_models(MODELS_DIR)
+    except FileNotFoundError as e:
+        print(f"Error loading model files: {e}")
+        print("Please run soil_testing_model.py first to train the model.")
+        sys.exit(1)
+
+    device_id = args.device or channel_id(args.url)
+    store = SensorLogStore(os.path.join(args.log_dir, f'backfill-{device_id}'))
+    backfill = Backfill(args.url, store, models, device_id=device_id, soil_type=args.soil_type,
+                        crop_type=args.crop_type, concurrency=args.concurrency, window=args.window)
+    try:
+        result = backfill.run(parse_timestamp(args.start) if args.start else None,
+                              parse_timestamp(args.end) if args.end else None)
+    finally:
+        backfill.close()
+        store.close()
+    print(f"Backfilled {result['written']} readings of device {result['device_id']} "
+          f"({result['entries']} fetched, {result['duplicates']} duplicates) in {result['requests']} requests, "
+          f"{result['seconds']:.1f} s; last entry {result['last_entry_id']}")
+
+
+if __name__ == "__main__":
+    main()
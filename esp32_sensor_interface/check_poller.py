@@ -0,0 +1,133 @@
+"""Check ThingSpeakPoller against the local fake ThingSpeak.
+
+Runs the poller against a FakeThingSpeak and checks:
+* a new entry_id triggers on_update, and refetching the same entry does not
+* failures (injected with fail_next) back off exponentially up to
+  max_backoff, keep the last good reading and are reported in status()
+* a snapshot turns stale after two missed polls and is fresh again once
+  a poll succeeds
+* recovering from an outage resets the backoff without re-predicting an
+  unchanged entry
+* the backoff stays bounded after a very long outage
+* the background thread picks up newly published entries, and keeps
+  polling when a callback raises
+
+Prints one line per check and exits with status 1 if any fails. Run from
+this directory:
+
+    python check_poller.py
+"""
+import sys
+import time
+
+from fake_thingspeak import FakeThingSpeak
+from thingspeak_poller import ThingSpeakPoller
+
+
+class Checks:
+    def __init__(self):
+        self.failed = []
+
+    def __call__(self, name, passed, detail=''):
+        print(f"{'ok  ' if passed else 'FAIL'} {name}{f' ({detail})' if detail else ''}")
+        if not passed:
+            self.failed.append(name)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def run():
+    check = Checks()
+    with FakeThingSpeak() as fake:
+        updates = []
+        poller = ThingSpeakPoller(fake.last_url(), interval=0.2, timeout=0.1, max_backoff=1.0,
+                                  parse=lambda data: {'entry_id': data['entry_id'], 'humidity': float(data['field1'])},
+                                  on_update=updates.append)
+
+        first = poller.poll_once()
+        check("first poll returns the reading", first is not None and first['entry_id'] == 1)
+        check("first entry triggers on_update", len(updates) == 1)
+        status = poller.status()
+        check("fresh after a successful poll", not status['stale'] and status['consecutive_failures'] == 0)
+        check("no backoff after a successful poll", poller.next_delay() == poller.interval)
+
+        poller.poll_once()
+        check("same entry_id does not trigger on_update", len(updates) == 1)
+        entry = fake.publish()
+        poller.poll_once()
+        check("new entry_id triggers on_update", len(updates) == 2 and updates[-1]['entry_id'] == entry['entry_id'])
+
+        fake.fail_next(4)
+        delays = []
+        for _ in range(4):
+            result = poller.poll_once()
+            delays.append(poller.next_delay())
+        status = poller.status()
+        check("failed polls return None", result is None)
+        check("failures are counted", status['consecutive_failures'] == 4, f"{status['consecutive_failures']}")
+        check("last error is reported", status['last_error'] == 'HTTP 503', f"{status['last_error']!r}")
+        check("last good reading is kept", poller.latest() == updates[-1])
+        expected = [min(poller.interval * 2 ** n, poller.max_backoff) for n in range(1, 5)]
+        check("backoff doubles with jitter up to max_backoff",
+              all(0.8 * bound <= delay <= bound for delay, bound in zip(delays, expected)),
+              ', '.join(f"{delay:.2f}" for delay in delays))
+
+        time.sleep(2 * poller.interval + poller.timeout + 0.05)
+        check("stale after two missed polls", poller.status()['stale'])
+        check("a snapshot that was never fetched is stale", poller.freshness(None)['stale'])
+
+        poller.poll_once()
+        status = poller.status()
+        check("recovery resets the failures", status['consecutive_failures'] == 0 and status['last_error'] is None)
+        check("fresh again after recovery", not status['stale'])
+        check("no backoff after recovery", poller.next_delay() == poller.interval)
+        check("unchanged entry is not re-predicted after recovery", len(updates) == 2)
+
+        poller._failures = 1100
+        try:
+            delay = poller.next_delay()
+            check("backoff stays bounded after a long outage", delay <= poller.max_backoff, f"{delay:.2f}")
+        except OverflowError as e:
+            check("backoff stays bounded after a long outage", False, str(e))
+        poller._failures = 0
+
+        poller.start()
+        entry = fake.publish()
+        picked_up = wait_for(lambda: updates[-1]['entry_id'] == entry['entry_id'])
+        poller.stop(1.0)
+        check("background thread picks up a new entry", picked_up)
+        check("background thread stops", not poller._thread.is_alive())
+
+        def failing_update(reading):
+            updates.append(reading)
+            if len(updates) == 4:
+                raise RuntimeError("on_update failed")
+
+        poller.on_update = failing_update
+        poller.start()
+        entry = fake.publish()
+        wait_for(lambda: updates[-1]['entry_id'] == entry['entry_id'])
+        entry = fake.publish()
+        picked_up = wait_for(lambda: updates[-1]['entry_id'] == entry['entry_id'])
+        poller.stop(1.0)
+        check("polling continues after on_update raises", picked_up and len(updates) == 5, f"{len(updates)} updates")
+    return check.failed
+
+
+def main():
+    failed = run()
+    if failed:
+        print(f"{len(failed)} check(s) failed")
+        sys.exit(1)
+    print("All poller checks passed")
+
+
+if __name__ == "__main__":
+    main()
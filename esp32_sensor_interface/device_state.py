@@ -0,0 +1,151 @@
+"""Per-device reading state for many field nodes.
+
+Each ESP32 node (or ThingSpeak channel) gets its own DeviceState holding its
+latest readings and its soil/crop fertilizer assignments. States live in a
+DeviceRegistry that is split into shards, each an OrderedDict in
+least-recently-used order behind its own lock, so lookups for different
+devices rarely contend. Memory is bounded by ``max_devices``; the least
+recently used device of a full shard is evicted, and devices idle for longer
+than ``idle_timeout`` are dropped from the front of their shard whenever it is
+touched. The bound is enforced per shard: each holds at most
+``max_devices // shards`` devices, so a shard that gets more than its share
+of device IDs evicts before the registry as a whole is full.
+"""
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from fertilizer_allocator import FertilizerAssignments
+
+
+class DeviceState:
+    """Latest readings and fertilizer assignments for one device."""
+
+    __slots__ = ('device_id', 'readings', 'fertilizer_cache', 'lock', 'last_seen')
+
+    def __init__(self, device_id: str, readings: Dict[str, Any]):
+        self.device_id = device_id
+        self.readings = readings
+        # soil_type -> {crop_type: fertilizer}
+        self.fertilizer_cache = FertilizerAssignments()
+        # Held while readings are updated and a recommendation is computed
+        self.lock = threading.RLock()
+        self.last_seen = time.monotonic()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """A copy of the readings that is safe to serialize."""
+        with self.lock:
+            return dict(self.readings)
+
+
+class _Shard:
+    __slots__ = ('lock', 'devices', 'evictions')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.devices: 'OrderedDict[str, DeviceState]' = OrderedDict()
+        # Counted under the shard's lock; summed by DeviceRegistry.evictions
+        self.evictions = 0
+
+
+class DeviceRegistry:
+    """Thread-safe, bounded map of device ID to DeviceState.
+
+    ``max_devices`` is split evenly across the shards, so the least recently
+    used device is evicted once its own shard is full.
+    """
+
+    def __init__(self, initial_readings: Callable[[], Dict[str, Any]], max_devices: int = 50000,
+                 idle_timeout: Optional[float] = None, shards: int = 64):
+        self.initial_readings = initial_readings
+        self.max_devices = max_devices
+        self.idle_timeout = idle_timeout
+        self._shards = [_Shard() for _ in range(shards)]
+        self._shard_capacity = max(1, max_devices // shards)
+        self._pinned = set()
+
+    def _shard(self, device_id: str) -> _Shard:
+        return self._shards[zlib.crc32(device_id.encode('utf-8')) % len(self._shards)]
+
+    def _evict(self, shard: _Shard, now: float):
+        devices = shard.devices
+        # Drop idle devices from the least recently used end
+        if self.idle_timeout is not None:
+            for _ in range(len(devices)):
+                device_id, state = next(iter(devices.items()))
+                if device_id in self._pinned:
+                    # Pinned devices must not shield idle ones behind them
+                    devices.move_to_end(device_id)
+                    continue
+                if now - state.last_seen <= self.idle_timeout:
+                    break
+                del devices[device_id]
+                shard.evictions += 1
+        # Then enforce the size bound
+        while len(devices) > self._shard_capacity:
+            for device_id in devices:
+                if device_id not in self._pinned:
+                    del devices[device_id]
+                    shard.evictions += 1
+                    break
+            else:
+                break
+
+    def get(self, device_id: str) -> DeviceState:
+        """Return the state for ``device_id``, creating it if needed."""
+        device_id = str(device_id)
+        shard = self._shard(device_id)
+        now = time.monotonic()
+        with shard.lock:
+            state = shard.devices.get(device_id)
+            if state is None:
+                state = DeviceState(device_id, self.initial_readings())
+                shard.devices[device_id] = state
+                self._evict(shard, now)
+            else:
+                shard.devices.move_to_end(device_id)
+            state.last_seen = now
+            return state
+
+    def peek(self, device_id: str) -> Optional[DeviceState]:
+        """Return the state for ``device_id`` without creating or touching it."""
+        device_id = str(device_id)
+        shard = self._shard(device_id)
+        with shard.lock:
+            return shard.devices.get(device_id)
+
+    def pin(self, device_id: str) -> DeviceState:
+        """Create ``device_id`` and exempt it from eviction."""
+        self._pinned.add(str(device_id))
+        return self.get(device_id)
+
+    def remove(self, device_id: str) -> bool:
+        device_id = str(device_id)
+        shard = self._shard(device_id)
+        with shard.lock:
+            self._pinned.discard(device_id)
+            return shard.devices.pop(device_id, None) is not None
+
+    def device_ids(self) -> List[str]:
+        ids = []
+        for shard in self._shards:
+            with shard.lock:
+                ids.extend(shard.devices)
+        return ids
+
+    @property
+    def evictions(self) -> int:
+        return sum(shard.evictions for shard in self._shards)
+
+    def __len__(self) -> int:
+        return sum(len(shard.devices) for shard in self._shards)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'devices': len(self),
+            'max_devices': self.max_devices,
+            'shard_capacity': self._shard_capacity,
+            'evictions': self.evictions,
+        }
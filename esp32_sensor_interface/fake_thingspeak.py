@@ -0,0 +1,252 @@
+"""Local stand-in for the ThingSpeak channel feed API.
+
+Serves ``/channels/<id>/feeds/last.json`` and ``/channels/<id>/feeds.json``
+from memory so the poller and backfill.py can be exercised without network
+access. ``history`` synthetic entries, ``history_interval`` seconds apart and
+ending now, make up the channel's past feed. Latency and failures can be
+injected:
+
+    with FakeThingSpeak(delay=0.5) as fake:
+        fake.fail_next(3)
+        poller = ThingSpeakPoller(fake.last_url(), interval=1)
+
+Or run standalone and point the server at it:
+
+    python fake_thingspeak.py 8765 [history]
+    THINGSPEAK_API_ENDPOINT=http://127.0.0.1:8765/channels/1/feeds/last.json python server2.py
+"""
+import datetime
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs
+
+import numpy as np
+
+LAST_PATH = re.compile(r'^/channels/(\d+)/feeds/last\.json$')
+FEEDS_PATH = re.compile(r'^/channels/(\d+)/feeds\.json$')
+# ThingSpeak returns at most this many entries per feeds.json request
+MAX_RESULTS = 8000
+QUERY_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def random_entry(entry_id: int, rng: random.Random) -> Dict[str, Any]:
+    """A feed entry with plausible values for the six sensor fields."""
+    created_at = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    return {
+        'created_at': created_at,
+        'entry_id': entry_id,
+        'field1': f"{rng.uniform(30, 80):.1f}",   # Humidity
+        'field2': f"{rng.uniform(20, 38):.1f}",   # Temperature
+        'field3': f"{rng.uniform(25, 65):.1f}",   # Moisture
+        'field4': str(rng.randint(4, 42)),        # Nitrogen
+        'field5': str(rng.randint(0, 42)),        # Phosphorus
+        'field6': str(rng.randint(0, 19)),        # Potassium
+    }
+
+
+def synthetic_history(count: int, interval: float, end: float, seed: int = 0) -> Dict[str, np.ndarray]:
+    """Columns of ``count`` feed entries ``interval`` seconds apart, the last at ``end``."""
+    rng = np.random.default_rng(seed)
+    # Devices do not report on the exact second: jitter each entry a little
+    offsets = interval * np.arange(count - 1, -1, -1) + rng.uniform(0, interval / 4, count)
+    return {
+        'created_at': np.floor(end - offsets).astype(np.int64),
+        'field1': np.round(rng.uniform(30, 80, count), 1),
+        'field2': np.round(rng.uniform(20, 38, count), 1),
+        'field3': np.round(rng.uniform(25, 65, count), 1),
+        'field4': rng.integers(4, 43, count),
+        'field5': rng.integers(0, 43, count),
+        'field6': rng.integers(0, 20, count),
+    }
+
+
+def history_entries(columns: Dict[str, np.ndarray], lo: int, hi: int) -> List[Dict[str, Any]]:
+    """Feed entries lo to hi (exclusive) of synthetic_history columns; entry IDs count from 1."""
+    created = np.datetime_as_string(columns['created_at'][lo:hi].astype('datetime64[s]'), unit='s')
+    rows = zip(created.tolist(), *(columns[f'field{i}'][lo:hi].tolist() for i in range(1, 7)))
+    return [{
+        'created_at': f"{created_at}Z",
+        'entry_id': lo + i + 1,
+        'field1': f"{f1:.1f}", 'field2': f"{f2:.1f}", 'field3': f"{f3:.1f}",
+        'field4': str(f4), 'field5': str(f5), 'field6': str(f6),
+    } for i, (created_at, f1, f2, f3, f4, f5, f6) in enumerate(rows)]
+
+
+def entry_time(entry: Dict[str, Any]) -> float:
+    return datetime.datetime.strptime(entry['created_at'], '%Y-%m-%dT%H:%M:%SZ').replace(
+        tzinfo=datetime.timezone.utc).timestamp()
+
+
+def parse_query_time(value: str) -> float:
+    """feeds.json start/end arguments, in UTC as ThingSpeak reads them by default."""
+    return datetime.datetime.strptime(value, QUERY_TIME_FORMAT).replace(
+        tzinfo=datetime.timezone.utc).timestamp()
+
+
+class FakeThingSpeak:
+    """Threaded HTTP server emulating the parts of ThingSpeak the server uses."""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, channel_id: int = 1,
+                 delay: float = 0.0, seed: int = 0, history: int = 0, history_interval: float = 15.0):
+        self.channel_id = channel_id
+        self.delay = delay
+        self.requests = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._failures_left = 0
+        self._history = synthetic_history(history, history_interval, time.time(), seed)
+        if history:
+            self._entry_id = history
+            self._latest = history_entries(self._history, history - 1, history)[0]
+            self._published: List[Dict[str, Any]] = []
+        else:
+            self._entry_id = 1
+            self._latest = random_entry(self._entry_id, self._rng)
+            self._published = [self._latest]
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def last_url(self) -> str:
+        return f"{self.base_url}/channels/{self.channel_id}/feeds/last.json"
+
+    def feeds_url(self) -> str:
+        return f"{self.base_url}/channels/{self.channel_id}/feeds.json"
+
+    def publish(self, fields: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Add a new entry, random unless ``fields`` are given."""
+        with self._lock:
+            self._entry_id += 1
+            entry = random_entry(self._entry_id, self._rng)
+            if fields:
+                entry.update({key: str(value) for key, value in fields.items()})
+            self._latest = entry
+            self._published.append(entry)
+            return entry
+
+    def fail_next(self, count: int):
+        """Answer the next ``count`` requests with HTTP 503."""
+        with self._lock:
+            self._failures_left = count
+
+    def _handle(self, handler: BaseHTTPRequestHandler):
+        with self._lock:
+            self.requests += 1
+            fail = self._failures_left > 0
+            if fail:
+                self._failures_left -= 1
+            latest = dict(self._latest)
+        if self.delay:
+            time.sleep(self.delay)
+
+        path, _, query = handler.path.partition('?')
+        match = LAST_PATH.match(path)
+        feeds_match = FEEDS_PATH.match(path)
+        if fail:
+            self._send(handler, 503, {'error': 'Service Unavailable'})
+        elif match and int(match.group(1)) == self.channel_id:
+            self._send(handler, 200, latest)
+        elif feeds_match and int(feeds_match.group(1)) == self.channel_id:
+            try:
+                self._send(handler, 200, self.feeds({key: values[-1] for key, values in parse_qs(query).items()}))
+            except ValueError as e:
+                self._send(handler, 400, {'error': str(e)})
+        else:
+            self._send(handler, 404, {'error': 'Not Found'})
+
+    def feeds(self, args: Dict[str, str]) -> Dict[str, Any]:
+        """The feeds.json response: the newest ``results`` entries between ``start`` and ``end``."""
+        start = parse_query_time(args['start']) if 'start' in args else float('-inf')
+        end = parse_query_time(args['end']) if 'end' in args else float('inf')
+        # Like ThingSpeak: 100 entries unless a range or a count is given
+        default = MAX_RESULTS if 'start' in args or 'end' in args else 100
+        results = min(int(args.get('results', default)), MAX_RESULTS)
+
+        created_at = self._history['created_at']
+        lo = int(np.searchsorted(created_at, start, side='left'))
+        hi = int(np.searchsorted(created_at, end, side='right'))
+        with self._lock:
+            published = [entry for entry in self._published if start <= entry_time(entry) <= end]
+            last_entry_id = self._entry_id
+        keep_history = max(0, results - len(published))
+        lo = max(lo, hi - keep_history)
+        entries = history_entries(self._history, lo, hi) + published[max(0, len(published) - results):]
+
+        first = int(created_at[0]) if len(created_at) else time.time()
+        channel_created = datetime.datetime.fromtimestamp(first, datetime.timezone.utc)
+        return {
+            'channel': {
+                'id': self.channel_id,
+                'name': 'Fake soil sensors',
+                'created_at': channel_created.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'last_entry_id': last_entry_id,
+                **{f'field{i}': name for i, name in enumerate(
+                    ['Humidity', 'Temperature', 'Moisture', 'Nitrogen', 'Phosphorus', 'Potassium'], 1)},
+            },
+            'feeds': entries,
+        }
+
+    @staticmethod
+    def _send(handler: BaseHTTPRequestHandler, status: int, payload: Any):
+        body = json.dumps(payload).encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def start(self) -> 'FakeThingSpeak':
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> 'FakeThingSpeak':
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    import sys
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    history = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    fake = FakeThingSpeak(port=port, history=history)
+    print(f"Fake ThingSpeak serving {fake.last_url()} and {fake.feeds_url()} ({history} past entries)")
+    fake.start()
+    try:
+        while True:
+            # New entry at ThingSpeak's free-tier update rate
+            time.sleep(15)
+            fake.publish()
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
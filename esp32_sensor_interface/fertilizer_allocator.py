@@ -0,0 +1,138 @@
+"""Fertilizer assignments per soil, indexed by the classes in use.
+
+Two crops on the same soil of a device should not be told to use the same
+fertilizer. FertilizerAssignments is the device's soil_type -> {crop_type:
+fertilizer} mapping, a plain dict so the shared device store can persist it
+as JSON. Alongside it each soil keeps, per fertilizer class, the number of
+crops assigned that class, and a bitmask of the classes with a non-zero
+count.
+
+A recommendation is the most probable class whose bit is clear once the
+crop's own current assignment is discounted, taken from a ranking of the
+classes computed once per prediction with rank_classes(). Recording it
+changes two counts and at most two bits. If every class is taken, the most
+probable class is kept.
+
+Class indices are columns of the model's predict_proba output; ``classes``
+gives the fertilizer name of each column. The index is rebuilt from the
+stored names when it is called with different classes, e.g. after a model
+reload. Callers serialize access per device (DeviceState.lock).
+"""
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+def rank_classes(proba) -> np.ndarray:
+    """Class indices of every row of an N x C probability matrix, most probable first.
+
+    Ties keep column order, so the first column of the ranking is what
+    model.predict returns.
+    """
+    return np.argsort(-np.asarray(proba, dtype=np.float64), axis=1, kind='stable')
+
+
+class FertilizerAssignments(dict):
+    """soil_type -> {crop_type: fertilizer}, with per-soil class counts and bitmasks."""
+
+    def __init__(self, assignments: Optional[Dict[Any, Dict[Any, str]]] = None):
+        super().__init__((soil, dict(crops)) for soil, crops in (assignments or {}).items())
+        self._classes = None
+        self._names: List[str] = []
+        self._bits: Dict[str, int] = {}
+        # soil_type -> [crops, crops per class, mask of classes in use]
+        self._index: Dict[Any, list] = {}
+
+    def _reindex(self, classes: Sequence[str]):
+        self._classes = classes
+        self._names = [str(name) for name in classes]
+        self._bits = {name: bit for bit, name in enumerate(self._names)}
+        self._index = {}
+        for soil_type, crops in self.items():
+            counts = [0] * len(classes)
+            mask = 0
+            for fertilizer in crops.values():
+                bit = self._bits.get(fertilizer)
+                # Names of classes the current model does not have take no bit
+                if bit is not None:
+                    counts[bit] += 1
+                    mask |= 1 << bit
+            self._index[soil_type] = [crops, counts, mask]
+
+    def _soil(self, soil_type, classes: Sequence[str]) -> list:
+        if classes is not self._classes:
+            self._reindex(classes)
+        entry = self._index.get(soil_type)
+        if entry is None or entry[0] is not self.get(soil_type):
+            # A soil stored directly rather than through assign()
+            if self.get(soil_type):
+                self._reindex(classes)
+                return self._index[soil_type]
+            entry = self._index[soil_type] = [self.setdefault(soil_type, {}), [0] * len(classes), 0]
+        return entry
+
+    def taken(self, soil_type, classes: Sequence[str], crop_type=None) -> int:
+        """Bitmask of the classes assigned on ``soil_type``, not counting ``crop_type``'s own."""
+        if soil_type not in self:
+            return 0
+        crops, counts, mask = self._soil(soil_type, classes)
+        own = self._bits.get(crops.get(crop_type))
+        if own is not None and counts[own] == 1:
+            mask &= ~(1 << own)
+        return mask
+
+    def assign(self, soil_type, crop_type, ranking: Sequence[int], classes: Sequence[str]) -> str:
+        """Assign ``crop_type`` the first class of ``ranking`` no other crop on the soil holds."""
+        entry = self._soil(soil_type, classes)
+        crops, counts, mask = entry
+        own = self._bits.get(crops.get(crop_type))
+        taken = mask & ~(1 << own) if own is not None and counts[own] == 1 else mask
+        bit = ranking[0]
+        if taken >> bit & 1:
+            for candidate in ranking:
+                if not taken >> candidate & 1:
+                    bit = candidate
+                    break
+        if bit != own:
+            if own is not None:
+                counts[own] -= 1
+                if not counts[own]:
+                    mask &= ~(1 << own)
+            counts[bit] += 1
+            entry[2] = mask | (1 << bit)
+            crops[crop_type] = self._names[bit]
+        return crops[crop_type]
+
+    def release(self, soil_type, crop_type) -> Optional[str]:
+        """Remove the assignment of ``crop_type`` on ``soil_type`` and return it."""
+        crops = self.get(soil_type)
+        if crops is None or crop_type not in crops:
+            return None
+        fertilizer = crops.pop(crop_type)
+        entry = self._index.get(soil_type)
+        bit = self._bits.get(fertilizer)
+        if entry is not None and entry[0] is crops and bit is not None:
+            counts = entry[1]
+            counts[bit] -= 1
+            if not counts[bit]:
+                entry[2] &= ~(1 << bit)
+        return fertilizer
+
+    def assign_field(self, soil_type, crop_types: Sequence[Any], proba, classes: Sequence[str]) -> List[str]:
+        """Reassign every crop of a field on ``soil_type`` at once.
+
+        ``proba`` holds one row of class probabilities per crop. The crops'
+        current assignments are released first, then the crops pick in order
+        of the model's confidence in their best class, so a confident crop is
+        not pushed off its fertilizer by an uncertain one. Other crops on the
+        soil keep theirs. Returns the fertilizers in the order of
+        ``crop_types``.
+        """
+        proba = np.asarray(proba, dtype=np.float64).reshape(len(crop_types), -1)
+        for crop_type in crop_types:
+            self.release(soil_type, crop_type)
+        rankings = rank_classes(proba).tolist()
+        fertilizers = [None] * len(crop_types)
+        for i in np.argsort(-proba.max(axis=1), kind='stable').tolist():
+            fertilizers[i] = self.assign(soil_type, crop_types[i], rankings[i], classes)
+        return fertilizers
@@ -0,0 +1,125 @@
+"""Packed binary frames of many readings, for field nodes that batch uploads.
+
+A frame carries the readings of one device, little-endian throughout:
+
+    offset  size  field
+    0       2     magic b'SQ'
+    2       1     version (1)
+    3       1     number of sensor columns (6)
+    4       16    device ID, UTF-8, padded with NUL bytes
+    20      4     base time, uint32 seconds since the epoch
+    24      4     sequence number, uint32, echoed back so the node can
+                  drop frames the server has acknowledged
+    28      2     number of readings N
+    30      2     reserved (0)
+    32      4     CRC-32 of the payload
+    36      4     reserved (0)
+    40      2N    time deltas, uint16 seconds: the first from the base
+                  time, each later one from the reading before it
+    40+2N   12N   six int16 columns of N values each, in SENSOR_FIELDS
+                  order, delta-encoded the same way (the first value is
+                  absolute) in fixed point: tenths for temperature,
+                  humidity and moisture, whole units for the nutrients
+
+So a reading costs 14 bytes plus its share of the 40-byte header. A request
+body is one or more frames back to back. decode_frames() turns each frame
+into NumPy arrays with np.frombuffer over the request body, without copying
+it; only the cumulative sums that undo the delta encoding allocate.
+"""
+import struct
+import zlib
+from typing import Iterator, List, NamedTuple, Sequence
+
+import numpy as np
+
+MAGIC = b'SQ'
+VERSION = 1
+HEADER = struct.Struct('<2sBB16sIIHHI4x')
+SENSOR_FIELDS = ['temperature', 'humidity', 'moisture', 'nitrogen', 'phosphorus', 'potassium']
+# Fixed-point scale per column: the sensors' resolution
+SCALE = np.array([10, 10, 10, 1, 1, 1], dtype=np.float64)
+MAX_READINGS = 65535
+
+
+class FrameError(ValueError):
+    pass
+
+
+class Frame(NamedTuple):
+    device_id: str
+    sequence: int
+    timestamps: np.ndarray  # float64 seconds since the epoch, shape (N,)
+    values: np.ndarray      # float64, shape (N, 6), columns in SENSOR_FIELDS order
+
+
+def frame_size(count: int) -> int:
+    return HEADER.size + 14 * count
+
+
+def _deltas(column: np.ndarray) -> np.ndarray:
+    return np.diff(column, prepend=0)
+
+
+def encode_frame(device_id: str, timestamps: Sequence[float], values, sequence: int = 0) -> bytes:
+    """Pack readings of one device into a frame (the reference encoder).
+
+    ``values`` has one row per reading and one column per SENSOR_FIELDS
+    entry. Timestamps are rounded to seconds and must not decrease; values
+    are rounded to the fixed-point resolution.
+    """
+    encoded_id = device_id.encode('utf-8')
+    if not encoded_id or len(encoded_id) > 16:
+        raise FrameError("Device ID must be 1 to 16 bytes of UTF-8")
+    times = np.rint(np.asarray(timestamps, dtype=np.float64)).astype(np.int64)
+    count = len(times)
+    if count > MAX_READINGS:
+        raise FrameError(f"A frame holds at most {MAX_READINGS} readings")
+    fixed = np.rint(np.asarray(values, dtype=np.float64).reshape(count, len(SENSOR_FIELDS)) * SCALE).astype(np.int64)
+
+    base = int(times[0]) if count else 0
+    time_deltas = _deltas(times - base)
+    if (time_deltas < 0).any() or (time_deltas > 0xFFFF).any():
+        raise FrameError("Timestamps must not decrease, nor be more than 65535 s apart")
+    value_deltas = _deltas(fixed.T.copy()) if count else np.zeros((len(SENSOR_FIELDS), 0), dtype=np.int64)
+    if count and (np.abs(value_deltas) > 0x7FFF).any():
+        raise FrameError("A value changed too much between readings for an int16 delta")
+
+    payload = time_deltas.astype('<u2').tobytes() + value_deltas.astype('<i2').tobytes()
+    return HEADER.pack(MAGIC, VERSION, len(SENSOR_FIELDS), encoded_id, base, sequence & 0xFFFFFFFF,
+                       count, 0, zlib.crc32(payload)) + payload
+
+
+def iter_frames(body) -> Iterator[Frame]:
+    """Decode the frames of a request body, in order."""
+    view = memoryview(body)
+    offset = 0
+    while offset < len(view):
+        if len(view) - offset < HEADER.size:
+            raise FrameError(f"Truncated frame header at byte {offset}")
+        magic, version, columns, raw_id, base, sequence, count, _, crc = HEADER.unpack_from(view, offset)
+        if magic != MAGIC:
+            raise FrameError(f"Bad magic at byte {offset}")
+        if version != VERSION or columns != len(SENSOR_FIELDS):
+            raise FrameError(f"Unsupported frame version {version} with {columns} columns")
+        start = offset + HEADER.size
+        end = offset + frame_size(count)
+        if end > len(view):
+            raise FrameError(f"Frame at byte {offset} needs {end - offset} bytes, {len(view) - offset} left")
+        if zlib.crc32(view[start:end]) != crc:
+            raise FrameError(f"CRC mismatch in frame at byte {offset}")
+
+        time_deltas = np.frombuffer(view, dtype='<u2', count=count, offset=start)
+        value_deltas = np.frombuffer(view, dtype='<i2', count=count * len(SENSOR_FIELDS),
+                                     offset=start + 2 * count).reshape(len(SENSOR_FIELDS), count)
+        timestamps = np.cumsum(time_deltas, dtype=np.float64) + base
+        values = np.cumsum(value_deltas, axis=1, dtype=np.float64).T / SCALE
+        device_id = raw_id.rstrip(b'\0').decode('utf-8', errors='replace')
+        if not device_id:
+            raise FrameError(f"Frame at byte {offset} has no device ID")
+        yield Frame(device_id, sequence, timestamps, values)
+        offset = end
+
+
+def decode_frames(body) -> List[Frame]:
+    """All frames of a request body; raises FrameError if any is malformed."""
+    return list(iter_frames(body))
@@ -0,0 +1,300 @@
+"""Per-device sensor history: raw ring buffers and min/max/mean rollups.
+
+Each device gets a DeviceHistory holding
+
+* a ring buffer of the most recent raw readings, and
+* minute, hour and day rollups, each a fixed number of buckets with the
+  count, sum, min and max of every field.
+
+Rollup buckets are direct-mapped: bucket ``n`` (the ``n``-th interval since
+the epoch) lives in slot ``n % capacity`` and overwrites whatever older
+bucket was there, so recording a reading is O(1) and memory per device is
+fixed by the capacities. A range query computes the bucket numbers it
+needs, gathers their slots with one fancy index and drops slots that hold a
+different bucket, without touching raw readings or the log files.
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+FIELDS = ['temperature', 'humidity', 'moisture', 'nitrogen', 'phosphorus', 'potassium']
+
+# Bucket width in seconds and default number of buckets kept per resolution
+RESOLUTIONS = OrderedDict([
+    ('minute', (60, 1440)),      # one day
+    ('hour', (3600, 720)),       # 30 days
+    ('day', (86400, 366)),       # one year
+])
+
+
+class RingBuffer:
+    """The last ``capacity`` raw readings of one device."""
+
+    def __init__(self, capacity: int, n_fields: int):
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.values = np.zeros((capacity, n_fields), dtype=np.float32)
+        self.head = 0
+        self.count = 0
+
+    def append(self, timestamp: float, values: Sequence[float]):
+        self.times[self.head] = timestamp
+        self.values[self.head] = values
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def extend(self, timestamps: np.ndarray, values: np.ndarray):
+        """Append many readings; only the last ``capacity`` can be kept."""
+        timestamps, values = timestamps[-self.capacity:], values[-self.capacity:]
+        slots = (self.head + np.arange(len(timestamps))) % self.capacity
+        self.times[slots] = timestamps
+        self.values[slots] = values
+        self.head = (self.head + len(timestamps)) % self.capacity
+        self.count = min(self.count + len(timestamps), self.capacity)
+
+    def query(self, start: float, end: float):
+        """Readings with ``start <= time < end``, oldest first."""
+        order = (np.arange(self.count) + self.head - self.count) % self.capacity
+        times = self.times[order]
+        mask = (times >= start) & (times < end)
+        return times[mask], self.values[order][mask]
+
+    @property
+    def nbytes(self) -> int:
+        return self.times.nbytes + self.values.nbytes
+
+
+class Rollup:
+    """Direct-mapped buckets of ``width`` seconds with count/sum/min/max per field."""
+
+    def __init__(self, width: int, capacity: int, n_fields: int):
+        self.width = width
+        self.capacity = capacity
+        self.bucket = np.full(capacity, -1, dtype=np.int64)
+        self.count = np.zeros(capacity, dtype=np.int32)
+        self.sum = np.zeros((capacity, n_fields), dtype=np.float64)
+        self.min = np.zeros((capacity, n_fields), dtype=np.float32)
+        self.max = np.zeros((capacity, n_fields), dtype=np.float32)
+        self.latest = -1
+
+    def add(self, timestamp: float, values: np.ndarray):
+        bucket = int(timestamp // self.width)
+        if bucket <= self.latest - self.capacity:
+            # Older than anything the rollup still keeps
+            return
+        slot = bucket % self.capacity
+        if self.bucket[slot] != bucket:
+            self.bucket[slot] = bucket
+            self.count[slot] = 0
+            self.sum[slot] = 0.0
+            self.min[slot] = values
+            self.max[slot] = values
+        else:
+            np.minimum(self.min[slot], values, out=self.min[slot])
+            np.maximum(self.max[slot], values, out=self.max[slot])
+        self.count[slot] += 1
+        self.sum[slot] += values
+        self.latest = max(self.latest, bucket)
+
+    def add_many(self, timestamps: np.ndarray, values: np.ndarray):
+        """Add readings sorted by time, aggregating each bucket with reduceat."""
+        buckets = (timestamps // self.width).astype(np.int64)
+        latest = max(self.latest, int(buckets[-1]))
+        keep = buckets > latest - self.capacity
+        buckets, values = buckets[keep], values[keep]
+        if len(buckets) == 0:
+            return
+
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        unique = buckets[starts]
+        count = np.diff(np.r_[starts, len(buckets)]).astype(np.int32)
+        total = np.add.reduceat(values.astype(np.float64), starts)
+        low = np.minimum.reduceat(values, starts)
+        high = np.maximum.reduceat(values, starts)
+
+        # Merge into buckets already present, overwrite stale slots
+        slots = unique % self.capacity
+        existing = self.bucket[slots] == unique
+        merge = slots[existing]
+        self.count[merge] += count[existing]
+        self.sum[merge] += total[existing]
+        self.min[merge] = np.minimum(self.min[merge], low[existing])
+        self.max[merge] = np.maximum(self.max[merge], high[existing])
+        fresh = slots[~existing]
+        self.bucket[fresh] = unique[~existing]
+        self.count[fresh] = count[~existing]
+        self.sum[fresh] = total[~existing]
+        self.min[fresh] = low[~existing]
+        self.max[fresh] = high[~existing]
+        self.latest = latest
+
+    def first_kept(self) -> int:
+        return self.latest - self.capacity + 1
+
+    def query(self, start: float, end: float) -> Dict[str, np.ndarray]:
+        """Non-empty buckets overlapping ``[start, end)``, oldest first."""
+        first = max(int(start // self.width), self.first_kept())
+        last = min(int(np.ceil(end / self.width)) - 1, self.latest)
+        if last < first:
+            buckets = np.empty(0, dtype=np.int64)
+        else:
+            buckets = np.arange(first, last + 1, dtype=np.int64)
+        slots = buckets % self.capacity
+        present = self.bucket[slots] == buckets
+        slots = slots[present]
+        count = self.count[slots]
+        return {
+            'time': buckets[present] * self.width,
+            'count': count,
+            'min': self.min[slots],
+            'max': self.max[slots],
+            'mean': self.sum[slots] / count[:, np.newaxis],
+        }
+
+    @property
+    def nbytes(self) -> int:
+        return self.bucket.nbytes + self.count.nbytes + self.sum.nbytes + self.min.nbytes + self.max.nbytes
+
+
+class DeviceHistory:
+    """Raw ring buffer and rollups for one device."""
+
+    def __init__(self, raw_capacity: int = 360, resolutions: Optional[Dict[str, Any]] = None):
+        resolutions = resolutions or RESOLUTIONS
+        self.raw = RingBuffer(raw_capacity, len(FIELDS))
+        self.rollups = OrderedDict((name, Rollup(width, capacity, len(FIELDS)))
+                                   for name, (width, capacity) in resolutions.items())
+        self.lock = threading.Lock()
+
+    def add(self, timestamp: float, values: Sequence[float]):
+        values = np.asarray(values, dtype=np.float32)
+        with self.lock:
+            self.raw.append(timestamp, values)
+            for rollup in self.rollups.values():
+                rollup.add(timestamp, values)
+
+    def add_many(self, timestamps: Sequence[float], values: Sequence[Sequence[float]]):
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float32).reshape(len(timestamps), -1)
+        if len(timestamps) == 0:
+            return
+        order = np.argsort(timestamps, kind='stable')
+        timestamps, values = timestamps[order], values[order]
+        with self.lock:
+            self.raw.extend(timestamps, values)
+            for rollup in self.rollups.values():
+                rollup.add_many(timestamps, values)
+
+    @property
+    def nbytes(self) -> int:
+        return self.raw.nbytes + sum(rollup.nbytes for rollup in self.rollups.values())
+
+
+class HistoryStore:
+    """Histories of up to ``max_devices`` devices, least recently updated evicted first."""
+
+    def __init__(self, max_devices: int = 1000, raw_capacity: int = 360,
+                 resolutions: Optional[Dict[str, Any]] = None):
+        self.max_devices = max_devices
+        self.raw_capacity = raw_capacity
+        self.resolutions = OrderedDict(resolutions or RESOLUTIONS)
+        self._devices: 'OrderedDict[str, DeviceHistory]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def _history(self, device_id: str, create: bool) -> Optional[DeviceHistory]:
+        with self._lock:
+            history = self._devices.get(device_id)
+            if history is not None:
+                self._devices.move_to_end(device_id)
+            elif create:
+                history = DeviceHistory(self.raw_capacity, self.resolutions)
+                self._devices[device_id] = history
+                while len(self._devices) > self.max_devices:
+                    self._devices.popitem(last=False)
+                    self.evicted += 1
+            return history
+
+    def record(self, device_id: str, timestamp: float, readings: Dict[str, Any]):
+        """Add one reading, which must have every field in FIELDS."""
+        values = [float(readings[field]) for field in FIELDS]
+        self._history(device_id, create=True).add(timestamp, values)
+
+    def record_many(self, device_id: str, timestamps: Sequence[float], values: Sequence[Sequence[float]]):
+        """Add many readings of one device; ``values`` has one column per field in FIELDS."""
+        self._history(device_id, create=True).add_many(timestamps, values)
+
+    def load_records(self, records: Iterable[Dict[str, Any]], parse_timestamp) -> int:
+        """Replay logged records into the store, skipping ones without a device or a field."""
+        count = 0
+        for record in records:
+            try:
+                self.record(str(record['device_id']), parse_timestamp(record.get('timestamp')), record)
+            except (KeyError, TypeError, ValueError):
+                continue
+            count += 1
+        return count
+
+    def choose_resolution(self, start: float, end: float, max_points: int) -> str:
+        """Finest rollup that keeps a range this long and returns at most ``max_points`` buckets."""
+        names = list(self.resolutions)
+        for name in names:
+            width, capacity = self.resolutions[name]
+            if (end - start) / width <= max_points and (end - start) / width <= capacity:
+                return name
+        return names[-1]
+
+    def query(self, device_id: str, start: float, end: float, resolution: str = 'auto',
+              fields: Optional[List[str]] = None, max_points: int = 1000) -> Optional[Dict[str, Any]]:
+        """Columnar history for ``[start, end)``; None for an unknown device.
+
+        ``resolution`` is ``raw``, a rollup name, or ``auto``.
+        """
+        history = self._history(device_id, create=False)
+        if history is None:
+            return None
+        fields = fields or FIELDS
+        unknown = [field for field in fields if field not in FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        if resolution == 'auto':
+            resolution = self.choose_resolution(start, end, max_points)
+        columns = [FIELDS.index(field) for field in fields]
+
+        with history.lock:
+            if resolution == 'raw':
+                times, values = history.raw.query(start, end)
+                return {
+                    'resolution': 'raw',
+                    'time': times.tolist(),
+                    **{field: values[:, i].tolist() for field, i in zip(fields, columns)},
+                }
+            if resolution not in history.rollups:
+                raise ValueError(f"Unknown resolution: {resolution}")
+            buckets = history.rollups[resolution].query(start, end)
+
+        return {
+            'resolution': resolution,
+            'bucket_seconds': history.rollups[resolution].width,
+            'time': buckets['time'].tolist(),
+            'count': buckets['count'].tolist(),
+            **{field: {stat: buckets[stat][:, i].tolist() for stat in ('min', 'max', 'mean')}
+               for field, i in zip(fields, columns)},
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            devices = len(self._devices)
+            per_device = next(iter(self._devices.values())).nbytes if devices else \
+                DeviceHistory(self.raw_capacity, self.resolutions).nbytes
+        return {
+            'devices': devices,
+            'max_devices': self.max_devices,
+            'evicted': self.evicted,
+            'bytes_per_device': per_device,
+            'raw_capacity': self.raw_capacity,
+            'resolutions': {name: {'bucket_seconds': width, 'buckets': capacity}
+                            for name, (width, capacity) in self.resolutions.items()},
+        }
@@ -0,0 +1,128 @@
+"""Bounded ingest queue drained in micro-batches by a worker thread.
+
+Request handlers only validate a reading and put it on the queue, which
+returns immediately. The worker waits for the first item, then keeps
+collecting until it has ``max_batch`` items or ``max_latency`` seconds have
+passed since that first item, and hands the whole batch to
+``process_batch``. When the queue holds ``max_size`` items submit() refuses
+new ones, so callers can answer 429 instead of building an unbounded backlog.
+"""
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+
+class IngestQueue:
+    """Queue of pending items processed ``max_batch`` at a time."""
+
+    def __init__(self, process_batch: Callable[[List[Any]], None], max_batch: int = 256,
+                 max_latency: float = 0.05, max_size: int = 10000):
+        self.process_batch = process_batch
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.max_size = max_size
+
+        self._queue: 'queue.Queue[Any]' = queue.Queue(maxsize=max_size)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+        self.accepted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.batches = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+        self.last_batch_seconds = 0.0
+
+    def submit(self, item: Any) -> bool:
+        """Enqueue an item; False if the queue is full."""
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self.accepted += 1
+        return True
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def _collect(self, timeout: Optional[float]) -> List[Any]:
+        """Block up to ``timeout`` for a first item, then fill the batch until the latency bound."""
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get_nowait() if remaining <= 0 else self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _process(self, batch: List[Any]):
+        start = time.perf_counter()
+        try:
+            self.process_batch(batch)
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+                self.last_error = str(e)
+            print(f"Error processing ingest batch of {len(batch)}: {e}")
+        with self._lock:
+            self.batches += 1
+            self.processed += len(batch)
+            self.last_batch_seconds = time.perf_counter() - start
+
+    def drain(self):
+        """Process everything queued so far on the calling thread."""
+        while True:
+            batch = self._collect(timeout=0)
+            if not batch:
+                return
+            self._process(batch)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='ingest-worker', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop the worker after it has processed the items already queued."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.drain()
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect(timeout=0.5)
+            if batch:
+                self._process(batch)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'queued': self._queue.qsize(),
+                'max_size': self.max_size,
+                'max_batch': self.max_batch,
+                'max_latency_ms': self.max_latency * 1000,
+                'accepted': self.accepted,
+                'rejected': self.rejected,
+                'processed': self.processed,
+                'batches': self.batches,
+                'mean_batch_size': self.processed / self.batches if self.batches else 0.0,
+                'last_batch_ms': self.last_batch_seconds * 1000,
+                'errors': self.errors,
+                'last_error': self.last_error,
+                'running': self._thread is not None and self._thread.is_alive(),
+            }
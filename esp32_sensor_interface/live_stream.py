@@ -0,0 +1,518 @@
+"""Server-sent event fan-out of new readings to many open dashboards.
+
+Broadcaster.publish() is called once per new reading of a device. It only
+hands the event to a dispatcher thread, which serializes it to one SSE frame
+and passes that frame to every subscriber to the device (or to '*', every
+device), so a reading costs one JSON encode plus one write per subscriber.
+
+Once a stream's response headers are sent, the dispatcher takes over its
+socket (the server exposes it as ``werkzeug.socket``) and writes frames to
+it directly, without blocking; the request thread just waits for the stream
+to end. Subscribers thus cost no thread wakeups, and CPU per client stays
+flat with thousands of them. Under a server that does not expose its socket
+the request thread writes each frame itself, which works but scales worse.
+
+Each subscriber's buffer of frames not yet written is bounded. When a slow
+consumer's buffer fills, it is coalesced to the newest frame per device,
+since dashboards only show the latest value; if it is still full (a '*'
+subscriber behind on many devices) the oldest frames are dropped. Idle
+streams get a comment line every ``heartbeat`` seconds, which also detects
+closed connections, and subscribers that have frames waiting but have not
+taken any for ``idle_timeout`` seconds are evicted, ending their stream.
+"""
+import collections
+import json
+import socket
+import ssl
+import threading
+import time
+from typing import Any, Deque, Dict, Iterator, List, Optional, Set, Tuple
+
+ALL_DEVICES = '*'
+
+# Sent to each new stream: how long an EventSource waits before reconnecting
+RETRY_MS = 3000
+
+HEARTBEAT_FRAME = b': ping\n\n'
+
+# How often the dispatcher retries writing to sockets that were full
+BACKLOG_RETRY_INTERVAL = 0.05
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+def encode_event(event_id: int, event: str, data: Any) -> bytes:
+    """One SSE frame; the JSON payload has no newlines, so it fits one data line."""
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+
+class Subscriber:
+    """One open stream: a bounded buffer of frames waiting to be written.
+
+    Frames are written to ``sock`` once the broadcaster has attached it, and
+    otherwise taken by the request thread with drain().
+    """
+
+    __slots__ = ('topic', 'buffer_size', 'pending', 'partial', 'sock', 'lock', 'wakeup', 'done', 'closed',
+                 'connected_at', 'last_delivery', 'delivered', 'coalesced', 'dropped')
+
+    def __init__(self, topic: str, buffer_size: int):
+        self.topic = topic
+        self.buffer_size = buffer_size
+        self.pending: Deque[Tuple[str, bytes]] = collections.deque()
+        # The unwritten rest of a frame the socket only took part of
+        self.partial = b''
+        self.sock: Optional[socket.socket] = None
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.done = threading.Event()
+        self.closed = False
+        self.connected_at = time.monotonic()
+        self.last_delivery = self.connected_at
+        self.delivered = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def offer(self, key: str, frame: bytes) -> bool:
+        """Write or buffer a frame; True if frames are left waiting for the socket."""
+        with self.lock:
+            if self.closed:
+                return False
+            if self.sock is not None and not self.pending and not self.partial:
+                self.delivered += 1
+                return not self._write(frame) and not self.closed
+            if len(self.pending) >= self.buffer_size:
+                self._coalesce()
+            self.pending.append((key, frame))
+            if self.sock is None:
+                self.wakeup.set()
+                return False
+            return self._flush()
+
+    def _coalesce(self):
+        """Keep only the newest frame per device, then drop the oldest if still full."""
+        newest: Dict[str, bytes] = {}
+        for key, frame in self.pending:
+            newest.pop(key, None)
+            newest[key] = frame
+        self.coalesced += len(self.pending) - len(newest)
+        self.pending = collections.deque(newest.items())
+        while len(self.pending) >= self.buffer_size:
+            self.pending.popleft()
+            self.dropped += 1
+
+    def _write(self, data: bytes) -> bool:
+        """Write as much of ``data`` as the socket takes now; True if all of it."""
+        try:
+            sent = self.sock.send(data)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self._close()
+            return False
+        if sent:
+            self.last_delivery = time.monotonic()
+        if sent < len(data):
+            # Started frames are always finished, never coalesced or dropped
+            self.partial = data[sent:]
+            return False
+        return True
+
+    def _flush(self) -> bool:
+        if self.partial:
+            data, self.partial = self.partial, b''
+            if not self._write(data):
+                return not self.closed
+        while self.pending:
+            _, frame = self.pending.popleft()
+            self.delivered += 1
+            if not self._write(frame):
+                return not self.closed
+        return False
+
+    def flush(self) -> bool:
+        """Write buffered frames; True if frames are still waiting."""
+        with self.lock:
+            if self.closed or self.sock is None:
+                return False
+            return self._flush()
+
+    def attach(self, sock: socket.socket) -> bool:
+        """Take over writing to ``sock``; True if frames are left waiting."""
+        with self.lock:
+            if self.closed:
+                return False
+            sock.setblocking(False)
+            self.sock = sock
+            return self._flush()
+
+    def heartbeat(self, idle_since: float) -> Optional[bool]:
+        """Write a heartbeat if nothing was written since ``idle_since``.
+
+        None if none was due, else True if part of it is left waiting.
+        """
+        with self.lock:
+            if self.closed or self.sock is None or self.pending or self.partial:
+                return None
+            if self.last_delivery >= idle_since:
+                return None
+            return not self._write(HEARTBEAT_FRAME) and not self.closed
+
+    def drain(self) -> List[bytes]:
+        with self.lock:
+            frames = [frame for _, frame in self.pending]
+            self.pending.clear()
+        self.delivered += len(frames)
+        return frames
+
+    def _close(self):
+        self.closed = True
+        self.wakeup.set()
+        self.done.set()
+
+    def close(self):
+        with self.lock:
+            self._close()
+
+    @property
+    def backlog(self) -> int:
+        return len(self.pending) + bool(self.partial)
+
+
+class Broadcaster:
+    """Fans published events out to the subscribers of their device."""
+
+    def __init__(self, buffer_size: int = 16, heartbeat: float = 15.0, idle_timeout: float = 60.0,
+                 max_subscribers: int = 10000):
+        self.buffer_size = buffer_size
+        self.heartbeat = heartbeat
+        self.idle_timeout = idle_timeout
+        self.max_subscribers = max_subscribers
+
+        self._topics: Dict[str, Set[Subscriber]] = {}
+        self._count = 0
+        # Subscribers whose sockets did not take everything written to them
+        self._backlogged: Set[Subscriber] = set()
+        self._lock = threading.Lock()
+        # Events waiting for the dispatcher, newest per device
+        self._outbox: Dict[str, Tuple[str, Any]] = {}
+        self._outbox_ready = threading.Condition(threading.Lock())
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._event_id = 0
+
+        self.published = 0
+        self.superseded = 0
+        self.fanned_out = 0
+        self.heartbeats = 0
+        self.evicted = 0
+        self.rejected = 0
+        self.total_subscribed = 0
+        self.delivered = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.dispatch_seconds = 0.0
+
+    # Subscribers
+
+    def subscribe(self, topic: str) -> Subscriber:
+        """Open a subscription to one device, or to every device with '*'."""
+        subscriber = Subscriber(topic, self.buffer_size)
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                self.rejected += 1
+                raise TooManySubscribers(f"{self._count} streams are open")
+            self._topics.setdefault(topic, set()).add(subscriber)
+            self._count += 1
+            self.total_subscribed += 1
+        self.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscriber.close()
+        with self._lock:
+            self._backlogged.discard(subscriber)
+            subscribers = self._topics.get(subscriber.topic)
+            if subscribers is None or subscriber not in subscribers:
+                return
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._topics[subscriber.topic]
+            self._count -= 1
+            self.delivered += subscriber.delivered
+            self.coalesced += subscriber.coalesced
+            self.dropped += subscriber.dropped
+
+    def has_subscribers(self, topic: str) -> bool:
+        # Unlocked reads of the dict are safe and only ever slightly stale
+        return topic in self._topics or ALL_DEVICES in self._topics
+
+    def topics(self) -> List[str]:
+        with self._lock:
+            return list(self._topics)
+
+    def subscribers(self) -> List[Subscriber]:
+        with self._lock:
+            return [subscriber for subscribers in self._topics.values() for subscriber in subscribers]
+
+    def __len__(self) -> int:
+        return self._count
+
+    # Publishing
+
+    def publish(self, topic: str, data: Any, event: str = 'reading'):
+        """Queue an event for the subscribers of ``topic``; returns at once.
+
+        If the dispatcher has not sent the previous event of the same device
+        yet, it is replaced, so publishers never wait and never queue more
+        than one event per device.
+        """
+        if not self.has_subscribers(topic):
+            return
+        with self._outbox_ready:
+            if topic in self._outbox:
+                self.superseded += 1
+            self._outbox[topic] = (event, data)
+            self.published += 1
+            self._outbox_ready.notify()
+
+    def _add_backlogged(self, subscribers: List[Subscriber]):
+        if subscribers:
+            with self._lock:
+                self._backlogged.update(s for s in subscribers if not s.closed)
+
+    def dispatch(self) -> int:
+        """Send every queued event to its subscribers; returns the frames fanned out."""
+        with self._outbox_ready:
+            outbox, self._outbox = self._outbox, {}
+        if not outbox:
+            return 0
+        start = time.perf_counter()
+        fanned_out = 0
+        for topic, (event, data) in outbox.items():
+            with self._lock:
+                targets = list(self._topics.get(topic, ()))
+                if topic != ALL_DEVICES:
+                    targets.extend(self._topics.get(ALL_DEVICES, ()))
+            if not targets:
+                continue
+            self._event_id += 1
+            frame = encode_event(self._event_id, event, data)
+            self._add_backlogged([subscriber for subscriber in targets if subscriber.offer(topic, frame)])
+            fanned_out += len(targets)
+        self.fanned_out += fanned_out
+        self.dispatch_seconds += time.perf_counter() - start
+        return fanned_out
+
+    def flush_backlog(self):
+        """Retry the sockets that were full, forgetting those that caught up."""
+        with self._lock:
+            backlogged, self._backlogged = self._backlogged, set()
+        self._add_backlogged([subscriber for subscriber in backlogged if subscriber.flush()])
+
+    def send_heartbeats(self) -> int:
+        """Write a heartbeat to attached streams that were sent nothing for half the interval."""
+        idle_since = time.monotonic() - self.heartbeat / 2
+        sent, backlogged = 0, []
+        for subscriber in self.subscribers():
+            waiting = subscriber.heartbeat(idle_since)
+            if waiting is None:
+                continue
+            sent += 1
+            if waiting:
+                backlogged.append(subscriber)
+        self._add_backlogged(backlogged)
+        self.heartbeats += sent
+        return sent
+
+    def evict_idle(self) -> int:
+        """Close subscribers with frames waiting that have not taken any for idle_timeout."""
+        cutoff = time.monotonic() - self.idle_timeout
+        idle = [subscriber for subscriber in self.subscribers()
+                if subscriber.backlog and subscriber.last_delivery < cutoff]
+        for subscriber in idle:
+            self.unsubscribe(subscriber)
+        self.evicted += len(idle)
+        return len(idle)
+
+    def _run(self):
+        now = time.monotonic()
+        next_heartbeat = now + self.heartbeat / 2
+        next_sweep = now + self.idle_timeout / 2
+        while not self._stop.is_set():
+            timeout = min(next_heartbeat, next_sweep) - now
+            if self._backlogged:
+                timeout = min(timeout, BACKLOG_RETRY_INTERVAL)
+            with self._outbox_ready:
+                if not self._outbox:
+                    self._outbox_ready.wait(timeout=max(0.0, timeout))
+            self.dispatch()
+            if self._backlogged:
+                self.flush_backlog()
+            now = time.monotonic()
+            if now >= next_heartbeat:
+                self.send_heartbeats()
+                next_heartbeat = now + self.heartbeat / 2
+            if now >= next_sweep:
+                self.evict_idle()
+                next_sweep = now + self.idle_timeout / 2
+
+    def start(self):
+        """Start the dispatcher thread (once)."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='live-stream', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 1.0):
+        """Stop the dispatcher and end every open stream."""
+        self._stop.set()
+        with self._outbox_ready:
+            self._outbox_ready.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        for subscriber in self.subscribers():
+            self.unsubscribe(subscriber)
+
+    # Streams
+
+    def stream(self, subscriber: Subscriber, initial: Optional[Any] = None, event: str = 'reading',
+               sock: Optional[socket.socket] = None) -> Iterator[bytes]:
+        """Yield the SSE response body for ``subscriber`` until it is closed.
+
+        Starts with ``initial`` (the device's current readings), so a new
+        dashboard does not wait for the next reading. Given the connection's
+        ``sock``, the dispatcher writes every later frame to it, and this
+        only waits for the stream to end. Unsubscribes when the client goes
+        away or the generator is closed.
+        """
+        try:
+            head = f"retry: {RETRY_MS}\n\n".encode()
+            if initial is not None:
+                head += encode_event(self._event_id, event, initial)
+            yield head
+            subscriber.last_delivery = time.monotonic()
+            if sock is not None and not isinstance(sock, ssl.SSLSocket):
+                if subscriber.attach(sock):
+                    self._add_backlogged([subscriber])
+                subscriber.done.wait()
+                return
+            while not subscriber.closed:
+                if subscriber.wakeup.wait(self.heartbeat):
+                    subscriber.wakeup.clear()
+                    frames = subscriber.drain()
+                    if not frames:
+                        continue
+                    yield b''.join(frames)
+                else:
+                    yield HEARTBEAT_FRAME
+                    self.heartbeats += 1
+                subscriber.last_delivery = time.monotonic()
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self) -> Dict[str, Any]:
+        subscribers = self.subscribers()
+        with self._lock:
+            topics = len(self._topics)
+            backlogged = len(self._backlogged)
+        return {
+            'subscribers': len(subscribers),
+            'attached': sum(1 for s in subscribers if s.sock is not None),
+            'max_subscribers': self.max_subscribers,
+            'topics': topics,
+            'total_subscribed': self.total_subscribed,
+            'rejected': self.rejected,
+            'published': self.published,
+            'superseded': self.superseded,
+            'fanned_out': self.fanned_out,
+            'delivered': self.delivered + sum(s.delivered for s in subscribers),
+            'coalesced': self.coalesced + sum(s.coalesced for s in subscribers),
+            'dropped': self.dropped + sum(s.dropped for s in subscribers),
+            'backlogged': backlogged,
+            'pending': sum(len(s.pending) for s in subscribers),
+            'heartbeats': self.heartbeats,
+            'evicted': self.evicted,
+            'dispatch_seconds': self.dispatch_seconds,
+        }
+
+
+class ChangeFeed:
+    """Publishes readings that other processes wrote to a shared device store.
+
+    With serve.py a reading is POSTed to one worker, but the dashboards
+    watching that device may be connected to any worker. Every
+    ``interval`` seconds this asks the store for the rows changed since the
+    last poll (with some overlap, for writes that committed late) and
+    publishes those of devices with subscribers here, skipping readings
+    already published, whether by this feed or directly by this process.
+    """
+
+    def __init__(self, broadcaster: Broadcaster, changed_since, to_event, interval: float = 0.5,
+                 overlap: float = 2.0):
+        self.broadcaster = broadcaster
+        self.changed_since = changed_since
+        self.to_event = to_event
+        self.interval = interval
+        self.overlap = overlap
+        self._last: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._since = time.time()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.polls = 0
+        self.published = 0
+
+    def seen(self, device_id: str, readings: Dict[str, Any]):
+        """Note readings this process published itself."""
+        with self._lock:
+            self._last[device_id] = readings
+
+    def poll(self) -> int:
+        topics = set(self.broadcaster.topics())
+        with self._lock:
+            for device_id in [d for d in self._last if d not in topics]:
+                del self._last[device_id]
+        if not topics:
+            self._since = time.time()
+            return 0
+        started = time.time()
+        rows = self.changed_since(self._since - self.overlap)
+        self._since = started
+        self.polls += 1
+        published = 0
+        for device_id, readings in rows:
+            if device_id not in topics and ALL_DEVICES not in topics:
+                continue
+            with self._lock:
+                if self._last.get(device_id) == readings:
+                    continue
+                self._last[device_id] = readings
+            self.broadcaster.publish(device_id, self.to_event(device_id, readings))
+            published += 1
+        self.published += published
+        return published
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Error polling the device store for the live stream: {e}")
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._since = time.time()
+        self._thread = threading.Thread(target=self._run, name='live-stream-feed', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 1.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
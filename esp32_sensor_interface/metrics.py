@@ -0,0 +1,345 @@
+"""Low-overhead latency histograms, counters and a sampling profiler.
+
+Histogram stores durations in log-linear buckets like HdrHistogram. Values
+below 2**SUB_BITS nanoseconds get one bucket each. Above that, every power
+of two is split into 2**(SUB_BITS - 1) buckets, so a bucket's width is at
+most about 3% of its value, and a percentile read from the histogram is
+within 3% of the true value. Recording costs one bit_length and one list
+increment, with no allocation.
+
+Metrics collects histograms, counters and collector callbacks that read
+existing statistics (cache, queue, registry) only when /metrics is scraped,
+and renders them in the Prometheus text exposition format.
+
+SamplingProfiler snapshots every thread's stack at a fixed interval on a
+background thread and counts the stacks, so it can be switched on in a
+running server to see where time goes.
+"""
+import sys
+import threading
+import time
+from collections import Counter as StackCounter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+SUB_BITS = 6
+SUB_COUNT = 1 << SUB_BITS
+HALF_COUNT = SUB_COUNT >> 1
+# Enough buckets for any duration below 2**63 ns
+BUCKET_COUNT = (64 - SUB_BITS + 2) * HALF_COUNT
+
+# Upper bounds (seconds) of the buckets exported to Prometheus
+EXPORT_BOUNDS = [0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+
+def bucket_index(value: int) -> int:
+    if value < SUB_COUNT:
+        return value
+    shift = value.bit_length() - SUB_BITS
+    return (shift + 1) * HALF_COUNT + (value >> shift) - HALF_COUNT
+
+
+def bucket_upper(index: int) -> int:
+    """Largest value (exclusive) that falls in bucket ``index``."""
+    if index < SUB_COUNT:
+        return index + 1
+    shift = index // HALF_COUNT - 1
+    top = index - shift * HALF_COUNT
+    return (top + 1) << shift
+
+
+def format_labels(labels: Tuple[Tuple[str, str], ...], extra: str = '') -> str:
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram: 'Histogram'):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.record_ns(time.perf_counter_ns() - self.start)
+        return False
+
+
+class Histogram:
+    """Log-linear histogram of durations in nanoseconds."""
+
+    def __init__(self, owner: Optional['Metrics'] = None):
+        self.owner = owner
+        self.counts = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self._lock = threading.Lock()
+
+    def record_ns(self, value: int):
+        index = bucket_index(value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total_ns += value
+            if value > self.max_ns:
+                self.max_ns = value
+
+    def observe(self, seconds: float):
+        if self.owner is None or self.owner.enabled:
+            self.record_ns(int(seconds * 1e9))
+
+    def time(self):
+        """Context manager recording the duration of its block."""
+        if self.owner is not None and not self.owner.enabled:
+            return NULL_TIMER
+        return _Timer(self)
+
+    def percentile(self, q: float) -> float:
+        """Upper bound, in seconds, of the bucket holding the ``q``-th percentile."""
+        with self._lock:
+            counts, count = list(self.counts), self.count
+        if count == 0:
+            return 0.0
+        rank = max(1, int(round(q / 100.0 * count)))
+        seen = 0
+        for index, n in enumerate(counts):
+            seen += n
+            if seen >= rank:
+                return min(bucket_upper(index), self.max_ns) / 1e9
+        return self.max_ns / 1e9
+
+    def cumulative(self, bounds: Iterable[float]) -> List[int]:
+        """Number of values at or below each bound (in seconds)."""
+        with self._lock:
+            counts = list(self.counts)
+        result = []
+        index = 0
+        seen = 0
+        for bound in bounds:
+            limit = int(bound * 1e9)
+            while index < len(counts) and bucket_upper(index) <= limit + 1:
+                seen += counts[index]
+                index += 1
+            result.append(seen)
+        return result
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'mean_ms': self.total_ns / self.count / 1e6 if self.count else 0.0,
+            'p50_ms': self.percentile(50) * 1000,
+            'p90_ms': self.percentile(90) * 1000,
+            'p99_ms': self.percentile(99) * 1000,
+            'p999_ms': self.percentile(99.9) * 1000,
+            'max_ms': self.max_ns / 1e6,
+        }
+
+
+class Counter:
+    """Monotonic counter."""
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1):
+        with self._lock:
+            self.value += amount
+
+
+class Metrics:
+    """Registry of named, labelled histograms and counters."""
+
+    def __init__(self, prefix: str = ''):
+        self.prefix = prefix
+        self.enabled = True
+        self._histograms: Dict[Tuple[str, Tuple], Histogram] = {}
+        self._counters: Dict[Tuple[str, Tuple], Counter] = {}
+        self._help: Dict[str, str] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, Dict[str, Any], float]]]] = []
+        self._lock = threading.Lock()
+        # Labels added to every rendered sample, e.g. the serving worker
+        self.const_labels: Dict[str, Any] = {}
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, Any]):
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def histogram(self, name: str, help: str = '', **labels) -> Histogram:
+        key = self._key(name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram(self))
+                self._help.setdefault(name, help)
+        return histogram
+
+    def counter(self, name: str, help: str = '', **labels) -> Counter:
+        key = self._key(name, labels)
+        counter = self._counters.get(key)
+        if counter is None:
+            with self._lock:
+                counter = self._counters.setdefault(key, Counter())
+                self._help.setdefault(name, help)
+        return counter
+
+    def inc(self, name: str, amount: int = 1, help: str = '', **labels):
+        if self.enabled:
+            self.counter(name, help, **labels).inc(amount)
+
+    def add_collector(self, collector: Callable[[], Iterable[Tuple[str, str, str, Dict[str, Any], float]]]):
+        """Register a function returning ``(name, type, help, labels, value)`` samples at scrape time."""
+        self._collectors.append(collector)
+
+    def summaries(self, name: str) -> Dict[str, Dict[str, float]]:
+        """Percentile summary of every histogram called ``name``, keyed by label values."""
+        return {','.join(value for _, value in labels) or name: histogram.summary()
+                for (hist_name, labels), histogram in sorted(self._histograms.items()) if hist_name == name}
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        described = set()
+        const = tuple(sorted((key, str(value)) for key, value in self.const_labels.items()))
+
+        def describe(name, kind, help):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), histogram in sorted(self._histograms.items()):
+            full = self.prefix + name
+            describe(full, 'histogram', self._help.get(name, ''))
+            labels = const + labels
+            for bound, count in zip(EXPORT_BOUNDS, histogram.cumulative(EXPORT_BOUNDS)):
+                bucket_labels = format_labels(labels, 'le="%s"' % bound)
+                lines.append(f"{full}_bucket{bucket_labels} {count}")
+            bucket_labels = format_labels(labels, 'le="+Inf"')
+            lines.append(f"{full}_bucket{bucket_labels} {histogram.count}")
+            lines.append(f"{full}_sum{format_labels(labels)} {histogram.total_ns / 1e9}")
+            lines.append(f"{full}_count{format_labels(labels)} {histogram.count}")
+
+        for (name, labels), counter in sorted(self._counters.items()):
+            full = self.prefix + name
+            describe(full, 'counter', self._help.get(name, ''))
+            labels = const + labels
+            lines.append(f"{full}{format_labels(labels)} {counter.value}")
+
+        for collector in self._collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+                continue
+            for name, kind, help, labels, value in samples:
+                full = self.prefix + name
+                describe(full, kind, help)
+                labels = const + tuple(sorted((key, str(v)) for key, v in labels.items()))
+                lines.append(f"{full}{format_labels(labels)} {float(value) if value is not None else 'NaN'}")
+        return '\n'.join(lines) + '\n'
+
+
+class SamplingProfiler:
+    """Count the stacks of all other threads every ``interval`` seconds.
+
+    Stacks are recorded as ``file:function`` frames joined by ``;``, outermost
+    first (the "folded" format flame graph tools read). At most
+    ``max_stacks`` distinct stacks are kept; further new stacks are counted
+    as dropped.
+    """
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 40, max_stacks: int = 10000):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.max_stacks = max_stacks
+        self.stacks: 'StackCounter[str]' = StackCounter()
+        self.samples = 0
+        self.dropped = 0
+        self.started_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: Optional[float] = None, reset: bool = True):
+        if self.running:
+            return
+        if interval:
+            self.interval = interval
+        if reset:
+            self.reset()
+        self._stop.clear()
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def reset(self):
+        with self._lock:
+            self.stacks.clear()
+            self.samples = 0
+            self.dropped = 0
+
+    def _folded(self, frame) -> str:
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, frame in frames.items():
+                    if thread_id == own:
+                        continue
+                    stack = self._folded(frame)
+                    if stack in self.stacks or len(self.stacks) < self.max_stacks:
+                        self.stacks[stack] += 1
+                    else:
+                        self.dropped += 1
+                self.samples += 1
+
+    def report(self, top: int = 50) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'running': self.running,
+                'interval': self.interval,
+                'started_at': self.started_at,
+                'samples': self.samples,
+                'dropped': self.dropped,
+                'stacks': [{'stack': stack, 'count': count} for stack, count in self.stacks.most_common(top)],
+            }
+
+    def folded(self) -> str:
+        with self._lock:
+            return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
@@ -0,0 +1,231 @@
+"""Hot-swappable model registry for the sensor server.
+
+ModelRegistry holds the models dict the server predicts with. A reload loads
+a new candidate in the calling (background) thread, smoke-tests it on the
+held-out rows saved at training time, and only then replaces the current
+models with a single reference assignment. Requests fetch the models once
+with get() and keep using that dict, so predictions already in flight finish
+on the version they started with; nothing is mutated in place.
+
+Reloads are started by the admin endpoint or by a watcher thread that polls
+the model files' modification times and reloads once they have stopped
+changing.
+"""
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+import numpy as np
+
+
+def model_version(models: Optional[Dict[str, Any]]) -> Optional[str]:
+    return models.get('version') if models else None
+
+
+class HoldoutValidator:
+    """Smoke test a candidate model on held-out rows saved by training.
+
+    A candidate passes if it predicts a known fertilizer for every row, its
+    accuracy is at least ``min_accuracy``, and it is not more than
+    ``max_accuracy_drop`` less accurate than the current model. Without a
+    holdout file only the load itself is checked.
+    """
+
+    def __init__(self, path: str, min_accuracy: float = 0.5, max_accuracy_drop: float = 0.1):
+        self.path = path
+        self.min_accuracy = min_accuracy
+        self.max_accuracy_drop = max_accuracy_drop
+
+    def load_holdout(self):
+        if not os.path.exists(self.path):
+            return None
+        with np.load(self.path, allow_pickle=False) as data:
+            return {name: data[name] for name in data.files}
+
+    def accuracy(self, models: Dict[str, Any], holdout: Dict[str, np.ndarray]) -> float:
+        columns = list(holdout['columns'])
+        features = holdout['features'].copy()
+        features[:, columns.index('Soil Type')] = models['soil_encoder'].transform(holdout['soil_type'])
+        features[:, columns.index('Crop Type')] = models['crop_encoder'].transform(holdout['crop_type'])
+
+        scaler = models['scaler']
+        predictions = models['model'].predict((features - scaler.mean_) / scaler.scale_)
+        names = models['fertilizer_encoder'].inverse_transform(predictions)
+        if not set(names) <= set(models['fertilizer_encoder'].classes_):
+            raise ValueError("Model predicted unknown fertilizer classes")
+        return float(np.mean(names.astype(str) == holdout['fertilizer']))
+
+    def __call__(self, candidate: Dict[str, Any], current: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        holdout = self.load_holdout()
+        if holdout is None:
+            return {'passed': True, 'rows': 0, 'note': f"No holdout file at {self.path}"}
+
+        report = {'rows': len(holdout['fertilizer'])}
+        try:
+            report['accuracy'] = self.accuracy(candidate, holdout)
+        except Exception as e:
+            return {**report, 'passed': False, 'reason': f"Smoke test failed: {e}"}
+        if current is not None:
+            try:
+                report['current_accuracy'] = self.accuracy(current, holdout)
+            except Exception:
+                # The holdout may use labels the current model does not know
+                pass
+
+        if report['accuracy'] < self.min_accuracy:
+            report.update(passed=False, reason=f"Accuracy {report['accuracy']:.3f} below {self.min_accuracy}")
+        elif report.get('current_accuracy', 0.0) - report['accuracy'] > self.max_accuracy_drop:
+            report.update(passed=False, reason=f"Accuracy dropped from {report['current_accuracy']:.3f} "
+                                               f"to {report['accuracy']:.3f}")
+        else:
+            report['passed'] = True
+        return report
+
+
+class ModelRegistry:
+    """The current models, loaded lazily and replaced atomically on reload."""
+
+    def __init__(self, load: Callable[[], Optional[Dict[str, Any]]], watch_paths: Iterable[str] = (),
+                 validate: Optional[Callable[[Dict[str, Any], Optional[Dict[str, Any]]], Dict[str, Any]]] = None,
+                 watch_interval: float = 10.0):
+        self._load = load
+        self.watch_paths = list(watch_paths)
+        self._validate = validate
+        self.watch_interval = watch_interval
+
+        self._models = None
+        self._loaded = False
+        self._load_lock = threading.Lock()
+        self._loaded_signature = None
+        self._pending_signature = None
+
+        self.loaded_at = None
+        self.reloads = 0
+        self.swaps = 0
+        self.rejections = 0
+        self.last_result = None
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def signature(self):
+        """Modification time and size of every watched file that exists."""
+        signature = []
+        for path in self.watch_paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def get(self) -> Optional[Dict[str, Any]]:
+        """The current models, loading them on first use."""
+        if not self._loaded:
+            with self._load_lock:
+                if not self._loaded:
+                    self._models = self._load()
+                    self._loaded_signature = self.signature()
+                    self.loaded_at = time.time()
+                    self._loaded = True
+        return self._models
+
+    @property
+    def version(self) -> Optional[str]:
+        return model_version(self._models)
+
+    def reload(self) -> Dict[str, Any]:
+        """Load, validate and swap in the models on disk.
+
+        Returns a result whose ``status`` is ``swapped``, ``unchanged`` (same
+        version as the current models), ``rejected`` (failed validation) or
+        ``error`` (could not be loaded). Only one reload runs at a time.
+        """
+        with self._load_lock:
+            self.reloads += 1
+            current = self._models
+            result = {'previous_version': model_version(current), 'started_at': time.time()}
+            try:
+                candidate = self._load()
+                if candidate is None:
+                    raise FileNotFoundError("No model files found")
+            except Exception as e:
+                result.update(status='error', error=str(e))
+            else:
+                result['version'] = model_version(candidate)
+                if current is not None and result['version'] == result['previous_version']:
+                    result['status'] = 'unchanged'
+                else:
+                    report = self._validate(candidate, current) if self._validate else {'passed': True}
+                    result['validation'] = report
+                    if report['passed']:
+                        # Single reference assignment; readers see either dict, never a mix
+                        self._models = candidate
+                        self._loaded = True
+                        self.loaded_at = time.time()
+                        self.swaps += 1
+                        result['status'] = 'swapped'
+                    else:
+                        self.rejections += 1
+                        result['status'] = 'rejected'
+
+            # Remember these files either way, so the watcher does not retry a rejected model
+            self._loaded_signature = self.signature()
+            result['finished_at'] = time.time()
+            self.last_result = result
+            print(f"Model reload {result['status']}: {result.get('previous_version')} -> "
+                  f"{result.get('version')} {result.get('error') or result.get('validation', {}).get('reason', '')}")
+            return result
+
+    def reload_in_background(self) -> bool:
+        """Start a reload on a new thread; False if one is already running."""
+        if self._load_lock.locked():
+            return False
+        threading.Thread(target=self.reload, name='model-reload', daemon=True).start()
+        return True
+
+    def check_for_changes(self) -> Optional[Dict[str, Any]]:
+        """Reload if the watched files changed and were unchanged since the last check."""
+        signature = self.signature()
+        if signature == self._loaded_signature:
+            self._pending_signature = None
+            return None
+        if signature != self._pending_signature:
+            # Files may still be being written; wait for them to settle
+            self._pending_signature = signature
+            return None
+        self._pending_signature = None
+        return self.reload()
+
+    def start_watching(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name='model-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _watch(self):
+        while not self._stop.wait(self.watch_interval):
+            try:
+                self.check_for_changes()
+            except Exception as e:
+                print(f"Error checking model files: {e}")
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'version': self.version,
+            'loaded': self._loaded,
+            'loaded_at': self.loaded_at,
+            'reloading': self._load_lock.locked(),
+            'watching': self._thread is not None and self._thread.is_alive(),
+            'reloads': self.reloads,
+            'swaps': self.swaps,
+            'rejections': self.rejections,
+            'last_result': self.last_result,
+        }
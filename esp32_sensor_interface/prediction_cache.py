@@ -0,0 +1,107 @@
+"""Memoization of fertilizer predictions on quantized sensor features.
+
+Sensor readings only change in steps of the sensors' resolution, so most
+predictions repeat. PredictionCache snaps each feature vector to a grid of
+``resolution`` per feature, and caches the model output for that grid point in
+a bounded LRU with a time-to-live. On a miss the model is run on the snapped
+features, so a cached value depends only on its key.
+
+The cache remembers which model object produced its entries and empties
+itself the first time it is asked about a different one, so reloading the
+model invalidates it without any explicit call.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class PredictionCache:
+    """Bounded LRU + TTL cache keyed on quantized feature vectors."""
+
+    def __init__(self, resolution: Sequence[float], max_entries: int = 4096, ttl: Optional[float] = 3600.0):
+        self.resolution = np.asarray(resolution, dtype=np.float64)
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[Tuple[int, ...], Tuple[Any, float]]' = OrderedDict()
+        self._model = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def quantize(self, features) -> Tuple[int, ...]:
+        """Grid coordinates of a feature vector."""
+        steps = np.rint(np.asarray(features, dtype=np.float64) / self.resolution)
+        return tuple(int(step) for step in steps)
+
+    def snap(self, key: Tuple[int, ...]) -> np.ndarray:
+        """Feature values at the grid point ``key``."""
+        return np.asarray(key, dtype=np.float64) * self.resolution
+
+    def _check_model(self, model: Any):
+        if model is not self._model:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._model = model
+
+    def get_or_compute(self, features, model: Any, compute: Callable[[np.ndarray], Any]) -> Any:
+        """Return the cached prediction for ``features``, computing it on a miss.
+
+        ``model`` identifies the model that ``compute`` uses; ``compute`` is
+        called with the snapped feature vector.
+        """
+        key = self.quantize(features)
+        now = time.monotonic()
+        with self._lock:
+            self._check_model(model)
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at >= now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+
+        # Run the model outside the lock so other keys are not blocked
+        value = compute(self.snap(key))
+
+        with self._lock:
+            if model is self._model:
+                expires_at = now + self.ttl if self.ttl is not None else float('inf')
+                self._entries[key] = (value, expires_at)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,608 @@
+"""Append-only, segmented storage for sensor log records.
+
+Records are written as JSON lines to numbered segment files. When the active
+segment grows past ``max_segment_bytes`` it is sealed, a small ``.idx``
+sidecar with its record count and timestamp range is written, and a new
+segment is started. Writes never touch earlier records, so an append costs
+the same regardless of how much history is stored.
+"""
+import datetime
+import hashlib
+import heapq
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.jsonl'
+INDEX_SUFFIX = '.idx'
+IMPORTS_FILE = 'imports.json'
+
+# Older log files used different names for some fields
+LEGACY_FIELD_NAMES = {
+    'phosphorous': 'phosphorus',
+    'recommended_fertilizer': 'fertilizer',
+}
+
+
+def parse_timestamp(value: Any) -> float:
+    """Convert a log timestamp to seconds since the epoch."""
+    if value is None:
+        return time.time()
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip()
+    try:
+        return datetime.datetime.strptime(text, TIMESTAMP_FORMAT).timestamp()
+    except ValueError:
+        pass
+    # ThingSpeak uses ISO 8601 with a trailing "Z"
+    if text.endswith('Z'):
+        text = text[:-1] + '+00:00'
+    return datetime.datetime.fromisoformat(text).timestamp()
+
+
+def format_timestamps(epoch_seconds) -> List[str]:
+    """Log timestamps in local time for an array of epoch seconds.
+
+    Uses the UTC offset of the first one for all of them.
+    """
+    if len(epoch_seconds) == 0:
+        return []
+    offset = datetime.datetime.fromtimestamp(epoch_seconds[0]).astimezone().utcoffset().total_seconds()
+    local = (np.asarray(epoch_seconds) + offset).astype('datetime64[s]')
+    return [text.replace('T', ' ') for text in np.datetime_as_string(local, unit='s')]
+
+
+def normalize_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Rename legacy field names to the ones used by receive_data."""
+    normalized = {}
+    for key, value in record.items():
+        normalized[LEGACY_FIELD_NAMES.get(key, key)] = value
+    return normalized
+
+
+def segment_numbers(directory: str) -> List[int]:
+    """Numbers of the segment files in ``directory``, oldest first."""
+    numbers = []
+    for name in os.listdir(directory):
+        if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+            numbers.append(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+    return sorted(numbers)
+
+
+class Segment:
+    """Metadata for one segment file."""
+
+    def __init__(self, number: int, path: str):
+        self.number = number
+        self.path = path
+        self.count = 0
+        self.min_ts = float('inf')
+        self.max_ts = float('-inf')
+        self.size = 0
+
+    def add(self, ts: float, nbytes: int):
+        self.count += 1
+        self.size += nbytes
+        if ts < self.min_ts:
+            self.min_ts = ts
+        if ts > self.max_ts:
+            self.max_ts = ts
+
+    def overlaps(self, start: Optional[float], end: Optional[float]) -> bool:
+        if self.count == 0:
+            return False
+        if start is not None and self.max_ts < start:
+            return False
+        if end is not None and self.min_ts > end:
+            return False
+        return True
+
+    @property
+    def index_path(self) -> str:
+        return self.path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+
+    def write_index(self):
+        with open(self.index_path, 'w') as f:
+            json.dump({'count': self.count, 'min_ts': self.min_ts,
+                       'max_ts': self.max_ts, 'size': self.size}, f)
+
+    def read_index(self) -> bool:
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if index.get('size') != os.path.getsize(self.path):
+            return False
+        self.count = index['count']
+        self.min_ts = index['min_ts']
+        self.max_ts = index['max_ts']
+        self.size = index['size']
+        return True
+
+    def scan(self):
+        """Rebuild the metadata by reading every record in the segment."""
+        self.count = 0
+        self.size = 0
+        self.min_ts = float('inf')
+        self.max_ts = float('-inf')
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # Torn write from a crash; it is truncated on reopen
+                    break
+                record = json.loads(line)
+                self.add(parse_timestamp(record.get('timestamp')), len(line))
+
+
+class SensorLogStore:
+    """Append-only sensor log split into rotating segment files.
+
+    ``fsync_every`` and ``fsync_interval`` control how many records may sit in
+    the OS page cache before they are forced to disk. The most recent
+    ``tail_size`` records are also kept in memory so that queries for recent
+    data never touch the segment files.
+    """
+
+    def __init__(self, directory: str, max_segment_bytes: int = 4 * 1024 * 1024,
+                 fsync_every: int = 64, fsync_interval: float = 1.0, tail_size: int = 1024):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+
+        self._lock = threading.Lock()
+        self._segments: List[Segment] = []
+        self._file = None
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        self._tail: deque = deque(maxlen=tail_size)
+        # Newest timestamp of any record that is no longer in the tail
+        self._evicted_max_ts = float('-inf')
+        self._flusher = None
+        self._closed = False
+
+        os.makedirs(directory, exist_ok=True)
+        self._load_segments()
+
+    # Opening
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{number:08d}{SEGMENT_SUFFIX}")
+
+    def _load_segments(self):
+        numbers = segment_numbers(self.directory)
+        for i, number in enumerate(numbers):
+            segment = Segment(number, self._segment_path(number))
+            is_active = i == len(numbers) - 1
+            if is_active or not segment.read_index():
+                self._repair(segment)
+                segment.scan()
+                if not is_active:
+                    segment.write_index()
+            self._segments.append(segment)
+            if segment.count and not is_active:
+                self._evicted_max_ts = max(self._evicted_max_ts, segment.max_ts)
+
+        # Warm the tail from the active segment so recent queries stay in memory
+        if self._segments:
+            for record in self._read_segment(self._segments[-1]):
+                self._remember(parse_timestamp(record.get('timestamp')), record)
+
+    @staticmethod
+    def _repair(segment: Segment):
+        """Drop a partially written last line left behind by a crash."""
+        with open(segment.path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+    # Writing
+
+    def _open_active(self):
+        if not self._segments or self._segments[-1].size >= self.max_segment_bytes:
+            self._rotate()
+        self._file = open(self._segments[-1].path, 'ab')
+
+    def _rotate(self):
+        if self._file is not None:
+            self._sync()
+            self._file.close()
+            self._file = None
+        if self._segments:
+            self._segments[-1].write_index()
+        number = self._segments[-1].number + 1 if self._segments else 1
+        segment = Segment(number, self._segment_path(number))
+        open(segment.path, 'ab').close()
+        self._segments.append(segment)
+
+    def _sync(self):
+        if self._file is None or self._pending == 0:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def _remember(self, ts: float, record: Dict[str, Any]):
+        if len(self._tail) == self._tail.maxlen:
+            evicted_ts = self._tail[0][0]
+            if evicted_ts > self._evicted_max_ts:
+                self._evicted_max_ts = evicted_ts
+        self._tail.append((ts, record))
+
+    def _write(self, record: Dict[str, Any], ts: Optional[float] = None):
+        if self._closed:
+            raise ValueError("Sensor log store is closed")
+        if self._file is None:
+            self._open_active()
+        elif self._segments[-1].size >= self.max_segment_bytes:
+            self._rotate()
+            self._file = open(self._segments[-1].path, 'ab')
+
+        if ts is None:
+            ts = parse_timestamp(record.get('timestamp'))
+        line = json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n'
+        self._file.write(line)
+        self._segments[-1].add(ts, len(line))
+        self._pending += 1
+        self._remember(ts, record)
+
+    def _maybe_sync(self):
+        if (self._pending >= self.fsync_every
+                or time.monotonic() - self._last_sync >= self.fsync_interval):
+            self._sync()
+
+    def append(self, record: Dict[str, Any]):
+        """Append one record to the log."""
+        with self._lock:
+            self._write(record)
+            self._maybe_sync()
+
+    def append_many(self, records: Iterable[Dict[str, Any]], timestamps: Optional[Iterable[float]] = None) -> int:
+        """Append several records under one lock acquisition and one fsync.
+
+        ``timestamps``, the records' times in epoch seconds, spare parsing
+        their timestamp fields when the caller already has them.
+        """
+        count = 0
+        with self._lock:
+            if timestamps is None:
+                for record in records:
+                    self._write(record)
+                    count += 1
+            else:
+                for record, ts in zip(records, timestamps):
+                    self._write(record, ts)
+                    count += 1
+            self._maybe_sync()
+        return count
+
+    def flush(self):
+        """Force every buffered record to disk."""
+        with self._lock:
+            self._sync()
+
+    def start_background_flush(self):
+        """Flush pending records every ``fsync_interval`` even when idle."""
+        if self._flusher is not None:
+            return
+
+        def run():
+            while not self._closed:
+                time.sleep(self.fsync_interval)
+                with self._lock:
+                    if not self._closed:
+                        self._sync()
+
+        self._flusher = threading.Thread(target=run, name='sensor-log-flush', daemon=True)
+        self._flusher.start()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._sync()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._closed = True
+
+    # Reading
+
+    @staticmethod
+    def _read_segment(segment: Segment) -> Iterator[Dict[str, Any]]:
+        with open(segment.path, 'rb') as f:
+            for line in f:
+                if line.endswith(b'\n'):
+                    yield json.loads(line)
+
+    def iter_records(self, start: Any = None, end: Any = None) -> Iterator[Dict[str, Any]]:
+        """Yield records with ``start <= timestamp <= end`` in append order.
+
+        Segments whose timestamp range does not overlap the query are skipped
+        without being opened.
+        """
+        start_ts = parse_timestamp(start) if start is not None else None
+        end_ts = parse_timestamp(end) if end is not None else None
+
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+            segments = [s for s in self._segments if s.overlaps(start_ts, end_ts)]
+
+        for segment in segments:
+            for record in self._read_segment(segment):
+                ts = parse_timestamp(record.get('timestamp'))
+                if start_ts is not None and ts < start_ts:
+                    continue
+                if end_ts is not None and ts > end_ts:
+                    continue
+                yield record
+
+    def query(self, start: Any = None, end: Any = None,
+              limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Return records in a time range, oldest first.
+
+        With ``limit`` only the newest ``limit`` matches are returned. Ranges
+        that start after every record outside the tail are answered from
+        memory.
+        """
+        start_ts = parse_timestamp(start) if start is not None else None
+        end_ts = parse_timestamp(end) if end is not None else None
+
+        with self._lock:
+            if start_ts is not None and start_ts > self._evicted_max_ts:
+                matches = [record for ts, record in self._tail
+                           if ts >= start_ts and (end_ts is None or ts <= end_ts)]
+                return matches[-limit:] if limit else matches
+
+        if limit:
+            matches: deque = deque(maxlen=limit)
+            matches.extend(self.iter_records(start_ts, end_ts))
+            return list(matches)
+        return list(self.iter_records(start_ts, end_ts))
+
+    def tail(self, n: int = 10) -> List[Dict[str, Any]]:
+        """Return the ``n`` most recently appended records."""
+        with self._lock:
+            return [record for _, record in list(self._tail)[-n:]]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'segments': len(self._segments),
+                'records': sum(s.count for s in self._segments),
+                'bytes': sum(s.size for s in self._segments),
+                'pending_fsync': self._pending,
+            }
+
+    # Importing
+
+    def _imports_path(self) -> str:
+        return os.path.join(self.directory, IMPORTS_FILE)
+
+    def import_json_log(self, path: str) -> int:
+        """Import a legacy ``sensor_log.json`` file.
+
+        Both the JSON array written to ``data/sensor_log.json`` and the JSON
+        lines written to ``logs/sensor_log.json`` are accepted. Progress is
+        remembered per file: a JSON array is imported once per checksum, and a
+        JSON lines file only has the lines appended since the last import read.
+        """
+        with open(path, 'rb') as f:
+            raw = f.read()
+
+        try:
+            with open(self._imports_path(), 'r') as f:
+                imported = json.load(f)
+        except (OSError, ValueError):
+            imported = {}
+        key = os.path.abspath(path)
+        previous = imported.get(key, {})
+
+        if raw.lstrip().startswith(b'['):
+            checksum = hashlib.sha256(raw).hexdigest()
+            if previous.get('sha256') == checksum:
+                return 0
+            records = json.loads(raw)
+            offset = len(raw)
+        else:
+            # Only read past the prefix that was already imported, as long as
+            # that prefix is unchanged
+            offset = previous.get('offset', 0)
+            if hashlib.sha256(raw[:offset]).hexdigest() != previous.get('sha256'):
+                offset = 0
+            new_data = raw[offset:]
+            complete = new_data[:new_data.rfind(b'\n') + 1]
+            records = [json.loads(line) for line in complete.splitlines() if line.strip()]
+            offset += len(complete)
+            checksum = hashlib.sha256(raw[:offset]).hexdigest()
+
+        count = self.append_many(normalize_record(r) for r in records)
+        self.flush()
+
+        imported[key] = {
+            'sha256': checksum,
+            'offset': offset,
+            'records': previous.get('records', 0) + count,
+        }
+        with open(self._imports_path(), 'w') as f:
+            json.dump(imported, f, indent=4)
+        return count
+
+
+# Reading several stores
+
+def store_directories(directory: str) -> List[str]:
+    """``directory`` and every subdirectory holding a store of its own.
+
+    serve.py gives each worker process its own store under the log
+    directory, because a store has a single writer.
+    """
+    directories = [directory]
+    if os.path.isdir(directory):
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if os.path.isdir(path) and segment_numbers(path):
+                directories.append(path)
+    return directories
+
+
+def _iter_directory(directory: str, start_ts: Optional[float],
+                    end_ts: Optional[float]) -> Iterator[Tuple[float, Dict[str, Any]]]:
+    numbers = segment_numbers(directory) if os.path.isdir(directory) else []
+    for i, number in enumerate(numbers):
+        segment = Segment(number, os.path.join(directory, f"{SEGMENT_PREFIX}{number:08d}{SEGMENT_SUFFIX}"))
+        # Sealed segments are skipped by their index; the active one is read
+        if i < len(numbers) - 1 and segment.read_index() and not segment.overlaps(start_ts, end_ts):
+            continue
+        try:
+            records = list(SensorLogStore._read_segment(segment))
+        except FileNotFoundError:
+            continue
+        for record in records:
+            ts = parse_timestamp(record.get('timestamp'))
+            if start_ts is not None and ts < start_ts:
+                continue
+            if end_ts is not None and ts > end_ts:
+                continue
+            yield ts, record
+
+
+def iter_store_records(directories: Iterable[str], start: Any = None,
+                       end: Any = None) -> Iterator[Dict[str, Any]]:
+    """Yield records from several stores, merged into timestamp order.
+
+    Only complete lines of the segment files are read and nothing is
+    repaired, so this is safe while other processes append to the stores.
+    Records still buffered by a writer are not seen until it flushes.
+    A store is in append order, which frames, imports and late POSTs can
+    put out of timestamp order, so each store's matches are sorted (stably,
+    so equal timestamps stay in append order) before they are merged.
+    """
+    start_ts = parse_timestamp(start) if start is not None else None
+    end_ts = parse_timestamp(end) if end is not None else None
+    streams = [sorted(_iter_directory(directory, start_ts, end_ts), key=lambda item: item[0])
+               for directory in directories]
+    for _, record in heapq.merge(*streams, key=lambda item: item[0]):
+        yield record
+
+
+def query_stores(directories: Iterable[str], start: Any = None, end: Any = None,
+                 limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """SensorLogStore.query over several stores, oldest first.
+
+    With ``limit`` only the newest ``limit`` matches by timestamp are
+    returned.
+    """
+    records = iter_store_records(directories, start, end)
+    if limit:
+        return list(deque(records, maxlen=limit))
+    return list(records)
+
+
+class StoreFollower:
+    """Reads what other processes append to several stores, each record once.
+
+    Keeps a segment number and byte offset per store directory and reads
+    only complete lines past it, so, like iter_store_records, it is safe
+    while the writers append. Stores created later (a worker started after
+    this one) are found on the next poll. Directories passed to ``ignore``
+    are skipped from then on; their position is kept.
+    """
+
+    def __init__(self, directory: str, interval: float = 1.0):
+        self.directory = directory
+        self.interval = interval
+        self._positions: Dict[str, Tuple[int, int]] = {}
+        self._ignored = set()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.polls = 0
+        self.records = 0
+
+    def ignore(self, directory: str):
+        """Stop reading ``directory``, e.g. the store this process writes itself."""
+        self._ignored.add(os.path.abspath(directory))
+
+    def _read_new(self, directory: str) -> List[Dict[str, Any]]:
+        number, offset = self._positions.get(directory, (0, 0))
+        records = []
+        for segment_number in segment_numbers(directory):
+            if segment_number < number:
+                continue
+            if segment_number > number:
+                number, offset = segment_number, 0
+            try:
+                with open(os.path.join(directory, f"{SEGMENT_PREFIX}{number:08d}{SEGMENT_SUFFIX}"), 'rb') as f:
+                    f.seek(offset)
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            # A line still being written is read on a later poll
+            complete = data.rfind(b'\n') + 1
+            records.extend(json.loads(line) for line in data[:complete].splitlines())
+            offset += complete
+        self._positions[directory] = (number, offset)
+        return records
+
+    def poll(self) -> List[Dict[str, Any]]:
+        """Records appended since the last poll, each store's in append order."""
+        records = []
+        for directory in store_directories(self.directory):
+            if os.path.abspath(directory) not in self._ignored:
+                records.extend(self._read_new(directory))
+        self.polls += 1
+        self.records += len(records)
+        return records
+
+    def start(self, on_records: Callable[[List[Dict[str, Any]]], Any]):
+        """Poll every ``interval`` seconds on a background thread, passing new records to ``on_records``."""
+        if self._thread is not None:
+            return
+
+        def run():
+            while not self._stop.wait(self.interval):
+                try:
+                    records = self.poll()
+                    if records:
+                        on_records(records)
+                except Exception as e:
+                    print(f"Error following the sensor log stores: {e}")
+
+        self._thread = threading.Thread(target=run, name='sensor-log-follow', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def main():
+    import sys
+
+    if len(sys.argv) < 4 or sys.argv[1] != 'import':
+        print("Usage: python sensor_log.py import <store_dir> <sensor_log.json> [...]")
+        sys.exit(1)
+
+    store = SensorLogStore(sys.argv[2])
+    try:
+        for path in sys.argv[3:]:
+            count = store.import_json_log(path)
+            print(f"Imported {count} records from {path}")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
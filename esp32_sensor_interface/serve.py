@@ -0,0 +1,276 @@
+"""Pre-fork production server for the soil monitoring app in server2.py.
+
+The master process imports server2, loads the model once and binds the
+listening socket, then forks SERVE_WORKERS workers that accept on that
+socket. The workers inherit the loaded model copy-on-write (the bundle's
+arrays are memory-mapped, so they share one copy in the page cache), and
+keep the mutable per-device state in the shared SQLite store of
+shared_state.py, so a reading POSTed to one worker is seen by all of them.
+Each worker appends to its own sensor log store; only worker 0 polls
+ThingSpeak.
+
+Signals to the master:
+    SIGTERM/SIGINT  graceful shutdown: workers stop accepting, finish the
+                    requests in flight and flush the log, and are killed
+                    after SERVE_GRACEFUL_TIMEOUT seconds
+    SIGHUP          reload the model in the master, then replace the
+                    workers one at a time
+Workers that exit are replaced. A worker retires itself after about
+SERVE_MAX_REQUESTS requests or SERVE_MAX_AGE seconds (0 disables either),
+staggered by a random jitter so they do not all restart at once.
+
+Usage (from esp32_sensor_interface):
+    python serve.py [--workers N] [--host HOST] [--port PORT]
+"""
+import argparse
+import gc
+import os
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+
+# Server settings. Workers default to one per CPU core.
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVE_HOST = os.environ.get('SERVE_HOST', '0.0.0.0')
+SERVE_PORT = int(os.environ.get('SERVE_PORT', 5000))
+SERVE_WORKERS = int(os.environ.get('SERVE_WORKERS', os.cpu_count() or 1))
+SERVE_THREADED = os.environ.get('SERVE_THREADED', '1') != '0'
+SERVE_BACKLOG = int(os.environ.get('SERVE_BACKLOG', 1024))
+SERVE_MAX_REQUESTS = int(os.environ.get('SERVE_MAX_REQUESTS', 100000))
+SERVE_MAX_REQUESTS_JITTER = int(os.environ.get('SERVE_MAX_REQUESTS_JITTER', 10000))
+SERVE_MAX_AGE = float(os.environ.get('SERVE_MAX_AGE', 0))
+SERVE_GRACEFUL_TIMEOUT = float(os.environ.get('SERVE_GRACEFUL_TIMEOUT', 30))
+
+# The shared device store must be configured before server2 is imported
+if not os.environ.get('DEVICE_STATE_DB'):
+    os.environ['DEVICE_STATE_DB'] = os.path.join(BASE_DIR, 'data', 'devices.sqlite')
+
+# A worker that exits this soon after starting is assumed to be failing on
+# startup, and is restarted with a delay rather than in a tight loop
+MIN_WORKER_LIFETIME = 2.0
+RESTART_DELAY = 1.0
+
+
+class RequestCounter:
+    """WSGI middleware that asks the worker to retire after ``limit`` requests."""
+
+    def __init__(self, app, limit, on_limit):
+        self.app = app
+        self.limit = limit
+        self.on_limit = on_limit
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.count += 1
+            reached = self.limit and self.count == self.limit
+        if reached:
+            self.on_limit(f'served {self.count} requests')
+        return self.app(environ, start_response)
+
+
+def run_worker(index, host, sock, server2):
+    """Serve requests on ``sock`` until told to stop; never returns."""
+    from werkzeug.serving import make_server
+
+    # Until the server is up, SIGTERM just ends the worker; Ctrl+C reaches
+    # the whole process group, so only the master acts on SIGINT
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
+    random.seed()
+    server2.start_worker(index)
+
+    max_requests = 0
+    if SERVE_MAX_REQUESTS > 0:
+        max_requests = SERVE_MAX_REQUESTS + random.randint(0, SERVE_MAX_REQUESTS_JITTER)
+
+    stopping = threading.Event()
+
+    def stop(reason):
+        if stopping.is_set():
+            return
+        stopping.set()
+        print(f"Worker {index} (pid {os.getpid()}) stopping: {reason}")
+        # Live streams never finish on their own; their clients reconnect
+        # to another worker
+        server2.end_streams()
+        # shutdown() waits for serve_forever to return, so it cannot run on
+        # the thread that is serving
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    app = RequestCounter(server2.app, max_requests, stop)
+    server = make_server(host, 0, app, threaded=SERVE_THREADED, fd=sock.fileno())
+    # server_close() only waits for request threads that are not daemons
+    server.daemon_threads = False
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop('SIGTERM'))
+    if SERVE_MAX_AGE > 0:
+        max_age = SERVE_MAX_AGE * random.uniform(1.0, 1.1)
+        timer = threading.Timer(max_age, stop, [f'older than {max_age:.0f}s'])
+        timer.daemon = True
+        timer.start()
+
+    exit_code = 0
+    try:
+        # Returns once stop() is called, after the requests in flight finish
+        server.serve_forever()
+        server2.stop_worker()
+    except Exception as e:
+        print(f"Worker {index} failed: {e}")
+        exit_code = 1
+    finally:
+        sys.stdout.flush()
+        os._exit(exit_code)
+
+
+class Master:
+    """Forks the workers and keeps one running in each slot."""
+
+    def __init__(self, host, sock, server2, workers):
+        self.host = host
+        self.sock = sock
+        self.server2 = server2
+        self.slots = [None] * workers
+        self.started = [0.0] * workers
+        self.stopping = False
+        self.restart_requested = False
+
+    def spawn(self, index):
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            run_worker(index, self.host, self.sock, self.server2)
+        self.slots[index] = pid
+        self.started[index] = time.monotonic()
+        print(f"Started worker {index} (pid {pid})")
+
+    def reap(self):
+        """Collect exited workers and restart their slots."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid not in self.slots:
+                continue
+            index = self.slots.index(pid)
+            self.slots[index] = None
+            code = os.waitstatus_to_exitcode(status)
+            if self.stopping:
+                continue
+            print(f"Worker {index} (pid {pid}) exited with {code}; restarting")
+            if time.monotonic() - self.started[index] < MIN_WORKER_LIFETIME:
+                time.sleep(RESTART_DELAY)
+            self.spawn(index)
+
+    def wait_for(self, pids, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            alive = [pid for pid in pids if pid in self.slots]
+            if not alive:
+                return
+            self.reap()
+            time.sleep(0.05)
+        for pid in pids:
+            if pid in self.slots:
+                print(f"Worker pid {pid} did not stop in {timeout:.0f}s; killing it")
+                os.kill(pid, signal.SIGKILL)
+
+    def rolling_restart(self):
+        """Reload the model, then replace the workers one at a time."""
+        print("Reloading the model and restarting workers")
+        self.server2.model_registry.reload()
+        for index, pid in enumerate(self.slots):
+            if pid is None:
+                continue
+            # Stop the old worker before starting its replacement, so each
+            # log store keeps a single writer; reap() starts the new one
+            os.kill(pid, signal.SIGTERM)
+            self.wait_for([pid], SERVE_GRACEFUL_TIMEOUT)
+            while self.slots[index] in (None, pid):
+                self.reap()
+                time.sleep(0.05)
+
+    def shutdown(self):
+        self.stopping = True
+        pids = [pid for pid in self.slots if pid is not None]
+        print(f"Stopping {len(pids)} workers")
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        self.wait_for(pids, SERVE_GRACEFUL_TIMEOUT)
+        while any(pid is not None for pid in self.slots):
+            self.reap()
+            time.sleep(0.05)
+
+    def run(self):
+        def request_stop(signum, frame):
+            self.stopping = True
+
+        def request_restart(signum, frame):
+            self.restart_requested = True
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+        signal.signal(signal.SIGHUP, request_restart)
+
+        for index in range(len(self.slots)):
+            self.spawn(index)
+        while not self.stopping:
+            self.reap()
+            if self.restart_requested:
+                self.restart_requested = False
+                self.rolling_restart()
+            time.sleep(0.2)
+        self.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=SERVE_WORKERS)
+    parser.add_argument('--host', default=SERVE_HOST)
+    parser.add_argument('--port', type=int, default=SERVE_PORT)
+    args = parser.parse_args()
+
+    import server2
+
+    os.makedirs(os.path.join(BASE_DIR, 'data'), exist_ok=True)
+    # Each worker loads the history itself (see server2.start_worker)
+    server2.import_legacy_logs()
+
+    # Load the model before forking so every worker shares it, and run one
+    # prediction so lazily built state is created once as well
+    models = server2.get_models()
+    if models is None:
+        print("No model loaded; workers will answer without predictions")
+    else:
+        server2.predict_fertilizer_batch([server2.default_readings()], models)
+    # Workers open their own database connections
+    server2.devices.close()
+    # Keep the garbage collector from touching (and so copying) the pages
+    # of objects created so far
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET6 if ':' in args.host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(SERVE_BACKLOG)
+    sock.set_inheritable(True)
+    print(f"Serving on http://{args.host}:{sock.getsockname()[1]} with {args.workers} workers "
+          f"(model {server2.model_registry.version})")
+
+    Master(args.host, sock, server2, args.workers).run()
+    sock.close()
+    print("Stopped")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,70 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, g, render_template, request, jsonify as flask_jsonify
+import atexit
+import csv
+import io
 import json
 import os
 import datetime
-import joblib
+import subprocess
+import sys
+import threading
+import time
 import numpy as np
-import requests
+
+from device_state import DeviceRegistry
+from fertilizer_allocator import rank_classes
+from frame_protocol import SENSOR_FIELDS as FRAME_FIELDS, FrameError, decode_frames
+from history import HistoryStore
+from ingest_queue import IngestQueue
+from live_stream import ALL_DEVICES, Broadcaster, ChangeFeed, TooManySubscribers
+from metrics import Metrics, SamplingProfiler
+from model_registry import HoldoutValidator, ModelRegistry, model_version
+from prediction_cache import PredictionCache
+from sensor_log import (SensorLogStore, StoreFollower, format_timestamps, iter_store_records, parse_timestamp,
+                        query_stores, store_directories)
+from shared_state import SharedDeviceRegistry
+from thingspeak_poller import ThingSpeakPoller
 
 app = Flask(__name__)
 
+# Latency histograms for each stage of handling a reading, request counters
+# and component statistics, served at /metrics in the Prometheus text format.
+# METRICS_ENABLED=0 turns the timers and counters off. The sampling profiler
+# is started and stopped at runtime through /admin/profiler.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+PROFILER_INTERVAL = float(os.environ.get('PROFILER_INTERVAL', 0.005))
+metrics = Metrics(prefix='soil_')
+metrics.enabled = METRICS_ENABLED
+STAGES = ['fetch', 'encode', 'lookup', 'scale', 'predict', 'persist', 'respond']
+stage_timers = {stage: metrics.histogram('stage_seconds', 'Time spent in each stage of handling a reading',
+                                         stage=stage)
+                for stage in STAGES}
+profiler = SamplingProfiler(interval=PROFILER_INTERVAL)
+atexit.register(profiler.stop, 1.0)
+
+def jsonify(*args, **kwargs):
+    """flask.jsonify, timed as the respond stage."""
+    with stage_timers['respond'].time():
+        return flask_jsonify(*args, **kwargs)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter_ns()
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.get('request_start')
+    if start is not None and metrics.enabled:
+        endpoint = request.endpoint or 'unknown'
+        metrics.histogram('request_seconds', 'Time to handle a request, by endpoint',
+                          endpoint=endpoint).record_ns(time.perf_counter_ns() - start)
+        metrics.inc('requests_total', help='Requests handled, by endpoint and status',
+                    endpoint=endpoint, status=response.status_code)
+    return response
+
+def count_error(where):
+    metrics.inc('errors_total', help='Errors caught on the request path, by where they happened', where=where)
+
 # ThingSpeak API configuration
 # To set up ThingSpeak:
 # 1. Create a free account at https://thingspeak.com
@@ -22,169 +79,764 @@ app = Flask(__name__)
 # 4. Replace the placeholder values below with your actual ThingSpeak credentials
 THINGSPEAK_CHANNEL_ID = "2989083"  # Replace with your ThingSpeak channel ID
 THINGSPEAK_READ_API_KEY = "R6LCX8EH46PUEC5Q"  # Replace with your ThingSpeak Read API Key
-THINGSPEAK_API_ENDPOINT = f"https://api.thingspeak.com/channels/{THINGSPEAK_CHANNEL_ID}/feeds/last.json?api_key={THINGSPEAK_READ_API_KEY}"
+THINGSPEAK_API_ENDPOINT = os.environ.get(
+    'THINGSPEAK_API_ENDPOINT',
+    f"https://api.thingspeak.com/channels/{THINGSPEAK_CHANNEL_ID}/feeds/last.json?api_key={THINGSPEAK_READ_API_KEY}")
+
+# Background polling: seconds between fetches, request timeout, and the
+# longest delay between retries while ThingSpeak is failing
+THINGSPEAK_POLL_INTERVAL = float(os.environ.get('THINGSPEAK_POLL_INTERVAL', 15))
+THINGSPEAK_TIMEOUT = float(os.environ.get('THINGSPEAK_TIMEOUT', 5))
+THINGSPEAK_MAX_BACKOFF = float(os.environ.get('THINGSPEAK_MAX_BACKOFF', 300))
+
+# Model files live in the project's models directory; model_bundle.py sits at
+# the project root next to the training scripts
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODELS_DIR = os.path.join(PROJECT_DIR, 'models')
+sys.path.append(PROJECT_DIR)
+from model_bundle import BUNDLE_FILE, JOBLIB_FILES, load_models as load_model_bundle
+from lookup_table import TABLE_FILE, load_table as load_lookup_table
+from drift import (REFRESH_SKIPPED, DriftDetector, discard_candidate, load_candidate, load_training_stats,
+                   promote_candidate)
+
+# With USE_LOOKUP_TABLE=1, readings on the grid of models/lookup_table.npy
+# (compiled by lookup_table.py for the current model) are predicted by a
+# single table lookup, and only the rest by the forest
+USE_LOOKUP_TABLE = os.environ.get('USE_LOOKUP_TABLE', '0') == '1'
 
 # Load models and encoders
 def load_models():
-    # Get the absolute path to the models directory
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    models_dir = os.path.join(os.path.dirname(current_dir), 'models')
-    
     # Create models directory if it doesn't exist
-    if not os.path.exists(models_dir):
-        os.makedirs(models_dir)
-        print(f"Created models directory at {models_dir}")
+    if not os.path.exists(MODELS_DIR):
+        os.makedirs(MODELS_DIR)
+        print(f"Created models directory at {MODELS_DIR}")
         print("Please run soil_testing_model.py first to train the model.")
         return None
     
     try:
-        models = {
-            'model': joblib.load(os.path.join(models_dir, 'soil_testing_model.joblib')),
-            'scaler': joblib.load(os.path.join(models_dir, 'scaler.joblib')),
-            'soil_encoder': joblib.load(os.path.join(models_dir, 'soil_type_encoder.joblib')),
-            'crop_encoder': joblib.load(os.path.join(models_dir, 'crop_type_encoder.joblib')),
-            'fertilizer_encoder': joblib.load(os.path.join(models_dir, 'fertilizer_encoder.joblib'))
-        }
-        return models
+        models = load_model_bundle(MODELS_DIR)
     except FileNotFoundError as e:
         print(f"Error loading model files: {e}")
         print("Please run soil_testing_model.py first to train the model.")
         return None
+    
+    if USE_LOOKUP_TABLE:
+        models['lookup_table'] = load_lookup_table(MODELS_DIR, models['version'])
+    return models
+
+# Models are loaded on the first prediction rather than at import, so the
+# server starts without reading the model files. A retrained model is picked
+# up without a restart: the watcher (every MODEL_WATCH_INTERVAL seconds, 0 to
+# disable) or POST /admin/reload-model loads it in the background, checks it
+# on the held-out rows saved by training, and swaps it in if it passes.
+# Set ADMIN_TOKEN to require a matching X-Admin-Token header on admin routes.
+MODEL_WATCH_INTERVAL = float(os.environ.get('MODEL_WATCH_INTERVAL', 10))
+MODEL_MIN_ACCURACY = float(os.environ.get('MODEL_MIN_ACCURACY', 0.5))
+MODEL_MAX_ACCURACY_DROP = float(os.environ.get('MODEL_MAX_ACCURACY_DROP', 0.1))
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+holdout_validator = HoldoutValidator(os.path.join(MODELS_DIR, 'holdout.npz'),
+                                     min_accuracy=MODEL_MIN_ACCURACY,
+                                     max_accuracy_drop=MODEL_MAX_ACCURACY_DROP)
+model_registry = ModelRegistry(
+    load_models,
+    watch_paths=[os.path.join(MODELS_DIR, name) for name in [*JOBLIB_FILES.values(), BUNDLE_FILE, TABLE_FILE]],
+    validate=holdout_validator,
+    watch_interval=MODEL_WATCH_INTERVAL or 10.0
+)
+atexit.register(model_registry.stop, 1.0)
+
+# Each request takes the current models once and uses them throughout, so a
+# reload never changes the model in the middle of a request
+def get_models():
+    return model_registry.get()
+
+# Initial readings for a device that has not reported yet
+def default_readings():
+    return {
+        'temperature': 25.0,
+        'humidity': 60.0,
+        'moisture': 35.0,
+        'nitrogen': 20.0,
+        'phosphorus': 15.0,
+        'potassium': 25.0,
+        'soil_type': 1,  # Default to Loamy
+        'crop_type': 0,  # Default to Maize
+        'recommended_fertilizer': 'No recommendation yet',
+        'timestamp': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
 
-# Initialize models
-models = load_models()
-
-# Initialize latest readings
-latest_readings = {
-    'temperature': 25.0,
-    'humidity': 60.0,
-    'moisture': 35.0,
-    'nitrogen': 20.0,
-    'phosphorus': 15.0,
-    'potassium': 25.0,
-    'soil_type': 1,  # Default to Loamy
-    'crop_type': 0,  # Default to Maize
-    'recommended_fertilizer': 'No recommendation yet',
-    'timestamp': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-}
-
-# Function to fetch data from ThingSpeak API
+# Per-device readings and fertilizer assignments, keyed by device/channel ID.
+# The ThingSpeak channel is the default device and is never evicted; other
+# devices are evicted least-recently-used first once their shard of the
+# registry holds its share of MAX_DEVICES (MAX_DEVICES / 64 in memory), or
+# after DEVICE_IDLE_TIMEOUT seconds without traffic. With DEVICE_STATE_DB
+# set (serve.py sets it) they are kept in that SQLite file instead of in
+# memory, so every worker process shares them.
+DEFAULT_DEVICE_ID = THINGSPEAK_CHANNEL_ID
+MAX_DEVICES = int(os.environ.get('MAX_DEVICES', 50000))
+DEVICE_IDLE_TIMEOUT = float(os.environ.get('DEVICE_IDLE_TIMEOUT', 7 * 24 * 3600))
+DEVICE_STATE_DB = os.environ.get('DEVICE_STATE_DB')
+if DEVICE_STATE_DB:
+    devices = SharedDeviceRegistry(DEVICE_STATE_DB, default_readings,
+                                   max_devices=MAX_DEVICES, idle_timeout=DEVICE_IDLE_TIMEOUT)
+else:
+    devices = DeviceRegistry(default_readings, max_devices=MAX_DEVICES, idle_timeout=DEVICE_IDLE_TIMEOUT)
+devices.pin(DEFAULT_DEVICE_ID)
+
+def get_device_id():
+    """Device ID from the query string or JSON body, defaulting to the ThingSpeak channel."""
+    device_id = request.args.get('device')
+    if device_id is None and request.is_json:
+        body = request.get_json(silent=True)
+        if isinstance(body, dict):
+            device_id = body.get('device_id')
+    return str(device_id) if device_id not in (None, '') else DEFAULT_DEVICE_ID
+
+# Map ThingSpeak fields to our application's data structure
+def parse_thingspeak_data(thingspeak_data):
+    latest_readings = devices.get(DEFAULT_DEVICE_ID).snapshot()
+    
+    # Field1: Humidity, Field2: Temperature, Field3: Moisture, 
+    # Field4: Nitrogen, Field5: Phosphorus, Field6: Potassium
+    data = {
+        'humidity': float(thingspeak_data.get('field1') or 0) or latest_readings['humidity'],
+        'temperature': float(thingspeak_data.get('field2') or 0) or latest_readings['temperature'],
+        'moisture': float(thingspeak_data.get('field3') or 0) or latest_readings['moisture'],
+        'nitrogen': float(thingspeak_data.get('field4') or 0) or latest_readings['nitrogen'],
+        'phosphorus': float(thingspeak_data.get('field5') or 0) or latest_readings['phosphorus'],
+        'potassium': float(thingspeak_data.get('field6') or 0) or latest_readings['potassium']
+    }
+    
+    # Add timestamp from ThingSpeak
+    data['created_at'] = thingspeak_data.get('created_at', datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    return data
+
+def apply_sensor_data(api_data):
+    """Update the ThingSpeak device's readings and recommendation."""
+    state = devices.get(DEFAULT_DEVICE_ID)
+    with state.lock:
+        state.readings.update(api_data)
+        state.readings['timestamp'] = api_data.get('created_at', datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        record_history(DEFAULT_DEVICE_ID, state.readings)
+        models = get_models()
+        state.readings['recommended_fertilizer'] = predict_fertilizer(state.readings, state.fertilizer_cache, models)
+        state.readings['model_version'] = model_version(models)
+        publish_reading(DEFAULT_DEVICE_ID, state.readings)
+
+def record_fetch(seconds, error):
+    stage_timers['fetch'].observe(seconds)
+    if error is not None:
+        metrics.inc('upstream_failures_total', help='Failed fetches from upstream services',
+                    upstream='thingspeak')
+    if DEVICE_STATE_DB:
+        # Let the workers that do not poll report the poller's freshness
+        devices.put_meta('thingspeak', thingspeak_poller.status())
+
+# Polls ThingSpeak in the background; routes only read its latest snapshot.
+# Set POLL_THINGSPEAK=0 for processes that should not poll (serve.py only
+# polls from its first worker).
+POLL_THINGSPEAK = os.environ.get('POLL_THINGSPEAK', '1') != '0'
+thingspeak_poller = ThingSpeakPoller(
+    THINGSPEAK_API_ENDPOINT,
+    interval=THINGSPEAK_POLL_INTERVAL,
+    timeout=THINGSPEAK_TIMEOUT,
+    max_backoff=THINGSPEAK_MAX_BACKOFF,
+    parse=parse_thingspeak_data,
+    on_update=apply_sensor_data,
+    on_fetch=record_fetch
+)
+atexit.register(thingspeak_poller.stop, 1.0)
+
+# Fetch data from ThingSpeak once, on the calling thread
 def fetch_sensor_data():
+    return thingspeak_poller.poll_once()
+
+def thingspeak_status():
+    """The poller's status, as published by the polling process if it is another one."""
+    if DEVICE_STATE_DB and not POLL_THINGSPEAK:
+        published = devices.get_meta('thingspeak')
+        if published is not None:
+            return {**published, **thingspeak_poller.freshness(published['fetched_at'])}
+    return thingspeak_poller.status()
+
+# Append-only sensor log, split into rotating segment files under data/sensor_log
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LOG_STORE_DIR = os.environ.get('SENSOR_LOG_DIR', os.path.join(BASE_DIR, 'data', 'sensor_log'))
+LEGACY_LOG_FILES = [
+    os.path.join(BASE_DIR, 'data', 'sensor_log.json'),
+    os.path.join(BASE_DIR, 'logs', 'sensor_log.json'),
+]
+log_store = SensorLogStore(LOG_STORE_DIR)
+log_store.start_background_flush()
+atexit.register(log_store.close)
+# Set by start_worker: this process writes its own store under LOG_STORE_DIR,
+# and reads merge the stores of all workers
+log_sharded = False
+
+def import_legacy_logs():
+    """Import the legacy JSON logs into the log store (each file only once)."""
+    for legacy_file in LEGACY_LOG_FILES:
+        if os.path.exists(legacy_file):
+            imported = log_store.import_json_log(legacy_file)
+            if imported:
+                print(f"Imported {imported} records from {legacy_file}")
+
+def history_start():
+    """Oldest timestamp the history's rollups can hold."""
+    return datetime.datetime.now().timestamp() - 366 * 86400
+
+def load_history():
+    """Rebuild the in-memory history from the logged readings it can hold."""
+    loaded = history.load_records(iter_store_records(store_directories(LOG_STORE_DIR), start=history_start()),
+                                  parse_timestamp)
+    print(f"Loaded {loaded} logged readings into the history")
+
+def add_logged_history(records, start=None):
+    """Add records read from the log stores to the history, oldest first."""
+    timed = []
+    for record in records:
+        try:
+            ts = parse_timestamp(record.get('timestamp'))
+        except (TypeError, ValueError):
+            continue
+        if start is None or ts >= start:
+            timed.append((ts, record))
+    timed.sort(key=lambda item: item[0])
+    return history.load_records((record for _, record in timed), parse_timestamp)
+
+# In-memory history per device: the last HISTORY_RAW_SIZE raw readings plus
+# minute (1 day), hour (30 days) and day (1 year) rollups, for up to
+# HISTORY_MAX_DEVICES devices (about 280 KB each)
+HISTORY_MAX_DEVICES = int(os.environ.get('HISTORY_MAX_DEVICES', 1000))
+HISTORY_RAW_SIZE = int(os.environ.get('HISTORY_RAW_SIZE', 360))
+history = HistoryStore(max_devices=HISTORY_MAX_DEVICES, raw_capacity=HISTORY_RAW_SIZE)
+# Under serve.py each worker reads the readings the other workers log from
+# their stores every HISTORY_FOLLOW_INTERVAL seconds (see start_worker)
+HISTORY_FOLLOW_INTERVAL = float(os.environ.get('HISTORY_FOLLOW_INTERVAL', 1.0))
+history_follower = None
+
+def record_history(device_id, readings):
     try:
-        response = requests.get(THINGSPEAK_API_ENDPOINT)
-        if response.status_code == 200:
-            thingspeak_data = response.json()
-            
-            # Map ThingSpeak fields to our application's data structure
-            # Field1: Humidity, Field2: Temperature, Field3: Moisture, 
-            # Field4: Nitrogen, Field5: Phosphorus, Field6: Potassium
-            data = {
-                'humidity': float(thingspeak_data.get('field1', 0)) or latest_readings['humidity'],
-                'temperature': float(thingspeak_data.get('field2', 0)) or latest_readings['temperature'],
-                'moisture': float(thingspeak_data.get('field3', 0)) or latest_readings['moisture'],
-                'nitrogen': float(thingspeak_data.get('field4', 0)) or latest_readings['nitrogen'],
-                'phosphorus': float(thingspeak_data.get('field5', 0)) or latest_readings['phosphorus'],
-                'potassium': float(thingspeak_data.get('field6', 0)) or latest_readings['potassium']
-            }
-            
-            # Add timestamp from ThingSpeak
-            data['created_at'] = thingspeak_data.get('created_at', datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-            
-            print("Successfully fetched data from ThingSpeak")
-            return data
-        else:
-            print(f"Error fetching data from ThingSpeak: {response.status_code}")
-            return None
+        history.record(device_id, parse_timestamp(readings.get('timestamp')), readings)
     except Exception as e:
-        print(f"Exception while fetching data from ThingSpeak: {e}")
+        count_error('history')
+        print(f"Error recording history: {e}")
+
+# Reading fields in the model's feature order (predict.FEATURE_COLUMNS),
+# used when building model input from readings
+FEATURE_FIELDS = ['temperature', 'humidity', 'moisture', 'soil_type', 'crop_type',
+                  'nitrogen', 'potassium', 'phosphorus']
+
+# Memoized predictions: features are snapped to the sensors' resolution
+# (temperature, humidity and moisture in 0.1 steps, the rest in whole units)
+# and the predicted fertilizer is cached per grid point
+PREDICTION_CACHE_RESOLUTION = [float(step) for step in os.environ.get(
+    'PREDICTION_CACHE_RESOLUTION', '0.1,0.1,0.1,1,1,1,1,1').split(',')]
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', 4096))
+PREDICTION_CACHE_TTL = float(os.environ.get('PREDICTION_CACHE_TTL', 3600))
+prediction_cache = PredictionCache(PREDICTION_CACHE_RESOLUTION,
+                                   max_entries=PREDICTION_CACHE_SIZE,
+                                   ttl=PREDICTION_CACHE_TTL)
+
+def build_features(readings):
+    """Build the N x 8 feature matrix for a list of readings."""
+    with stage_timers['encode'].time():
+        rows = [[reading.get(field, 0) if field == 'crop_type' else reading[field]
+                 for field in FEATURE_FIELDS] for reading in readings]
+        return np.array(rows, dtype=np.float64).reshape(-1, len(FEATURE_FIELDS))
+
+def scale_features(features, models):
+    # Same arithmetic as StandardScaler.transform, applied to all rows at once
+    with stage_timers['scale'].time():
+        scaler = models['scaler']
+        return (features - scaler.mean_) / scaler.scale_
+
+def predict_classes(features, models):
+    """Scale a feature matrix and predict one encoded fertilizer per row with the model."""
+    features_scaled = scale_features(features, models)
+    with stage_timers['predict'].time():
+        return models['model'].predict(features_scaled)
+
+def rank_fertilizers(features, models):
+    """Rank the fertilizer classes of every row of a feature matrix, most probable first.
+    
+    One predict_proba call for all rows; the lookup table is not used, since
+    it only stores the most probable class.
+    """
+    features_scaled = scale_features(features, models)
+    with stage_timers['predict'].time():
+        return rank_classes(models['model'].predict_proba(features_scaled))
+
+# Fertilizer name of each predict_proba column, for the current model
+_fertilizer_classes = (None, None)
+
+def fertilizer_classes(models):
+    global _fertilizer_classes
+    model, classes = _fertilizer_classes
+    if model is not models['model']:
+        classes = models['fertilizer_encoder'].inverse_transform(models['model'].classes_)
+        _fertilizer_classes = (models['model'], classes)
+    return classes
+
+def table_columns(features, models):
+    """predict_proba column of the lookup table's class for each row of a feature matrix, -1 off the grid.
+    
+    None when no lookup table is loaded.
+    """
+    table = models.get('lookup_table')
+    if table is None:
         return None
+    with stage_timers['lookup'].time():
+        codes, inside = table.lookup(features)
+        columns = np.searchsorted(models['model'].classes_, codes)
+    columns[~inside] = -1
+    return columns
 
-# Add this after the models initialization and before the predict_fertilizer function
-# Cache to store soil-crop-fertilizer mappings
-fertilizer_cache = {}
+def predict_fertilizer_names(features, models):
+    """Predict one fertilizer name per row of a feature matrix."""
+    table = models.get('lookup_table')
+    if table is not None:
+        # Rows on the table's grid are looked up; the rest go to the model
+        with stage_timers['lookup'].time():
+            codes, inside = table.lookup(features)
+            predictions = codes.astype(np.int64)
+        if not inside.all():
+            predictions[~inside] = predict_classes(features[~inside], models)
+    else:
+        predictions = predict_classes(features, models)
+    return models['fertilizer_encoder'].inverse_transform(predictions)
 
-def predict_fertilizer(data):
-    """Make prediction using the AI model."""
+def predict_fertilizer_batch(readings, models=None):
+    """Predict fertilizers for many readings in one model call.
+    
+    Results are returned in input order. Unlike predict_fertilizer, the
+    per-soil conflict avoidance is not applied, since backfilled readings
+    should not change the assignments shown on the dashboard.
+    """
+    if models is None:
+        models = get_models()
+    if models is None:
+        raise RuntimeError("Model not loaded. Please train the model first.")
+    if not readings:
+        return []
+    return list(predict_fertilizer_names(build_features(readings), models))
+
+def parse_csv_readings(text):
+    """Parse CSV text with a header row of reading field names."""
+    reader = csv.DictReader(io.StringIO(text))
+    readings = []
+    for row in reader:
+        readings.append({key.strip(): float(value) for key, value in row.items()
+                         if key and key.strip() in FEATURE_FIELDS and value not in (None, '')})
+    return readings
+
+def predict_fertilizer(data, fertilizer_cache=None, models=None):
+    """Make prediction using the AI model.
+    
+    fertilizer_cache holds the soil-crop-fertilizer assignments used to avoid
+    conflicts; it defaults to the ThingSpeak device's assignments. models
+    defaults to the registry's current models.
+    """
+    if fertilizer_cache is None:
+        fertilizer_cache = devices.get(DEFAULT_DEVICE_ID).fertilizer_cache
+    if models is None:
+        models = get_models()
     if models is None:
         return "Model not loaded. Please train the model first."
 
     try:
-        # Prepare input data
-        features = np.array([
-            data['temperature'],
-            data['humidity'],
-            data['moisture'],
-            data['soil_type'],
-            data.get('crop_type', 0),
-            data['nitrogen'],
-            data['phosphorus'],
-            data['potassium']
-        ]).reshape(1, -1)
-
-        # Scale features
-        features_scaled = models['scaler'].transform(features)
-
-        # Make prediction
-        prediction = models['model'].predict(features_scaled)[0]
-        fertilizer = models['fertilizer_encoder'].inverse_transform([prediction])[0]
-
-        # Get soil type and crop type
-        soil_type = data['soil_type']
-        crop_type = data.get('crop_type', 0)
-
-        # Check if this soil type has any fertilizer recommendations already
-        if soil_type in fertilizer_cache:
-            existing_fertilizers = set(fertilizer_cache[soil_type].values())
-
-            # If recommended fertilizer is already assigned to another crop on same soil
-            if fertilizer in existing_fertilizers:
-                # Get all possible fertilizers
-                all_fertilizers = set(models['fertilizer_encoder'].classes_)
-
-                # Remove fertilizers already assigned for this soil type
-                alternative_fertilizers = list(all_fertilizers - existing_fertilizers)
-
-                if alternative_fertilizers:
-                    # Pick first available alternative
-                    fertilizer = alternative_fertilizers[0]
-                    print(f"Changed fertilizer recommendation for soil {soil_type}, crop {crop_type} "
-                          f"to avoid conflicts with existing assignments.")
-                else:
-                    print(f"No alternative fertilizer available for soil {soil_type}. Keeping original: {fertilizer}")
-
-        # Store this recommendation in the cache
-        if soil_type not in fertilizer_cache:
-            fertilizer_cache[soil_type] = {}
-        fertilizer_cache[soil_type][crop_type] = fertilizer
-
-        return fertilizer
+        features = build_features([data])[0]
+        table = models.get('lookup_table')
+        if table is not None:
+            # One table read answers the reading unless its class is taken
+            with stage_timers['lookup'].time():
+                code = table.lookup_one(features)
+            if code is not None:
+                column = int(np.searchsorted(models['model'].classes_, code))
+                fertilizer = assign_table_class(column, data, fertilizer_cache, models)
+                if fertilizer is not None:
+                    return fertilizer
+        
+        # Rank the fertilizers for the input, reusing the ranking for
+        # readings that match a previous one at sensor resolution
+        ranking = prediction_cache.get_or_compute(
+            features, models, lambda snapped: rank_fertilizers(snapped.reshape(1, -1), models)[0].tolist())
+        return assign_fertilizer(ranking, data, fertilizer_cache, models)
 
     except Exception as e:
+        count_error('predict')
         print(f"Error in predict_fertilizer: {e}")
         return "Prediction error"
 
+def assign_table_class(column, data, fertilizer_cache, models):
+    """Assign the lookup table's class (a predict_proba column, -1 off the grid) if no other crop on the soil holds it.
+    
+    Returns None when the reading needs the model's ranking instead: the
+    table only stores the most probable class.
+    """
+    if column < 0:
+        return None
+    soil_type = data['soil_type']
+    crop_type = data.get('crop_type', 0)
+    classes = fertilizer_classes(models)
+    if fertilizer_cache.taken(soil_type, classes, crop_type) >> column & 1:
+        return None
+    return fertilizer_cache.assign(soil_type, crop_type, [column], classes)
+
+def assign_fertilizer(ranking, data, fertilizer_cache, models):
+    """Recommend the most probable fertilizer no other crop on the same soil is assigned, and record it.
+    
+    ranking lists the fertilizer classes most probable first (a row of
+    rank_fertilizers); fertilizer_cache is the device's FertilizerAssignments.
+    """
+    soil_type = data['soil_type']
+    crop_type = data.get('crop_type', 0)
+    classes = fertilizer_classes(models)
+    
+    conflict = fertilizer_cache.taken(soil_type, classes, crop_type) >> ranking[0] & 1
+    fertilizer = fertilizer_cache.assign(soil_type, crop_type, ranking, classes)
+    if conflict:
+        if fertilizer != classes[ranking[0]]:
+            print(f"Changed fertilizer recommendation for soil {soil_type}, crop {crop_type} "
+                  f"to avoid conflicts with existing assignments.")
+        else:
+            print(f"No alternative fertilizer available for soil {soil_type}. Keeping original: {fertilizer}")
+    return fertilizer
+
+# Sensor fields a POST to /sensor-data may update
+SENSOR_FIELDS = ['temperature', 'humidity', 'moisture', 'nitrogen', 'phosphorus', 'potassium']
+
+def validate_sensor_data(data):
+    """Return an error message if a POSTed reading is malformed, else None."""
+    if not isinstance(data, dict):
+        return "Expected a JSON object"
+    for field in SENSOR_FIELDS:
+        value = data.get(field)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            return f"Field '{field}' must be a number"
+    return None
+
+def update_readings(readings, data, timestamp=None):
+    """Apply the sensor fields of a POSTed reading to a device's readings."""
+    readings.update({field: data.get(field, readings[field]) for field in SENSOR_FIELDS})
+    readings['timestamp'] = timestamp or datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+def build_log_record(readings, device_id, fertilizer, models, source='Direct POST'):
+    return {
+        'timestamp': readings['timestamp'],
+        'device_id': device_id,
+        'temperature': readings['temperature'],
+        'humidity': readings['humidity'],
+        'moisture': readings['moisture'],
+        'soil_type': readings['soil_type'],
+        'nitrogen': readings['nitrogen'],
+        'phosphorus': readings['phosphorus'],
+        'potassium': readings['potassium'],
+        'crop_type': readings['crop_type'],
+        'fertilizer': fertilizer,
+        'model_version': model_version(models),
+        'source': source
+    }
+
+# Drift detection: every logged reading is compared with the statistics of
+# the training data (models/training_stats.json) in windows of DRIFT_WINDOW
+# readings. When a feature's PSI reaches DRIFT_PSI_THRESHOLD and
+# DRIFT_REFRESH=1, `drift.py refresh` refits the forest in a background
+# process, at most once every DRIFT_REFRESH_COOLDOWN seconds, on
+# DRIFT_REFRESH_DATA: an .npz of readings with confirmed fertilizers (X in
+# model order, and labels). Logged readings are not used: their fertilizers
+# have been changed to avoid conflicts, and labelling them with the model's
+# own prediction would not change its answers, only silence the drift. Without
+# that file drift is only reported. The refreshed model is written to
+# models/candidate/ and only moved over the model files if it passes the
+# holdout check.
+DRIFT_ENABLED = os.environ.get('DRIFT_ENABLED', '1') != '0'
+DRIFT_WINDOW = int(os.environ.get('DRIFT_WINDOW', 5000))
+DRIFT_PSI_THRESHOLD = float(os.environ.get('DRIFT_PSI_THRESHOLD', 0.25))
+DRIFT_REFRESH = os.environ.get('DRIFT_REFRESH', '0') == '1'
+DRIFT_REFRESH_DATA = os.environ.get('DRIFT_REFRESH_DATA')
+DRIFT_REFRESH_COOLDOWN = float(os.environ.get('DRIFT_REFRESH_COOLDOWN', 6 * 3600))
+model_refresh = {'running': False, 'started_at': None, 'finished_at': None, 'result': None}
+model_refresh_lock = threading.Lock()
+
+def start_model_refresh(report):
+    """Called by the drift detector when a window of readings has drifted."""
+    print(f"Drift detected in {', '.join(report['drifted_features'])} "
+          f"over the last {report['count']} readings")
+    if not DRIFT_REFRESH:
+        return
+    if not DRIFT_REFRESH_DATA or not os.path.exists(DRIFT_REFRESH_DATA):
+        print("Not refreshing the model: DRIFT_REFRESH_DATA names no file of confirmed labels")
+        return
+    with model_refresh_lock:
+        last = model_refresh['started_at']
+        if model_refresh['running'] or (last is not None and time.time() - last < DRIFT_REFRESH_COOLDOWN):
+            return
+        model_refresh['running'] = True
+        model_refresh['started_at'] = time.time()
+    threading.Thread(target=run_model_refresh, name='model-refresh', daemon=True).start()
+
+def run_model_refresh():
+    """Refit the forest on the confirmed rows in a child process; promote it if it passes the holdout check."""
+    result = {'returncode': None, 'output': None}
+    try:
+        completed = subprocess.run(
+            [sys.executable, os.path.join(PROJECT_DIR, 'drift.py'), 'refresh',
+             '--data', os.path.abspath(DRIFT_REFRESH_DATA), '--models-dir', MODELS_DIR],
+            cwd=PROJECT_DIR, capture_output=True, text=True, timeout=3600)
+        output = (completed.stdout.strip().splitlines() or [completed.stderr.strip()])[-1:]
+        result = {'returncode': completed.returncode, 'output': ' '.join(output)}
+        print(f"Model refresh: {result['output']}")
+        if completed.returncode == 0:
+            report = holdout_validator(load_candidate(MODELS_DIR), get_models())
+            result['validation'] = report
+            if report['passed']:
+                promote_candidate(MODELS_DIR)
+                reference = load_training_stats(MODELS_DIR)
+                if drift_detector is not None and reference is not None:
+                    drift_detector.reference = reference
+                model_registry.reload_in_background()
+            else:
+                discard_candidate(MODELS_DIR)
+                print(f"Refreshed model rejected: {report['reason']}")
+        elif completed.returncode != REFRESH_SKIPPED:
+            count_error('model_refresh')
+    except Exception as e:
+        count_error('model_refresh')
+        result['output'] = str(e)
+        print(f"Error refreshing the model: {e}")
+    finally:
+        with model_refresh_lock:
+            model_refresh.update(running=False, finished_at=time.time(), result=result)
+
+drift_reference = load_training_stats(MODELS_DIR) if DRIFT_ENABLED else None
+drift_detector = None
+if drift_reference is not None:
+    drift_detector = DriftDetector(drift_reference, window=DRIFT_WINDOW,
+                                   psi_threshold=DRIFT_PSI_THRESHOLD, on_drift=start_model_refresh)
+elif DRIFT_ENABLED:
+    print("No training statistics in the models directory; drift detection is off. "
+          "Run `python drift.py stats` to create them.")
+
+def observe_drift(records):
+    if drift_detector is None:
+        return
+    for record in records:
+        try:
+            drift_detector.observe([float(record[field]) for field in FEATURE_FIELDS])
+        except (KeyError, TypeError, ValueError):
+            continue
+
+def save_log_records(records):
+    """Append records to the log store, falling back to logs/sensor_log.json."""
+    observe_drift(records)
+    with stage_timers['persist'].time():
+        try:
+            log_store.append_many(records)
+        except Exception as e:
+            count_error('persist')
+            print(f"Error saving log: {e}")
+            
+            # Also save to logs directory as backup
+            logs_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
+            if not os.path.exists(logs_dir):
+                os.makedirs(logs_dir)
+            
+            with open(os.path.join(logs_dir, 'sensor_log.json'), 'a') as f:
+                for record in records:
+                    json.dump(record, f)
+                    f.write('\n')
+
+def process_ingest_batch(items):
+    """Apply a micro-batch of queued POSTs: one model call, one log write.
+    
+    Readings are applied to each device in arrival order; the conflict
+    avoidance then runs per reading in the same order, as it would inline.
+    """
+    models = get_models()
+    
+    # Apply every reading first, keeping the readings each prediction is for
+    applied = []
+    for device_id, data, received_at in items:
+        state = devices.get(device_id)
+        with state.lock:
+            update_readings(state.readings, data, received_at)
+            applied.append((device_id, state, dict(state.readings)))
+        record_history(device_id, applied[-1][2])
+    
+    if models is not None:
+        features = build_features([readings for _, _, readings in applied])
+        columns = table_columns(features, models)
+        if columns is None:
+            rankings = rank_fertilizers(features, models).tolist()
+        else:
+            # Rows off the grid are ranked up front, rows whose table class
+            # turns out to be taken when they are assigned on demand
+            rankings = [None] * len(applied)
+            off_grid = np.flatnonzero(columns < 0)
+            if len(off_grid):
+                for i, ranking in zip(off_grid.tolist(), rank_fertilizers(features[off_grid], models).tolist()):
+                    rankings[i] = ranking
+    
+    records = []
+    for i, (device_id, state, readings) in enumerate(applied):
+        with state.lock:
+            if models is None:
+                fertilizer = "Model not loaded. Please train the model first."
+            else:
+                fertilizer = None if columns is None else assign_table_class(
+                    int(columns[i]), readings, state.fertilizer_cache, models)
+                if fertilizer is None:
+                    if rankings[i] is None:
+                        rankings[i] = rank_fertilizers(features[i:i + 1], models)[0].tolist()
+                    fertilizer = assign_fertilizer(rankings[i], readings, state.fertilizer_cache, models)
+            state.readings['recommended_fertilizer'] = fertilizer
+            state.readings['model_version'] = model_version(models)
+            publish_reading(device_id, state.readings)
+        records.append(build_log_record(readings, device_id, fertilizer, models))
+    save_log_records(records)
+
+# Binary frames (see frame_protocol.py) from field nodes that upload many
+# readings at once. A request body larger than FRAME_MAX_BYTES gets 413.
+FRAME_MAX_BYTES = int(os.environ.get('FRAME_MAX_BYTES', 1024 * 1024))
+
+def ingest_frame(frame, models):
+    """Predict and log every reading of a decoded frame: one model call, one log write.
+    
+    Only the newest reading updates the device's readings and goes through
+    the conflict avoidance, as a reading POSTed on its own would; the older
+    ones are logged with the model's prediction, like batch predictions.
+    Returns the device's recommendation.
+    """
+    count = len(frame.timestamps)
+    state = devices.get(frame.device_id)
+    with state.lock:
+        soil_type = state.readings['soil_type']
+        crop_type = state.readings.get('crop_type', 0)
+    
+    with stage_timers['encode'].time():
+        features = np.empty((count, len(FEATURE_FIELDS)))
+        for i, field in enumerate(FEATURE_FIELDS):
+            if field == 'soil_type':
+                features[:, i] = soil_type
+            elif field == 'crop_type':
+                features[:, i] = crop_type
+            else:
+                features[:, i] = frame.values[:, FRAME_FIELDS.index(field)]
+    if models is None:
+        fertilizers = ["Model not loaded. Please train the model first."] * count
+    else:
+        # Rows on the lookup table's grid are read from it; the rest are ranked by the model
+        columns = table_columns(features, models)
+        ranked = np.arange(count) if columns is None else np.flatnonzero(columns < 0)
+        newest_ranking = None
+        if len(ranked):
+            rankings = rank_fertilizers(features[ranked], models)
+            if columns is None:
+                columns = rankings[:, 0]
+            else:
+                columns[ranked] = rankings[:, 0]
+            if ranked[-1] == count - 1:
+                newest_ranking = rankings[-1].tolist()
+        fertilizers = list(fertilizer_classes(models)[columns])
+    timestamps = format_timestamps(frame.timestamps)
+    
+    with state.lock:
+        update_readings(state.readings, dict(zip(FRAME_FIELDS, frame.values[-1].tolist())), timestamps[-1])
+        if models is not None:
+            fertilizer = None
+            if newest_ranking is None:
+                fertilizer = assign_table_class(int(columns[-1]), state.readings, state.fertilizer_cache, models)
+                if fertilizer is None:
+                    newest_ranking = rank_fertilizers(features[-1:], models)[0].tolist()
+            if fertilizer is None:
+                fertilizer = assign_fertilizer(newest_ranking, state.readings, state.fertilizer_cache, models)
+            fertilizers[-1] = fertilizer
+        state.readings['recommended_fertilizer'] = fertilizers[-1]
+        state.readings['model_version'] = model_version(models)
+        publish_reading(frame.device_id, state.readings)
+    
+    try:
+        history.record_many(frame.device_id, frame.timestamps, frame.values)
+    except Exception as e:
+        count_error('history')
+        print(f"Error recording history: {e}")
+    
+    base = {'soil_type': soil_type, 'crop_type': crop_type}
+    save_log_records([
+        build_log_record({**base, 'timestamp': timestamp, **dict(zip(FRAME_FIELDS, row))},
+                         frame.device_id, fertilizer, models, source='Binary frame')
+        for timestamp, row, fertilizer in zip(timestamps, frame.values.tolist(), fertilizers)
+    ])
+    return fertilizers[-1]
+
+# Ingest mode for POST /sensor-data: 'sync' predicts and logs on the request
+# thread; 'async' validates, queues and answers 202 at once, and a worker
+# handles queued readings in micro-batches of up to INGEST_BATCH_SIZE,
+# waiting at most INGEST_MAX_LATENCY_MS to fill one. When INGEST_QUEUE_SIZE
+# readings are waiting, new POSTs get 429.
+INGEST_MODE = os.environ.get('INGEST_MODE', 'sync')
+INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', 256))
+INGEST_MAX_LATENCY_MS = float(os.environ.get('INGEST_MAX_LATENCY_MS', 50))
+INGEST_QUEUE_SIZE = int(os.environ.get('INGEST_QUEUE_SIZE', 10000))
+ingest_queue = IngestQueue(process_ingest_batch,
+                           max_batch=INGEST_BATCH_SIZE,
+                           max_latency=INGEST_MAX_LATENCY_MS / 1000,
+                           max_size=INGEST_QUEUE_SIZE)
+atexit.register(ingest_queue.stop, 5.0)
+
+# Live readings pushed to dashboards over GET /stream (server-sent events),
+# instead of each dashboard polling GET /sensor-data. Every new reading is
+# serialized once and fanned out to the device's streams. A stream buffers
+# at most STREAM_BUFFER_SIZE events; a slow client's buffer is coalesced to
+# the newest reading, and a client that takes nothing for
+# STREAM_IDLE_TIMEOUT seconds is dropped. Idle streams get a heartbeat every
+# STREAM_HEARTBEAT seconds. Beyond STREAM_MAX_SUBSCRIBERS open streams new
+# ones get 503. With DEVICE_STATE_DB, each process also polls the shared
+# store every STREAM_STORE_POLL_INTERVAL seconds for readings that other
+# workers received.
+STREAM_BUFFER_SIZE = int(os.environ.get('STREAM_BUFFER_SIZE', 16))
+STREAM_HEARTBEAT = float(os.environ.get('STREAM_HEARTBEAT', 15))
+STREAM_IDLE_TIMEOUT = float(os.environ.get('STREAM_IDLE_TIMEOUT', 60))
+STREAM_MAX_SUBSCRIBERS = int(os.environ.get('STREAM_MAX_SUBSCRIBERS', 10000))
+STREAM_STORE_POLL_INTERVAL = float(os.environ.get('STREAM_STORE_POLL_INTERVAL', 0.5))
+live_stream = Broadcaster(buffer_size=STREAM_BUFFER_SIZE,
+                          heartbeat=STREAM_HEARTBEAT,
+                          idle_timeout=STREAM_IDLE_TIMEOUT,
+                          max_subscribers=STREAM_MAX_SUBSCRIBERS)
+atexit.register(live_stream.stop, 1.0)
+
+def reading_event(device_id, readings):
+    """A stream event, shaped like the GET /sensor-data response."""
+    return {
+        'device_id': device_id,
+        'data': readings,
+        'recommended_fertilizer': readings.get('recommended_fertilizer', 'Unknown'),
+        'model_version': readings.get('model_version'),
+        'timestamp': readings.get('timestamp')
+    }
+
+def publish_reading(device_id, readings):
+    """Push a device's new readings to its open streams, if it has any."""
+    if not live_stream.has_subscribers(device_id):
+        return
+    readings = dict(readings)
+    if store_feed is not None:
+        store_feed.seen(device_id, readings)
+    live_stream.publish(device_id, reading_event(device_id, readings))
+
+store_feed = None
+if DEVICE_STATE_DB:
+    store_feed = ChangeFeed(live_stream, devices.changed_since, reading_event,
+                            interval=STREAM_STORE_POLL_INTERVAL)
+    atexit.register(store_feed.stop, 1.0)
+
 
 @app.route('/')
 def home():
     """Render the web interface."""
-    # Fetch latest data from the API
-    api_data = fetch_sensor_data()
-    
-    if api_data:
-        # Update latest readings with data from API
-        latest_readings.update({
-            'temperature': api_data.get('temperature', latest_readings['temperature']),
-            'humidity': api_data.get('humidity', latest_readings['humidity']),
-            'moisture': api_data.get('moisture', latest_readings['moisture']),
-            'nitrogen': api_data.get('nitrogen', latest_readings['nitrogen']),
-            'phosphorus': api_data.get('phosphorus', latest_readings['phosphorus']),
-            'potassium': api_data.get('potassium', latest_readings['potassium']),
-            'timestamp': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        })
-        
-        # Get fertilizer recommendation based on updated data
-        fertilizer = predict_fertilizer(latest_readings)
-        latest_readings['recommended_fertilizer'] = fertilizer
+    # Readings are kept up to date by the background ThingSpeak poller
+    state = devices.get(get_device_id())
     
     # Define soil types and crop types
     soil_types = [
@@ -210,7 +862,7 @@ def home():
     ]
     
     return render_template('index2.html', 
-                          readings=latest_readings, 
+                          readings=state.snapshot(), 
                           soil_types=soil_types,
                           crop_types=crop_types)
 
@@ -218,100 +870,245 @@ def home():
 def receive_data():
     """Receive and process sensor data."""
     try:
+        device_id = get_device_id()
+        state = devices.get(device_id)
+        
         if request.method == 'GET':
-            # For GET requests, fetch fresh data from ThingSpeak
-            thingspeak_data = fetch_sensor_data()
-            
-            if thingspeak_data:
-                # Update latest readings with ThingSpeak data
-                latest_readings.update(thingspeak_data)
-                timestamp = thingspeak_data.get('created_at', datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-                latest_readings['timestamp'] = timestamp
-                
-                # Get fertilizer recommendation based on updated readings
-                fertilizer = predict_fertilizer(fertilizer = predict_fertilizer(latest_readings)
-)
-                latest_readings['recommended_fertilizer'] = fertilizer
-                
-                return jsonify({
-                    'status': 'success',
-                    'data': latest_readings,
-                    'recommended_fertilizer': fertilizer,
-                    'timestamp': timestamp
-                })
-            else:
-                # If ThingSpeak fetch fails, return cached data with warning
-                fertilizer = latest_readings.get('recommended_fertilizer', 'Unknown')
-                return jsonify({
-                    'status': 'success',
-                    'data': latest_readings,
-                    'recommended_fertilizer': fertilizer,
-                    'timestamp': latest_readings.get('timestamp', datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
-                    'warning': 'Using cached data. Could not fetch new data from ThingSpeak.'
-                })
-        else:  # POST request
-            # For POST requests, use the data sent in the request
-            data = request.json
-            
-            # Update latest readings with POST data
-            latest_readings.update({
-                'temperature': data.get('temperature', latest_readings['temperature']),
-                'humidity': data.get('humidity', latest_readings['humidity']),
-                'moisture': data.get('moisture', latest_readings['moisture']),
-                'nitrogen': data.get('nitrogen', latest_readings['nitrogen']),
-                'phosphorus': data.get('phosphorus', latest_readings['phosphorus']),
-                'potassium': data.get('potassium', latest_readings['potassium']),
-                'timestamp': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            })
+            # For GET requests, serve the device's latest readings from memory
+            latest_readings = state.snapshot()
+            response = {
+                'status': 'success',
+                'device_id': device_id,
+                'data': latest_readings,
+                'recommended_fertilizer': latest_readings.get('recommended_fertilizer', 'Unknown'),
+                'model_version': latest_readings.get('model_version'),
+                'timestamp': latest_readings.get('timestamp', datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            }
+            if device_id == DEFAULT_DEVICE_ID:
+                # The ThingSpeak channel is refreshed by the background poller
+                status = thingspeak_status()
+                response['fetched_at'] = status['fetched_at']
+                response['data_age_seconds'] = status['age_seconds']
+                if status['stale']:
+                    # If ThingSpeak has not been reachable recently, warn that the data is cached
+                    response['warning'] = 'Using cached data. Could not fetch new data from ThingSpeak.'
+            return jsonify(response)
         
-        # Get fertilizer recommendation
-        fertilizer = predict_fertilizer(latest_readings)
-        latest_readings['recommended_fertilizer'] = fertilizer
+        # For POST requests, use the data sent in the request
+        data = request.json
         
-        # Log data to file
-        log_data = {
-            'timestamp': latest_readings['timestamp'],
-            'temperature': latest_readings['temperature'],
-            'humidity': latest_readings['humidity'],
-            'moisture': latest_readings['moisture'],
-            'soil_type': latest_readings['soil_type'],
-            'nitrogen': latest_readings['nitrogen'],
-            'phosphorus': latest_readings['phosphorus'],
-            'potassium': latest_readings['potassium'],
-            'crop_type': latest_readings['crop_type'],
-            'fertilizer': fertilizer,
-            'source': 'API' if 'api_data' in locals() and api_data else 'Direct POST'
-        }
+        if INGEST_MODE == 'async':
+            # Validate and queue; the ingest worker predicts and logs
+            error = validate_sensor_data(data)
+            if error:
+                return jsonify({'status': 'error', 'message': error}), 400
+            received_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            if not ingest_queue.submit((device_id, data, received_at)):
+                response = jsonify({'status': 'error', 'message': 'Ingest queue is full, retry later'})
+                response.headers['Retry-After'] = '1'
+                return response, 429
+            return jsonify({
+                'status': 'accepted',
+                'device_id': device_id,
+                'queued': ingest_queue.depth()
+            }), 202
         
-        # Save to log file
-        log_file = os.path.join('data', 'sensor_log.json')
-        try:
-            if os.path.exists(log_file):
-                with open(log_file, 'r') as f:
-                    logs = json.load(f)
-            else:
-                logs = []
-            
-            logs.append(log_data)
+        models = get_models()
+        
+        with state.lock:
+            latest_readings = state.readings
             
-            with open(log_file, 'w') as f:
-                json.dump(logs, f, indent=4)
-        except Exception as e:
-            print(f"Error saving log: {e}")
+            # Update latest readings with POST data
+            update_readings(latest_readings, data)
+            record_history(device_id, latest_readings)
             
-            # Also save to logs directory as backup
-            logs_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
-            if not os.path.exists(logs_dir):
-                os.makedirs(logs_dir)
+            # Get fertilizer recommendation
+            fertilizer = predict_fertilizer(latest_readings, state.fertilizer_cache, models)
+            latest_readings['recommended_fertilizer'] = fertilizer
+            latest_readings['model_version'] = model_version(models)
+            publish_reading(device_id, latest_readings)
             
-            with open(os.path.join(logs_dir, 'sensor_log.json'), 'a') as f:
-                json.dump(log_data, f)
-                f.write('\n')
+            # Log data to file
+            log_data = build_log_record(latest_readings, device_id, fertilizer, models)
+            latest_readings = dict(latest_readings)
+        
+        # Append to the segmented log store
+        save_log_records([log_data])
         
         return jsonify({
             'status': 'success',
+            'device_id': device_id,
             'data': latest_readings,
-            'recommended_fertilizer': fertilizer
+            'recommended_fertilizer': fertilizer,
+            'model_version': model_version(models)
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+@app.route('/ingest/frames', methods=['POST'])
+def ingest_frames():
+    """Ingest readings sent as binary frames; see frame_protocol.py for the format.
+    
+    Frames are checked before any is applied, so a malformed body changes
+    nothing. The response acknowledges each frame's sequence number.
+    """
+    if request.content_length is not None and request.content_length > FRAME_MAX_BYTES:
+        return jsonify({'status': 'error', 'message': f'Body larger than {FRAME_MAX_BYTES} bytes'}), 413
+    body = request.get_data(cache=False)
+    if len(body) > FRAME_MAX_BYTES:
+        return jsonify({'status': 'error', 'message': f'Body larger than {FRAME_MAX_BYTES} bytes'}), 413
+    try:
+        frames = decode_frames(body)
+    except FrameError as e:
+        count_error('frames')
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    
+    models = get_models()
+    acknowledged = []
+    for frame in frames:
+        if len(frame.timestamps) == 0:
+            recommended = None
+        else:
+            recommended = ingest_frame(frame, models)
+        acknowledged.append({
+            'device_id': frame.device_id,
+            'sequence': frame.sequence,
+            'readings': len(frame.timestamps),
+            'recommended_fertilizer': recommended
+        })
+    readings = sum(len(frame.timestamps) for frame in frames)
+    metrics.inc('frames_total', len(frames), help='Binary frames ingested')
+    metrics.inc('frame_readings_total', readings, help='Readings ingested from binary frames')
+    
+    return jsonify({
+        'status': 'success',
+        'frames': len(frames),
+        'readings': readings,
+        'acknowledged': acknowledged,
+        'model_version': model_version(models)
+    })
+
+@app.route('/stream', methods=['GET'])
+def stream_readings():
+    """Server-sent events with each new reading and recommendation of a device.
+
+    Starts with the device's current readings; ?device=* streams every
+    device, without the initial readings.
+    """
+    device_id = get_device_id()
+    try:
+        subscriber = live_stream.subscribe(device_id)
+    except TooManySubscribers as e:
+        response = jsonify({'status': 'error', 'message': f'Too many live streams ({e}), retry later'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+    initial = None
+    if device_id != ALL_DEVICES:
+        readings = devices.get(device_id).snapshot()
+        if store_feed is not None:
+            store_feed.seen(device_id, readings)
+        initial = reading_event(device_id, readings)
+    # The dispatcher writes to the connection itself when the server lets it
+    body = live_stream.stream(subscriber, initial, sock=request.environ.get('werkzeug.socket'))
+    response = Response(body, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Keep reverse proxies from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    # In case the body is closed without ever being iterated
+    response.call_on_close(lambda: live_stream.unsubscribe(subscriber))
+    return response
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    """Predict fertilizers for many readings sent as JSON or CSV."""
+    try:
+        if request.mimetype == 'text/csv':
+            readings = parse_csv_readings(request.get_data(as_text=True))
+        else:
+            data = request.get_json(force=True)
+            readings = data['readings'] if isinstance(data, dict) else data
+        
+        models = get_models()
+        fertilizers = predict_fertilizer_batch(readings, models)
+        
+        return jsonify({
+            'status': 'success',
+            'count': len(fertilizers),
+            'recommended_fertilizers': fertilizers,
+            'model_version': model_version(models)
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+@app.route('/sensor-log', methods=['GET'])
+def sensor_log():
+    """Return logged readings within an optional time range."""
+    try:
+        start = request.args.get('start')
+        end = request.args.get('end')
+        limit = request.args.get('limit', type=int)
+        # Workers under serve.py and backfill.py write stores of their own
+        directories = store_directories(LOG_STORE_DIR)
+        if log_sharded or len(directories) > 1:
+            log_store.flush()
+            records = query_stores(directories, start, end, limit)
+        else:
+            records = log_store.query(start, end, limit)
+        return jsonify({
+            'status': 'success',
+            'count': len(records),
+            'records': records
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+def parse_time_arg(value, default):
+    """Epoch seconds from a query argument given as a number or a timestamp."""
+    if value in (None, ''):
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return parse_timestamp(value)
+
+@app.route('/history', methods=['GET'])
+def sensor_history():
+    """Readings of a device over a time range, from the in-memory rollups.
+    
+    Query arguments: start and end (epoch seconds or timestamps; default the
+    last 24 hours), resolution (raw, minute, hour, day or auto), fields
+    (comma-separated) and max_points (for auto).
+    """
+    try:
+        device_id = get_device_id()
+        end = parse_time_arg(request.args.get('end'), datetime.datetime.now().timestamp())
+        start = parse_time_arg(request.args.get('start'), end - 86400)
+        fields = request.args.get('fields')
+        result = history.query(device_id, start, end,
+                               resolution=request.args.get('resolution', 'auto'),
+                               fields=fields.split(',') if fields else None,
+                               max_points=request.args.get('max_points', 1000, type=int))
+        if result is None:
+            return jsonify({'status': 'error', 'message': f"No history for device {device_id}"}), 404
+        return jsonify({
+            'status': 'success',
+            'device_id': device_id,
+            'start': start,
+            'end': end,
+            **result
         })
         
     except Exception as e:
@@ -320,20 +1117,74 @@ def receive_data():
             'message': str(e)
         }), 400
 
+@app.route('/devices', methods=['GET'])
+def list_devices():
+    """Report how many devices are tracked and how many were evicted."""
+    return jsonify({
+        'status': 'success',
+        'default_device': DEFAULT_DEVICE_ID,
+        **devices.stats()
+    })
+
+@app.route('/stats/prediction-cache', methods=['GET'])
+def prediction_cache_stats():
+    """Hit, miss and eviction counters of the prediction cache."""
+    return jsonify({
+        'status': 'success',
+        **prediction_cache.stats()
+    })
+
+@app.route('/stats/drift', methods=['GET'])
+def drift_stats():
+    """Drift detector counters, the last window's comparison, and the last model refresh."""
+    if drift_detector is None:
+        return jsonify({'status': 'error', 'message': 'Drift detection is off'}), 404
+    with model_refresh_lock:
+        refresh = dict(model_refresh)
+    return jsonify({
+        'status': 'success',
+        **drift_detector.stats(),
+        'refresh': refresh
+    })
+
+@app.route('/stats/ingest', methods=['GET'])
+def ingest_stats():
+    """Queue depth, batch sizes and rejections of the async ingest pipeline."""
+    return jsonify({
+        'status': 'success',
+        'mode': INGEST_MODE,
+        **ingest_queue.stats()
+    })
+
+@app.route('/stats/stream', methods=['GET'])
+def stream_stats():
+    """Open live streams and their fan-out, coalescing and eviction counters."""
+    return jsonify({
+        'status': 'success',
+        **live_stream.stats()
+    })
+
 @app.route('/update-crop', methods=['POST'])
 def update_crop():
     """Update crop type and get new recommendation."""
     try:
         crop_type = request.json['crop_type']
-        latest_readings['crop_type'] = int(crop_type)
+        state = devices.get(get_device_id())
         
-        # Get fertilizer recommendation with updated crop type
-        fertilizer = predict_fertilizer(latest_readings)
-        latest_readings['recommended_fertilizer'] = fertilizer
+        with state.lock:
+            state.readings['crop_type'] = int(crop_type)
+            
+            # Get fertilizer recommendation with updated crop type
+            models = get_models()
+            fertilizer = predict_fertilizer(state.readings, state.fertilizer_cache, models)
+            state.readings['recommended_fertilizer'] = fertilizer
+            state.readings['model_version'] = model_version(models)
+            publish_reading(state.device_id, state.readings)
         
         return jsonify({
             'status': 'success',
-            'recommended_fertilizer': fertilizer
+            'recommended_fertilizer': fertilizer,
+            'model_version': model_version(models)
         })
         
     except Exception as e:
@@ -347,15 +1198,65 @@ def update_soil():
     """Update soil type and get new recommendation."""
     try:
         soil_type = request.json['soil_type']
-        latest_readings['soil_type'] = int(soil_type)
+        state = devices.get(get_device_id())
+        
+        with state.lock:
+            state.readings['soil_type'] = int(soil_type)
+            
+            # Get fertilizer recommendation with updated soil type
+            models = get_models()
+            fertilizer = predict_fertilizer(state.readings, state.fertilizer_cache, models)
+            state.readings['recommended_fertilizer'] = fertilizer
+            state.readings['model_version'] = model_version(models)
+            publish_reading(state.device_id, state.readings)
+        
+        return jsonify({
+            'status': 'success',
+            'recommended_fertilizer': fertilizer,
+            'model_version': model_version(models)
+        })
         
-        # Get fertilizer recommendation with updated soil type
-        fertilizer = predict_fertilizer(latest_readings)
-        latest_readings['recommended_fertilizer'] = fertilizer
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+@app.route('/assign-field', methods=['POST'])
+def assign_field():
+    """Reassign the fertilizers of every crop of a field on one soil at once.
+    
+    Each crop is predicted with the device's current sensor readings, all in
+    one model call, and the crops pick in order of the model's confidence.
+    """
+    try:
+        soil_type = int(request.json['soil_type'])
+        crop_types = [int(crop_type) for crop_type in request.json['crop_types']]
+        state = devices.get(get_device_id())
+        models = get_models()
+        if models is None:
+            raise RuntimeError("Model not loaded. Please train the model first.")
+        
+        with state.lock:
+            readings = [{**state.readings, 'soil_type': soil_type, 'crop_type': crop_type}
+                        for crop_type in crop_types]
+            proba = models['model'].predict_proba(scale_features(build_features(readings), models))
+            fertilizers = state.fertilizer_cache.assign_field(soil_type, crop_types, proba,
+                                                              fertilizer_classes(models))
+            
+            # The device's own crop follows its new assignment
+            own_crop = state.readings.get('crop_type', 0)
+            if state.readings['soil_type'] == soil_type and own_crop in crop_types:
+                state.readings['recommended_fertilizer'] = fertilizers[crop_types.index(own_crop)]
+                state.readings['model_version'] = model_version(models)
+                publish_reading(state.device_id, state.readings)
         
         return jsonify({
             'status': 'success',
-            'recommended_fertilizer': fertilizer
+            'soil_type': soil_type,
+            'assignments': [{'crop_type': crop_type, 'recommended_fertilizer': fertilizer}
+                            for crop_type, fertilizer in zip(crop_types, fertilizers)],
+            'model_version': model_version(models)
         })
         
     except Exception as e:
@@ -364,9 +1265,204 @@ def update_soil():
             'message': str(e)
         }), 400
 
+def collect_component_metrics():
+    """Counters and gauges kept by the cache, ingest queue, registries and poller."""
+    cache = prediction_cache.stats()
+    ingest = ingest_queue.stats()
+    registry = model_registry.status()
+    poller = thingspeak_status()
+    return [
+        ('prediction_cache_hits_total', 'counter', 'Prediction cache hits', {}, cache['hits']),
+        ('prediction_cache_misses_total', 'counter', 'Prediction cache misses', {}, cache['misses']),
+        ('prediction_cache_evictions_total', 'counter', 'Prediction cache evictions', {}, cache['evictions']),
+        ('prediction_cache_entries', 'gauge', 'Entries in the prediction cache', {}, cache['entries']),
+        ('ingest_accepted_total', 'counter', 'Readings accepted by the ingest queue', {}, ingest['accepted']),
+        ('ingest_rejected_total', 'counter', 'Readings refused because the ingest queue was full', {},
+         ingest['rejected']),
+        ('ingest_processed_total', 'counter', 'Readings processed by the ingest worker', {}, ingest['processed']),
+        ('ingest_batch_errors_total', 'counter', 'Ingest batches that raised', {}, ingest['errors']),
+        ('ingest_queue_depth', 'gauge', 'Readings waiting in the ingest queue', {}, ingest['queued']),
+        ('devices', 'gauge', 'Devices tracked in memory', {}, devices.stats()['devices']),
+        ('history_devices', 'gauge', 'Devices with in-memory history', {}, history.stats()['devices']),
+        ('model_swaps_total', 'counter', 'Models swapped in by reloads', {}, registry['swaps']),
+        ('model_rejections_total', 'counter', 'Reloaded models rejected by validation', {}, registry['rejections']),
+        ('model_info', 'gauge', 'Version of the model in use', {'version': registry['version']}, 1),
+        ('thingspeak_consecutive_failures', 'gauge', 'ThingSpeak fetches failed in a row', {},
+         poller['consecutive_failures']),
+        ('thingspeak_data_age_seconds', 'gauge', 'Age of the latest ThingSpeak reading', {},
+         poller['age_seconds']),
+        *collect_drift_metrics(),
+        *collect_stream_metrics(),
+    ]
+
+def collect_drift_metrics():
+    if drift_detector is None:
+        return []
+    drift = drift_detector.stats()
+    samples = [
+        ('drift_checks_total', 'counter', 'Windows of readings compared with the training data', {},
+         drift['checks']),
+        ('drift_events_total', 'counter', 'Windows in which a feature drifted', {}, drift['drift_events']),
+    ]
+    if drift['last_report'] is not None:
+        for feature, result in drift['last_report']['features'].items():
+            samples.append(('drift_psi', 'gauge', 'PSI of the last window against the training data',
+                            {'feature': feature}, result['psi']))
+    return samples
+
+def collect_stream_metrics():
+    stream = live_stream.stats()
+    return [
+        ('stream_subscribers', 'gauge', 'Open live streams', {}, stream['subscribers']),
+        ('stream_rejected_total', 'counter', 'Live streams refused because too many were open', {},
+         stream['rejected']),
+        ('stream_events_published_total', 'counter', 'Readings published to live streams', {},
+         stream['published']),
+        ('stream_frames_fanned_out_total', 'counter', 'Events queued for live stream clients', {},
+         stream['fanned_out']),
+        ('stream_frames_coalesced_total', 'counter', 'Events replaced by a newer one for slow stream clients',
+         {}, stream['coalesced']),
+        ('stream_frames_dropped_total', 'counter', 'Events dropped from full stream buffers', {},
+         stream['dropped']),
+        ('stream_evictions_total', 'counter', 'Live streams closed for not reading', {}, stream['evicted']),
+    ]
+
+metrics.add_collector(collect_component_metrics)
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """All metrics in the Prometheus text exposition format."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/stats/latency', methods=['GET'])
+def latency_stats():
+    """Latency percentiles of each stage and each endpoint."""
+    return jsonify({
+        'status': 'success',
+        'enabled': metrics.enabled,
+        'stages': metrics.summaries('stage_seconds'),
+        'endpoints': metrics.summaries('request_seconds')
+    })
+
+def admin_authorized():
+    return ADMIN_TOKEN is None or request.headers.get('X-Admin-Token') == ADMIN_TOKEN
+
+@app.route('/admin/model', methods=['GET'])
+def model_status():
+    """Current model version and the outcome of the last reload."""
+    if not admin_authorized():
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
+    return jsonify({
+        'status': 'success',
+        **model_registry.status()
+    })
+
+@app.route('/admin/reload-model', methods=['POST'])
+def reload_model():
+    """Load, validate and swap in the model files on disk.
+    
+    Runs in the background and returns 202 unless ?wait=1 is given, in which
+    case the reload result is returned.
+    """
+    if not admin_authorized():
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
+    
+    if request.args.get('wait') in ('1', 'true'):
+        result = model_registry.reload()
+        code = 200 if result['status'] in ('swapped', 'unchanged') else 409
+        return jsonify({'status': 'success' if code == 200 else 'error', **result}), code
+    
+    started = model_registry.reload_in_background()
+    return jsonify({
+        'status': 'success',
+        'message': 'Reload started' if started else 'A reload is already running',
+        'version': model_registry.version
+    }), 202
+
+@app.route('/admin/profiler', methods=['GET', 'POST'])
+def sampling_profiler():
+    """Start, stop or reset the sampling profiler, or read its stack counts.
+    
+    POST takes ?action=start|stop|reset (and optionally interval=seconds for
+    start). GET returns the most frequent stacks as JSON, or all of them in
+    the folded format flame graph tools read with ?format=folded.
+    """
+    if not admin_authorized():
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 403
+    
+    if request.method == 'POST':
+        action = request.args.get('action')
+        if action == 'start':
+            profiler.start(interval=request.args.get('interval', type=float))
+        elif action == 'stop':
+            profiler.stop(1.0)
+        elif action == 'reset':
+            profiler.reset()
+        else:
+            return jsonify({'status': 'error', 'message': 'action must be start, stop or reset'}), 400
+    
+    if request.args.get('format') == 'folded':
+        return Response(profiler.folded(), mimetype='text/plain')
+    return jsonify({
+        'status': 'success',
+        **profiler.report(top=request.args.get('top', 50, type=int))
+    })
+
 # Removed automatic refresh on every request to make refreshing manual only
 # The refresh now happens only when explicitly requested via the refresh button
 
+@app.before_first_request
+def start_background_tasks():
+    """Start the background threads in the process that serves requests."""
+    if POLL_THINGSPEAK:
+        thingspeak_poller.start()
+    if INGEST_MODE == 'async':
+        ingest_queue.start()
+    if MODEL_WATCH_INTERVAL > 0:
+        model_registry.start_watching()
+    if store_feed is not None:
+        store_feed.start()
+    if history_follower is not None:
+        history_follower.start(add_logged_history)
+
+def start_worker(index):
+    """Set up a pre-fork worker process (see serve.py) after the fork.
+    
+    Each worker appends to its own log store, LOG_STORE_DIR/worker-<index>,
+    since a store has a single writer; only worker 0 polls ThingSpeak. The
+    history is rebuilt from every store, so a replaced worker does not start
+    from an old snapshot, and then kept current from the other workers'
+    stores. /metrics samples get a worker label.
+    """
+    global log_store, log_sharded, POLL_THINGSPEAK, history, history_follower
+    log_store = SensorLogStore(os.path.join(LOG_STORE_DIR, f'worker-{index}'))
+    log_store.start_background_flush()
+    log_sharded = True
+    POLL_THINGSPEAK = index == 0
+    metrics.const_labels['worker'] = index
+    
+    history = HistoryStore(max_devices=HISTORY_MAX_DEVICES, raw_capacity=HISTORY_RAW_SIZE)
+    history_follower = StoreFollower(LOG_STORE_DIR, interval=HISTORY_FOLLOW_INTERVAL)
+    loaded = add_logged_history(history_follower.poll(), start=history_start())
+    # This worker records its own readings as it logs them
+    history_follower.ignore(log_store.directory)
+    print(f"Worker {index} loaded {loaded} logged readings into the history")
+
+def end_streams():
+    """End the open live streams, so a stopping worker's requests can finish."""
+    if store_feed is not None:
+        store_feed.stop(1.0)
+    live_stream.stop(1.0)
+    if history_follower is not None:
+        history_follower.stop(1.0)
+
+def stop_worker(timeout=5.0):
+    """Stop the background threads and flush the log, once requests have finished."""
+    thingspeak_poller.stop(1.0)
+    ingest_queue.stop(timeout)
+    model_registry.stop(1.0)
+    log_store.close()
+
 if __name__ == '__main__':
     # Create templates directory if it doesn't exist
     templates_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
@@ -381,13 +1477,16 @@ if __name__ == '__main__':
     # Create data directory if it doesn't exist
     os.makedirs("data", exist_ok=True)
     
+    import_legacy_logs()
+    load_history()
+    
     # Fetch initial data from ThingSpeak
     print("Attempting to fetch initial data from ThingSpeak...")
     initial_data = fetch_sensor_data()
     if initial_data:
-        latest_readings.update(initial_data)
         print("Initial data loaded successfully from ThingSpeak")
     else:
         print("Could not fetch initial data from ThingSpeak. Using default values.")
-        
+    
+
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,384 @@
+"""Device state shared between the worker processes of serve.py.
+
+SharedDeviceRegistry has the same interface as device_state.DeviceRegistry,
+but keeps each device's readings and fertilizer assignments as a row of a
+SQLite database (in WAL mode, so readers never wait for writers) instead of
+in process memory. Every worker therefore sees the readings and assignments
+written by the others.
+
+``with state.lock:`` takes a per-device lock that holds across threads and
+processes: a byte-range lock on a sidecar ``.lock`` file, striped by device
+ID, plus a thread lock for the same stripe inside the process. Entering the
+lock reloads the row, and leaving it writes the row back in one statement,
+so the read-modify-write of a reading and its recommendation is atomic per
+device while different devices are updated in parallel. The SQLite write
+lock is only held for that final statement, never while a model predicts.
+"""
+import contextlib
+import errno
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional
+
+from fertilizer_allocator import FertilizerAssignments
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (
+    device_id TEXT PRIMARY KEY,
+    readings TEXT NOT NULL,
+    assignments TEXT NOT NULL,
+    pinned INTEGER NOT NULL DEFAULT 0,
+    last_seen REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS devices_last_seen ON devices (last_seen);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# How stale a device's last_seen may get before a read refreshes it; reads
+# within this window do not write to the database
+TOUCH_INTERVAL = 60.0
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, separators=(',', ':'))
+
+
+def _key(value: str) -> Any:
+    """JSON object keys are strings; soil and crop types are ints."""
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def _load_assignments(text: str) -> FertilizerAssignments:
+    return FertilizerAssignments({_key(soil): {_key(crop): fertilizer for crop, fertilizer in crops.items()}
+                                  for soil, crops in json.loads(text).items()})
+
+
+class StripedLock:
+    """Mutual exclusion per stripe, across threads and processes.
+
+    Stripe ``i`` is byte ``i`` of ``path``, locked with ``fcntl.lockf``.
+    POSIX record locks belong to a process, so a thread lock per stripe keeps
+    threads of one process apart as well. The file descriptor and thread
+    locks are created per process, after any fork.
+    """
+
+    def __init__(self, path: str, stripes: int = 1024):
+        self.path = path
+        self.stripes = stripes
+        self._pid = None
+        self._fd = None
+        self._locks: List[threading.Lock] = []
+        self._setup_lock = threading.Lock()
+
+    def _ensure_open(self):
+        if self._pid == os.getpid():
+            return
+        with self._setup_lock:
+            if self._pid != os.getpid():
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                self._locks = [threading.Lock() for _ in range(self.stripes)]
+                self._pid = os.getpid()
+
+    def stripe(self, key: str) -> int:
+        return zlib.crc32(key.encode('utf-8')) % self.stripes
+
+    def acquire(self, stripe: int):
+        self._ensure_open()
+        self._locks[stripe].acquire()
+        try:
+            while True:
+                try:
+                    fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, stripe, os.SEEK_SET)
+                    break
+                except OSError as e:
+                    # The kernel tracks lock owners by process, so threads of
+                    # two processes waiting on each other's stripes look like
+                    # a deadlock even though neither holds two stripes
+                    if e.errno != errno.EDEADLK:
+                        raise
+                    time.sleep(0.001)
+        except BaseException:
+            self._locks[stripe].release()
+            raise
+
+    def release(self, stripe: int):
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, stripe, os.SEEK_SET)
+        self._locks[stripe].release()
+
+
+class _DeviceLock:
+    """Reentrant lock for one SharedDeviceState that loads and saves its row."""
+
+    __slots__ = ('state', 'owner', 'depth')
+
+    def __init__(self, state: 'SharedDeviceState'):
+        self.state = state
+        self.owner = None
+        self.depth = 0
+
+    def __enter__(self):
+        me = threading.get_ident()
+        if self.owner == me:
+            self.depth += 1
+            return self
+        registry = self.state.registry
+        registry._locks.acquire(self.state.stripe)
+        try:
+            registry._load(self.state)
+        except BaseException:
+            registry._locks.release(self.state.stripe)
+            raise
+        self.owner = me
+        self.depth = 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.depth -= 1
+        if self.depth:
+            return False
+        registry = self.state.registry
+        self.owner = None
+        try:
+            # Changes made by a block that raised are not written back
+            if exc_type is None:
+                registry._save(self.state)
+        finally:
+            registry._locks.release(self.state.stripe)
+        return False
+
+
+class SharedDeviceState:
+    """Readings and fertilizer assignments of one device, backed by a database row.
+
+    The attributes hold the row as of the last load; they are reloaded when
+    ``lock`` is entered and written back when it is left.
+    """
+
+    __slots__ = ('registry', 'device_id', 'stripe', 'readings', 'fertilizer_cache', 'lock', 'last_seen')
+
+    def __init__(self, registry: 'SharedDeviceRegistry', device_id: str,
+                 readings: Dict[str, Any], fertilizer_cache: FertilizerAssignments, last_seen: float):
+        self.registry = registry
+        self.device_id = device_id
+        self.stripe = registry._locks.stripe(device_id)
+        self.readings = readings
+        # soil_type -> {crop_type: fertilizer}
+        self.fertilizer_cache = fertilizer_cache
+        self.lock = _DeviceLock(self)
+        self.last_seen = last_seen
+
+    def snapshot(self) -> Dict[str, Any]:
+        """A copy of the latest committed readings that is safe to serialize."""
+        if self.lock.owner == threading.get_ident():
+            return dict(self.readings)
+        row = self.registry._select(self.device_id)
+        return json.loads(row[0]) if row is not None else dict(self.readings)
+
+
+class SharedDeviceRegistry:
+    """DeviceRegistry backed by a SQLite file that several processes can share.
+
+    Unlike DeviceRegistry, ``get`` returns a new state object on each call;
+    the shared row is the state. Evictions (least recently seen first, and
+    after ``idle_timeout`` seconds without traffic) run when a new device is
+    added, and are counted across all processes.
+    """
+
+    def __init__(self, path: str, initial_readings: Callable[[], Dict[str, Any]],
+                 max_devices: int = 50000, idle_timeout: Optional[float] = None, stripes: int = 1024):
+        self.path = path
+        self.initial_readings = initial_readings
+        self.max_devices = max_devices
+        self.idle_timeout = idle_timeout
+        self._locks = StripedLock(path + '.lock', stripes)
+        self._pool: List[sqlite3.Connection] = []
+        self._inherited: List[sqlite3.Connection] = []
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connection() as db:
+            db.executescript(SCHEMA)
+
+    # Connections
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    @contextlib.contextmanager
+    def _connection(self):
+        """Borrow a connection from this process's pool.
+
+        Request threads come and go, so connections are pooled rather than
+        kept per thread. Connections never cross a fork: a child starts with
+        an empty pool. Inherited connections are set aside without closing
+        them, since closing one would drop the child's own locks on the file.
+        """
+        with self._pool_lock:
+            if self._pool_pid != os.getpid():
+                self._inherited.extend(self._pool)
+                self._pool = []
+                self._pool_pid = os.getpid()
+            db = self._pool.pop() if self._pool else None
+        if db is None:
+            db = self._connect()
+        try:
+            yield db
+        finally:
+            with self._pool_lock:
+                if self._pool_pid == os.getpid():
+                    self._pool.append(db)
+
+    def close(self):
+        """Close this process's pooled connections (before forking, say)."""
+        with self._pool_lock:
+            pool, self._pool = self._pool, []
+        for db in pool:
+            db.close()
+
+    # Rows
+
+    def _select(self, device_id: str):
+        with self._connection() as db:
+            return db.execute('SELECT readings, assignments, last_seen FROM devices WHERE device_id = ?',
+                              (device_id,)).fetchone()
+
+    def _insert(self, device_id: str, pinned: bool = False) -> bool:
+        now = time.time()
+        with self._connection() as db:
+            cursor = db.execute(
+                'INSERT OR IGNORE INTO devices (device_id, readings, assignments, pinned, last_seen) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (device_id, _dumps(self.initial_readings()), '{}', int(pinned), now))
+            return cursor.rowcount > 0
+
+    def _load(self, state: SharedDeviceState):
+        row = self._select(state.device_id)
+        if row is None:
+            # Evicted by another process since it was looked up
+            state.readings = self.initial_readings()
+            state.fertilizer_cache = FertilizerAssignments()
+        else:
+            state.readings = json.loads(row[0])
+            state.fertilizer_cache = _load_assignments(row[1])
+
+    def _save(self, state: SharedDeviceState):
+        state.last_seen = time.time()
+        with self._connection() as db:
+            db.execute(
+                'INSERT INTO devices (device_id, readings, assignments, last_seen) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (device_id) DO UPDATE SET readings = excluded.readings, '
+                'assignments = excluded.assignments, last_seen = excluded.last_seen',
+                (state.device_id, _dumps(state.readings), _dumps(state.fertilizer_cache), state.last_seen))
+
+    def _evict(self):
+        now = time.time()
+        evicted = 0
+        with self._connection() as db:
+            if self.idle_timeout is not None:
+                evicted += db.execute('DELETE FROM devices WHERE pinned = 0 AND last_seen < ?',
+                                      (now - self.idle_timeout,)).rowcount
+            excess = db.execute('SELECT COUNT(*) FROM devices').fetchone()[0] - self.max_devices
+            if excess > 0:
+                evicted += db.execute(
+                    'DELETE FROM devices WHERE device_id IN '
+                    '(SELECT device_id FROM devices WHERE pinned = 0 ORDER BY last_seen LIMIT ?)',
+                    (excess,)).rowcount
+            if evicted:
+                db.execute("INSERT INTO meta (key, value) VALUES ('evictions', ?) "
+                           "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + ?",
+                           (evicted, evicted))
+
+    # DeviceRegistry interface
+
+    def get(self, device_id: str) -> SharedDeviceState:
+        """Return the state for ``device_id``, creating it if needed."""
+        device_id = str(device_id)
+        row = self._select(device_id)
+        if row is None:
+            if self._insert(device_id):
+                self._evict()
+            row = self._select(device_id)
+            if row is None:
+                # Evicted straight away (every slot is pinned); serve defaults
+                return SharedDeviceState(self, device_id, self.initial_readings(), FertilizerAssignments(), time.time())
+        readings, assignments, last_seen = row
+        now = time.time()
+        if now - last_seen > TOUCH_INTERVAL:
+            with self._connection() as db:
+                db.execute('UPDATE devices SET last_seen = ? WHERE device_id = ?', (now, device_id))
+            last_seen = now
+        return SharedDeviceState(self, device_id, json.loads(readings), _load_assignments(assignments), last_seen)
+
+    def peek(self, device_id: str) -> Optional[SharedDeviceState]:
+        """Return the state for ``device_id`` without creating or touching it."""
+        device_id = str(device_id)
+        row = self._select(device_id)
+        if row is None:
+            return None
+        return SharedDeviceState(self, device_id, json.loads(row[0]), _load_assignments(row[1]), row[2])
+
+    def pin(self, device_id: str) -> SharedDeviceState:
+        """Create ``device_id`` and exempt it from eviction."""
+        device_id = str(device_id)
+        self._insert(device_id, pinned=True)
+        with self._connection() as db:
+            db.execute('UPDATE devices SET pinned = 1 WHERE device_id = ?', (device_id,))
+        return self.get(device_id)
+
+    def remove(self, device_id: str) -> bool:
+        with self._connection() as db:
+            return db.execute('DELETE FROM devices WHERE device_id = ?', (str(device_id),)).rowcount > 0
+
+    def device_ids(self) -> List[str]:
+        with self._connection() as db:
+            return [row[0] for row in db.execute('SELECT device_id FROM devices')]
+
+    def __len__(self) -> int:
+        with self._connection() as db:
+            return db.execute('SELECT COUNT(*) FROM devices').fetchone()[0]
+
+    @property
+    def evictions(self) -> int:
+        return int(self.get_meta('evictions') or 0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'devices': len(self),
+            'max_devices': self.max_devices,
+            'evictions': self.evictions,
+        }
+
+    def changed_since(self, since: float) -> List[Any]:
+        """(device_id, readings) of the devices written or touched at or after ``since``."""
+        with self._connection() as db:
+            rows = db.execute('SELECT device_id, readings FROM devices WHERE last_seen >= ?', (since,)).fetchall()
+        return [(device_id, json.loads(readings)) for device_id, readings in rows]
+
+    # Small shared values other than device state, such as the ThingSpeak
+    # poller's status that only one worker knows first-hand
+
+    def put_meta(self, key: str, value: Any):
+        with self._connection() as db:
+            db.execute('INSERT INTO meta (key, value) VALUES (?, ?) '
+                       'ON CONFLICT (key) DO UPDATE SET value = excluded.value', (key, _dumps(value)))
+
+    def get_meta(self, key: str) -> Any:
+        with self._connection() as db:
+            row = db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
@@ -0,0 +1,149 @@
+"""Background polling of the ThingSpeak channel feed.
+
+The poller fetches ``feeds/last.json`` on its own thread over a pooled
+``requests.Session`` and keeps the newest parsed reading in memory, so web
+routes only read a snapshot and never wait on ThingSpeak. Failed fetches back
+off exponentially, up to ``max_backoff`` seconds, until the upstream recovers.
+"""
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 2 ** failures is capped here: past about 1024 failures it no longer
+# converts to a float, and any cap beyond max_backoff gives the same delay
+MAX_BACKOFF_EXPONENT = 32
+
+
+class ThingSpeakPoller:
+    """Fetch a ThingSpeak URL every ``interval`` seconds on a daemon thread.
+
+    ``parse`` turns the ThingSpeak JSON into a reading dict and
+    ``on_update`` is called with each new reading, both on the poller thread.
+    ``on_fetch``, if given, is called after every fetch, once ``status()``
+    reflects it, with its duration in seconds and the error message (None on
+    success).
+    """
+
+    def __init__(self, url: str, interval: float = 15.0, timeout: float = 5.0,
+                 max_backoff: float = 300.0, parse: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+                 on_update: Optional[Callable[[Dict[str, Any]], None]] = None, pool_size: int = 4,
+                 on_fetch: Optional[Callable[[float, Optional[str]], None]] = None):
+        self.url = url
+        self.interval = interval
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.parse = parse or (lambda data: data)
+        self.on_update = on_update
+        self.on_fetch = on_fetch
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._lock = threading.Lock()
+        self._latest: Optional[Dict[str, Any]] = None
+        self._fetched_at: Optional[float] = None
+        self._last_error: Optional[str] = None
+        self._failures = 0
+        self._entry_id = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def poll_once(self) -> Optional[Dict[str, Any]]:
+        """Fetch once on the calling thread and return the parsed reading."""
+        start = time.perf_counter()
+        try:
+            response = self.session.get(self.url, timeout=self.timeout)
+            if response.status_code != 200:
+                raise ValueError(f"HTTP {response.status_code}")
+            thingspeak_data = response.json()
+            data = self.parse(thingspeak_data)
+        except Exception as e:
+            with self._lock:
+                self._failures += 1
+                self._last_error = str(e)
+            print(f"Error fetching data from ThingSpeak: {e}")
+            if self.on_fetch is not None:
+                self.on_fetch(time.perf_counter() - start, str(e))
+            return None
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            is_new = thingspeak_data.get('entry_id') != self._entry_id or self._latest is None
+            self._entry_id = thingspeak_data.get('entry_id')
+            self._latest = data
+            self._fetched_at = time.time()
+            self._failures = 0
+            self._last_error = None
+        if self.on_fetch is not None:
+            self.on_fetch(elapsed, None)
+
+        # Only recompute downstream state when ThingSpeak has a new entry
+        if is_new and self.on_update is not None:
+            self.on_update(data)
+        return data
+
+    def next_delay(self) -> float:
+        """Seconds until the next poll, backing off after failures."""
+        with self._lock:
+            failures = self._failures
+        if failures == 0:
+            return self.interval
+        delay = min(self.interval * (2 ** min(failures, MAX_BACKOFF_EXPONENT)), self.max_backoff)
+        # Jitter so many servers do not retry in lockstep
+        return delay * random.uniform(0.8, 1.0)
+
+    def _run(self):
+        while not self._stop.is_set():
+            # An error in on_update or on_fetch must not end polling for good
+            try:
+                self.poll_once()
+                delay = self.next_delay()
+            except Exception as e:
+                print(f"Error in ThingSpeak poller: {e}")
+                delay = self.interval
+            self._stop.wait(delay)
+
+    def start(self):
+        """Start polling on a daemon thread (no-op if already running)."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='thingspeak-poller', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.session.close()
+
+    def latest(self) -> Optional[Dict[str, Any]]:
+        """The newest successfully parsed reading, or None."""
+        with self._lock:
+            return self._latest
+
+    def freshness(self, fetched_at: Optional[float]) -> Dict[str, Any]:
+        """Age and staleness of a snapshot fetched at ``fetched_at``."""
+        age = time.time() - fetched_at if fetched_at is not None else None
+        return {
+            'fetched_at': fetched_at,
+            'age_seconds': age,
+            # Stale once two polls in a row have been missed
+            'stale': age is None or age > 2 * self.interval + self.timeout,
+        }
+
+    def status(self) -> Dict[str, Any]:
+        """Freshness information for the current snapshot."""
+        with self._lock:
+            return {
+                **self.freshness(self._fetched_at),
+                'consecutive_failures': self._failures,
+                'last_error': self._last_error,
+            }
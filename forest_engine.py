@@ -0,0 +1,378 @@
+"""Flattened RandomForest inference without sklearn dispatch.
+
+export_forest() copies every tree of a fitted RandomForestClassifier, plus the
+StandardScaler parameters, into a handful of contiguous NumPy arrays. The
+CompiledForest class walks all trees at once over those arrays. Leaves point
+back to themselves, so every tree can be stepped ``max_depth`` times without
+branching on whether it has already reached a leaf.
+
+Batches of rows take a second route that does not walk the trees at all
+(the bit-vector scheme of QuickScorer, Lucchese et al. 2015). Each tree's
+leaves are numbered left to right, and every split node stores the bitmask
+of the leaves in its left subtree, which a row going right can never reach.
+Per feature, the split nodes are sorted by threshold; a row's value then
+passes a prefix of them, found by one binary search, and the OR of those
+nodes' masks is precomputed per tree for every prefix. A row's exit leaf in
+a tree is the lowest leaf not masked out by any of its features. This costs
+one search per feature plus a few word operations per tree, instead of a
+gather per tree and level. It is used when every tree has at most 64 leaves
+and the prefix tables fit in LEAF_INDEX_MAX_BYTES.
+
+Predictions match ``model.predict(scaler.transform(X))`` exactly: inputs are
+rounded to float32 before the threshold comparisons, as sklearn's trees do,
+and per-tree probabilities are summed in estimator order.
+"""
+import os
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+ENGINE_FILE = 'forest_engine.npz'
+# Largest prefix-OR tables (split nodes plus features, times trees, in
+# words) built for the bit-vector route; bigger forests walk the trees
+LEAF_INDEX_MAX_BYTES = 64 * 1024 * 1024
+# Batches of at least this many rows sum the trees' probabilities one tree
+# at a time rather than in one gather
+TREE_LOOP_MIN_ROWS = 128
+
+
+def flatten_forest(model) -> Dict[str, np.ndarray]:
+    """Concatenate the node arrays of every tree in the forest."""
+    n_classes = len(model.classes_)
+    total_nodes = sum(est.tree_.node_count for est in model.estimators_)
+
+    feature = np.zeros(total_nodes, dtype=np.int64)
+    threshold = np.full(total_nodes, np.inf, dtype=np.float64)
+    children = np.empty((total_nodes, 2), dtype=np.int64)
+    leaf_proba = np.zeros((total_nodes, n_classes), dtype=np.float64)
+    roots = np.empty(len(model.estimators_), dtype=np.int64)
+
+    offset = 0
+    max_depth = 0
+    for i, est in enumerate(model.estimators_):
+        tree = est.tree_
+        n = tree.node_count
+        nodes = np.arange(offset, offset + n)
+        is_leaf = tree.children_left == -1
+
+        roots[i] = offset
+        feature[offset:offset + n] = np.where(is_leaf, 0, tree.feature)
+        threshold[offset:offset + n] = np.where(is_leaf, np.inf, tree.threshold)
+        children[offset:offset + n, 0] = np.where(is_leaf, nodes, tree.children_left + offset)
+        children[offset:offset + n, 1] = np.where(is_leaf, nodes, tree.children_right + offset)
+
+        # Normalise leaf counts the way DecisionTreeClassifier.predict_proba does
+        value = tree.value[:, 0, :]
+        normalizer = value.sum(axis=1)[:, np.newaxis]
+        normalizer[normalizer == 0.0] = 1.0
+        leaf_proba[offset:offset + n] = np.where(is_leaf[:, np.newaxis], value / normalizer, 0.0)
+
+        max_depth = max(max_depth, tree.max_depth)
+        offset += n
+
+    return {
+        'feature': feature,
+        'threshold': threshold,
+        'children': children,
+        'leaf_proba': leaf_proba,
+        'roots': roots,
+        'max_depth': np.array(max_depth, dtype=np.int64),
+        'classes': np.asarray(model.classes_),
+    }
+
+
+def export_forest(model, scaler, path: str, class_names=None) -> Dict[str, np.ndarray]:
+    """Write the flattened forest and scaler parameters to an .npz file."""
+    arrays = flatten_forest(model)
+    arrays['scaler_mean'] = np.asarray(scaler.mean_, dtype=np.float64)
+    arrays['scaler_scale'] = np.asarray(scaler.scale_, dtype=np.float64)
+    if class_names is not None:
+        arrays['class_names'] = np.asarray(class_names, dtype=str)
+    np.savez(path, **arrays)
+    return arrays
+
+
+class CompiledForest:
+    """Vectorized forest evaluator over flattened node arrays.
+
+    predict_one() reuses buffers allocated in the constructor, so it performs
+    no array allocation per call and is not thread-safe; use one instance per
+    thread. predict() and predict_proba() handle batches and allocate per
+    call.
+    """
+
+    def __init__(self, arrays: Dict[str, Any]):
+        self.feature = np.ascontiguousarray(arrays['feature'], dtype=np.int64)
+        self.threshold = np.ascontiguousarray(arrays['threshold'], dtype=np.float64)
+        self.children = np.ascontiguousarray(arrays['children'], dtype=np.int64).reshape(-1)
+        self.leaf_proba = np.ascontiguousarray(arrays['leaf_proba'], dtype=np.float64)
+        self.roots = np.ascontiguousarray(arrays['roots'], dtype=np.int64)
+        self.max_depth = int(arrays['max_depth'])
+        self.classes = np.asarray(arrays['classes'])
+        self.mean = np.ascontiguousarray(arrays['scaler_mean'], dtype=np.float64)
+        self.scale = np.ascontiguousarray(arrays['scaler_scale'], dtype=np.float64)
+        self.class_names = np.asarray(arrays['class_names']) if 'class_names' in arrays else None
+
+        self.n_trees = len(self.roots)
+        self.n_features = len(self.mean)
+        self.n_classes = self.leaf_proba.shape[1]
+
+        # Scratch buffers for predict_one
+        self._x = np.empty(self.n_features, dtype=np.float64)
+        self._x32 = np.empty(self.n_features, dtype=np.float32)
+        self._node = np.empty(self.n_trees, dtype=np.int64)
+        self._index = np.empty(self.n_trees, dtype=np.int64)
+        self._feat = np.empty(self.n_trees, dtype=np.int64)
+        self._value = np.empty(self.n_trees, dtype=np.float64)
+        self._thresh = np.empty(self.n_trees, dtype=np.float64)
+        self._right = np.empty(self.n_trees, dtype=np.bool_)
+        self._proba = np.empty((self.n_trees, self.n_classes), dtype=np.float64)
+        self._total = np.empty(self.n_classes, dtype=np.float64)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: Optional[str] = None) -> 'CompiledForest':
+        with np.load(path, mmap_mode=mmap_mode) as data:
+            return cls({key: data[key] for key in data.files})
+
+    @classmethod
+    def from_model(cls, model, scaler, class_names=None) -> 'CompiledForest':
+        arrays = flatten_forest(model)
+        arrays['scaler_mean'] = scaler.mean_
+        arrays['scaler_scale'] = scaler.scale_
+        if class_names is not None:
+            arrays['class_names'] = np.asarray(class_names, dtype=str)
+        return cls(arrays)
+
+    def predict_proba_one(self, features) -> np.ndarray:
+        """Class probabilities for one unscaled feature vector.
+
+        The returned array is an internal buffer that is overwritten by the
+        next call.
+        """
+        x = self._x
+        np.copyto(x, features)
+        np.subtract(x, self.mean, out=x)
+        np.divide(x, self.scale, out=x)
+        # Trees compare float32 inputs against float64 thresholds
+        np.copyto(self._x32, x, casting='same_kind')
+        np.copyto(x, self._x32)
+
+        node = self._node
+        np.copyto(node, self.roots)
+        for _ in range(self.max_depth):
+            np.take(self.feature, node, out=self._feat)
+            np.take(x, self._feat, out=self._value)
+            np.take(self.threshold, node, out=self._thresh)
+            np.greater(self._value, self._thresh, out=self._right)
+            np.multiply(node, 2, out=self._index)
+            np.add(self._index, self._right, out=self._index)
+            np.take(self.children, self._index, out=node)
+
+        np.take(self.leaf_proba, node, axis=0, out=self._proba)
+        np.sum(self._proba, axis=0, out=self._total)
+        np.divide(self._total, self.n_trees, out=self._total)
+        return self._total
+
+    def predict_one(self, features):
+        """Predicted class label for one unscaled feature vector."""
+        return self.classes[int(np.argmax(self.predict_proba_one(features)))]
+
+    def predict_proba(self, X) -> np.ndarray:
+        """Class probabilities for an N x n_features matrix of unscaled rows."""
+        X = np.asarray(X, dtype=np.float64).reshape(-1, self.n_features)
+        return self.predict_proba_scaled((X - self.mean) / self.scale)
+
+    def _build_leaf_index(self) -> Optional[Dict[str, Any]]:
+        """Masks and prefix tables of the bit-vector route, or None if the forest is too large for it."""
+        n_nodes = len(self.feature)
+        nodes = np.arange(n_nodes)
+        left, right = self.children[0::2], self.children[1::2]
+        is_leaf = left == nodes
+        tree = np.searchsorted(self.roots, nodes, side='right') - 1
+
+        # Nodes by depth, then leaf counts bottom-up and each subtree's first
+        # leaf (in left-to-right order) top-down
+        levels = []
+        frontier = self.roots
+        while frontier.size:
+            frontier = frontier[~is_leaf[frontier]]
+            levels.append(frontier)
+            frontier = np.concatenate([left[frontier], right[frontier]])
+        leaves = is_leaf.astype(np.int64)
+        for level in reversed(levels):
+            leaves[level] = leaves[left[level]] + leaves[right[level]]
+        first = np.zeros(n_nodes, dtype=np.int64)
+        for level in levels:
+            first[left[level]] = first[level]
+            first[right[level]] = first[level] + leaves[left[level]]
+
+        most_leaves = int(leaves[self.roots].max())
+        word = np.uint32 if most_leaves <= 32 else np.uint64
+        bits = np.iinfo(word).bits
+        split = np.flatnonzero(~is_leaf)
+        if most_leaves > 64 or (len(split) + self.n_features) * self.n_trees * bits // 8 > LEAF_INDEX_MAX_BYTES:
+            return None
+
+        leaf_nodes = np.zeros(self.n_trees * bits, dtype=np.int64)
+        leaf = np.flatnonzero(is_leaf)
+        leaf_nodes[tree[leaf] * bits + first[leaf]] = leaf
+        # Leaves of the left subtree, unreachable for a row going right
+        count = leaves[left[split]].astype(np.uint64)
+        masks = (((np.uint64(1) << count) - np.uint64(1)) << first[split].astype(np.uint64)).astype(word)
+
+        thresholds, offsets = [], []
+        table = np.zeros((len(split) + self.n_features, self.n_trees), dtype=word)
+        row = 0
+        for f in range(self.n_features):
+            on_feature = np.flatnonzero(self.feature[split] == f)
+            on_feature = on_feature[np.argsort(self.threshold[split[on_feature]], kind='stable')]
+            thresholds.append(self.threshold[split[on_feature]])
+            offsets.append(row)
+            # Row k holds the masks of the k lowest thresholds, ORed per tree
+            block = table[row:row + len(on_feature) + 1]
+            block[np.arange(1, len(on_feature) + 1), tree[split[on_feature]]] = masks[on_feature]
+            np.bitwise_or.accumulate(block, axis=0, out=block)
+            row += len(on_feature) + 1
+        return {'thresholds': thresholds, 'offsets': offsets, 'table': table, 'leaf_nodes': leaf_nodes,
+                'tree_base': np.arange(self.n_trees) * bits, 'one': word(1)}
+
+    @property
+    def leaf_index(self) -> Optional[Dict[str, Any]]:
+        """The bit-vector route's tables, built on first use."""
+        if not hasattr(self, '_leaf_index'):
+            self._leaf_index = self._build_leaf_index()
+        return self._leaf_index
+
+    def exit_leaves(self, X) -> Optional[np.ndarray]:
+        """apply_scaled() by the bit-vector route, or None if the forest does not support it."""
+        index = self.leaf_index
+        if index is None:
+            return None
+        x = np.asarray(X, dtype=np.float64).reshape(-1, self.n_features)
+        x = x.astype(np.float32).astype(np.float64)
+
+        table = index['table']
+        passed = table[np.searchsorted(index['thresholds'][0], x[:, 0]) + index['offsets'][0]]
+        for f in range(1, self.n_features):
+            passed |= table[np.searchsorted(index['thresholds'][f], x[:, f]) + index['offsets'][f]]
+        reachable = ~passed
+        lowest = reachable & (~reachable + index['one'])
+        # frexp gives 2**k as 0.5 * 2**(k + 1), exactly
+        rank = np.frexp(lowest.astype(np.float64))[1] - 1
+        return index['leaf_nodes'].take(rank + index['tree_base'])
+
+    def apply_scaled(self, X) -> np.ndarray:
+        """Leaf node reached in every tree, N x n_trees, for rows that are already standardized."""
+        x = np.asarray(X, dtype=np.float64).reshape(-1, self.n_features)
+        x = x.astype(np.float32).astype(np.float64)
+
+        n = len(x)
+        rows = np.arange(n)[:, np.newaxis]
+        node = np.broadcast_to(self.roots, (n, self.n_trees)).copy()
+        for _ in range(self.max_depth):
+            go_right = x[rows, self.feature[node]] > self.threshold[node]
+            node = self.children[node * 2 + go_right]
+        return node
+
+    def predict_proba_scaled(self, X) -> np.ndarray:
+        """Class probabilities for rows that are already standardized."""
+        leaves = self.exit_leaves(X)
+        if leaves is None:
+            leaves = self.apply_scaled(X)
+        if len(leaves) >= TREE_LOOP_MIN_ROWS:
+            proba = np.zeros((len(leaves), self.n_classes))
+            for t in range(self.n_trees):
+                proba += self.leaf_proba.take(leaves[:, t], axis=0)
+        else:
+            proba = self.leaf_proba[leaves].sum(axis=1)
+        proba /= self.n_trees
+        return proba
+
+    def predict(self, X) -> np.ndarray:
+        """Predicted class labels for an N x n_features matrix of unscaled rows."""
+        return self.classes.take(np.argmax(self.predict_proba(X), axis=1))
+
+    def predict_scaled(self, X) -> np.ndarray:
+        """Predicted class labels for rows that are already standardized."""
+        return self.classes.take(np.argmax(self.predict_proba_scaled(X), axis=1))
+
+    def predict_names(self, X) -> np.ndarray:
+        """Class names (e.g. fertilizer names) when they were exported."""
+        if self.class_names is None:
+            raise ValueError("Engine was exported without class names")
+        return self.class_names[self.predict(X)]
+
+
+def export_models(models_dir: str = 'models', path: Optional[str] = None) -> str:
+    """Export the saved joblib model and scaler in ``models_dir``."""
+    import joblib
+
+    model = joblib.load(os.path.join(models_dir, 'soil_testing_model.joblib'))
+    scaler = joblib.load(os.path.join(models_dir, 'scaler.joblib'))
+    fertilizer_encoder = joblib.load(os.path.join(models_dir, 'fertilizer_encoder.joblib'))
+
+    path = path or os.path.join(models_dir, ENGINE_FILE)
+    export_forest(model, scaler, path, class_names=fertilizer_encoder.classes_)
+    return path
+
+
+def load_engine(models_dir: str = 'models') -> CompiledForest:
+    """Load the exported engine, exporting it first if it is missing or stale."""
+    path = os.path.join(models_dir, ENGINE_FILE)
+    model_path = os.path.join(models_dir, 'soil_testing_model.joblib')
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(model_path):
+        export_models(models_dir, path)
+    return CompiledForest.load(path)
+
+
+def load_dataset_features(path: str, models_dir: str = 'models') -> np.ndarray:
+    """Encode a dataset CSV into the unscaled feature matrix the model expects.
+
+    Reads the dataset's columnar cache (see dataset_cache.py) under
+    ``models_dir``/cache, so the CSV is only parsed when it changes.
+    """
+    import joblib
+    from dataset_cache import load_dataset
+
+    dataset = load_dataset(path, os.path.join(models_dir, 'cache'))
+    encoders = {
+        'Soil Type': joblib.load(os.path.join(models_dir, 'soil_type_encoder.joblib')),
+        'Crop Type': joblib.load(os.path.join(models_dir, 'crop_type_encoder.joblib')),
+    }
+    columns = [dataset.encode_as(name, encoders[name].classes_) if name in encoders else dataset[name]
+               for name in dataset.column_names if name != 'Fertilizer Name']
+    return np.column_stack(columns).astype(np.float64)
+
+
+def verify(engine: CompiledForest, model, scaler, X: np.ndarray) -> int:
+    """Return the number of rows where the engine and sklearn disagree."""
+    import pandas as pd
+
+    X_scaled = scaler.transform(pd.DataFrame(X, columns=scaler.feature_names_in_)) \
+        if hasattr(scaler, 'feature_names_in_') else scaler.transform(X)
+    expected = model.predict(X_scaled)
+    mismatches = int((engine.predict(X) != expected).sum())
+    mismatches += sum(engine.predict_one(row) != label for row, label in zip(X, expected))
+    return mismatches
+
+
+def main():
+    import joblib
+
+    print("Exporting forest...")
+    path = export_models('models')
+    engine = CompiledForest.load(path)
+    print(f"Saved {engine.n_trees} trees ({len(engine.feature)} nodes) to {path}")
+
+    print("Verifying against the joblib model on dataset/data_core.csv...")
+    model = joblib.load('models/soil_testing_model.joblib')
+    scaler = joblib.load('models/scaler.joblib')
+    X = load_dataset_features('dataset/data_core.csv')
+    mismatches = verify(engine, model, scaler, X)
+    if mismatches:
+        raise SystemExit(f"Engine disagrees with model.predict on {mismatches} predictions")
+    print(f"All {len(X)} rows match model.predict")
+
+
+if __name__ == "__main__":
+    main()
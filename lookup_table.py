@@ -0,0 +1,436 @@
+"""Precomputed fertilizer lookup table over a quantized feature grid.
+
+The sensors report coarse values (whole-unit NPK, one of 5 soil types and 11
+crop types), so once temperature, humidity and moisture are quantized the
+input space is a finite grid. compile_table() evaluates the forest at every
+grid point and stores the predicted class in a uint8 array with one axis per
+feature, saved as .npy so it can be memory-mapped. A lookup rounds each
+feature to the nearest grid point and reads one byte; rows outside the grid
+are predicted by the forest instead.
+
+Grid points are not evaluated one by one. Every tree is walked once over
+boxes of grid indices: a split on feature f at threshold t cuts the box along
+f after the last grid value <= t, so each leaf ends up with the box of grid
+points that reach it. Then, one (soil, crop) slab at a time, the leaves'
+class probabilities are added over their boxes - as integer votes through an
+N-d difference array when every leaf is pure, as the default forest's are,
+or as float sums in tree order otherwise - and the argmax taken, so each cell
+holds exactly what the forest predicts at that grid point. How well the table agrees with the
+forest between grid points depends on the grid's resolution; compile_table()
+measures it and stores the report next to the table.
+"""
+import itertools
+import json
+import os
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from forest_engine import CompiledForest
+
+TABLE_FILE = 'lookup_table.npy'
+META_SUFFIX = '.json'
+FORMAT_VERSION = 1
+
+# Feature order of the model input, as in predict.FEATURE_COLUMNS
+FEATURES = ['Temparature', 'Humidity', 'Moisture', 'Soil Type', 'Crop Type',
+            'Nitrogen', 'Potassium', 'Phosphorous']
+CATEGORICAL = {'Soil Type', 'Crop Type'}
+
+# (start, stop, step) of each continuous feature, in raw sensor units; the
+# categorical features always cover every encoded class. Ranges cover the
+# training data, so only unusual readings fall back to the forest.
+GRIDS = {
+    'coarse': {
+        'Temparature': (20, 38, 3), 'Humidity': (40, 70, 5), 'Moisture': (20, 70, 10),
+        'Nitrogen': (5, 45, 8), 'Potassium': (5, 25, 5), 'Phosphorous': (2, 42, 8),
+    },
+    'medium': {
+        'Temparature': (20, 38, 2), 'Humidity': (40, 70, 5), 'Moisture': (20, 70, 5),
+        'Nitrogen': (5, 45, 4), 'Potassium': (5, 25, 4), 'Phosphorous': (6, 42, 4),
+    },
+    'fine': {
+        'Temparature': (20, 38, 1), 'Humidity': (40, 70, 2), 'Moisture': (20, 70, 2),
+        'Nitrogen': (5, 45, 2), 'Potassium': (5, 25, 2), 'Phosphorous': (6, 42, 2),
+    },
+    # Whole units everywhere: shows what the full sensor resolution would cost
+    'sensor': {
+        'Temparature': (20, 38, 1), 'Humidity': (40, 70, 1), 'Moisture': (20, 70, 1),
+        'Nitrogen': (5, 45, 1), 'Potassium': (5, 25, 1), 'Phosphorous': (5, 42, 1),
+    },
+}
+DEFAULT_GRID = 'medium'
+
+# Tables larger than this are reported but not compiled
+MAX_TABLE_BYTES = 512 * 1024 * 1024
+
+
+def grid_axes(grid: Dict[str, Tuple[float, float, float]], n_soil: int, n_crop: int) -> List[Dict[str, Any]]:
+    """Start, step and size of each axis, in FEATURES order."""
+    axes = []
+    for feature in FEATURES:
+        if feature in CATEGORICAL:
+            size = n_soil if feature == 'Soil Type' else n_crop
+            axes.append({'feature': feature, 'start': 0.0, 'step': 1.0, 'size': size})
+        else:
+            start, stop, step = grid[feature]
+            size = int(np.floor((stop - start) / step + 1e-9)) + 1
+            axes.append({'feature': feature, 'start': float(start), 'step': float(step), 'size': size})
+    return axes
+
+
+def axis_values(axis: Dict[str, Any]) -> np.ndarray:
+    return axis['start'] + axis['step'] * np.arange(axis['size'], dtype=np.float64)
+
+
+def table_bytes(axes: Sequence[Dict[str, Any]]) -> int:
+    return int(np.prod([axis['size'] for axis in axes], dtype=np.int64))
+
+
+class LookupTable:
+    """A compiled table and its grid; ``table`` may be a read-only memmap."""
+
+    def __init__(self, table: np.ndarray, meta: Dict[str, Any], path: Optional[str] = None):
+        self.table = table
+        self.meta = meta
+        self.path = path
+        self.model_version = meta.get('model_version')
+        axes = meta['axes']
+        self.start = np.array([axis['start'] for axis in axes], dtype=np.float64)
+        self.step = np.array([axis['step'] for axis in axes], dtype=np.float64)
+        self.shape = np.array([axis['size'] for axis in axes], dtype=np.int64)
+        self.strides = np.array([int(np.prod(self.shape[i + 1:])) for i in range(len(axes))], dtype=np.int64)
+        self.flat = table.reshape(-1)
+        self._axes = list(zip(self.start.tolist(), self.step.tolist(), self.shape.tolist(), self.strides.tolist()))
+
+    @classmethod
+    def open(cls, path: str) -> 'LookupTable':
+        """Map a table written by save_table()."""
+        with open(path + META_SUFFIX) as f:
+            meta = json.load(f)
+        return cls(np.load(path, mmap_mode='r'), meta, path)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.table.size * self.table.itemsize)
+
+    def indices(self, X) -> Tuple[np.ndarray, np.ndarray]:
+        """Flat table index of the nearest grid point to each row, and whether the row is on the grid."""
+        X = np.asarray(X, dtype=np.float64).reshape(-1, len(self.start))
+        idx = np.rint((X - self.start) / self.step)
+        inside = ((idx >= 0) & (idx < self.shape)).all(axis=1)
+        idx[~inside] = 0
+        return idx.astype(np.int64) @ self.strides, inside
+
+    def lookup(self, X) -> Tuple[np.ndarray, np.ndarray]:
+        """Class of each row and the on-grid mask; rows off the grid get 0."""
+        flat, inside = self.indices(X)
+        return self.flat[flat], inside
+
+    def lookup_one(self, row) -> Optional[int]:
+        """Class of one row, or None when it is off the grid."""
+        offset = 0
+        for x, (start, step, size, stride) in zip(row, self._axes):
+            i = round((x - start) / step)
+            if i < 0 or i >= size:
+                return None
+            offset += i * stride
+        return int(self.flat[offset])
+
+    def predict(self, X, fallback: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+        """Classes of many unscaled rows; ``fallback`` predicts the rows off the grid."""
+        X = np.asarray(X, dtype=np.float64).reshape(-1, len(self.start))
+        codes, inside = self.lookup(X)
+        result = codes.astype(np.int64)
+        if not inside.all():
+            result[~inside] = fallback(X[~inside])
+        return result
+
+
+def _split_points(engine: CompiledForest, values: List[np.ndarray]) -> np.ndarray:
+    """For each node, how many grid values along its feature go to the left child."""
+    split = np.zeros(len(engine.feature), dtype=np.int64)
+    for f, axis in enumerate(values):
+        # The trees compare standardized inputs rounded to float32
+        scaled = ((axis - engine.mean[f]) / engine.scale[f]).astype(np.float32).astype(np.float64)
+        nodes = np.flatnonzero(engine.feature == f)
+        split[nodes] = np.searchsorted(scaled, engine.threshold[nodes], side='right')
+    return split
+
+
+def leaf_boxes(engine: CompiledForest, split: np.ndarray, shape: Sequence[int]):
+    """The box of grid indices reaching each leaf, tree by tree.
+
+    Returns ``(lo, hi, nodes)``: the inclusive lower and exclusive upper index
+    of each box along every axis, and the leaf node it reaches. Leaves no grid
+    point reaches are left out.
+    """
+    children = engine.children
+    los, his, nodes = [], [], []
+    for root in engine.roots:
+        stack = [(int(root), [0] * len(shape), list(shape))]
+        leaves = []
+        while stack:
+            node, lo, hi = stack.pop()
+            left, right = int(children[2 * node]), int(children[2 * node + 1])
+            if left == node:
+                leaves.append((node, lo, hi))
+                continue
+            f, k = int(engine.feature[node]), int(split[node])
+            if k > lo[f]:
+                left_hi = list(hi)
+                left_hi[f] = min(hi[f], k)
+                stack.append((left, lo, left_hi))
+            if k < hi[f]:
+                right_lo = list(lo)
+                right_lo[f] = max(lo[f], k)
+                stack.append((right, right_lo, hi))
+        for node, lo, hi in leaves:
+            nodes.append(node)
+            los.append(lo)
+            his.append(hi)
+    return np.array(los, dtype=np.int64), np.array(his, dtype=np.int64), np.array(nodes, dtype=np.int64)
+
+
+def _slab_votes(lo: np.ndarray, hi: np.ndarray, classes: np.ndarray, free_shape: Sequence[int],
+                n_classes: int) -> np.ndarray:
+    """Votes per class over a slab, from one class per box, with an N-d difference array.
+
+    Each box adds +1 or -1 at its 2**d corners, and cumulative sums along
+    every axis turn the corners back into per-cell counts.
+    """
+    diff = np.zeros([n_classes] + [size + 1 for size in free_shape], dtype=np.int32)
+    for corner in itertools.product((False, True), repeat=len(free_shape)):
+        coords = np.where(corner, hi, lo)
+        np.add.at(diff, (classes, *coords.T), -1 if sum(corner) % 2 else 1)
+    for axis in range(1, len(free_shape) + 1):
+        np.cumsum(diff, axis=axis, out=diff)
+    return diff[(slice(None),) + tuple(slice(0, size) for size in free_shape)]
+
+
+def _slab_proba(engine: CompiledForest, lo: np.ndarray, hi: np.ndarray, nodes: np.ndarray,
+                free_shape: Sequence[int]) -> np.ndarray:
+    """Summed leaf probabilities per class over a slab, added box by box in tree order."""
+    proba = np.zeros([engine.n_classes] + list(free_shape), dtype=np.float64)
+    for box_lo, box_hi, node in zip(lo, hi, nodes):
+        box = tuple(slice(a, b) for a, b in zip(box_lo, box_hi))
+        # Adding 0.0 would not change the sums, so zero classes are skipped
+        for c in np.flatnonzero(engine.leaf_proba[node]):
+            proba[c][box] += engine.leaf_proba[node, c]
+    return proba
+
+
+def compile_table(engine: CompiledForest, axes: List[Dict[str, Any]], out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Predicted class at every grid point, as a uint8 array shaped by ``axes``.
+
+    ``out`` may be a writable memmap of that shape, so large tables are
+    written slab by slab without holding the whole table in memory.
+    """
+    if len(engine.classes) > 256 or engine.classes.min() < 0 or engine.classes.max() > 255:
+        raise ValueError("Lookup tables store classes as uint8")
+    shape = [axis['size'] for axis in axes]
+    if out is None:
+        out = np.empty(shape, dtype=np.uint8)
+    split = _split_points(engine, [axis_values(axis) for axis in axes])
+    lo, hi, nodes = leaf_boxes(engine, split, shape)
+
+    # A forest grown to pure leaves gives each tree one whole vote, so
+    # integer vote counts reproduce the summed probabilities exactly
+    leaf_proba = engine.leaf_proba[nodes]
+    pure = bool(((leaf_proba == 0.0) | (leaf_proba == 1.0)).all())
+    votes = np.argmax(leaf_proba, axis=1)
+
+    slab_axes = [FEATURES.index('Soil Type'), FEATURES.index('Crop Type')]
+    free = [axis for axis in range(len(shape)) if axis not in slab_axes]
+    free_shape = [shape[axis] for axis in free]
+    classes = engine.classes.astype(np.uint8)
+
+    for soil in range(shape[slab_axes[0]]):
+        for crop in range(shape[slab_axes[1]]):
+            boxes = ((lo[:, slab_axes[0]] <= soil) & (soil < hi[:, slab_axes[0]]) &
+                     (lo[:, slab_axes[1]] <= crop) & (crop < hi[:, slab_axes[1]]))
+            if pure:
+                proba = _slab_votes(lo[boxes][:, free], hi[boxes][:, free], votes[boxes],
+                                    free_shape, engine.n_classes)
+            else:
+                proba = _slab_proba(engine, lo[boxes][:, free], hi[boxes][:, free], nodes[boxes], free_shape)
+            index = [slice(None)] * len(shape)
+            index[slab_axes[0]], index[slab_axes[1]] = soil, crop
+            out[tuple(index)] = classes[np.argmax(proba, axis=0)]
+    return out
+
+
+def _temp_path(path: str, suffix: str) -> str:
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=suffix)
+    os.close(fd)
+    os.chmod(tmp_path, 0o644)
+    return tmp_path
+
+
+def write_meta(path: str, meta: Dict[str, Any]):
+    """Write the metadata next to the table, replacing it atomically."""
+    tmp_path = _temp_path(path, '.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, path + META_SUFFIX)
+
+
+def random_inputs(axes: Sequence[Dict[str, Any]], n: int, seed: int = 0) -> np.ndarray:
+    """Readings at sensor resolution spread over the grid's range."""
+    rng = np.random.default_rng(seed)
+    columns = []
+    for axis in axes:
+        low, high = axis['start'], axis['start'] + axis['step'] * (axis['size'] - 1)
+        if axis['feature'] in CATEGORICAL:
+            columns.append(rng.integers(0, axis['size'], n).astype(np.float64))
+        elif axis['feature'] in ('Temparature', 'Humidity', 'Moisture'):
+            columns.append(np.round(rng.uniform(low, high, n), 1))
+        else:
+            columns.append(rng.integers(int(np.ceil(low)), int(high) + 1, n).astype(np.float64))
+    return np.column_stack(columns)
+
+
+def agreement(table: LookupTable, engine: CompiledForest, X: np.ndarray) -> Dict[str, float]:
+    """Share of rows where the table matches the forest, over the rows on the grid."""
+    codes, inside = table.lookup(X)
+    expected = engine.predict(X)
+    matched = int((codes[inside] == expected[inside]).sum())
+    return {
+        'rows': int(len(X)),
+        'on_grid': float(inside.mean()) if len(X) else 0.0,
+        'agreement': matched / int(inside.sum()) if inside.any() else 0.0,
+    }
+
+
+def measure_latency(table: LookupTable, engine: CompiledForest, X: np.ndarray) -> Dict[str, float]:
+    """Median and p99 single-row time of lookup_one and the forest, in microseconds."""
+    lookup, forest = [], []
+    for row in X:
+        values = row.tolist()
+        start = time.perf_counter()
+        table.lookup_one(values)
+        lookup.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        engine.predict_one(row)
+        forest.append(time.perf_counter() - start)
+    lookup_us, forest_us = np.array(lookup) * 1e6, np.array(forest) * 1e6
+    return {
+        'lookup_p50_us': float(np.percentile(lookup_us, 50)),
+        'lookup_p99_us': float(np.percentile(lookup_us, 99)),
+        'forest_p50_us': float(np.percentile(forest_us, 50)),
+        'forest_p99_us': float(np.percentile(forest_us, 99)),
+    }
+
+
+def build_table(models_dir: str = 'models', grid: str = DEFAULT_GRID, path: Optional[str] = None,
+                datasets: Sequence[str] = ('dataset/enhanced_data_core.csv', 'dataset/data_core.csv'),
+                max_bytes: int = MAX_TABLE_BYTES) -> Dict[str, Any]:
+    """Compile the table for the bundled model, check it and save it; returns its metadata."""
+    from model_bundle import load_bundle
+
+    bundle = load_bundle(models_dir)
+    engine = bundle.engine
+    axes = grid_axes(GRIDS[grid], len(bundle.soil_encoder.classes_), len(bundle.crop_encoder.classes_))
+    size = table_bytes(axes)
+    if size > max_bytes:
+        raise ValueError(f"Grid '{grid}' needs {size / 2**20:.0f} MB, more than the {max_bytes / 2**20:.0f} MB limit")
+
+    # Compile straight into a memory-mapped file, moved into place once checked
+    path = path or os.path.join(models_dir, TABLE_FILE)
+    tmp_path = _temp_path(path, '.npy.tmp')
+    try:
+        table = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8,
+                                          shape=tuple(axis['size'] for axis in axes))
+        start = time.perf_counter()
+        compile_table(engine, axes, out=table)
+        table.flush()
+        compile_seconds = time.perf_counter() - start
+        meta = check_table(table, axes, bundle, datasets, models_dir)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    meta['compile_seconds'] = compile_seconds
+    meta['grid'] = grid
+    del table
+
+    write_meta(path, meta)
+    os.replace(tmp_path, path)
+    return meta
+
+
+def check_table(table: np.ndarray, axes: List[Dict[str, Any]], bundle, datasets: Sequence[str],
+                models_dir: str) -> Dict[str, Any]:
+    """Metadata for a compiled table, with its agreement with the forest and lookup latency."""
+    from forest_engine import load_dataset_features
+
+    engine = bundle.engine
+    meta = {
+        'format_version': FORMAT_VERSION,
+        'model_version': bundle.version,
+        'axes': axes,
+        'shape': [axis['size'] for axis in axes],
+        'bytes': table_bytes(axes),
+        'classes': [str(name) for name in bundle.fertilizer_encoder.classes_],
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    lookup = LookupTable(table, meta)
+    checks = {os.path.basename(dataset): agreement(lookup, engine, load_dataset_features(dataset, models_dir))
+              for dataset in datasets if os.path.exists(dataset)}
+    samples = random_inputs(axes, 20000)
+    checks['random'] = agreement(lookup, engine, samples)
+    meta['agreement'] = checks
+    meta['latency'] = measure_latency(lookup, engine, samples[:2000])
+    return meta
+
+
+def load_table(models_dir: str = 'models', model_version: Optional[str] = None) -> Optional[LookupTable]:
+    """Open the compiled table, or None if it is missing or built for another model."""
+    path = os.path.join(models_dir, TABLE_FILE)
+    if not os.path.exists(path) or not os.path.exists(path + META_SUFFIX):
+        return None
+    table = LookupTable.open(path)
+    if model_version is not None and table.model_version != model_version:
+        print(f"Lookup table was built for model {table.model_version}, not {model_version}; not using it")
+        return None
+    return table
+
+
+def print_report(meta: Dict[str, Any]):
+    print(f"Grid '{meta['grid']}': shape {'x'.join(str(s) for s in meta['shape'])}, "
+          f"{meta['bytes'] / 1024:.0f} KB, compiled in {meta['compile_seconds']:.1f}s")
+    for name, check in meta['agreement'].items():
+        print(f"  {name:26s} {check['rows']:7d} rows, {check['on_grid']:6.1%} on grid, "
+              f"{check['agreement']:6.1%} agree with the forest")
+    latency = meta['latency']
+    print(f"  lookup p50/p99 {latency['lookup_p50_us']:.1f}/{latency['lookup_p99_us']:.1f} us, "
+          f"forest p50/p99 {latency['forest_p50_us']:.1f}/{latency['forest_p99_us']:.1f} us")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compile the fertilizer lookup table for the trained model.")
+    parser.add_argument('--grid', choices=list(GRIDS), default=DEFAULT_GRID)
+    parser.add_argument('--models-dir', default='models')
+    parser.add_argument('--sizes', action='store_true', help="only print the table size of every grid")
+    parser.add_argument('--max-bytes', type=int, default=MAX_TABLE_BYTES, help="refuse to compile larger tables")
+    args = parser.parse_args()
+
+    if args.sizes:
+        from model_bundle import load_bundle
+        bundle = load_bundle(args.models_dir)
+        for name, grid in GRIDS.items():
+            axes = grid_axes(grid, len(bundle.soil_encoder.classes_), len(bundle.crop_encoder.classes_))
+            print(f"{name:8s} {'x'.join(str(axis['size']) for axis in axes):>28s} "
+                  f"{table_bytes(axes) / 2**20:10.1f} MB")
+        return
+
+    meta = build_table(args.models_dir, args.grid, max_bytes=args.max_bytes)
+    print(f"Saved lookup table for model {meta['model_version']} to {os.path.join(args.models_dir, TABLE_FILE)}")
+    print_report(meta)
+
+
+if __name__ == "__main__":
+    main()
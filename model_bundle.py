@@ -0,0 +1,308 @@
+"""Single-file model bundle: forest, scaler and encoders as raw arrays.
+
+Instead of five joblib pickles, a bundle stores everything needed for
+prediction in one versioned file:
+
+    magic (8 bytes) | format version, manifest length (2 x uint32)
+    | JSON manifest | padding | arrays, each aligned to 64 bytes
+
+The manifest records the dtype, shape and offset of every array. Loading maps
+the file read-only with np.memmap and wraps each array as a view, so nothing
+is unpickled, sklearn is never imported, and worker processes that open the
+same bundle share the tree arrays through the page cache instead of each
+holding a private copy.
+
+The flattened forest comes from forest_engine.flatten_forest(), so the bundle
+supports RandomForest and ExtraTrees models. load_models() falls back to the
+joblib files for any other estimator.
+"""
+import datetime
+import hashlib
+import json
+import os
+import struct
+import tempfile
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from forest_engine import CompiledForest, flatten_forest
+
+BUNDLE_FILE = 'model_bundle.bin'
+MAGIC = b'SOILMDL\x00'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+HEADER = struct.Struct('<II')
+
+# joblib files a bundle is built from, by models dict key
+JOBLIB_FILES = {
+    'model': 'soil_testing_model.joblib',
+    'scaler': 'scaler.joblib',
+    'soil_encoder': 'soil_type_encoder.joblib',
+    'crop_encoder': 'crop_type_encoder.joblib',
+    'fertilizer_encoder': 'fertilizer_encoder.joblib',
+}
+
+FOREST_ARRAYS = ['feature', 'threshold', 'children', 'leaf_proba', 'roots', 'classes']
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+class ArrayEncoder:
+    """LabelEncoder replacement backed by a plain array of class names."""
+
+    def __init__(self, classes):
+        self.classes_ = np.asarray(classes).astype(object)
+        self._codes = {name: code for code, name in enumerate(self.classes_)}
+
+    def transform(self, values) -> np.ndarray:
+        try:
+            return np.array([self._codes[value] for value in values], dtype=np.int64)
+        except KeyError as e:
+            raise ValueError(f"y contains previously unseen labels: {e.args[0]!r}") from None
+
+    def inverse_transform(self, codes) -> np.ndarray:
+        return self.classes_[np.asarray(codes, dtype=np.int64)]
+
+
+class ArrayScaler:
+    """StandardScaler replacement backed by its mean and scale arrays."""
+
+    def __init__(self, mean, scale, feature_names=None):
+        self.mean_ = mean
+        self.scale_ = scale
+        if feature_names is not None:
+            self.feature_names_in_ = np.asarray(feature_names).astype(object)
+
+    def transform(self, X) -> np.ndarray:
+        return (np.asarray(X, dtype=np.float64) - self.mean_) / self.scale_
+
+
+class ScaledForest:
+    """Classifier interface over a CompiledForest for already-scaled input.
+
+    Callers scale features with the bundle's scaler first, exactly as with
+    the sklearn model, so ``models['model'].predict`` keeps its meaning.
+    """
+
+    def __init__(self, engine: CompiledForest):
+        self.engine = engine
+        self.classes_ = engine.classes
+
+    def predict(self, X) -> np.ndarray:
+        return self.engine.predict_scaled(X)
+
+    def predict_proba(self, X) -> np.ndarray:
+        return self.engine.predict_proba_scaled(X)
+
+
+def bundle_arrays(model, scaler, soil_encoder, crop_encoder, fertilizer_encoder) -> Dict[str, np.ndarray]:
+    """Everything a bundle stores, as plain (non-object) arrays."""
+    if not all(hasattr(est, 'tree_') for est in getattr(model, 'estimators_', [None])):
+        raise TypeError(f"Cannot bundle a {type(model).__name__}; only tree forests are supported")
+    return forest_bundle_arrays(flatten_forest(model), scaler, soil_encoder, crop_encoder, fertilizer_encoder)
+
+
+def forest_bundle_arrays(forest: Dict[str, np.ndarray], scaler, soil_encoder, crop_encoder,
+                         fertilizer_encoder) -> Dict[str, np.ndarray]:
+    """Bundle arrays for a forest already flattened as by flatten_forest()."""
+    arrays = dict(forest)
+    arrays['scaler_mean'] = np.asarray(scaler.mean_, dtype=np.float64)
+    arrays['scaler_scale'] = np.asarray(scaler.scale_, dtype=np.float64)
+    if hasattr(scaler, 'feature_names_in_'):
+        arrays['feature_names'] = np.asarray(scaler.feature_names_in_, dtype=str)
+    arrays['soil_classes'] = np.asarray(soil_encoder.classes_, dtype=str)
+    arrays['crop_classes'] = np.asarray(crop_encoder.classes_, dtype=str)
+    arrays['class_names'] = np.asarray(fertilizer_encoder.classes_, dtype=str)
+    return arrays
+
+
+def write_bundle(path: str, arrays: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    """Write arrays to ``path`` as a bundle and return its manifest.
+
+    The file is written next to ``path`` and renamed into place, so readers
+    never see a partial bundle and processes still mapping the previous file
+    keep a consistent view of it.
+    """
+    arrays = {name: np.ascontiguousarray(value) for name, value in arrays.items()}
+    max_depth = int(arrays.pop('max_depth'))
+
+    digest = hashlib.sha256()
+    layout = {}
+    offset = 0
+    for name, value in arrays.items():
+        layout[name] = {'dtype': value.dtype.str, 'shape': list(value.shape), 'offset': offset}
+        digest.update(name.encode())
+        digest.update(value.tobytes())
+        offset = _aligned(offset + value.nbytes)
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'model_version': digest.hexdigest()[:16],
+        'created_at': datetime.datetime.now().isoformat(),
+        'n_trees': len(arrays['roots']),
+        'n_nodes': len(arrays['feature']),
+        'max_depth': max_depth,
+        'arrays': layout,
+    }
+    manifest_bytes = json.dumps(manifest).encode('utf-8')
+    data_start = _aligned(len(MAGIC) + HEADER.size + len(manifest_bytes))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.bundle-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC)
+            f.write(HEADER.pack(FORMAT_VERSION, len(manifest_bytes)))
+            f.write(manifest_bytes)
+            for name, value in arrays.items():
+                f.seek(data_start + layout[name]['offset'])
+                f.write(value.tobytes())
+            f.truncate(data_start + offset)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return manifest
+
+
+def read_manifest(path: str):
+    """Validate a bundle's header and return ``(manifest, data_start)``."""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a model bundle")
+        version, manifest_length = HEADER.unpack(f.read(HEADER.size))
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported model bundle version {version} (expected {FORMAT_VERSION})")
+        manifest = json.loads(f.read(manifest_length))
+    return manifest, _aligned(len(MAGIC) + HEADER.size + manifest_length)
+
+
+class ModelBundle:
+    """A loaded bundle: compiled forest, scaler and encoders."""
+
+    def __init__(self, arrays: Dict[str, np.ndarray], manifest: Dict[str, Any], path: Optional[str] = None):
+        self.manifest = manifest
+        self.path = path
+        self.version = manifest['model_version']
+
+        engine_arrays = {name: arrays[name] for name in FOREST_ARRAYS}
+        engine_arrays.update(max_depth=manifest['max_depth'], scaler_mean=arrays['scaler_mean'],
+                             scaler_scale=arrays['scaler_scale'], class_names=arrays['class_names'])
+        self.engine = CompiledForest(engine_arrays)
+        self.model = ScaledForest(self.engine)
+        self.scaler = ArrayScaler(arrays['scaler_mean'], arrays['scaler_scale'], arrays.get('feature_names'))
+        self.soil_encoder = ArrayEncoder(arrays['soil_classes'])
+        self.crop_encoder = ArrayEncoder(arrays['crop_classes'])
+        self.fertilizer_encoder = ArrayEncoder(arrays['class_names'])
+
+    @classmethod
+    def open(cls, path: str) -> 'ModelBundle':
+        """Map a bundle file; arrays are read-only views into the mapping."""
+        manifest, data_start = read_manifest(path)
+        data = np.memmap(path, dtype=np.uint8, mode='r')
+        arrays = {}
+        for name, spec in manifest['arrays'].items():
+            dtype = np.dtype(spec['dtype'])
+            count = int(np.prod(spec['shape'], dtype=np.int64))
+            start = data_start + spec['offset']
+            arrays[name] = data[start:start + count * dtype.itemsize].view(dtype).reshape(spec['shape'])
+        return cls(arrays, manifest, path)
+
+    def as_models(self) -> Dict[str, Any]:
+        """The models dict used by predict.py and the server."""
+        return {
+            'model': self.model,
+            'scaler': self.scaler,
+            'soil_encoder': self.soil_encoder,
+            'crop_encoder': self.crop_encoder,
+            'fertilizer_encoder': self.fertilizer_encoder,
+            'version': self.version,
+        }
+
+
+def load_joblib_models(models_dir: str = 'models') -> Dict[str, Any]:
+    """Load the five joblib files written by soil_testing_model.py.
+
+    ``version`` is a hash of the model file, so it changes with every retrain.
+    """
+    import joblib
+
+    models = {key: joblib.load(os.path.join(models_dir, filename)) for key, filename in JOBLIB_FILES.items()}
+    with open(os.path.join(models_dir, JOBLIB_FILES['model']), 'rb') as f:
+        models['version'] = hashlib.sha256(f.read()).hexdigest()[:16]
+    return models
+
+
+def export_bundle(models_dir: str = 'models', path: Optional[str] = None) -> Dict[str, Any]:
+    """Build the bundle from the joblib files in ``models_dir``."""
+    models = load_joblib_models(models_dir)
+    arrays = bundle_arrays(models['model'], models['scaler'], models['soil_encoder'],
+                           models['crop_encoder'], models['fertilizer_encoder'])
+    return write_bundle(path or os.path.join(models_dir, BUNDLE_FILE), arrays)
+
+
+def bundle_is_stale(models_dir: str = 'models') -> bool:
+    """True when the bundle is missing or older than any joblib file next to it."""
+    path = os.path.join(models_dir, BUNDLE_FILE)
+    if not os.path.exists(path):
+        return True
+    bundle_mtime = os.path.getmtime(path)
+    for filename in JOBLIB_FILES.values():
+        source = os.path.join(models_dir, filename)
+        if os.path.exists(source) and os.path.getmtime(source) > bundle_mtime:
+            return True
+    return False
+
+
+def load_bundle(models_dir: str = 'models') -> ModelBundle:
+    """Open the bundle, rebuilding it first if the joblib files are newer.
+
+    A directory containing only the bundle is enough to serve predictions.
+    """
+    path = os.path.join(models_dir, BUNDLE_FILE)
+    if bundle_is_stale(models_dir):
+        if not os.path.exists(os.path.join(models_dir, JOBLIB_FILES['model'])):
+            raise FileNotFoundError(f"No model bundle or trained model in {models_dir}")
+        export_bundle(models_dir, path)
+    return ModelBundle.open(path)
+
+
+def load_models(models_dir: str = 'models') -> Dict[str, Any]:
+    """Models dict from the bundle, or from the joblib files if the model cannot be bundled."""
+    try:
+        return load_bundle(models_dir).as_models()
+    except TypeError as e:
+        print(f"{e}; loading joblib files instead")
+        return load_joblib_models(models_dir)
+
+
+def main():
+    manifest = export_bundle('models')
+    path = os.path.join('models', BUNDLE_FILE)
+    print(f"Saved model bundle {manifest['model_version']} ({manifest['n_trees']} trees, "
+          f"{manifest['n_nodes']} nodes, {os.path.getsize(path) / 1024:.0f} KB) to {path}")
+
+    print("Verifying against the joblib models on dataset/data_core.csv...")
+    import pandas as pd
+    from forest_engine import load_dataset_features, verify
+
+    bundle = ModelBundle.open(path)
+    models = load_joblib_models('models')
+    X = load_dataset_features('dataset/data_core.csv')
+    mismatches = verify(bundle.engine, models['model'], models['scaler'], X)
+    scaler = models['scaler']
+    X_scaled = scaler.transform(pd.DataFrame(X, columns=scaler.feature_names_in_)) \
+        if hasattr(scaler, 'feature_names_in_') else scaler.transform(X)
+    expected = models['model'].predict(X_scaled)
+    mismatches += int((bundle.model.predict(bundle.scaler.transform(X)) != expected).sum())
+    if mismatches:
+        raise SystemExit(f"Bundle disagrees with model.predict on {mismatches} predictions")
+    print(f"All {len(X)} rows match model.predict")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,29 @@
-import joblib
 import numpy as np
-from typing import Dict, Any
+from typing import Dict, Any, Iterable, List, Union
 import pandas as pd
 
+import model_bundle
+from dataset_cache import load_dataset
+
+# Column order the scaler and model were fitted with
+FEATURE_COLUMNS = ['Temparature', 'Humidity', 'Moisture', 'Soil Type', 'Crop Type',
+                   'Nitrogen', 'Potassium', 'Phosphorous']
+
+# Keys used by get_user_input, mapped to the dataset column names
+INPUT_COLUMNS = {
+    'Temperature': 'Temparature',
+    'Humidity': 'Humidity',
+    'Moisture': 'Moisture',
+    'Soil Type': 'Soil Type',
+    'Crop Type': 'Crop Type',
+    'Nitrogen': 'Nitrogen',
+    'Potassium': 'Potassium',
+    'Phosphorous': 'Phosphorous'
+}
+
 def load_models() -> Dict[str, Any]:
-    """Load all necessary models and encoders."""
-    models = {
-        'model': joblib.load('models/soil_testing_model.joblib'),
-        'scaler': joblib.load('models/scaler.joblib'),
-        'soil_encoder': joblib.load('models/soil_type_encoder.joblib'),
-        'crop_encoder': joblib.load('models/crop_type_encoder.joblib'),
-        'fertilizer_encoder': joblib.load('models/fertilizer_encoder.joblib')
-    }
-    return models
+    """Load all necessary models and encoders from the model bundle."""
+    return model_bundle.load_models('models')
 
 def get_user_input() -> Dict[str, Any]:
     """Get input parameters from user."""
@@ -66,6 +77,70 @@ def prepare_input(user_input: Dict[str, Any], models: Dict[str, Any]) -> np.ndar
     features_scaled = models['scaler'].transform(features_df)
     return features_scaled
 
+def load_readings(readings: Union[str, pd.DataFrame, Iterable[Dict[str, Any]]]) -> pd.DataFrame:
+    """Load readings from a CSV path, a DataFrame or a list of input dicts.
+
+    Columns may use either the dataset names (``Temparature``) or the keys
+    returned by get_user_input (``Temperature``). A CSV is read through the
+    columnar cache (see dataset_cache.py), so it is only parsed once.
+    """
+    if isinstance(readings, str):
+        df = load_dataset(readings).to_frame()
+    elif isinstance(readings, pd.DataFrame):
+        df = readings
+    else:
+        df = pd.DataFrame.from_records(list(readings))
+    
+    df = df.rename(columns=INPUT_COLUMNS)
+    missing = [column for column in FEATURE_COLUMNS if column not in df.columns]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+    return df[FEATURE_COLUMNS]
+
+def encode_column(column: pd.Series, encoder) -> np.ndarray:
+    """Encode a text column; a categorical column is encoded once per category."""
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        column = column.cat.remove_unused_categories()
+        codes = column.cat.codes.to_numpy()
+        if (codes < 0).any():
+            raise ValueError(f"Missing values in column {column.name}")
+        return encoder.transform(column.cat.categories.to_numpy())[codes]
+    return encoder.transform(column.to_numpy())
+
+def prepare_batch(readings: Union[str, pd.DataFrame, Iterable[Dict[str, Any]]],
+                  models: Dict[str, Any]) -> np.ndarray:
+    """Encode and scale many readings in one pass.
+
+    Gives the same values as calling prepare_input on each reading, but
+    encodes each categorical column once and applies the scaler's mean and
+    scale to the whole matrix with NumPy instead of calling transform per row.
+    """
+    df = load_readings(readings)
+    
+    features = np.empty((len(df), len(FEATURE_COLUMNS)), dtype=np.float64)
+    for i, column in enumerate(FEATURE_COLUMNS):
+        if column == 'Soil Type':
+            features[:, i] = encode_column(df[column], models['soil_encoder'])
+        elif column == 'Crop Type':
+            features[:, i] = encode_column(df[column], models['crop_encoder'])
+        else:
+            features[:, i] = df[column].to_numpy(dtype=np.float64)
+    
+    # Same arithmetic as StandardScaler.transform
+    scaler = models['scaler']
+    features -= scaler.mean_
+    features /= scaler.scale_
+    return features
+
+def predict_batch(readings: Union[str, pd.DataFrame, Iterable[Dict[str, Any]]],
+                  models: Dict[str, Any]) -> List[str]:
+    """Recommend a fertilizer for each reading, in input order."""
+    features = prepare_batch(readings, models)
+    if len(features) == 0:
+        return []
+    predictions = models['model'].predict(features)
+    return list(models['fertilizer_encoder'].inverse_transform(predictions))
+
 def main():
     global models
     try:
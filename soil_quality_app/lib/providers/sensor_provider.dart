@@ -1,3 +1,4 @@
+import 'dart:async';
 import 'package:flutter/foundation.dart';
 import '../models/sensor_reading.dart';
 import '../services/api_service.dart';
@@ -72,6 +73,28 @@ class SensorProvider with ChangeNotifier {
     }
   }
 
+  StreamSubscription<SensorReading>? _liveSubscription;
+
+  // Follow the readings the server pushes, instead of refreshing
+  void startLiveUpdates() {
+    _liveSubscription ??= _apiService.liveReadings().listen((data) {
+      _sensorData = data;
+      _error = '';
+      notifyListeners();
+    });
+  }
+
+  void stopLiveUpdates() {
+    _liveSubscription?.cancel();
+    _liveSubscription = null;
+  }
+
+  @override
+  void dispose() {
+    stopLiveUpdates();
+    super.dispose();
+  }
+
   // Update crop type
   Future<void> updateCropType(int cropType) async {
     _isLoading = true;
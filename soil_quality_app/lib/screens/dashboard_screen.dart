@@ -14,9 +14,11 @@ class _DashboardScreenState extends State<DashboardScreen> {
   @override
   void initState() {
     super.initState();
-    // Fetch data when screen loads
+    // Fetch data when screen loads, then follow the server's live updates
     Future.delayed(Duration.zero, () {
-      Provider.of<SensorProvider>(context, listen: false).fetchSensorData();
+      final sensorProvider = Provider.of<SensorProvider>(context, listen: false);
+      sensorProvider.fetchSensorData();
+      sensorProvider.startLiveUpdates();
     });
   }
 
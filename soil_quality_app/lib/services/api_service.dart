@@ -92,6 +92,48 @@ class ApiService {
     }
   }
 
+  // Live readings pushed by the server as server-sent events from /stream,
+  // instead of polling. Reconnects after a short delay if the stream drops.
+  Stream<SensorReading> liveReadings() async* {
+    while (true) {
+      final client = http.Client();
+      try {
+        final request = http.Request('GET', Uri.parse('$serverEndpoint/stream'))
+          ..headers['Accept'] = 'text/event-stream';
+        final response = await client.send(request);
+        
+        if (response.statusCode == 200) {
+          String event = '';
+          final data = StringBuffer();
+          final lines = response.stream.transform(utf8.decoder).transform(const LineSplitter());
+          await for (final line in lines) {
+            if (line.isEmpty) {
+              // A blank line ends an event; heartbeats are comments and carry none
+              if (event == 'reading' && data.isNotEmpty) {
+                final Map<String, dynamic> message = json.decode(data.toString());
+                yield SensorReading.fromJson({
+                  ...message['data'],
+                  'recommended_fertilizer': message['recommended_fertilizer'],
+                });
+              }
+              event = '';
+              data.clear();
+            } else if (line.startsWith('event:')) {
+              event = line.substring(6).trim();
+            } else if (line.startsWith('data:')) {
+              data.write(line.substring(5).trim());
+            }
+          }
+        }
+      } catch (e) {
+        print('Live stream error: $e');
+      } finally {
+        client.close();
+      }
+      await Future.delayed(const Duration(seconds: 3));
+    }
+  }
+
   // Update crop type
   Future<String> updateCropType(int cropType) async {
     try {
@@ -1,51 +1,329 @@
+import argparse
+import json
+import os
+import threading
+import time
 import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import train_test_split, cross_val_score, StratifiedKFold
 from sklearn.preprocessing import LabelEncoder, StandardScaler
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import classification_report, confusion_matrix
+from sklearn.ensemble import RandomForestClassifier, ExtraTreesClassifier
+from sklearn.pipeline import make_pipeline
+from sklearn.metrics import classification_report, confusion_matrix, accuracy_score
 import joblib
 import seaborn as sns
 import matplotlib.pyplot as plt
+from dataset_cache import load_dataset
+from drift import save_training_stats
+from forest_engine import export_models
+from model_bundle import export_bundle
+from compaction import compact_model, print_report
 
-# Load the dataset
-def load_data():
-    df = pd.read_csv('dataset/enhanced_data_core.csv')
-    return df
+try:
+    from xgboost import XGBClassifier
+except ImportError:
+    XGBClassifier = None
+
+DATASET_PATH = 'dataset/enhanced_data_core.csv'
+CACHE_DIR = 'models/cache'
+SEARCH_REPORT_PATH = 'models/search_report.json'
+HOLDOUT_PATH = 'models/holdout.npz'
+
+# Model configurations compared by the hyperparameter search
+SEARCH_SPACE = [
+    {'name': 'rf_100', 'estimator': 'random_forest', 'params': {'n_estimators': 100}},
+    {'name': 'rf_50', 'estimator': 'random_forest', 'params': {'n_estimators': 50}},
+    {'name': 'rf_200', 'estimator': 'random_forest', 'params': {'n_estimators': 200}},
+    {'name': 'rf_100_depth8', 'estimator': 'random_forest', 'params': {'n_estimators': 100, 'max_depth': 8}},
+    {'name': 'rf_50_leaf2', 'estimator': 'random_forest', 'params': {'n_estimators': 50, 'min_samples_leaf': 2}},
+    {'name': 'extra_trees_100', 'estimator': 'extra_trees', 'params': {'n_estimators': 100}},
+    {'name': 'xgb_100_depth4', 'estimator': 'xgboost', 'params': {'n_estimators': 100, 'max_depth': 4, 'learning_rate': 0.1}},
+    {'name': 'xgb_200_depth6', 'estimator': 'xgboost', 'params': {'n_estimators': 200, 'max_depth': 6, 'learning_rate': 0.05}},
+    {'name': 'xgb_50_depth3', 'estimator': 'xgboost', 'params': {'n_estimators': 50, 'max_depth': 3, 'learning_rate': 0.3}},
+]
+
+# Load the dataset from its columnar cache, compiling the cache on first use
+def load_data(path=DATASET_PATH, cache_dir=CACHE_DIR):
+    return load_dataset(path, cache_dir).to_frame()
+
+# Fit a label encoder; cached categorical columns already hold LabelEncoder's codes
+def encode_labels(column):
+    if isinstance(column.dtype, pd.CategoricalDtype) and not column.isna().any():
+        categories = list(column.cat.categories)
+        codes = column.cat.codes.to_numpy()
+        if categories == sorted(categories) and np.bincount(codes, minlength=len(categories)).all():
+            return encoder_from_classes(np.asarray(categories, dtype=object)), codes.astype(np.int64)
+    encoder = LabelEncoder()
+    return encoder, encoder.fit_transform(column)
 
 # Preprocess the data
 def preprocess_data(df):
-    # Create label encoders for categorical variables
-    le_soil = LabelEncoder()
-    le_crop = LabelEncoder()
-    le_fertilizer = LabelEncoder()
-    
     # Encode categorical variables
-    df['Soil Type'] = le_soil.fit_transform(df['Soil Type'])
-    df['Crop Type'] = le_crop.fit_transform(df['Crop Type'])
-    df['Fertilizer Name'] = le_fertilizer.fit_transform(df['Fertilizer Name'])
+    le_soil, df['Soil Type'] = encode_labels(df['Soil Type'])
+    le_crop, df['Crop Type'] = encode_labels(df['Crop Type'])
+    le_fertilizer, df['Fertilizer Name'] = encode_labels(df['Fertilizer Name'])
     
     # Save label encoders for future use
+    save_encoders(le_soil, le_crop, le_fertilizer)
+    
+    return df
+
+# Save the label encoders next to the model
+def save_encoders(le_soil, le_crop, le_fertilizer):
     joblib.dump(le_soil, 'models/soil_type_encoder.joblib')
     joblib.dump(le_crop, 'models/crop_type_encoder.joblib')
     joblib.dump(le_fertilizer, 'models/fertilizer_encoder.joblib')
+
+# Rebuild a fitted LabelEncoder from its classes
+def encoder_from_classes(classes):
+    encoder = LabelEncoder()
+    encoder.classes_ = np.asarray(classes)
+    return encoder
+
+# Load, encode and split the dataset, reusing cached arrays when the file is unchanged
+def load_preprocessed(path=DATASET_PATH, cache_dir=CACHE_DIR, test_size=0.2, random_state=42):
+    # The columnar cache has the file's hash, so an unchanged file is not rehashed
+    dataset = load_dataset(path, cache_dir)
+    digest = dataset.checksum
+    cache_file = os.path.join(cache_dir, f"preprocessed_{digest[:16]}.npz")
     
-    return df
+    if os.path.exists(cache_file):
+        with np.load(cache_file, allow_pickle=False) as cached:
+            columns = [str(c) for c in cached['columns']]
+            X = pd.DataFrame(cached['X'], columns=columns)
+            y = pd.Series(cached['y'], name='Fertilizer Name')
+            train_idx, test_idx = cached['train_idx'], cached['test_idx']
+            encoders = [encoder_from_classes(cached[name].astype(object)) for name in ('soil_classes', 'crop_classes', 'fertilizer_classes')]
+        # Keep the saved encoders in sync with the cached encoding
+        save_encoders(*encoders)
+        print(f"Using cached preprocessing for dataset {digest[:16]}")
+    else:
+        df = preprocess_data(dataset.to_frame())
+        X = df.drop('Fertilizer Name', axis=1)
+        y = df['Fertilizer Name']
+        train_idx, test_idx = train_test_split(np.arange(len(df)), test_size=test_size, random_state=random_state)
+        
+        os.makedirs(cache_dir, exist_ok=True)
+        encoders = [joblib.load(f'models/{name}_encoder.joblib') for name in ('soil_type', 'crop_type', 'fertilizer')]
+        np.savez(cache_file,
+                 X=X.to_numpy(dtype=np.float64), y=y.to_numpy(), columns=np.asarray(X.columns, dtype=str),
+                 train_idx=train_idx, test_idx=test_idx,
+                 soil_classes=np.asarray(encoders[0].classes_, dtype=str),
+                 crop_classes=np.asarray(encoders[1].classes_, dtype=str),
+                 fertilizer_classes=np.asarray(encoders[2].classes_, dtype=str))
+    
+    return {
+        'hash': digest,
+        'X': X,
+        'y': y,
+        'X_train': X.iloc[train_idx],
+        'X_test': X.iloc[test_idx],
+        'y_train': y.iloc[train_idx],
+        'y_test': y.iloc[test_idx]
+    }
+
+# Build an unfitted estimator for a search configuration
+def build_estimator(config, n_jobs=None):
+    params = dict(config['params'])
+    if config['estimator'] == 'random_forest':
+        return RandomForestClassifier(random_state=42, n_jobs=n_jobs, **params)
+    if config['estimator'] == 'extra_trees':
+        return ExtraTreesClassifier(random_state=42, n_jobs=n_jobs, **params)
+    if config['estimator'] == 'xgboost':
+        if XGBClassifier is None:
+            raise ImportError("xgboost is not installed")
+        return XGBClassifier(random_state=42, n_jobs=n_jobs, tree_method='hist', **params)
+    raise ValueError(f"Unknown estimator: {config['estimator']}")
+
+# Median single-row and full-batch prediction time of a fitted pipeline
+def measure_latency(pipeline, X, repeats=200):
+    rows = X.to_numpy()
+    single = []
+    for i in range(repeats):
+        row = rows[i % len(rows)].reshape(1, -1)
+        start = time.perf_counter()
+        pipeline.predict(row)
+        single.append(time.perf_counter() - start)
+    
+    start = time.perf_counter()
+    pipeline.predict(rows)
+    batch = time.perf_counter() - start
+    return {
+        'single_row_p50_ms': float(np.percentile(single, 50) * 1000),
+        'single_row_p99_ms': float(np.percentile(single, 99) * 1000),
+        'batch_rows_per_s': float(len(rows) / batch)
+    }
+
+# Resident memory of this process and all its descendants (the n_jobs
+# workers), in bytes, summed from /proc; None where /proc is not available
+def process_tree_rss():
+    try:
+        parents = {}
+        for entry in os.listdir('/proc'):
+            if entry.isdigit():
+                try:
+                    with open(f'/proc/{entry}/stat', 'rb') as f:
+                        stat = f.read()
+                except OSError:
+                    continue
+                # The command name in parentheses may contain spaces
+                parents[int(entry)] = int(stat[stat.rindex(b')') + 2:].split()[1])
+    except OSError:
+        return None
+    tree = {os.getpid()}
+    added = True
+    while added:
+        children = {pid for pid, ppid in parents.items() if ppid in tree and pid not in tree}
+        tree |= children
+        added = bool(children)
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    total = 0
+    for pid in tree:
+        try:
+            with open(f'/proc/{pid}/statm') as f:
+                total += int(f.read().split()[1]) * page_size
+        except OSError:
+            continue
+    return total
+
+# Peak process tree RSS, sampled on a background thread while the block runs.
+# Unlike tracemalloc it sees native allocations (tree arrays, XGBoost) and
+# the worker processes, and it does not slow the timed code down.
+class PeakRssSampler:
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
 
-def train_model(X, y):
+    def _sample(self):
+        rss = process_tree_rss()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+# Cross-validate, fit and time one configuration
+def evaluate_config(config, data, n_jobs=-1, cv=5):
+    with PeakRssSampler() as sampler:
+        start = time.perf_counter()
+        
+        # Scaling is refit inside each fold, as in train_model
+        pipeline = make_pipeline(StandardScaler(), build_estimator(config))
+        folds = StratifiedKFold(n_splits=cv, shuffle=True, random_state=42)
+        scores = cross_val_score(pipeline, data['X_train'].to_numpy(), data['y_train'].to_numpy(),
+                                 cv=folds, n_jobs=n_jobs)
+        
+        pipeline.fit(data['X_train'].to_numpy(), data['y_train'].to_numpy())
+        test_accuracy = accuracy_score(data['y_test'], pipeline.predict(data['X_test'].to_numpy()))
+        fit_seconds = time.perf_counter() - start
+    
+    result = {
+        'name': config['name'],
+        'estimator': config['estimator'],
+        'params': config['params'],
+        'cv_accuracy_mean': float(scores.mean()),
+        'cv_accuracy_std': float(scores.std()),
+        'test_accuracy': float(test_accuracy),
+        'wall_seconds': fit_seconds,
+        'peak_rss_mb': sampler.peak / 1e6 if sampler.peak is not None else None
+    }
+    result.update(measure_latency(pipeline, data['X_test']))
+    return result
+
+# Read the results of configurations finished by an earlier, possibly interrupted, run
+def load_checkpoint(checkpoint_path):
+    results = {}
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    result = json.loads(line)
+                    # Results from before peak RSS was sampled are measured again
+                    if 'peak_rss_mb' in result:
+                        results[result['name']] = result
+    return results
+
+# Cross-validated search over SEARCH_SPACE that resumes from its checkpoint
+def search_models(data, configs=SEARCH_SPACE, n_jobs=-1, cv=5, cache_dir=CACHE_DIR):
+    os.makedirs(cache_dir, exist_ok=True)
+    checkpoint_path = os.path.join(cache_dir, f"search_{data['hash'][:16]}.jsonl")
+    results = load_checkpoint(checkpoint_path)
+    if results:
+        print(f"Resuming search: {len(results)} configurations already done")
+    
+    start = time.perf_counter()
+    for config in configs:
+        if config['name'] in results:
+            continue
+        if config['estimator'] == 'xgboost' and XGBClassifier is None:
+            print(f"Skipping {config['name']}: xgboost is not installed")
+            continue
+    
+        print(f"Evaluating {config['name']}...")
+        result = evaluate_config(config, data, n_jobs=n_jobs, cv=cv)
+        results[config['name']] = result
+    
+        # Append and sync so an interrupted search resumes after this config
+        with open(checkpoint_path, 'a') as f:
+            f.write(json.dumps(result) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+    
+    report = {
+        'dataset_hash': data['hash'],
+        'n_jobs': n_jobs,
+        'cv_folds': cv,
+        'search_wall_seconds': time.perf_counter() - start,
+        'peak_rss_mb': max((r['peak_rss_mb'] for r in results.values() if r['peak_rss_mb'] is not None),
+                           default=None),
+        'results': sorted(results.values(), key=lambda r: (-r['cv_accuracy_mean'], r['single_row_p50_ms']))
+    }
+    return report
+
+# Print the search results, best cross-validated accuracy first
+def print_search_report(report):
+    print("\nSearch Results:")
+    print(f"{'config':18s} {'cv acc':>8s} {'test acc':>9s} {'fit s':>7s} {'p50 ms':>8s} {'p99 ms':>8s} {'rows/s':>10s} {'peak MB':>8s}")
+    for r in report['results']:
+        print(f"{r['name']:18s} {r['cv_accuracy_mean']:8.3f} {r['test_accuracy']:9.3f} {r['wall_seconds']:7.2f} "
+              f"{r['single_row_p50_ms']:8.3f} {r['single_row_p99_ms']:8.3f} {r['batch_rows_per_s']:10.0f} "
+              f"{r['peak_rss_mb'] if r['peak_rss_mb'] is not None else float('nan'):8.1f}")
+    print(f"\nSearch wall-clock time: {report['search_wall_seconds']:.1f}s")
+    if report['peak_rss_mb'] is not None:
+        print(f"Peak RSS, process and workers: {report['peak_rss_mb']:.0f} MB")
+
+def train_model(X, y, estimator=None, split=None):
     # Split the data
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    if split is None:
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    else:
+        X_train, X_test, y_train, y_test = split
     
     # Scale the features
     scaler = StandardScaler()
     X_train_scaled = scaler.fit_transform(X_train)
     X_test_scaled = scaler.transform(X_test)
     
-    # Save the scaler
+    # Save the scaler, and the training distribution for drift detection
     joblib.dump(scaler, 'models/scaler.joblib')
+    save_training_stats(X_train.to_numpy(dtype=np.float64))
     
     # Create and train the model
-    model = RandomForestClassifier(n_estimators=100, random_state=42)
+    model = estimator if estimator is not None else RandomForestClassifier(n_estimators=100, random_state=42)
     model.fit(X_train_scaled, y_train)
     
     # Make predictions
@@ -67,29 +345,78 @@ def train_model(X, y):
     
     return model
 
+# Save the held-out test rows, with labels as names, for the server's reload smoke test
+def save_holdout(X_test, y_test, path=HOLDOUT_PATH):
+    soil_encoder = joblib.load('models/soil_type_encoder.joblib')
+    crop_encoder = joblib.load('models/crop_type_encoder.joblib')
+    fertilizer_encoder = joblib.load('models/fertilizer_encoder.joblib')
+    np.savez(path,
+             columns=np.asarray(X_test.columns, dtype=str),
+             features=X_test.to_numpy(dtype=np.float64),
+             soil_type=np.asarray(soil_encoder.inverse_transform(X_test['Soil Type'].astype(int)), dtype=str),
+             crop_type=np.asarray(crop_encoder.inverse_transform(X_test['Crop Type'].astype(int)), dtype=str),
+             fertilizer=np.asarray(fertilizer_encoder.inverse_transform(np.asarray(y_test, dtype=int)), dtype=str))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train the soil testing model.")
+    parser.add_argument('--search', action='store_true',
+                        help="run the cross-validated model search instead of training")
+    parser.add_argument('--config', help="train this SEARCH_SPACE configuration instead of the default forest")
+    parser.add_argument('--n-jobs', type=int, default=-1, help="parallel workers for the search (default: all cores)")
+    parser.add_argument('--cv', type=int, default=5, help="cross-validation folds for the search")
+    parser.add_argument('--no-compact', action='store_true',
+                        help="skip writing the compacted forest for low-power gateways")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
+    
     # Create models directory if it doesn't exist
-    import os
     if not os.path.exists('models'):
         os.makedirs('models')
     
-    # Load and preprocess data
+    # Load and preprocess data (cached by dataset hash)
     print("Loading and preprocessing data...")
-    df = load_data()
-    df_processed = preprocess_data(df)
+    data = load_preprocessed()
     
-    # Prepare features and target
-    X = df_processed.drop('Fertilizer Name', axis=1)
-    y = df_processed['Fertilizer Name']
+    if args.search:
+        print("Searching model configurations...")
+        report = search_models(data, n_jobs=args.n_jobs, cv=args.cv)
+        print_search_report(report)
+        with open(SEARCH_REPORT_PATH, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f"Report saved to {SEARCH_REPORT_PATH}")
+        return
+    
+    estimator = None
+    if args.config:
+        configs = {config['name']: config for config in SEARCH_SPACE}
+        estimator = build_estimator(configs[args.config])
     
     # Train the model
     print("Training the model...")
-    model = train_model(X, y)
+    split = (data['X_train'], data['X_test'], data['y_train'], data['y_test'])
+    model = train_model(data['X'], data['y'], estimator=estimator, split=split)
     
     # Save the model
     print("Saving the model...")
     joblib.dump(model, 'models/soil_testing_model.joblib')
+    save_holdout(data['X_test'], data['y_test'])
     print("Model saved successfully!")
+    
+    # Export the flattened forest for the compiled inference engine
+    if isinstance(model, RandomForestClassifier):
+        print("Exporting the compiled forest...")
+        export_models('models')
+        
+        # Single-file bundle loaded by predict.py and the server
+        manifest = export_bundle('models')
+        print(f"Model bundle {manifest['model_version']} saved to models/model_bundle.bin")
+        
+        # Smaller forest for low-power gateways, see compaction.py
+        if not args.no_compact:
+            print("Compacting the forest...")
+            print_report(compact_model('models'))
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
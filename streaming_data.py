@@ -0,0 +1,231 @@
+"""Chunked, constant-memory data pipeline for large soil datasets.
+
+The CSV is read in chunks with compact dtypes (float32 features, categorical
+labels) and never held in memory as a whole:
+
+1. fit_encoders() collects the categories of the label columns.
+2. fit_scaler() fits a StandardScaler with partial_fit, one chunk at a time.
+3. train_streaming() trains either a Random Forest on a fixed-size uniform
+   reservoir sample of the rows (``mode='forest'``, the default), or a truly
+   out-of-core linear model with partial_fit over every chunk
+   (``mode='sgd'``).
+
+Memory use depends on ``chunksize`` (and ``sample_size`` for the forest), not
+on the number of rows in the file.
+"""
+import argparse
+import os
+from typing import Dict, Iterator, Optional, Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import SGDClassifier
+from sklearn.preprocessing import LabelEncoder, StandardScaler
+
+FEATURE_COLUMNS = ['Temparature', 'Humidity', 'Moisture', 'Soil Type', 'Crop Type',
+                   'Nitrogen', 'Potassium', 'Phosphorous']
+CATEGORICAL_COLUMNS = ['Soil Type', 'Crop Type', 'Fertilizer Name']
+TARGET_COLUMN = 'Fertilizer Name'
+
+# Explicit compact dtypes so pandas neither infers int64/float64 nor keeps
+# the label columns as Python string objects
+CSV_DTYPES = {
+    'Temparature': np.float32,
+    'Humidity': np.float32,
+    'Moisture': np.float32,
+    'Soil Type': 'category',
+    'Crop Type': 'category',
+    'Nitrogen': np.float32,
+    'Potassium': np.float32,
+    'Phosphorous': np.float32,
+    'Fertilizer Name': 'category',
+}
+
+ENCODER_FILES = {
+    'Soil Type': 'soil_type_encoder.joblib',
+    'Crop Type': 'crop_type_encoder.joblib',
+    'Fertilizer Name': 'fertilizer_encoder.joblib',
+}
+
+
+def iter_chunks(path: str, chunksize: int = 100_000) -> Iterator[pd.DataFrame]:
+    """Yield the CSV in chunks of at most ``chunksize`` rows."""
+    yield from pd.read_csv(path, dtype=CSV_DTYPES, chunksize=chunksize)
+
+
+def fit_encoders(path: str, chunksize: int = 100_000) -> Dict[str, LabelEncoder]:
+    """Collect every label of the categorical columns in one pass.
+
+    The returned encoders have sorted classes, exactly like LabelEncoder.fit
+    on the full column.
+    """
+    categories = {column: set() for column in CATEGORICAL_COLUMNS}
+    for chunk in iter_chunks(path, chunksize):
+        for column in CATEGORICAL_COLUMNS:
+            categories[column].update(chunk[column].cat.categories)
+
+    encoders = {}
+    for column, values in categories.items():
+        encoder = LabelEncoder()
+        encoder.classes_ = np.array(sorted(values), dtype=object)
+        encoders[column] = encoder
+    return encoders
+
+
+def encode_column(series: pd.Series, encoder: LabelEncoder) -> np.ndarray:
+    """Integer codes of a categorical chunk column under a global encoder.
+
+    Only the chunk's (few) categories are looked up; the per-row work is a
+    single take on the chunk's category codes.
+    """
+    categories = np.asarray(series.cat.categories, dtype=object)
+    lookup = np.searchsorted(encoder.classes_, categories)
+    # A label missing from the encoder sorts next to a different class
+    found = encoder.classes_[np.minimum(lookup, len(encoder.classes_) - 1)]
+    if (found != categories).any():
+        raise ValueError(f"Unknown labels in column {series.name}")
+    codes = series.cat.codes.to_numpy()
+    if (codes < 0).any():
+        raise ValueError(f"Missing values in column {series.name}")
+    return lookup.take(codes)
+
+
+def encode_chunk(chunk: pd.DataFrame, encoders: Dict[str, LabelEncoder]) -> Tuple[np.ndarray, np.ndarray]:
+    """Feature matrix (float32, dataset column order) and labels of a chunk."""
+    X = np.empty((len(chunk), len(FEATURE_COLUMNS)), dtype=np.float32)
+    for i, column in enumerate(FEATURE_COLUMNS):
+        if column in encoders:
+            X[:, i] = encode_column(chunk[column], encoders[column])
+        else:
+            X[:, i] = chunk[column].to_numpy(dtype=np.float32)
+    y = encode_column(chunk[TARGET_COLUMN], encoders[TARGET_COLUMN])
+    return X, y
+
+
+def iter_encoded(path: str, encoders: Dict[str, LabelEncoder],
+                 chunksize: int = 100_000) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    for chunk in iter_chunks(path, chunksize):
+        yield encode_chunk(chunk, encoders)
+
+
+def fit_scaler(path: str, encoders: Dict[str, LabelEncoder], chunksize: int = 100_000) -> StandardScaler:
+    """Fit a StandardScaler incrementally over every chunk."""
+    scaler = StandardScaler()
+    for X, _ in iter_encoded(path, encoders, chunksize):
+        scaler.partial_fit(pd.DataFrame(X, columns=FEATURE_COLUMNS))
+    return scaler
+
+
+def scale(X: np.ndarray, scaler: StandardScaler) -> np.ndarray:
+    """Apply the scaler's mean and scale without a DataFrame round trip."""
+    return ((X - scaler.mean_) / scaler.scale_).astype(np.float32)
+
+
+def reservoir_sample(path: str, encoders: Dict[str, LabelEncoder], sample_size: int,
+                     chunksize: int = 100_000, seed: int = 42) -> Tuple[np.ndarray, np.ndarray]:
+    """Uniform sample of ``sample_size`` rows (Algorithm R), vectorized per chunk."""
+    rng = np.random.default_rng(seed)
+    X_sample = np.empty((sample_size, len(FEATURE_COLUMNS)), dtype=np.float32)
+    y_sample = np.empty(sample_size, dtype=np.int64)
+    seen = 0
+
+    for X, y in iter_encoded(path, encoders, chunksize):
+        n = len(X)
+        # Fill the reservoir first
+        fill = min(max(sample_size - seen, 0), n)
+        X_sample[seen:seen + fill] = X[:fill]
+        y_sample[seen:seen + fill] = y[:fill]
+
+        # Row with global index i replaces slot j ~ U[0, i] when j < sample_size.
+        # Fancy assignment keeps the last write, matching sequential order.
+        if fill < n:
+            positions = np.arange(seen + fill, seen + n)
+            slots = rng.integers(0, positions + 1)
+            keep = slots < sample_size
+            X_sample[slots[keep]] = X[fill:][keep]
+            y_sample[slots[keep]] = y[fill:][keep]
+        seen += n
+
+    count = min(seen, sample_size)
+    return X_sample[:count], y_sample[:count]
+
+
+def train_streaming(path: str, mode: str = 'forest', chunksize: int = 100_000, epochs: int = 3,
+                    sample_size: int = 200_000, n_estimators: int = 100,
+                    encoders: Optional[Dict[str, LabelEncoder]] = None,
+                    scaler: Optional[StandardScaler] = None):
+    """Fit encoders, scaler and model without loading the whole CSV.
+
+    Returns ``(model, scaler, encoders)``.
+    """
+    if encoders is None:
+        encoders = fit_encoders(path, chunksize)
+    if scaler is None:
+        scaler = fit_scaler(path, encoders, chunksize)
+    classes = np.arange(len(encoders[TARGET_COLUMN].classes_))
+
+    if mode == 'sgd':
+        model = SGDClassifier(loss='log_loss', random_state=42)
+        for _ in range(epochs):
+            for X, y in iter_encoded(path, encoders, chunksize):
+                model.partial_fit(scale(X, scaler), y, classes=classes)
+    elif mode == 'forest':
+        X, y = reservoir_sample(path, encoders, sample_size, chunksize)
+        model = RandomForestClassifier(n_estimators=n_estimators, random_state=42)
+        model.fit(scale(X, scaler), y)
+    else:
+        raise ValueError(f"Unknown training mode: {mode}")
+
+    return model, scaler, encoders
+
+
+def evaluate_streaming(path: str, model, scaler: StandardScaler, encoders: Dict[str, LabelEncoder],
+                       chunksize: int = 100_000) -> float:
+    """Accuracy of the model over every row of a CSV, chunk by chunk."""
+    correct = total = 0
+    for X, y in iter_encoded(path, encoders, chunksize):
+        correct += int((model.predict(scale(X, scaler)) == y).sum())
+        total += len(y)
+    return correct / total if total else 0.0
+
+
+def save_artifacts(out_dir: str, model, scaler: StandardScaler, encoders: Dict[str, LabelEncoder]):
+    """Save in the same layout as soil_testing_model.py."""
+    os.makedirs(out_dir, exist_ok=True)
+    joblib.dump(model, os.path.join(out_dir, 'soil_testing_model.joblib'))
+    joblib.dump(scaler, os.path.join(out_dir, 'scaler.joblib'))
+    for column, filename in ENCODER_FILES.items():
+        joblib.dump(encoders[column], os.path.join(out_dir, filename))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train on a CSV too large to load into memory.")
+    parser.add_argument('csv', help="dataset CSV with the same columns as dataset/data_core.csv")
+    parser.add_argument('--mode', choices=['sgd', 'forest'], default='forest',
+                        help="forest: Random Forest on a reservoir sample; sgd: partial_fit over every chunk")
+    parser.add_argument('--chunksize', type=int, default=100_000)
+    parser.add_argument('--epochs', type=int, default=3, help="passes over the data in sgd mode")
+    parser.add_argument('--sample-size', type=int, default=200_000, help="reservoir size in forest mode")
+    parser.add_argument('--out', default='models/streaming', help="directory for the trained artifacts")
+    args = parser.parse_args()
+
+    print("Fitting encoders and scaler...")
+    encoders = fit_encoders(args.csv, args.chunksize)
+    scaler = fit_scaler(args.csv, encoders, args.chunksize)
+
+    print(f"Training ({args.mode})...")
+    model, scaler, encoders = train_streaming(args.csv, mode=args.mode, chunksize=args.chunksize,
+                                              epochs=args.epochs, sample_size=args.sample_size,
+                                              encoders=encoders, scaler=scaler)
+
+    accuracy = evaluate_streaming(args.csv, model, scaler, encoders, args.chunksize)
+    print(f"Training-set accuracy: {accuracy:.3f}")
+
+    save_artifacts(args.out, model, scaler, encoders)
+    print(f"Artifacts saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()